@@ -7,19 +7,19 @@ Provides REST API endpoints for configuration snapshots and change tracking.
 
 import os
 import sys
+import threading
+import time
 import logging
 from functools import wraps
 # --- CHANGE: Import 'session' for session management ---
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, g, jsonify, request, session
 from flask_cors import CORS
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
 
 # --- CHANGE: Import FLASK_SECRET_KEY ---
 from config import (
     GRAPH_CLIENT_ID, GRAPH_TENANT_ID, GRAPH_CLIENT_SECRET,
     ADMIN_USER, ADMIN_PASS, CHECK_INTERVAL_MINUTES,
-    LOG_LEVEL, LOG_FORMAT, FLASK_SECRET_KEY
+    LOG_LEVEL, LOG_FORMAT, FLASK_SECRET_KEY, SNAPSHOT_CACHE_MAX_AGE_SECONDS
 )
 
 # Configure logging
@@ -27,8 +27,18 @@ logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 # Import other modules
-from monitor import check_for_changes
-from db import get_all_snapshots, get_snapshot_details, init_app as init_db
+from monitor import MONITOR_LEASE, collect_monitor_metrics, poll_intervals, start_monitoring
+from lease import Lease
+from explanation_worker import STATUS_PENDING
+from snapshot_diff import diff_cache_stats
+from metrics import CONTENT_TYPE, HTTP_REQUEST_SECONDS, register_collector, render as render_metrics
+from events import broker_for, parse_last_event_id, subscriber_count
+from tenants import get_tenant, get_tenants, is_multi_tenant
+from http_responses import cacheable, client_has, compress_response
+from db import (
+    get_snapshot_page, get_snapshot_details, get_snapshot_version, get_snapshot_diff, get_state_at, get_object_history,
+    search_history, get_lease, get_first_sync_status, init_app as init_db
+)
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -49,6 +59,16 @@ CORS(app, resources={
 def verify_environment():
     """Verify required secrets are loaded."""
     logger.info("Verifying environment configuration...")
+
+    if is_multi_tenant():
+        try:
+            tenants = get_tenants()
+        except (OSError, ValueError) as e:
+            logger.error(f"Invalid tenants file: {e}")
+            sys.exit(1)
+        logger.info(f"  Tenants: {', '.join(tenant.key for tenant in tenants)}")
+        logger.info("✓ All required configuration present")
+        return
     
     required_vars = {
         "GRAPH_CLIENT_ID": GRAPH_CLIENT_ID,
@@ -119,25 +139,118 @@ def internal_error(error):
     logger.error(f"Internal server error: {error}", exc_info=True)
     return jsonify({'message': 'Internal server error', 'error': 'internal_error'}), 500
 
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def _select_tenant():
+    """With several tenants, ?tenant=<key> picks the one a request is about (the first by default)."""
+    if not is_multi_tenant():
+        return None
+    try:
+        g.tenant = get_tenant(request.args.get('tenant'))
+    except KeyError:
+        return jsonify({'message': f"Unknown tenant: {request.args.get('tenant')}", 'error': 'not_found'}), 404
+    return None
+
+def _tenant_database():
+    """Database of the request's tenant (None: DATABASE_URL)."""
+    tenant = g.get('tenant')
+    return tenant.database if tenant else None
+
+@app.after_request
+def _observe_request(response):
+    """Request latency by route rule (not by URL, to keep the number of series bounded)."""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                     method=request.method, route=route, status=response.status_code)
+    return response
+
+@app.after_request
+def _compress(response):
+    """gzip/brotli for JSON responses (runs before _observe_request, so latency includes it)."""
+    return compress_response(request, response)
+
+def _collect_stats_metrics():
+    """The API's in-process counters, as Prometheus metrics."""
+    diffs = diff_cache_stats()
+    return [
+        ("diff_cache_lookups_total", "counter", "Snapshot diff cache lookups by result",
+         [({"result": "hit"}, diffs["hits"]), ({"result": "miss"}, diffs["misses"])]),
+        ("event_subscribers", "gauge", "Open /api/events streams in this process", [({}, subscriber_count())]),
+    ]
+
+register_collector(_collect_stats_metrics)
+
+def _include_config():
+    """True when the request asked for full configurations (?include=config)."""
+    return 'config' in request.args.get('include', '').split(',')
+
 # API Routes (The routes themselves are unchanged, but are now protected by the new auth_required)
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint."""
+    """
+    Liveness probe: answers from the process alone, without the database, so an outage does
+    not get the API restarted. The monitor leader is reported by /api/ready, and the monitor's
+    counters by the worker's /metrics.
+    """
     return jsonify({
         "status": "ok",
         "service": "EntraID Change Detection",
         "version": "1.0.0",
-        "check_interval_minutes": CHECK_INTERVAL_MINUTES
+        "check_interval_minutes": CHECK_INTERVAL_MINUTES,
+        "poll_intervals_minutes": poll_intervals(),
+        "tenants": len(get_tenants()) if is_multi_tenant() else 1
+    }), 200
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe, separate from /api/health: 200 as soon as the API can serve requests
+    (the database answers), with whether the monitor's first sync of the tenant (?tenant=)
+    is still in progress and whether a monitor holds the lease; 503 while the database is
+    unreachable. Who holds it (host and process) is only shown to a logged-in user.
+    """
+    try:
+        sync = get_first_sync_status()
+        leader = get_lease(MONITOR_LEASE)
+    except Exception as e:
+        logger.warning(f"Not ready: {e}")
+        return jsonify({"status": "unavailable", "error": "database_unavailable"}), 503
+    return jsonify({
+        "status": "serving",
+        **({"tenant": g.tenant.key} if g.get('tenant') else {}),
+        "first_sync": "complete" if sync["complete"] else "in_progress",
+        "latest_snapshot": sync["latest_snapshot"],
+        "monitor_leading": leader is not None,
+        **({"monitor_leader": leader} if 'user_id' in session else {})
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 @app.route('/api/snapshots', methods=['GET'])
 @auth_required
 def get_snapshots():
-    """Get list of all configuration snapshots."""
+    """
+    Get one page of configuration snapshots, newest first.
+
+    Query parameters: cursor (next_cursor of the previous page), limit, since / until
+    (ISO timestamps), object_type, object_id and kind (added, removed or modified).
+    """
+    filters = {name: request.args[name] for name in
+               ('cursor', 'limit', 'since', 'until', 'object_type', 'object_id', 'kind') if name in request.args}
     try:
-        snapshots = get_all_snapshots()
-        logger.debug(f"Retrieved {len(snapshots)} snapshots")
-        return jsonify(snapshots), 200
+        page = get_snapshot_page(**filters)
+        logger.debug(f"Retrieved {len(page['items'])} snapshots")
+        return jsonify(page), 200
+    except ValueError as e:
+        return jsonify({'message': str(e), 'error': 'bad_request'}), 400
     except Exception as e:
         logger.error(f"Error retrieving snapshots: {e}", exc_info=True)
         return jsonify({'message': 'Failed to retrieve snapshots', 'error': 'database_error'}), 500
@@ -145,16 +258,137 @@ def get_snapshots():
 @app.route('/api/snapshots/<int:snap_id>', methods=['GET'])
 @auth_required
 def get_snapshot(snap_id):
-    """Get detailed information about a specific snapshot."""
+    """
+    Get detailed information about a specific snapshot (?include=config adds both full configurations).
+
+    The response has a strong ETag and may be reused by the browser for
+    SNAPSHOT_CACHE_MAX_AGE_SECONDS once the explanation is final; repeat views after that
+    revalidate and get a 304. It is not marked immutable: compaction can rewrite the changes
+    of a kept snapshot. While the explanation is pending it is revalidated every time.
+    """
     try:
-        details = get_snapshot_details(snap_id)
+        version = get_snapshot_version(snap_id, include_config=_include_config())
+        if not version:
+            return jsonify({'message': 'Snapshot not found', 'error': 'not_found'}), 404
+        etag, explanation_status = version
+        final = explanation_status != STATUS_PENDING
+        caching = {'etag': etag, 'max_age': SNAPSHOT_CACHE_MAX_AGE_SECONDS if final else 0}
+        if client_has(request, etag):
+            # A repeat view: answer 304 without building the details
+            return cacheable(request, Response(), **caching)
+        details = get_snapshot_details(snap_id, include_config=_include_config())
         if not details:
             return jsonify({'message': 'Snapshot not found', 'error': 'not_found'}), 404
-        return jsonify(details), 200
+        return cacheable(request, jsonify(details), **caching)
     except Exception as e:
         logger.error(f"Error retrieving snapshot {snap_id}: {e}", exc_info=True)
         return jsonify({'message': 'Failed to retrieve snapshot details', 'error': 'database_error'}), 500
 
+@app.route('/api/snapshots/<int:snap_id>/diff', methods=['GET'])
+@auth_required
+def get_snapshot_changes(snap_id):
+    """
+    Get the objects that changed in a snapshot, compared with the previous one.
+
+    Query parameters: object_type, cursor, limit, and include=config for the full configurations.
+    """
+    paging = {name: request.args[name] for name in ('object_type', 'cursor', 'limit') if name in request.args}
+    try:
+        diff = get_snapshot_diff(snap_id, include_config=_include_config(), **paging)
+        if not diff:
+            return jsonify({'message': 'Snapshot not found', 'error': 'not_found'}), 404
+        return jsonify(diff), 200
+    except ValueError as e:
+        return jsonify({'message': str(e), 'error': 'bad_request'}), 400
+    except Exception as e:
+        logger.error(f"Error computing diff for snapshot {snap_id}: {e}", exc_info=True)
+        return jsonify({'message': 'Failed to compute snapshot diff', 'error': 'database_error'}), 500
+
+@app.route('/api/state', methods=['GET'])
+@auth_required
+def get_state():
+    """
+    Get the configuration as it was at a point in time.
+
+    Query parameters: at (ISO date or timestamp, required), object_type, and object_id
+    (with object_type) for a single object.
+    """
+    at = request.args.get('at')
+    if not at:
+        return jsonify({'message': 'at is required', 'error': 'bad_request'}), 400
+    try:
+        state = get_state_at(at, request.args.get('object_type'), request.args.get('object_id'))
+        if state is None:
+            return jsonify({'message': 'No snapshot exists at that time', 'error': 'not_found'}), 404
+        return jsonify(state), 200
+    except ValueError as e:
+        return jsonify({'message': str(e), 'error': 'bad_request'}), 400
+    except Exception as e:
+        logger.error(f"Error rebuilding the state at {at}: {e}", exc_info=True)
+        return jsonify({'message': 'Failed to rebuild the configuration', 'error': 'database_error'}), 500
+
+@app.route('/api/objects/<object_type>/<path:object_id>/history', methods=['GET'])
+@auth_required
+def get_history(object_type, object_id):
+    """
+    Get every version of an object, newest first, with the changes that produced it.
+
+    Query parameters: cursor (next_cursor of the previous page), limit.
+    """
+    paging = {name: request.args[name] for name in ('cursor', 'limit') if name in request.args}
+    try:
+        history = get_object_history(object_type, object_id, **paging)
+        if history is None:
+            return jsonify({'message': 'Object not found', 'error': 'not_found'}), 404
+        return jsonify(history), 200
+    except ValueError as e:
+        return jsonify({'message': str(e), 'error': 'bad_request'}), 400
+    except Exception as e:
+        logger.error(f"Error retrieving the history of {object_type} {object_id}: {e}", exc_info=True)
+        return jsonify({'message': 'Failed to retrieve object history', 'error': 'database_error'}), 500
+
+@app.route('/api/search', methods=['GET'])
+@auth_required
+def search_objects_and_changes():
+    """
+    Search objects (by any name or UPN they ever had) and change events, newest first.
+
+    Query parameters: q (required), scope (objects or changes; both by default),
+    object_type, cursor (next_cursor of the previous page, with scope), limit.
+    """
+    options = {name: request.args[name] for name in ('scope', 'object_type', 'cursor', 'limit') if name in request.args}
+    try:
+        return jsonify(search_history(request.args.get('q', ''), **options)), 200
+    except ValueError as e:
+        return jsonify({'message': str(e), 'error': 'bad_request'}), 400
+    except Exception as e:
+        logger.error(f"Error searching for '{request.args.get('q')}': {e}", exc_info=True)
+        return jsonify({'message': 'Search failed', 'error': 'database_error'}), 500
+
+@app.route('/api/events', methods=['GET'])
+@auth_required
+def stream_events():
+    """
+    Server-Sent Events: snapshot-created and explanation-ready, pushed as they are committed.
+
+    A reconnecting client sends Last-Event-ID (EventSource does this itself, or pass
+    ?last_event_id=) and first receives the events it missed.
+    """
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    return Response(broker_for(_tenant_database()).stream(last_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/tenants', methods=['GET'])
+@auth_required
+def list_tenants():
+    """The monitored tenants; every other endpoint takes ?tenant=<key> (the first by default)."""
+    tenants = get_tenants() if is_multi_tenant() else []
+    return jsonify({
+        "multi_tenant": is_multi_tenant(),
+        "tenants": [tenant.as_dict() for tenant in tenants],
+        "default": tenants[0].key if tenants else None
+    }), 200
+
 # This info endpoint is useful for debugging and does not require auth
 @app.route('/api/info', methods=['GET'])
 def get_info():
@@ -163,38 +397,36 @@ def get_info():
         "service": "EntraID Change Detection API",
         "endpoints": {
             "health": "/api/health",
+            "ready": "/api/ready (readiness: serving, and whether the first sync is in progress)",
+            "metrics": "/metrics (Prometheus text format)",
             "login": "/api/login",
             "logout": "/api/logout",
-            "snapshots": "/api/snapshots (requires auth)",
-            "snapshot_detail": "/api/snapshots/{id} (requires auth)"
+            "snapshots": "/api/snapshots?cursor=&limit=&since=&until=&object_type=&object_id=&kind= (requires auth)",
+            "snapshot_detail": "/api/snapshots/{id}?include=config (requires auth)",
+            "snapshot_diff": "/api/snapshots/{id}/diff?object_type=&cursor=&limit=&include=config (requires auth)",
+            "state": "/api/state?at=&object_type=&object_id= (requires auth)",
+            "object_history": "/api/objects/{type}/{id}/history?cursor=&limit= (requires auth)",
+            "search": "/api/search?q=&scope=&object_type=&cursor=&limit= (requires auth)",
+            "events": "/api/events (Server-Sent Events, requires auth)",
+            "tenants": "/api/tenants (requires auth; the other endpoints take ?tenant=)"
         },
         "authentication": "Session-based (cookie)"
     }), 200
 
-# Scheduler setup (No changes needed here)
-scheduler = BackgroundScheduler(daemon=True)
-
-def on_job_error(event):
-    logger.error(f"Scheduled job failed: {event.exception}")
+# The monitor (Graph polling, explanations, compaction) runs in the worker process (worker.py).
+# The development server also runs it in a background thread, under the same lease, so
+# `python app.py` works on its own and never duplicates a worker that is running too.
+monitor_stop = threading.Event()
 
-def on_job_executed(event):
-    logger.info(f"Scheduled job completed successfully")
+# Application startup
+def startup_tasks(run_monitor=True):
+    """
+    Perform startup tasks.
 
-scheduler.add_listener(on_job_error, EVENT_JOB_ERROR)
-scheduler.add_listener(on_job_executed, EVENT_JOB_EXECUTED)
-
-scheduler.add_job(
-    func=check_for_changes,
-    trigger='interval',
-    minutes=CHECK_INTERVAL_MINUTES,
-    id='configuration_check',
-    name='Check Entra ID Configuration',
-    replace_existing=True
-)
-
-# Application startup (No changes needed here)
-def startup_tasks():
-    """Perform startup tasks."""
+    Args:
+        run_monitor (bool): Also run the monitor in a background thread (development server).
+            The production server only serves the API (see wsgi.py).
+    """
     logger.info("="*50)
     logger.info("Starting EntraID Change Detection System")
     logger.info("="*50)
@@ -204,32 +436,32 @@ def startup_tasks():
     init_db(app)
     logger.info("✓ Database initialized")
     
-    scheduler.start()
-    logger.info(f"✓ Scheduler started (interval: {CHECK_INTERVAL_MINUTES} minutes)")
-    
-    logger.info("Performing initial configuration check...")
-    try:
-        check_for_changes()
-        logger.info("✓ Initial check completed")
-    except Exception as e:
-        logger.error(f"Initial check failed: {e}", exc_info=True)
-        logger.warning("System will retry on next scheduled interval")
+    if run_monitor:
+        register_collector(collect_monitor_metrics)
+        threading.Thread(target=start_monitoring, args=(Lease(MONITOR_LEASE), monitor_stop),
+                         name="monitor", daemon=True).start()
+        logger.info("✓ Monitor started in the background (it polls Graph while it holds the monitor lease)")
+    else:
+        logger.info("✓ Serving the API only (Graph is polled by the monitor worker, worker.py)")
     
     logger.info("="*50)
     logger.info("System ready! Access the UI at http://localhost")
     logger.info("="*50)
 
-# Run startup tasks (No changes needed here)
-if not os.environ.get('WERKZEUG_RUN_MAIN'):
-    startup_tasks()
-
-# Shutdown handler (No changes needed here)
+# Shutdown handler: stop the monitor thread, which releases its lease
 import atexit
 def shutdown():
-    logger.info("Shutting down scheduler...")
-    scheduler.shutdown(wait=False)
+    monitor_stop.set()
 
 atexit.register(shutdown)
 
+# Development server. In production, gunicorn imports wsgi.py instead.
 if __name__ == '__main__':
+    # The reloader runs this file again in a child process (WERKZEUG_RUN_MAIN set) that serves
+    # the requests; the startup tasks run once, in the parent, and the child only needs the
+    # database hooks
+    if not os.environ.get('WERKZEUG_RUN_MAIN'):
+        startup_tasks()
+    else:
+        init_db(app)
     app.run(debug=True, host='0.0.0.0', port=5000)
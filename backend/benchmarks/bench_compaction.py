@@ -0,0 +1,101 @@
+"""
+Storage saved by tiered retention and dictionary compression on a long history.
+
+Builds --days of history (--per-day snapshots a day, each modifying --churn of --objects
+users) with payloads compressed the way the monitor writes them before a dictionary exists,
+then runs one compaction pass. Reports what retention removed, the payload bytes before and
+after (retention plus recompression with the shared dictionary), and the throughput.
+
+Usage: python -m benchmarks.bench_compaction [--days 730] [--per-day 4] [--objects 2000]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import timed
+from compaction import compact, snapshots_to_keep
+from db import create_schema
+from storage import load_state, save_snapshot
+from storage_backend import SQLiteBackend
+
+NOW = datetime(2030, 1, 1, tzinfo=timezone.utc)
+DEPARTMENTS = ["Engineering", "Sales", "Marketing", "Finance", "Human Resources", "Legal", "Support"]
+SKUS = ["c7df2760-2c81-4ef7-b578-5b5392b571df", "f30db892-07e9-47e9-837c-80727f46fd3d",
+        "18181a46-0d4e-45cd-891e-60aabd171b4e"]
+
+
+def _user(index: int, version: int):
+    return {
+        "id": str(uuid.UUID(int=0x5EED << 96 | index)),
+        "displayName": f"User {index}",
+        "userPrincipalName": f"user{index}@contoso.onmicrosoft.com",
+        "mail": f"user{index}@contoso.com",
+        "accountEnabled": version % 7 != 3,
+        "jobTitle": f"Engineer {version % 5}",
+        "department": DEPARTMENTS[(index + version) % len(DEPARTMENTS)],
+        "officeLocation": f"Building {index % 12}",
+        "usageLocation": "US",
+        "assignedLicenses": [{"skuId": SKUS[(index + version) % len(SKUS)], "disabledPlans": []}],
+        "onPremisesSyncEnabled": index % 3 == 0,
+        "createdDateTime": "2021-03-04T10:11:12Z",
+    }
+
+
+def build_history(conn, days: int, per_day: int, objects: int, churn: int, seed: int = 7):
+    rng = random.Random(seed)
+    state = [_user(index, 0) for index in range(objects)]
+    total = days * per_day
+    for step in range(total):
+        timestamp = (NOW - timedelta(days=days) + timedelta(days=step / per_day)).isoformat()
+        if step:
+            for index in rng.sample(range(objects), churn):
+                state[index] = _user(index, step)
+        save_snapshot(conn, timestamp, {"user": list(state)}, [f"{churn} users modified"], None)
+        if step % 100 == 0:
+            conn.commit()
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--per-day", type=int, default=4)
+    parser.add_argument("--objects", type=int, default=2000)
+    parser.add_argument("--churn", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteBackend(os.path.join(tmp, "bench.db"))
+        conn = backend.connect()
+        create_schema(conn)
+        timings = {}
+        with timed(timings, "build"):
+            build_history(conn, args.days, args.per_day, args.objects, args.churn)
+        snapshots = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+        versions = conn.execute("SELECT COUNT(*) FROM object_versions").fetchone()[0]
+        raw = conn.execute("SELECT SUM(LENGTH(payload)) FROM object_versions").fetchone()[0]
+        kept = snapshots_to_keep(list(conn.execute("SELECT id, timestamp FROM snapshots")), NOW)
+        print(f"{args.days} days, {snapshots:,} snapshots, {versions:,} object versions "
+              f"({raw / 1e6:.1f} MB compressed without a dictionary), built in {timings['build']:.1f}s")
+        latest = load_state(conn)
+
+        stats = compact(conn, now=NOW)
+
+        assert load_state(conn) == latest
+        print(f"  retention kept {len(kept):,} snapshots, removed {stats['snapshots_removed']:,} snapshots "
+              f"and {stats['versions_removed']:,} versions")
+        print(f"  recompressed {stats['versions_recompressed']:,} payloads with the shared dictionary")
+        print(f"  payload bytes {stats['bytes_before'] / 1e6:.2f} MB -> {stats['bytes_after'] / 1e6:.2f} MB "
+              f"(saved {stats['bytes_saved'] / 1e6:.2f} MB, {stats['bytes_saved'] / stats['bytes_before']:.0%})")
+        print(f"  {stats['seconds']:.2f}s, {stats['versions_per_second']:,.0f} versions/s, "
+              f"{stats['mb_per_second']:.1f} MB/s")
+        conn.close()
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
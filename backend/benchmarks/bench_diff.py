@@ -0,0 +1,69 @@
+"""
+_compute_diff on a large object type: field-by-field vs content-hash-first.
+
+Hashes are computed up front, as they are stored alongside every snapshot, so only the
+diff itself is timed.
+
+Usage: python -m benchmarks.bench_diff [--objects 500000] [--changed 0.001]
+"""
+
+import argparse
+import time
+
+from benchmarks.common import timed
+from monitor import _compute_diff
+from storage import HashIndex, payload_hash
+
+
+def synthetic_users(count: int, changed_every: int = 0):
+    users = []
+    for i in range(count):
+        changed = changed_every and i % changed_every == 0
+        users.append({
+            "id": f"user-{i:07d}",
+            "displayName": f"User {i}",
+            "userPrincipalName": f"user{i}@contoso.example",
+            "jobTitle": "Lead" if changed else "Engineer",
+            "accountEnabled": True,
+        })
+    return users
+
+
+def best_of(runs: int, func):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--objects", type=int, default=500_000)
+    parser.add_argument("--changed", type=float, default=0.001, help="fraction of objects modified")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    old = synthetic_users(args.objects)
+    new = synthetic_users(args.objects, max(1, int(1 / args.changed)))
+    setup = {}
+    with timed(setup, "hashing"):
+        old_hashes = HashIndex((obj["id"], payload_hash(obj)) for obj in old)
+        new_hashes = HashIndex((obj["id"], payload_hash(obj)) for obj in new)
+    same_hashes = HashIndex(old_hashes, old_hashes.fingerprint)
+
+    fieldwise, expected = best_of(args.runs, lambda: _compute_diff(old, new, "user"))
+    hashed, result = best_of(args.runs, lambda: _compute_diff(old, new, "user", old_hashes, new_hashes))
+    unchanged, skipped = best_of(args.runs, lambda: _compute_diff(old, old, "user", old_hashes, same_hashes))
+    assert sorted(result) == sorted(expected) and skipped == []
+
+    print(f"{args.objects:,} users, {len(expected):,} modified "
+          f"(hashing once at write time: {setup['hashing']:.2f}s)")
+    print(f"  field-by-field diff:   {fieldwise * 1000:8.1f} ms")
+    print(f"  hash-first diff:       {hashed * 1000:8.1f} ms  ({fieldwise / hashed:.1f}x faster)")
+    print(f"  unchanged fingerprint: {unchanged * 1000:8.3f} ms  (type skipped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Load test for /api/events: 1,000 idle subscribers on one server process.
+
+Starts the app in a subprocess - under the threaded development server (one thread per
+stream, like the production server's gthread workers) and, for comparison and if the gevent
+package is installed, under gevent's WSGI server - opens the SSE
+connections with a logged-in session, and reports the server's threads and memory while
+they sit idle, then how long an event committed by another process takes to reach every
+subscriber. Finally a batch of subscribers disconnects, misses a few events and
+reconnects with Last-Event-ID to check the replay.
+
+Usage: python -m benchmarks.bench_events [--subscribers 1000] [--servers threaded gevent]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.common import timed
+
+POLL_SECONDS = 0.1
+
+
+def serve(server: str, port: int):
+    """Run the app on port until killed (the subprocess side of the benchmark)."""
+    if server == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+    import logging
+    from app import app
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    if server == "gevent":
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(("127.0.0.1", port), app, log=None).serve_forever()
+    else:
+        from werkzeug.serving import make_server
+        make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def _process_status(pid: int):
+    """Threads and resident memory (MB) of a process, from /proc."""
+    fields = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            key, _, value = line.partition(":")
+            fields[key] = value.strip()
+    return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) / 1024
+
+
+def _publish(database: str, count: int = 1):
+    """Commit events from this process, as the monitor worker would."""
+    from events import SNAPSHOT_CREATED, record_event
+    conn = sqlite3.connect(database)
+    ids = [record_event(conn, SNAPSHOT_CREATED, {"id": n, "change_count": 1}) for n in range(count)]
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def _login(base: str):
+    from config import ADMIN_USER, ADMIN_PASS
+    request = urllib.request.Request(
+        f"{base}/api/login", data=json.dumps({"username": ADMIN_USER, "password": ADMIN_PASS}).encode(),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.headers["Set-Cookie"].split(";")[0]
+
+
+class Subscriber:
+    """One raw SSE connection; collects the event ids it receives."""
+
+    def __init__(self):
+        self.reader = self.writer = None
+        self.ids = []
+        self.received_at = {}
+
+    async def connect(self, port: int, cookie: str, last_event_id: int = None):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        headers = f"GET /api/events HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\nAccept: text/event-stream\r\n"
+        if last_event_id is not None:
+            headers += f"Last-Event-ID: {last_event_id}\r\n"
+        self.writer.write((headers + "\r\n").encode())
+        await self.writer.drain()
+        status = await self.reader.readline()
+        if b" 200 " not in status:
+            raise RuntimeError(f"Subscription failed: {status!r}")
+        while b"retry:" not in await self.reader.readline():
+            pass
+
+    async def read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            if line.startswith(b"id: "):
+                event_id = int(line[4:])
+                self.ids.append(event_id)
+                self.received_at.setdefault(event_id, time.perf_counter())
+
+    def close(self):
+        self.writer.close()
+
+
+async def _wait_for(subscribers, event_id: int, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while any(event_id not in subscriber.received_at for subscriber in subscribers):
+        if time.perf_counter() > deadline:
+            missing = sum(event_id not in subscriber.received_at for subscriber in subscribers)
+            raise RuntimeError(f"{missing} subscribers never received event {event_id}")
+        await asyncio.sleep(0.01)
+
+
+def _percentile(values, fraction: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def _load(server: str, subscribers: int, database: str, port: int, pid: int):
+    base = f"http://127.0.0.1:{port}"
+    cookie = _login(base)
+    threads_before, rss_before = _process_status(pid)
+
+    clients = [Subscriber() for _ in range(subscribers)]
+    results = {}
+    with timed(results, "connect"):
+        for start in range(0, subscribers, 100):
+            await asyncio.gather(*(client.connect(port, cookie) for client in clients[start:start + 100]))
+    readers = [asyncio.ensure_future(client.read()) for client in clients]
+    await asyncio.sleep(1)
+    threads, rss = _process_status(pid)
+    print(f"  {server:<9} {subscribers:,} subscribers connected in {results['connect']:.2f}s; "
+          f"server threads {threads_before} -> {threads}, RSS {rss_before:.0f} -> {rss:.0f} MB "
+          f"({(rss - rss_before) * 1024 / subscribers:.1f} KB per subscriber)")
+
+    latencies = []
+    for _ in range(5):
+        published = time.perf_counter()
+        event_id = _publish(database)[0]
+        await _wait_for(clients, event_id)
+        latencies.extend(client.received_at[event_id] - published for client in clients)
+    print(f"  {'':<9} fan-out of 5 events (poll interval {POLL_SECONDS * 1000:.0f} ms): "
+          f"p50 {_percentile(latencies, 0.5) * 1000:.0f} ms, p99 {_percentile(latencies, 0.99) * 1000:.0f} ms, "
+          f"max {max(latencies) * 1000:.0f} ms")
+
+    # Disconnect a batch, publish while it is away, reconnect with Last-Event-ID
+    batch = clients[:100]
+    last_seen = batch[0].ids[-1]
+    for client, reader in zip(batch, readers):
+        reader.cancel()
+        client.close()
+    missed = _publish(database, 10)
+    returning = [Subscriber() for _ in batch]
+    await asyncio.gather(*(client.connect(port, cookie, last_event_id=last_seen) for client in returning))
+    readers += [asyncio.ensure_future(client.read()) for client in returning]
+    await _wait_for(returning, missed[-1])
+    replayed = all(client.ids == missed for client in returning)
+    print(f"  {'':<9} {len(returning)} reconnects with Last-Event-ID replayed the {len(missed)} missed events: "
+          f"{'yes' if replayed else 'NO'}")
+
+    for reader in readers:
+        reader.cancel()
+    for client in clients[100:] + returning:
+        client.close()
+    return replayed
+
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(port: int, process, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("The server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--servers", nargs="+", default=["threaded"], choices=["gevent", "threaded"])
+    parser.add_argument("--serve", choices=["gevent", "threaded"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    from db import create_schema
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "events.db")
+        conn = sqlite3.connect(database)
+        create_schema(conn)
+        conn.close()
+        for server in args.servers:
+            port = _free_port()
+            env = dict(os.environ, DATABASE_URL=database, EVENTS_POLL_SECONDS=str(POLL_SECONDS))
+            process = subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.bench_events", "--serve", server, "--port", str(port)], env=env
+            )
+            try:
+                _wait_until_up(port, process)
+                ok = asyncio.run(_load(server, args.subscribers, database, port, process.pid)) and ok
+            finally:
+                process.kill()
+                process.wait()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Point-in-time reconstruction on a long history: checkpoints + deltas vs version range scans.
+
+Builds --days of history (see bench_compaction.build_history) and times rebuilding the
+state at snapshots spread over the history, with the checkpoints the monitor writes and
+with the checkpoints removed (every version written before the snapshot is scanned). Also
+times state_at for a single object and one page of an object's history.
+
+Usage: python -m benchmarks.bench_history [--days 365] [--per-day 24] [--objects 2000]
+"""
+
+import argparse
+import os
+import tempfile
+
+from benchmarks.bench_compaction import build_history
+from benchmarks.bench_snapshots import best_ms
+from db import create_schema
+from history import object_history, state_at
+from storage import backfill_checkpoints, load_state
+from storage_backend import SQLiteBackend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=24)
+    parser.add_argument("--objects", type=int, default=2000)
+    parser.add_argument("--churn", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteBackend(os.path.join(tmp, "bench.db"))
+        conn = backend.connect()
+        create_schema(conn)
+        build_history(conn, args.days, args.per_day, args.objects, args.churn)
+        snapshot_ids = [row[0] for row in conn.execute("SELECT id FROM snapshots ORDER BY id")]
+        versions = conn.execute("SELECT COUNT(*) FROM object_versions").fetchone()[0]
+        checkpoints = conn.execute("SELECT COUNT(DISTINCT snapshot_id) FROM state_checkpoints").fetchone()[0]
+        rows = conn.execute("SELECT COUNT(*) FROM state_checkpoints").fetchone()[0]
+        print(f"{len(snapshot_ids):,} snapshots, {versions:,} object versions, "
+              f"{checkpoints} checkpoints ({rows:,} rows)")
+
+        targets = [snapshot_ids[int(fraction * (len(snapshot_ids) - 1))] for fraction in (0.1, 0.5, 0.9, 1.0)]
+        with_checkpoints = {target: best_ms(lambda: load_state(conn, target), runs=3) for target in targets}
+        saved = conn.execute("SELECT snapshot_id, object_type, version_id FROM state_checkpoints").fetchall()
+        conn.execute("DELETE FROM state_checkpoints")
+        without = {target: best_ms(lambda: load_state(conn, target), runs=3) for target in targets}
+        conn.execute("DELETE FROM state_checkpoints")
+        backfill_checkpoints(conn)
+        assert len(saved) == conn.execute("SELECT COUNT(*) FROM state_checkpoints").fetchone()[0]
+        conn.commit()
+
+        print("  load_state at a past snapshot (ms):   checkpoints   range scan")
+        for target in targets:
+            print(f"    snapshot {target:>6}                     {with_checkpoints[target]:9.1f}  "
+                  f"{without[target]:11.1f}")
+
+        object_id = "00005eed-0000-0000-0000-000000000007"
+        middle = conn.execute("SELECT timestamp FROM snapshots WHERE id = ?",
+                              (snapshot_ids[len(snapshot_ids) // 2],)).fetchone()[0]
+        print(f"  state_at for one object: {best_ms(lambda: state_at(conn, middle, 'user', object_id)):.2f} ms")
+        print(f"  object history, first page: {best_ms(lambda: object_history(conn, 'user', object_id)):.2f} ms")
+        conn.close()
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Peak memory of a full check cycle against a synthetic tenant.
+
+Pages are generated on the fly (no mock server), so the traced peak is the pipeline's own
+working set: it should track the page size, not the number of objects in the tenant.
+
+Usage: python -m benchmarks.bench_memory [--objects 1000000] [--page-size 999] [--churn 0.01]
+"""
+
+import argparse
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.common import create_database, timed
+import monitor
+
+
+def synthetic_pages(total: int, page_size: int, generation: int, churn: float):
+    """Build the iter_pages replacement serving a synthetic tenant of `total` users."""
+    churn_every = max(1, int(1 / churn)) if churn else 0
+
+    def iter_pages(url, delta=False, label=None):
+        if "/groups" in url:
+            yield [{"id": "group-0", "displayName": "All users", "description": "Synthetic"}], {}
+            return
+        for start in range(0, total, page_size):
+            page = []
+            for i in range(start, min(start + page_size, total)):
+                changed = generation and churn_every and i % churn_every == 0
+                if changed and i % (churn_every * 10) == 0:
+                    continue  # a tenth of the churn are deletions
+                page.append({
+                    "id": f"user-{i:07d}",
+                    "displayName": f"User {i}" + (f" v{generation}" if changed else ""),
+                    "userPrincipalName": f"user{i}@contoso.example",
+                    "jobTitle": "Engineer",
+                    "accountEnabled": True,
+                })
+            more = start + page_size < total
+            yield page, {"@odata.nextLink": f"{url}#page{start + page_size}"} if more else {}
+    return iter_pages
+
+
+def run_cycle(args, generation):
+    monitor.iter_pages = synthetic_pages(args.objects, args.page_size, generation, args.churn)
+    timings = {}
+    tracemalloc.start()
+    with timed(timings, "cycle"):
+        monitor.check_for_changes(["user", "group"])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings["cycle"], peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--objects", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=999)
+    parser.add_argument("--churn", type=float, default=0.01, help="fraction of users changed in the second cycle")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        monitor.DATABASE_URL = create_database(os.path.join(tmp, "bench.db"))
+        monitor.SYNC_MODE = "full"
+        monitor.enqueue_explanation = lambda snapshot_id, database_path=None: None
+
+        print(f"Synthetic tenant: {args.objects:,} users, page size {args.page_size}")
+        for generation, label in enumerate(["initial snapshot", f"{args.churn:.0%} churn"]):
+            seconds, peak = run_cycle(args, generation)
+            print(f"  {label:17} {seconds:7.1f}s   peak traced memory {peak / 2**20:7.1f} MiB "
+                  f"({peak / args.objects:.0f} bytes/object)")
+        print(f"  database size     {os.path.getsize(monitor.DATABASE_URL) / 2**20:7.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cost of the metrics hooks: per update, per rendered scrape, and per check cycle.
+
+Times counter increments and histogram observations (single-threaded and from several
+threads at once) and a /metrics render with a realistic number of series, then counts
+the metric updates made by a check cycle against the mock Graph server to put their
+total cost next to the cycle time. (Timing cycles with and without the hooks only
+measures noise: the difference is far below the run-to-run variation.)
+
+Usage: python -m benchmarks.bench_metrics [--updates 1000000] [--users 20000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import create_database, timed, use_mock_graph
+import metrics
+import monitor
+import resources
+from metrics import Counter, Histogram, render
+from mock_graph import MockGraphServer
+
+
+def _per_update_ns(update, count: int, threads: int = 1):
+    def run(n):
+        for _ in range(n):
+            update()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(run, [count // threads] * threads))
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def _cycle_seconds(users: int, runs: int = 5):
+    with MockGraphServer(page_size=999) as server, tempfile.TemporaryDirectory() as tmp:
+        use_mock_graph(server)
+        server.set_objects("users", [
+            {"id": f"user-{index:06d}", "displayName": f"User {index}", "userPrincipalName": f"user{index}@contoso.com",
+             "accountEnabled": True, "jobTitle": "Engineer"} for index in range(users)
+        ])
+        monitor.DATABASE_URL = create_database(os.path.join(tmp, "bench.db"))
+        monitor.SYNC_MODE = "full"
+        monitor.enqueue_explanation = lambda snapshot_id, database_path=None: None
+        resources.MONITORED_RESOURCES = ["user"]
+        monitor.check_for_changes()
+        timings, updates = [], []
+        key = metrics._Metric._key
+        for _ in range(runs):
+            calls = [0]
+
+            def counting_key(metric, labels):
+                calls[0] += 1
+                return key(metric, labels)
+            metrics._Metric._key = counting_key
+            results = {}
+            try:
+                with timed(results, "cycle"):
+                    monitor.check_for_changes()
+            finally:
+                metrics._Metric._key = key
+            timings.append(results["cycle"])
+            updates.append(calls[0])
+        return min(timings), max(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    args = parser.parse_args()
+
+    counter = Counter("bench_updates_total", "Benchmark counter", ["object_type"])
+    histogram = Histogram("bench_duration_seconds", "Benchmark histogram", ["route"])
+    print("  per update (ns)            1 thread   8 threads")
+    costs = []
+    for label, update in (("counter.inc", lambda: counter.inc(object_type="user")),
+                          ("histogram.observe", lambda: histogram.observe(0.042, route="/api/snapshots"))):
+        single = _per_update_ns(update, args.updates)
+        costs.append(single)
+        print(f"  {label:<24} {single:10.0f} {_per_update_ns(update, args.updates, threads=8):11.0f}")
+
+    for route in range(40):
+        for status in (200, 400, 404, 500):
+            histogram.observe(0.01, route=f"/api/route{route}")
+            metrics.HTTP_REQUEST_SECONDS.observe(0.01, method="GET", route=f"/api/route{route}", status=status)
+    results = {}
+    with timed(results, "render"):
+        text = render()
+    print(f"  render: {len(text.splitlines()):,} lines in {results['render'] * 1000:.2f} ms")
+
+    cycle, updates = _cycle_seconds(args.users)
+    overhead = updates * max(costs) / 1e9
+    print(f"  check cycle, {args.users:,} users: {cycle:.3f}s, {updates} metric updates "
+          f"= {overhead * 1e6:.0f} us ({overhead / cycle * 100:.4f}% of the cycle)")
+
+
+if __name__ == "__main__":
+    main()
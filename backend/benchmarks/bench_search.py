@@ -0,0 +1,128 @@
+"""
+/api/search latency on millions of change records.
+
+Builds a database with --events change events (spread over snapshots of --per-snapshot
+events, for --users users) and --users object names, indexed as the monitor indexes them,
+then times searches: a single UPN, a common attribute value, short prefixes, a type
+filter, a page deep in the results and an object search. For comparison, the first query
+is also run as the LIKE scan that searching without an index amounts to.
+
+Usage: python -m benchmarks.bench_search [--events 2000000] [--users 100000]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import timed
+from db import create_schema
+from search import search
+from storage_backend import SQLiteBackend
+
+TITLES = ["Engineer", "Senior Engineer", "Security Administrator", "Sales Manager", "Accountant", "Designer"]
+DEPARTMENTS = ["Engineering", "Sales", "Marketing", "Finance", "Legal", "Support"]
+BATCH = 50_000
+
+
+def build(conn, events: int, users: int, per_snapshot: int, seed: int = 11):
+    rng = random.Random(seed)
+    conn.executemany(
+        "INSERT INTO object_names (object_type, object_id, name, upn, first_snapshot) VALUES ('user', ?, ?, ?, 1)",
+        [(f"user-{index:07d}", f"User {index} {rng.choice(['Smith', 'Jones', 'Cohen', 'Levi'])}",
+          f"user{index}@contoso.com") for index in range(users)]
+    )
+    snapshots = events // per_snapshot
+    conn.executemany(
+        "INSERT INTO snapshots (id, timestamp, changes, explanation, change_count) VALUES (?, ?, '[]', NULL, ?)",
+        [(snapshot_id, "2024-01-01T00:00:00+00:00", per_snapshot) for snapshot_id in range(1, snapshots + 1)]
+    )
+    rows = []
+    for index in range(events):
+        user = rng.randrange(users)
+        field = rng.random()
+        if field < 0.5:
+            path, old, new = "jobTitle", rng.choice(TITLES), rng.choice(TITLES)
+        elif field < 0.8:
+            path, old, new = "department", rng.choice(DEPARTMENTS), rng.choice(DEPARTMENTS)
+        elif field < 0.95:
+            path, old, new = "accountEnabled", True, False
+        else:
+            path, old, new = "userPrincipalName", f"user{user}@contoso.com", f"user{user}@fabrikam.com"
+        rows.append((index // per_snapshot + 1, "user", f"user-{user:07d}", f"User {user}", path, "replace",
+                     json.dumps(old), json.dumps(new), "modified"))
+        if len(rows) == BATCH:
+            _insert_events(conn, rows)
+            rows = []
+    _insert_events(conn, rows)
+    conn.commit()
+
+
+def _insert_events(conn, rows):
+    conn.executemany(
+        "INSERT INTO change_events (snapshot_id, object_type, object_id, name, path, op, old_value, new_value, kind) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+    )
+
+
+def _time(func, runs: int = 7):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--per-snapshot", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        backend = SQLiteBackend(path)
+        conn = backend.connect()
+        create_schema(conn)
+        timings = {}
+        with timed(timings, "build"):
+            build(conn, args.events, args.users, args.per_snapshot)
+        print(f"{args.events:,} change events, {args.users:,} objects, indexed in {timings['build']:.1f}s "
+              f"(database {os.path.getsize(path) / 1e6:.0f} MB)")
+
+        deep = search(conn, "security administrator", scope="changes", limit=200)["changes"]
+        for _ in range(20):
+            if not deep["next_cursor"]:
+                break
+            deep = search(conn, "security administrator", scope="changes", cursor=deep["next_cursor"], limit=200)["changes"]
+        queries = [
+            ("one UPN", dict(q="user4242@contoso.com")),
+            ("one UPN, changes only", dict(q="user4242@fabrikam.com", scope="changes")),
+            ("common value", dict(q="security administrator", scope="changes")),
+            ("short prefix", dict(q="se ad", scope="changes")),
+            ("type filter", dict(q="engineering", scope="changes", object_type="user")),
+            ("page 21 (cursor)", dict(q="security administrator", scope="changes", cursor=deep["next_cursor"])),
+            ("object by surname prefix", dict(q="coh", scope="objects")),
+            ("no match", dict(q="nonexistentvalue")),
+        ]
+        print(f"  {'query':<28} {'p50 ms':>8} {'max ms':>8}  results")
+        for label, kwargs in queries:
+            p50, worst, result = _time(lambda: search(conn, **kwargs))
+            found = sum(len(part["items"]) for part in result.values())
+            print(f"  {label:<28} {p50:8.2f} {worst:8.2f}  {found}")
+
+        p50, _, _ = _time(lambda: conn.execute(
+            "SELECT id FROM change_events WHERE old_value LIKE ? OR new_value LIKE ? OR name LIKE ? "
+            "ORDER BY id DESC LIMIT 21", ("%user4242@contoso.com%",) * 3).fetchall(), runs=3)
+        print(f"  {'one UPN, LIKE scan':<28} {p50:8.2f}")
+        conn.close()
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
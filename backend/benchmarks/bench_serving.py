@@ -0,0 +1,220 @@
+"""
+API throughput: the production server (gunicorn with threaded workers, gunicorn.conf.py) against
+the Flask development server.
+
+Builds a database from a synthetic tenant (an initial sync and a few delta cycles against
+the mock Graph server, explanations marked ready), starts each server in a subprocess with
+the app as both run it - database initialised, no scheduler - and drives it from
+--connections concurrent clients (keep-alive where the server allows it). Scenarios:
+
+- snapshot: a snapshot's details with both full configurations (?include=config), sent
+  uncompressed (Accept-Encoding: identity, what every response was before), with gzip and,
+  if installed, brotli
+- snapshot_304: the same request revalidated with the ETag of an earlier response
+- snapshots: the first page of the snapshot list
+- health: /api/health
+
+Usage: python -m benchmarks.bench_serving [--users 1000] [--requests 500] [--connections 16] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.common import create_database, use_mock_graph
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wsgi_app():
+    """The app as the benchmark servers run it (gunicorn calls this as an app factory)."""
+    from app import app
+    from db import init_app
+    init_app(app)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    return app
+
+
+def build_database(database: str, users: int, cycles: int = 3):
+    """Snapshots of a synthetic tenant: an initial sync, then cycles with 1% churn."""
+    from benchmarks.tenant import SyntheticTenant
+    from mock_graph import MockGraphServer
+    import monitor
+    import resources
+
+    monitor.DATABASE_URL = create_database(database)
+    monitor.enqueue_explanation = lambda snapshot_id, database_path=None: None
+    resources.MONITORED_RESOURCES = ["user", "group", "conditional_access_policy", "application",
+                                     "service_principal", "directory_role_assignment"]
+    tenant = SyntheticTenant(users)
+    with MockGraphServer(page_size=999) as server:
+        use_mock_graph(server)
+        tenant.load(server)
+        monitor.check_for_changes()
+        for _ in range(cycles):
+            tenant.churn(server, 0.01)
+            monitor.check_for_changes()
+    conn = sqlite3.connect(database)
+    conn.execute("UPDATE snapshots SET explanation = 'Benchmark explanation', explanation_status = 'ready'")
+    conn.commit()
+    latest = conn.execute("SELECT MAX(id) FROM snapshots").fetchone()[0]
+    conn.close()
+    return latest
+
+
+def _start(server: str, port: int, database: str, workers: int, tmp: str):
+    env = dict(os.environ, DATABASE_URL=database, LOG_LEVEL="WARNING")
+    if server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+                   "--workers", str(workers), "benchmarks.bench_serving:wsgi_app()"]
+    else:
+        command = [sys.executable, "-c", "from benchmarks.bench_serving import wsgi_app; "
+                   f"wsgi_app().run(host='127.0.0.1', port={port}, threaded=True)"]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=open(os.path.join(tmp, f"{server}.log"), "w"))
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The {server} server exited during startup (see {tmp}/{server}.log)")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The {server} server did not start")
+
+
+def _login(port: int):
+    from config import ADMIN_USER, ADMIN_PASS
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/api/login",
+        data=json.dumps({"username": ADMIN_USER, "password": ADMIN_PASS}).encode(),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.headers["Set-Cookie"].split(";")[0]
+
+
+async def _request(reader, writer, raw: bytes):
+    """Send one request on a keep-alive connection; returns (status, headers, body length)."""
+    writer.write(raw)
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length:
+        await reader.readexactly(length)
+    return int(status_line.split()[1]), headers, length
+
+
+async def _drive(port: int, raw: bytes, requests: int, connections: int):
+    """Send requests over several connections; returns (seconds, latencies, bytes per response)."""
+    latencies, sizes = [], []
+    remaining = [requests]
+
+    async def connection():
+        writer = None
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                start = time.perf_counter()
+                if writer is None:
+                    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                status, headers, length = await _request(reader, writer, raw)
+                latencies.append(time.perf_counter() - start)
+                sizes.append(length)
+                if status not in (200, 304):
+                    raise RuntimeError(f"Unexpected status {status}")
+                if headers.get("connection") == "close":
+                    # The development server closes the connection after every response
+                    writer.close()
+                    writer = None
+        finally:
+            if writer is not None:
+                writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connection() for _ in range(connections)))
+    return time.perf_counter() - start, latencies, sum(sizes) / len(sizes)
+
+
+def _raw_request(path: str, cookie: str, **headers):
+    lines = [f"GET {path} HTTP/1.1", "Host: 127.0.0.1", f"Cookie: {cookie}"]
+    lines += [f"{name.replace('_', '-')}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+async def _scenarios(port: int, latest: int, args):
+    from http_responses import brotli
+
+    cookie = _login(port)
+    detail = f"/api/snapshots/{latest}?include=config"
+    probe = _raw_request(detail, cookie, Accept_Encoding="gzip")
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    _, headers, _ = await _request(reader, writer, probe)
+    writer.close()
+
+    scenarios = {"snapshot (identity)": _raw_request(detail, cookie, Accept_Encoding="identity"),
+                 "snapshot (gzip)": probe}
+    if brotli is not None:
+        scenarios["snapshot (br)"] = _raw_request(detail, cookie, Accept_Encoding="br")
+    scenarios["snapshot_304"] = _raw_request(detail, cookie, Accept_Encoding="gzip", If_None_Match=headers["etag"])
+    scenarios["snapshots"] = _raw_request("/api/snapshots", cookie, Accept_Encoding="gzip")
+    scenarios["health"] = _raw_request("/api/health", cookie, Accept_Encoding="gzip")
+
+    results = {}
+    for name, raw in scenarios.items():
+        await _drive(port, raw, min(200, args.requests), args.connections)   # warm-up
+        seconds, latencies, size = await _drive(port, raw, args.requests, args.connections)
+        latencies.sort()
+        results[name] = {"rps": len(latencies) / seconds, "p50_ms": latencies[len(latencies) // 2] * 1000,
+                         "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000, "bytes": size}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="gunicorn worker processes")
+    parser.add_argument("--servers", nargs="+", default=["dev", "gunicorn"], choices=["dev", "gunicorn"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "serving.db")
+        latest = build_database(database, args.users)
+        print(f"  {args.users:,} users, snapshot {latest}; {args.requests} requests per scenario over "
+              f"{args.connections} connections, gunicorn with {args.workers} threaded workers")
+        print(f"  {'':<22}{'server':<10}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'bytes':>10}")
+        all_results = {}
+        for port, server in enumerate(args.servers, start=18431):
+            process = _start(server, port, database, args.workers, tmp)
+            try:
+                all_results[server] = asyncio.run(_scenarios(port, latest, args))
+            finally:
+                process.terminate()
+                process.wait()
+        for scenario in next(iter(all_results.values())):
+            for server, results in all_results.items():
+                row = results[scenario]
+                print(f"  {scenario:<22}{server:<10}{row['rps']:9.0f}{row['p50_ms']:9.1f}{row['p99_ms']:9.1f}"
+                      f"{row['bytes']:10,.0f}")
+
+
+if __name__ == "__main__":
+    main()
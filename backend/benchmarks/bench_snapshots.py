@@ -0,0 +1,92 @@
+"""
+Snapshot listing with a long history: keyset pages vs the old load-everything listing.
+
+Builds a database with --snapshots snapshots (each with a few change events) and times the
+first page, a page deep in the history, and filtered pages. Keyset pages should cost the
+same wherever they are in the history.
+
+Usage: python -m benchmarks.bench_snapshots [--snapshots 100000] [--limit 50]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import timed
+from db import create_schema
+from storage import query_snapshots
+
+
+def build_history(conn, count: int):
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    snapshots, events = [], []
+    for i in range(1, count + 1):
+        changes = [f"User modified: User {i} - jobTitle changed from 'a' to 'b'"] * (1 + i % 3)
+        snapshots.append((i, (start + timedelta(minutes=10 * i)).isoformat(), json.dumps(changes), "", len(changes)))
+        events.append((i, "user", f"user-{i % 5000:05d}", "jobTitle", "replace", "modified"))
+        if i % 10 == 0:
+            events.append((i, "group", f"group-{i % 200:03d}", "", "add", "added"))
+        if i % 1000 == 0:
+            events.append((i, "conditional_access_policy", "policy-1", "", "remove", "removed"))
+    conn.executemany(
+        "INSERT INTO snapshots (id, timestamp, changes, explanation, change_count) VALUES (?, ?, ?, ?, ?)", snapshots
+    )
+    conn.executemany(
+        "INSERT INTO change_events (snapshot_id, object_type, object_id, path, op, kind) VALUES (?, ?, ?, ?, ?, ?)",
+        events
+    )
+    conn.commit()
+
+
+def legacy_listing(conn):
+    """The listing before pagination: every row, ordered by the unindexed timestamp."""
+    rows = conn.execute("SELECT id, timestamp FROM snapshots NOT INDEXED ORDER BY timestamp DESC").fetchall()
+    return [{"id": row[0], "timestamp": row[1]} for row in rows]
+
+
+def best_ms(func, runs=5):
+    best = float("inf")
+    for _ in range(runs):
+        timing = {}
+        with timed(timing, "run"):
+            func()
+        best = min(best, timing["run"])
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--snapshots", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        create_schema(conn)
+        setup = {}
+        with timed(setup, "build"):
+            build_history(conn, args.snapshots)
+        print(f"{args.snapshots:,} snapshots built in {setup['build']:.1f}s, page size {args.limit}")
+
+        deep_cursor = str(args.snapshots // 100)  # 99% of the way back in history
+        cases = {
+            "legacy: all rows, ORDER BY timestamp": lambda: legacy_listing(conn),
+            "first page": lambda: query_snapshots(conn, limit=args.limit),
+            "middle page": lambda: query_snapshots(conn, limit=args.limit, cursor=str(args.snapshots // 2)),
+            "deep page (cursor near oldest)": lambda: query_snapshots(conn, limit=args.limit, cursor=deep_cursor),
+            "time range (one week)": lambda: query_snapshots(conn, limit=args.limit, since="2020-06-01", until="2020-06-08"),
+            "object_type=group": lambda: query_snapshots(conn, limit=args.limit, object_type="group"),
+            "object_type=group, deep": lambda: query_snapshots(conn, limit=args.limit, object_type="group", cursor=deep_cursor),
+            "object_id=user-00042": lambda: query_snapshots(conn, limit=args.limit, object_id="user-00042"),
+            "kind=removed (rare)": lambda: query_snapshots(conn, limit=args.limit, kind="removed"),
+        }
+        for label, func in cases.items():
+            print(f"  {label:40} {best_ms(func):9.3f} ms")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+API read latency while the monitor writes a large snapshot: default SQLite settings vs
+performance mode (WAL, tuned pragmas, per-thread pooled connections).
+
+For each mode a database with --history snapshots and --objects current users is built.
+A writer then stages a snapshot that changes every user, page by page as the monitor does,
+and applies it in one transaction. Meanwhile --readers threads keep serving "API requests"
+(first page of the snapshot listing + the change records of the newest snapshot), each on
+a connection from the backend. Read latencies are reported while the write is in progress.
+
+Usage: python -m benchmarks.bench_sqlite_concurrency [--objects 100000] [--readers 4]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_snapshots import build_history
+from db import create_schema
+from storage import apply_staged, clear_staging, insert_snapshot, load_change_records, query_snapshots, stage_page
+from storage_backend import SQLiteBackend
+
+PAGE_SIZE = 1000
+
+
+def _users(count: int, version: int):
+    return [{"id": f"user-{index:06d}", "displayName": f"User {index}", "jobTitle": f"Title {version}",
+             "department": "Engineering" if index % 2 else "Sales"} for index in range(count)]
+
+
+def _write_snapshot(backend, objects: int, version: int):
+    """Stage and apply one snapshot that changes every user, committing page by page like the monitor."""
+    conn = backend.connect()
+    users = _users(objects, version)
+    for start in range(0, objects, PAGE_SIZE):
+        stage_page(conn, "user", users[start:start + PAGE_SIZE])
+        conn.commit()
+    snapshot_id = insert_snapshot(conn, f"2030-01-01T00:00:{version:02d}", [f"{objects} users modified"], None)
+    apply_staged(conn, snapshot_id, "user")
+    clear_staging(conn, "user")
+    conn.commit()
+    conn.close()
+
+
+def _build(backend, history: int, objects: int):
+    conn = backend.connect()
+    create_schema(conn)
+    build_history(conn, history)
+    conn.close()
+    _write_snapshot(backend, objects, 0)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_mode(path: str, performance_mode: bool, history: int, objects: int, readers: int):
+    backend = SQLiteBackend(path, performance_mode=performance_mode)
+    _build(backend, history, objects)
+
+    latencies, errors = [], []
+    writing = threading.Event()
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def reader():
+        writing.wait()
+        local = []
+        while not done.is_set():
+            start = time.perf_counter()
+            try:
+                conn = backend.connect()
+                page = query_snapshots(conn, limit=50)
+                load_change_records(conn, page["items"][0]["id"])
+                conn.close()
+                local.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(e)
+        backend.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    writing.set()
+    start = time.perf_counter()
+    _write_snapshot(backend, objects, 1)
+    write_seconds = time.perf_counter() - start
+    done.set()
+    for thread in threads:
+        thread.join()
+    backend.close()
+
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        "write_seconds": write_seconds,
+        "reads": len(ms),
+        "reads_per_second": len(ms) / write_seconds,
+        "p50_ms": statistics.median(ms) if ms else None,
+        "p95_ms": _percentile(ms, 0.95) if ms else None,
+        "p99_ms": _percentile(ms, 0.99) if ms else None,
+        "max_ms": max(ms) if ms else None,
+        "errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, default=20_000)
+    parser.add_argument("--objects", type=int, default=100_000)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{args.history:,} snapshots of history, writing a snapshot that changes {args.objects:,} users, "
+          f"{args.readers} concurrent readers")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, performance_mode in (("default (rollback journal, new connections)", False),
+                                        ("performance mode (WAL, pooled)", True)):
+            path = os.path.join(tmp, f"bench-{performance_mode}.db")
+            result = run_mode(path, performance_mode, args.history, args.objects, args.readers)
+            print(f"  {label}")
+            print(f"    write {result['write_seconds']:.2f}s, {result['reads']:,} reads "
+                  f"({result['reads_per_second']:,.0f}/s), errors: {result['errors']}")
+            if result["reads"]:
+                print(f"    read latency p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, "
+                      f"p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks run from the backend directory (python -m benchmarks.<name>) against the
+local mock Graph server, so they only need placeholder secrets to import config.
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+for _name in ("GRAPH_CLIENT_ID", "GRAPH_TENANT_ID", "GRAPH_CLIENT_SECRET", "OPENAI_API_KEY", "FLASK_SECRET_KEY"):
+    os.environ.setdefault(_name, f"benchmark-{_name.lower()}")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@contextmanager
+def timed(results: dict, key: str):
+    """Store the wall time of the block in results[key] (seconds)."""
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+
+
+def create_database(path: str):
+    """Create the schema in a new database, as worker.py does before the monitor's first check."""
+    from db import create_schema
+    from storage_backend import connect
+    conn = connect(path)
+    try:
+        create_schema(conn)
+    finally:
+        conn.close()
+    return path
+
+
+def use_mock_graph(server):
+    """Point graph_client at a running MockGraphServer with a dummy token."""
+    import graph_client
+    graph_client.GRAPH_CONFIG_ENDPOINT = server.base_url
+    graph_client._get_access_token = lambda: "benchmark-token"
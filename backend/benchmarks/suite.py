@@ -0,0 +1,405 @@
+"""
+End-to-end benchmark suite with machine-readable results, for comparing commits.
+
+Generates a synthetic tenant (see benchmarks.tenant) of --users users and serves it from
+the mock Graph server with realistic paging (--page-size), per-response latency with
+jitter, and a request rate limit above which requests are throttled with 429 and
+Retry-After. Then times:
+
+- fetch: fetch_all_graph_data for every monitored collection, serially and concurrently
+- diff: _compute_diff for every object type, before vs after one round of churn
+- persistence: saving the whole tenant as one snapshot, and rebuilding it with load_state
+- cycle: check_for_changes - the initial sync, then --cycles delta cycles with --churn of
+  every object type changed before each - with the fetch / diff / store split
+- api: the API endpoints over HTTP, on the database the cycles produced
+- startup: the production server (gunicorn, one worker) from launch to its first served
+  request (/api/ready) on a new database, and to the first sync being reported complete
+  with the monitor started alongside it
+
+The results are written as JSON (--output; benchmarks/results/<commit>.json by default).
+Pass an earlier results file as --compare to print the relative change of every timing;
+the exit status is 1 when any of them is more than --threshold slower.
+
+Usage: python -m benchmarks.suite [--users 10000] [--churn 0.01] [--only fetch,cycle] [--compare FILE]
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+from benchmarks.common import create_database, use_mock_graph
+from benchmarks.tenant import SyntheticTenant
+from mock_graph import MockGraphServer
+import graph_client
+import metrics
+import monitor
+import resources
+import storage_backend
+
+SCENARIOS = ("fetch", "diff", "persistence", "cycle", "api", "startup")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Mock Graph collection of each monitored resource (group_membership is groups plus members)
+COLLECTIONS = {
+    "user": "users",
+    "group": "groups",
+    "conditional_access_policy": "identity/conditionalAccess/policies",
+    "application": "applications",
+    "service_principal": "servicePrincipals",
+    "directory_role_assignment": "roleManagement/directory/roleAssignments",
+}
+
+
+def _summary(timings: list, **extra):
+    """Result entry for repeated measurements (seconds)."""
+    summary = {"seconds": statistics.median(timings), "min": min(timings), "max": max(timings)}
+    if len(timings) >= 10:
+        summary["p95"] = statistics.quantiles(timings, n=20)[-1]
+    return {**{key: round(value, 6) for key, value in summary.items()}, "runs": len(timings), **extra}
+
+
+def _repeat(func, runs: int):
+    timings, result = [], None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def _graph_server(args):
+    return MockGraphServer(page_size=args.page_size, latency=args.latency, latency_jitter=args.jitter,
+                           rate_limit=args.rate_limit, seed=args.seed)
+
+
+def bench_fetch(args, tenant):
+    results = {}
+    with _graph_server(args) as server:
+        use_mock_graph(server)
+        tenant.load(server)
+        endpoints = {name: resources.RESOURCES[name].endpoint for name in COLLECTIONS}
+        for name, endpoint in endpoints.items():
+            graph_client.reset_fetch_stats()
+            throttled = server.throttled
+            timings, items = _repeat(lambda: graph_client.fetch_all_graph_data(endpoint), args.repeat)
+            results[f"fetch.serial.{name}"] = _summary(
+                timings, objects=len(items), requests=graph_client.get_fetch_stats()["requests"] // args.repeat,
+                throttled=(server.throttled - throttled) // args.repeat
+            )
+        graph_client.reset_fetch_stats()
+        throttled = server.throttled
+        fetchers = {name: partial(graph_client.fetch_all_graph_data, endpoint) for name, endpoint in endpoints.items()}
+        timings, _ = _repeat(lambda: graph_client.fetch_concurrently(fetchers), args.repeat)
+        stats = graph_client.get_fetch_stats()
+        results["fetch.concurrent.all"] = _summary(
+            timings, requests=stats["requests"] // args.repeat, retries=stats["retries"] // args.repeat,
+            throttled=(server.throttled - throttled) // args.repeat
+        )
+    return results
+
+
+def bench_diff(args, tenant):
+    results = {}
+    before = copy.deepcopy(tenant.collections)
+    with MockGraphServer() as sink:
+        tenant.churn(sink, args.churn)
+    for name, collection in COLLECTIONS.items():
+        old, new = list(before[collection].values()), list(tenant.collections[collection].values())
+        timings, changes = _repeat(lambda: monitor._compute_diff(old, new, name), args.repeat)
+        results[f"diff.{name}"] = _summary(timings, objects=len(new), changes=len(changes))
+    return results
+
+
+def bench_persistence(args, tenant, tmp):
+    from db import create_schema
+    from storage import load_state, save_snapshot
+
+    state = {name: list(tenant.collections[collection].values()) for name, collection in COLLECTIONS.items()}
+    save_timings, load_timings = [], []
+    for run in range(args.repeat):
+        backend = storage_backend.create_backend(os.path.join(tmp, f"persistence-{run}.db"))
+        conn = backend.connect()
+        create_schema(conn)
+        start = time.perf_counter()
+        save_snapshot(conn, datetime.now(timezone.utc).isoformat(), state, ["Initial configuration snapshot"], None)
+        conn.commit()
+        save_timings.append(time.perf_counter() - start)
+        load_timings.append(_repeat(lambda: load_state(conn), 1)[0][0])
+        conn.close()
+        backend.close()
+    return {
+        "persistence.save_snapshot": _summary(save_timings, objects=tenant.object_count),
+        "persistence.load_state": _summary(load_timings, objects=tenant.object_count),
+    }
+
+
+def _stage_seconds():
+    """Total seconds recorded so far for each check stage."""
+    return {sample[1]["stage"]: sample[2] for sample in metrics.CHECK_STAGE_SECONDS.samples()
+            if sample[0].endswith("_sum")}
+
+
+def bench_cycle(args, tenant, database):
+    monitor.DATABASE_URL = create_database(database)
+    monitor.SYNC_MODE = "delta"
+    monitor.enqueue_explanation = lambda snapshot_id, database_path=None: None
+    resources.MONITORED_RESOURCES = list(COLLECTIONS) + ["group_membership"]
+    results = {}
+    with _graph_server(args) as server:
+        use_mock_graph(server)
+        tenant.load(server)
+        start = time.perf_counter()
+        monitor.check_for_changes()
+        results["cycle.initial"] = _summary([time.perf_counter() - start], objects=tenant.object_count)
+
+        timings, stages, changes = [], {}, 0
+        for _ in range(args.cycles):
+            changes += tenant.churn(server, args.churn)
+            before = _stage_seconds()
+            start = time.perf_counter()
+            monitor.check_for_changes()
+            timings.append(time.perf_counter() - start)
+            for stage, total in _stage_seconds().items():
+                if stage in ("fetch", "diff", "store"):
+                    stages.setdefault(stage, []).append(total - before.get(stage, 0.0))
+        results["cycle.incremental"] = _summary(timings, changes=changes // max(1, args.cycles))
+        for stage, stage_timings in stages.items():
+            results[f"cycle.incremental.{stage}"] = _summary(stage_timings)
+    return results
+
+
+def bench_api(args, database):
+    import requests
+    from werkzeug.serving import make_server
+
+    storage_backend.DATABASE_URL = database
+    from app import app
+    from config import ADMIN_USER, ADMIN_PASS
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    session = requests.Session()
+    session.post(f"{base}/api/login", json={"username": ADMIN_USER, "password": ADMIN_PASS}).raise_for_status()
+
+    latest = session.get(f"{base}/api/snapshots?limit=1").json()["items"][0]["id"]
+    user_id = session.get(f"{base}/api/state?at=2999-01-01&object_type=user").json()["state"]["user"][0]["id"]
+    endpoints = {
+        "health": "/api/health",
+        "snapshots": "/api/snapshots",
+        "snapshot": f"/api/snapshots/{latest}",
+        "snapshot_diff": f"/api/snapshots/{latest}/diff",
+        "state": "/api/state?at=2999-01-01&object_type=group",
+        "object_history": f"/api/objects/user/{user_id}/history",
+        "search": "/api/search?q=engineer",
+        "metrics": "/metrics",
+    }
+    results = {}
+    try:
+        for name, path in endpoints.items():
+            def request():
+                response = session.get(base + path)
+                response.raise_for_status()
+                return len(response.content)
+            request()  # warm-up (first request of a route, diff cache)
+            timings, size = _repeat(request, args.requests)
+            results[f"api.{name}"] = _summary(timings, bytes=size)
+    finally:
+        server.shutdown()
+    return results
+
+
+def _start_server(database: str):
+    """Launch gunicorn with one worker on a free port; returns (process, base URL)."""
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "--workers", "1",
+         "wsgi:app"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=dict(os.environ, DATABASE_URL=database),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+def _poll_ready(process, base: str, until=lambda ready: True, timeout: float = 120):
+    """Poll /api/ready until it answers 200 and until(body) holds; returns the body."""
+    import requests
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            response = requests.get(f"{base}/api/ready", timeout=1)
+            if response.status_code == 200 and until(response.json()):
+                return response.json()
+        except (requests.ConnectionError, requests.Timeout):
+            pass
+        time.sleep(0.01)
+    raise RuntimeError("The server did not become ready")
+
+
+def bench_startup(args, tenant, tmp):
+    from db import create_schema
+    from lease import Lease
+
+    timings = []
+    for run in range(args.repeat + 1):
+        database = os.path.join(tmp, f"startup-{run}.db")
+        start = time.perf_counter()
+        process, base = _start_server(database)
+        try:
+            ready = _poll_ready(process, base)
+            timings.append(time.perf_counter() - start)
+            if run < args.repeat:
+                continue
+            # Last run: start the monitor too, and wait for the tenant's baseline
+            assert ready["first_sync"] == "in_progress"
+            conn = storage_backend.connect(database)
+            create_schema(conn)
+            conn.close()
+            monitor.DATABASE_URL = database
+            monitor.enqueue_explanation = lambda snapshot_id, database_path=None: None
+            resources.MONITORED_RESOURCES = list(COLLECTIONS) + ["group_membership"]
+            stop = threading.Event()
+            with _graph_server(args) as server:
+                use_mock_graph(server)
+                tenant.load(server)
+                start = time.perf_counter()
+                thread = threading.Thread(target=monitor.start_monitoring, args=(Lease("monitor", database=database), stop))
+                thread.start()
+                try:
+                    _poll_ready(process, base, until=lambda body: body["first_sync"] == "complete", timeout=3600)
+                    first_sync = time.perf_counter() - start
+                finally:
+                    stop.set()
+                    thread.join()
+        finally:
+            process.terminate()
+            process.wait()
+    # The first launch also pays for cold imports; it is reported, but not in the median
+    return {
+        "startup.first_request": _summary(timings[1:], cold_seconds=round(timings[0], 6)),
+        "startup.first_sync": _summary([first_sync], objects=tenant.object_count),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Run the selected scenarios; returns the results document."""
+    only = set(args.only.split(",")) if args.only else set(SCENARIOS)
+    unknown = only - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))} (choose from {', '.join(SCENARIOS)})")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "suite.db")
+        if "fetch" in only:
+            results.update(bench_fetch(args, SyntheticTenant(args.users, args.seed)))
+        if "diff" in only:
+            results.update(bench_diff(args, SyntheticTenant(args.users, args.seed)))
+        if "persistence" in only:
+            results.update(bench_persistence(args, SyntheticTenant(args.users, args.seed), tmp))
+        if "cycle" in only or "api" in only:
+            # The API is measured on the history the monitor wrote
+            results.update(bench_cycle(args, SyntheticTenant(args.users, args.seed), database))
+        if "api" in only:
+            results.update(bench_api(args, database))
+        if "startup" in only:
+            results.update(bench_startup(args, SyntheticTenant(args.users, args.seed), tmp))
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {name: getattr(args, name) for name in
+                       ("users", "churn", "cycles", "page_size", "latency", "jitter", "rate_limit", "repeat",
+                        "requests", "seed")},
+        "results": results,
+    }
+
+
+def compare(document: dict, baseline: dict, threshold: float):
+    """Print every timing next to the baseline; returns the names that regressed."""
+    if baseline.get("parameters") != document["parameters"]:
+        print("  note: the baseline was run with different parameters")
+    regressions = []
+    print(f"  {'benchmark':<40} {'baseline s':>11} {'now s':>11} {'change':>8}")
+    for name, result in document["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            print(f"  {name:<40} {'-':>11} {result['seconds']:11.4f}")
+            continue
+        change = (result["seconds"] - previous["seconds"]) / previous["seconds"] if previous["seconds"] else 0.0
+        flag = "  << slower" if change > threshold else ""
+        print(f"  {name:<40} {previous['seconds']:11.4f} {result['seconds']:11.4f} {change * 100:+7.1f}%{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000, help="tenant size; other object types scale with it")
+    parser.add_argument("--churn", type=float, default=0.01, help="fraction of each object type changed per cycle")
+    parser.add_argument("--cycles", type=int, default=3, help="incremental check cycles")
+    parser.add_argument("--page-size", type=int, default=999)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every Graph response")
+    parser.add_argument("--jitter", type=float, default=0.01, help="up to this many extra seconds, at random")
+    parser.add_argument("--rate-limit", type=float, default=200, help="Graph requests/second before throttling")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each fetch / diff / persistence timing")
+    parser.add_argument("--requests", type=int, default=20, help="requests per API endpoint")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help=f"comma-separated scenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    document = run(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"{document['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2)
+
+    for name, result in document["results"].items():
+        extra = ", ".join(f"{key}={value}" for key, value in result.items()
+                          if key not in ("seconds", "min", "max", "p95", "runs"))
+        print(f"  {name:<40} {result['seconds'] * 1000:10.1f} ms  {extra}")
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(document, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Synthetic Entra ID tenants for the benchmarks, served by mock_graph.MockGraphServer.
+
+A tenant is sized by its number of users; the other object types scale with it in
+proportions typical of a mid-size organisation (a group per 25 users, an application per
+50, ...). Objects carry the attributes the monitored resources select, with nested
+structures where Graph has them (conditional access conditions, app credentials), and
+every group has a member list for the group_membership resource.
+
+churn() mutates a fraction of every object type the way a tenant changes between polls -
+attribute edits, new objects, deletions, membership changes - through the mock server's
+upsert/delete, so the delta endpoints report exactly those changes.
+"""
+
+import random
+import uuid
+
+ROLE_DEFINITIONS = [str(uuid.UUID(int=0x62e90394_69f5_4237_9190_012177145e10 + index)) for index in range(12)]
+TITLES = ["Engineer", "Senior Engineer", "Manager", "Sales Representative", "Accountant", "Designer", "Analyst"]
+SCOPES = ["User.Read", "Mail.Send", "Files.ReadWrite.All", "Directory.Read.All", "Sites.Read.All"]
+
+# Collection (path below /v1.0) -> objects per user
+PROPORTIONS = {
+    "groups": 1 / 25,
+    "applications": 1 / 50,
+    "servicePrincipals": 1 / 20,
+    "identity/conditionalAccess/policies": 1 / 1000,
+    "roleManagement/directory/roleAssignments": 1 / 100,
+}
+
+
+class SyntheticTenant:
+    """A generated tenant, kept in memory and pushed to a MockGraphServer."""
+
+    def __init__(self, users: int = 10_000, seed: int = 1):
+        self.random = random.Random(seed)
+        self._next_id = 0
+        self.collections = {"users": {}}
+        for _ in range(users):
+            self._add("users", self._user())
+        for collection, per_user in PROPORTIONS.items():
+            self.collections[collection] = {}
+            minimum = 3 if collection == "identity/conditionalAccess/policies" else 1
+            for _ in range(max(minimum, round(users * per_user))):
+                self._add(collection, self._make(collection))
+        self.members = {group_id: self._members() for group_id in self.collections["groups"]}
+
+    @property
+    def object_count(self):
+        return sum(len(objects) for objects in self.collections.values())
+
+    # --- Generation ---
+
+    def _new_id(self):
+        self._next_id += 1
+        return str(uuid.UUID(int=(0x5eed << 96) | self._next_id))
+
+    def _add(self, collection: str, obj: dict):
+        self.collections[collection][obj["id"]] = obj
+        return obj
+
+    def _user(self):
+        object_id = self._new_id()
+        number = self._next_id
+        return {
+            "id": object_id,
+            "displayName": f"User {number}",
+            "userPrincipalName": f"user{number}@contoso.example",
+            "jobTitle": self.random.choice(TITLES),
+            "accountEnabled": self.random.random() > 0.05,
+            "department": self.random.choice(["Engineering", "Sales", "Finance", "Support"]),
+        }
+
+    def _members(self):
+        users = list(self.collections["users"].values())
+        count = min(len(users), self.random.randint(2, 40))
+        return {user["id"]: {"id": user["id"], "displayName": user["displayName"]}
+                for user in self.random.sample(users, count)}
+
+    def _make(self, collection: str):
+        object_id = self._new_id()
+        number = self._next_id
+        if collection == "groups":
+            return {"id": object_id, "displayName": f"Group {number}", "description": f"Team {number % 97}"}
+        if collection == "applications":
+            return {
+                "id": object_id, "appId": str(uuid.uuid5(uuid.NAMESPACE_OID, object_id)),
+                "displayName": f"App {number}", "signInAudience": "AzureADMyOrg",
+                "requiredResourceAccess": [{
+                    "resourceAppId": "00000003-0000-0000-c000-000000000000",
+                    "resourceAccess": [{"id": scope, "type": "Scope"}
+                                       for scope in self.random.sample(SCOPES, self.random.randint(1, 3))],
+                }],
+                "passwordCredentials": [self._credential()],
+                "keyCredentials": [],
+            }
+        if collection == "servicePrincipals":
+            return {
+                "id": object_id, "appId": str(uuid.uuid5(uuid.NAMESPACE_OID, object_id)),
+                "displayName": f"Service principal {number}", "accountEnabled": True,
+                "servicePrincipalType": "Application", "appRoleAssignmentRequired": self.random.random() < 0.3,
+            }
+        if collection == "identity/conditionalAccess/policies":
+            groups = list(self.collections.get("groups", {}))
+            return {
+                "id": object_id, "displayName": f"CA{number:03d} - Require MFA", "state": "enabled",
+                "conditions": {
+                    "users": {"includeUsers": ["All"], "excludeUsers": [],
+                              "includeGroups": self.random.sample(groups, min(2, len(groups)))},
+                    "applications": {"includeApplications": ["All"]},
+                    "clientAppTypes": ["all"],
+                },
+                "grantControls": {"operator": "OR", "builtInControls": ["mfa"]},
+                "sessionControls": None,
+            }
+        if collection == "roleManagement/directory/roleAssignments":
+            return {
+                "id": object_id, "principalId": self.random.choice(list(self.collections["users"])),
+                "roleDefinitionId": self.random.choice(ROLE_DEFINITIONS), "directoryScopeId": "/",
+            }
+        raise ValueError(f"Unknown collection: {collection}")
+
+    def _credential(self):
+        return {"keyId": self._new_id(), "displayName": "Client secret",
+                "endDateTime": f"20{self.random.randint(26, 29)}-0{self.random.randint(1, 9)}-01T00:00:00Z"}
+
+    # --- Serving and churn ---
+
+    def load(self, server):
+        """Serve the tenant from a MockGraphServer (replacing whatever it served)."""
+        for collection, objects in self.collections.items():
+            server.set_objects(collection, objects.values())
+        for group_id, members in self.members.items():
+            server.set_objects(f"groups/{group_id}/members", members.values())
+
+    def _how_many(self, count: int, rate: float):
+        """round(count * rate), with the fraction decided at random so small types still change."""
+        expected = count * rate
+        return int(expected) + (self.random.random() < expected - int(expected))
+
+    def churn(self, server, rate: float = 0.01):
+        """
+        Change a fraction of every object type and publish the changes to the server.
+
+        Args:
+            server: The MockGraphServer serving this tenant.
+            rate (float): Fraction of the objects of each type changed.
+
+        Returns:
+            int: Number of object-level changes made.
+        """
+        changes = 0
+        users = self.collections["users"]
+        for _ in range(self._how_many(len(users), rate)):
+            roll = self.random.random()
+            if roll < 0.1:
+                obj = self._add("users", self._user())
+            elif roll < 0.2 and len(users) > 1:
+                object_id = self.random.choice(list(users))
+                del users[object_id]
+                server.delete("users", object_id)
+                changes += 1
+                continue
+            else:
+                obj = users[self.random.choice(list(users))]
+                if self.random.random() < 0.7:
+                    obj["jobTitle"] = self.random.choice(TITLES)
+                else:
+                    obj["accountEnabled"] = not obj["accountEnabled"]
+            server.upsert("users", obj)
+            changes += 1
+
+        for collection in PROPORTIONS:
+            objects = self.collections[collection]
+            for _ in range(self._how_many(len(objects), rate)):
+                obj = objects[self.random.choice(list(objects))]
+                if collection == "groups":
+                    obj["description"] = f"Team {self.random.randint(0, 999)}"
+                elif collection == "applications":
+                    obj["passwordCredentials"] = obj["passwordCredentials"] + [self._credential()]
+                elif collection == "servicePrincipals":
+                    obj["accountEnabled"] = not obj["accountEnabled"]
+                elif collection == "identity/conditionalAccess/policies":
+                    obj["state"] = "enabledForReportingButNotEnforced" if obj["state"] == "enabled" else "enabled"
+                else:
+                    # Role assignments are not edited in place: one is removed, another granted
+                    del objects[obj["id"]]
+                    server.delete(collection, obj["id"])
+                    obj = self._add(collection, self._make(collection))
+                server.upsert(collection, obj)
+                changes += 1
+
+        users_list = list(users.values())
+        for group_id in self.random.sample(list(self.members), self._how_many(len(self.members), rate)):
+            members = self.members[group_id]
+            if members and self.random.random() < 0.5:
+                members.pop(self.random.choice(list(members)))
+            else:
+                user = self.random.choice(users_list)
+                members[user["id"]] = {"id": user["id"], "displayName": user["displayName"]}
+            server.set_objects(f"groups/{group_id}/members", members.values())
+            changes += 1
+        return changes
@@ -0,0 +1,303 @@
+"""
+Tiered retention and compaction of snapshot history.
+
+The retention policy keeps every snapshot for RETENTION_KEEP_ALL_DAYS, the last snapshot of
+each day until RETENTION_DAILY_DAYS, and the last snapshot of each month after that. The
+first snapshot (the baseline) and the latest one are always kept.
+
+Removing snapshots never changes the state at a kept snapshot. Object version ranges are
+moved onto the kept snapshots, versions that were only valid between two kept snapshots are
+dropped, and aggregate fingerprints move forward to the next kept snapshot. Each kept
+snapshot that directly follows removed ones gets its changes recomputed against the previous
+kept snapshot, so the previous-snapshot lookup, the diff API and the change list stay
+consistent. It keeps its explanation: explaining every rewritten snapshot again would cost one
+OpenAI call each, hundreds on the first run over a long history. Up to
+COMPACTION_REEXPLAIN_MAX of them per run, the newest first, are explained again instead.
+
+The same job trains the shared compression dictionary once enough payloads exist, and
+recompresses the payloads written before it with that dictionary.
+"""
+
+import bisect
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import (
+    RETENTION_KEEP_ALL_DAYS, RETENTION_DAILY_DAYS, COMPRESSION_DICT_SAMPLES, DIFF_FIELD_RULES,
+    COMPACTION_REEXPLAIN_MAX
+)
+from compression import dictionary_id
+from diff_engine import DiffRules, diff_states, render_changes
+from explanation_worker import enqueue_explanation, STATUS_PENDING, STATUS_NONE
+from resources import RESOURCES
+from snapshot_diff import clear_diff_cache
+from storage import (
+    backfill_checkpoints, current_dictionary, decode, load_changed_versions, payload_encoder, save_change_records,
+    save_dictionary
+)
+from storage_backend import connect
+
+logger = logging.getLogger(__name__)
+
+_BATCH_SIZE = 500
+
+# Process-wide totals, reported by /api/health
+_stats = {"runs": 0, "last_run": None}
+
+
+def _parse_timestamp(timestamp: str):
+    parsed = datetime.fromisoformat(timestamp)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def snapshots_to_keep(snapshots, now: datetime, keep_all_days: float = None, daily_days: float = None):
+    """
+    Apply the retention policy.
+
+    Args:
+        snapshots (list): (id, ISO timestamp) tuples.
+        now (datetime): Reference time (timezone-aware).
+        keep_all_days / daily_days: Tier boundaries in days (RETENTION_* by default).
+
+    Returns:
+        set: Ids of the snapshots to keep.
+    """
+    keep_all_days = RETENTION_KEEP_ALL_DAYS if keep_all_days is None else keep_all_days
+    daily_days = RETENTION_DAILY_DAYS if daily_days is None else daily_days
+    if not snapshots:
+        return set()
+
+    keep = {min(snap_id for snap_id, _ in snapshots), max(snap_id for snap_id, _ in snapshots)}
+    buckets = {}
+    for snap_id, timestamp in snapshots:
+        taken = _parse_timestamp(timestamp).astimezone(timezone.utc)
+        age = now - taken
+        if age <= timedelta(days=keep_all_days):
+            keep.add(snap_id)
+            continue
+        # Last snapshot of each day, or of each month once older than the daily tier
+        bucket = ("day", taken.date()) if age <= timedelta(days=daily_days) else ("month", taken.year, taken.month)
+        buckets[bucket] = max(buckets.get(bucket, snap_id), snap_id)
+    keep.update(buckets.values())
+    return keep
+
+
+def _in_batches(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), _BATCH_SIZE):
+        yield ids[start:start + _BATCH_SIZE]
+
+
+def _remove_snapshots(conn, removed: set, kept: list):
+    """Delete snapshots and fold their object versions and fingerprints into the kept ones (sorted ids)."""
+    # Fingerprints: a removed snapshot's fingerprint moves to the next kept snapshot, unless a
+    # newer fingerprint of the type already exists up to that snapshot
+    for batch in _in_batches(removed):
+        placeholders = ",".join("?" * len(batch))
+        for object_type, snapshot_id in conn.execute(
+            f"SELECT object_type, snapshot_id FROM type_fingerprints WHERE snapshot_id IN ({placeholders}) "
+            "ORDER BY snapshot_id DESC", batch
+        ).fetchall():
+            position = bisect.bisect_right(kept, snapshot_id)
+            target = kept[position] if position < len(kept) else None
+            newer = target is None or conn.execute(
+                "SELECT 1 FROM type_fingerprints WHERE object_type = ? AND snapshot_id > ? AND snapshot_id <= ?",
+                (object_type, snapshot_id, target)
+            ).fetchone()
+            if newer:
+                conn.execute("DELETE FROM type_fingerprints WHERE object_type = ? AND snapshot_id = ?",
+                             (object_type, snapshot_id))
+            else:
+                conn.execute("UPDATE type_fingerprints SET snapshot_id = ? WHERE object_type = ? AND snapshot_id = ?",
+                             (target, object_type, snapshot_id))
+    for batch in _in_batches(removed):
+        placeholders = ",".join("?" * len(batch))
+        conn.execute(f"DELETE FROM change_events WHERE snapshot_id IN ({placeholders})", batch)
+        conn.execute(f"DELETE FROM state_checkpoints WHERE snapshot_id IN ({placeholders})", batch)
+        conn.execute(f"DELETE FROM snapshots WHERE id IN ({placeholders})", batch)
+
+    # Version ranges start and end at the next kept snapshot: the state at every kept
+    # snapshot is unchanged, and versions that only lived between two kept ones become empty
+    conn.execute("""
+        UPDATE object_versions SET valid_from_snapshot = (
+            SELECT MIN(s.id) FROM snapshots s WHERE s.id >= object_versions.valid_from_snapshot
+        ) WHERE NOT EXISTS (SELECT 1 FROM snapshots s WHERE s.id = object_versions.valid_from_snapshot)
+    """)
+    conn.execute("""
+        UPDATE object_versions SET valid_to_snapshot = (
+            SELECT MIN(s.id) FROM snapshots s WHERE s.id >= object_versions.valid_to_snapshot
+        ) WHERE valid_to_snapshot IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM snapshots s WHERE s.id = object_versions.valid_to_snapshot)
+    """)
+    conn.execute("""
+        UPDATE object_names SET first_snapshot = (
+            SELECT MIN(s.id) FROM snapshots s WHERE s.id >= object_names.first_snapshot
+        ) WHERE NOT EXISTS (SELECT 1 FROM snapshots s WHERE s.id = object_names.first_snapshot)
+    """)
+    return conn.execute("DELETE FROM object_versions WHERE valid_to_snapshot = valid_from_snapshot").rowcount
+
+
+def _recompute_changes(conn, snapshot_id: int, base_id: int, reexplain: bool = False):
+    """
+    Rewrite a kept snapshot's changes as the difference from the previous kept snapshot.
+
+    Args:
+        reexplain (bool): Mark the explanation pending again if the changes differ; otherwise
+            the snapshot keeps the explanation it has.
+
+    Returns:
+        bool: True if the explanation was marked pending.
+    """
+    records = []
+    changed = load_changed_versions(conn, base_id, snapshot_id)
+    for object_type in sorted(changed):
+        old_objects, new_objects = changed[object_type]
+        key = RESOURCES[object_type].key if object_type in RESOURCES else "id"
+        rules = DiffRules.for_type(object_type, DIFF_FIELD_RULES)
+        records.extend(diff_states(old_objects, new_objects, object_type, rules, key=key))
+    changes = render_changes(records)
+    previous = conn.execute("SELECT changes FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()[0]
+    if json.loads(previous or "[]") == changes:
+        return False   # Only the base moved: the removed snapshots changed nothing it lists
+    conn.execute("DELETE FROM change_events WHERE snapshot_id = ?", (snapshot_id,))
+    save_change_records(conn, snapshot_id, records)
+    if changes and not reexplain:
+        conn.execute("UPDATE snapshots SET changes = ?, change_count = ? WHERE id = ?",
+                     (json.dumps(changes), len(changes), snapshot_id))
+        return False
+    conn.execute(
+        "UPDATE snapshots SET changes = ?, change_count = ?, explanation = NULL, explanation_status = ?, "
+        "explanation_attempts = 0, explanation_tokens = 0 WHERE id = ?",
+        (json.dumps(changes), len(changes), STATUS_PENDING if changes else STATUS_NONE, snapshot_id)
+    )
+    return bool(changes)
+
+
+def _payload_bytes(conn):
+    return conn.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM object_versions").fetchone()[0]
+
+
+def _recompress(conn, dictionary: bytes):
+    """Re-encode every payload not yet compressed with `dictionary`, in committed batches."""
+    encode = payload_encoder(conn)
+    wanted = dictionary_id(dictionary)
+    recompressed, last_id = 0, 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, payload FROM object_versions WHERE id > ? ORDER BY id LIMIT ?", (last_id, _BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for version_id, payload in rows:
+            if isinstance(payload, str) or bytes(payload[1:9]) != wanted:
+                updates.append((encode(decode(conn, payload)), version_id))
+        if updates:
+            conn.executemany("UPDATE object_versions SET payload = ? WHERE id = ?", updates)
+            conn.commit()
+            recompressed += len(updates)
+    return recompressed
+
+
+def compact(conn, now: datetime = None, retrain: bool = False, reexplain_max: int = None):
+    """
+    Enforce the retention policy and compress stored payloads.
+
+    Args:
+        conn: Open database connection.
+        now (datetime): Reference time for the retention tiers (current time by default).
+        retrain (bool): Train a new compression dictionary even if one exists.
+        reexplain_max (int): Rewritten snapshots to explain again, the newest first
+            (COMPACTION_REEXPLAIN_MAX by default).
+
+    Returns:
+        dict: snapshots_removed, versions_removed, versions_recompressed, bytes_before,
+        bytes_after, bytes_saved, seconds, throughput (versions_per_second, mb_per_second) and
+        requeued_explanations (ids of the rewritten snapshots whose explanation is pending again).
+    """
+    now = now or datetime.now(timezone.utc)
+    reexplain_max = COMPACTION_REEXPLAIN_MAX if reexplain_max is None else reexplain_max
+    started = time.perf_counter()
+    bytes_before = _payload_bytes(conn)
+    versions_before = conn.execute("SELECT COUNT(*) FROM object_versions").fetchone()[0]
+
+    # 1. Retention
+    snapshots = [(row[0], row[1]) for row in conn.execute("SELECT id, timestamp FROM snapshots ORDER BY id")]
+    keep = snapshots_to_keep(snapshots, now)
+    removed = {snap_id for snap_id, _ in snapshots if snap_id not in keep}
+    versions_removed, requeue = 0, []
+    if removed:
+        kept = sorted(keep)
+        # Kept snapshots directly preceded by removed ones: (snapshot, previous kept snapshot)
+        rebased = {}
+        for snap_id, _ in snapshots:
+            if snap_id in removed:
+                following = next((kept_id for kept_id in kept if kept_id > snap_id), None)
+                previous = max((kept_id for kept_id in kept if kept_id < snap_id), default=None)
+                if following is not None and previous is not None:
+                    rebased[following] = previous
+        versions_removed = _remove_snapshots(conn, removed, kept)
+        for snap_id, base_id in sorted(rebased.items(), reverse=True):
+            if _recompute_changes(conn, snap_id, base_id, reexplain=len(requeue) < reexplain_max):
+                requeue.append(snap_id)
+        requeue.reverse()
+        # Checkpoints of removed snapshots are gone; fill the gaps they leave
+        backfill_checkpoints(conn)
+        conn.commit()
+        clear_diff_cache()
+
+    # 2. Compression: train the shared dictionary once enough payloads exist
+    recompressed = 0
+    codec, dictionary = current_dictionary(conn)
+    if (dictionary is None or retrain) and versions_before >= COMPRESSION_DICT_SAMPLES // 10:
+        samples = [decode(conn, row[0]) for row in conn.execute(
+            "SELECT payload FROM object_versions ORDER BY id DESC LIMIT ?", (COMPRESSION_DICT_SAMPLES,)
+        ).fetchall()]
+        trained = save_dictionary(conn, samples, now.isoformat())
+        conn.commit()
+        if trained:
+            logger.info(f"Trained a {len(trained)} byte compression dictionary from {len(samples)} payloads")
+            recompressed = _recompress(conn, trained)
+
+    seconds = time.perf_counter() - started
+    bytes_after = _payload_bytes(conn)
+    processed = versions_removed + recompressed
+    stats = {
+        "snapshots_removed": len(removed),
+        "versions_removed": versions_removed,
+        "versions_recompressed": recompressed,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_saved": bytes_before - bytes_after,
+        "seconds": round(seconds, 3),
+        "versions_per_second": round(processed / seconds, 1) if seconds else None,
+        "mb_per_second": round(bytes_before / seconds / 1e6, 2) if seconds and processed else None,
+        "requeued_explanations": requeue,
+    }
+    return stats
+
+
+def run_compaction(database: str = None):
+    """Scheduled job: compact a database (the configured one by default) and log what it saved."""
+    conn = connect(database)
+    try:
+        stats = compact(conn)
+    finally:
+        conn.close()
+    for snapshot_id in stats["requeued_explanations"]:
+        enqueue_explanation(snapshot_id, database)
+    _stats["runs"] += 1
+    _stats["last_run"] = {**stats, "finished_at": datetime.now(timezone.utc).isoformat()}
+    logger.info(
+        f"Compaction: removed {stats['snapshots_removed']} snapshots and {stats['versions_removed']} versions, "
+        f"recompressed {stats['versions_recompressed']} payloads, saved {stats['bytes_saved']:,} bytes "
+        f"({stats['bytes_before']:,} -> {stats['bytes_after']:,}) in {stats['seconds']}s"
+    )
+    return stats
+
+
+def compaction_stats():
+    return dict(_stats)
@@ -0,0 +1,146 @@
+"""
+Compression of stored object payloads.
+
+Directory objects of one tenant share most of their text (property names, GUID prefixes,
+domain names, license SKUs), so each payload is compressed against a shared dictionary
+trained on the tenant's own data instead of on its own. A small JSON object that zlib alone
+barely shrinks typically compresses several times smaller with the dictionary.
+
+Encoded payloads are bytes: one codec byte, the 8-byte id of the dictionary used (all zero
+for none), then the compressed data. Dictionary ids are derived from their content, so an
+id always identifies the same dictionary in any database. Plain text values (payloads
+written before compression) are returned unchanged by decode_payload.
+
+zlib is always available. zstd is used when configured and the optional `zstandard` package
+is installed; otherwise zlib is used.
+"""
+
+import hashlib
+import logging
+import re
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+from config import SNAPSHOT_COMPRESSION, COMPRESSION_LEVEL
+
+logger = logging.getLogger(__name__)
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+CODECS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+NO_DICTIONARY = bytes(8)
+# zlib only looks back 32 KB, so a longer dictionary would be wasted
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+ZSTD_DICTIONARY_SIZE = 64 * 1024
+
+# Property names and string values: the recurring parts of directory objects
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"(?::)?')
+
+
+def configured_codec():
+    """The codec new payloads are written with (SNAPSHOT_COMPRESSION)."""
+    codec = CODECS.get(SNAPSHOT_COMPRESSION)
+    if codec is None:
+        logger.warning(f"Unknown SNAPSHOT_COMPRESSION '{SNAPSHOT_COMPRESSION}', using zlib")
+        return CODEC_ZLIB
+    if codec == CODEC_ZSTD and zstandard is None:
+        logger.warning("SNAPSHOT_COMPRESSION=zstd but the zstandard package is not installed, using zlib")
+        return CODEC_ZLIB
+    return codec
+
+
+def dictionary_id(data: bytes) -> bytes:
+    """Content-derived 8-byte id of a dictionary."""
+    return hashlib.sha256(data).digest()[:8]
+
+
+def train_dictionary(samples, codec: int = CODEC_ZLIB) -> bytes:
+    """
+    Train a compression dictionary from sample payloads (JSON text).
+
+    For zstd the library's trainer is used. For zlib the dictionary is the most frequent
+    property names and values of the samples, concatenated with the most frequent ones last
+    (zlib encodes matches closer to the end of the dictionary more cheaply).
+
+    Returns:
+        bytes: The dictionary (empty if the samples are too few to learn from).
+    """
+    samples = [sample.encode("utf-8") if isinstance(sample, str) else sample for sample in samples]
+    if not samples:
+        return b""
+    if codec == CODEC_ZSTD:
+        try:
+            return zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, samples).as_bytes()
+        except zstandard.ZstdError as e:
+            logger.warning(f"zstd dictionary training failed ({e}), too few samples")
+            return b""
+
+    counts = Counter()
+    for sample in samples:
+        counts.update(_TOKEN.findall(sample.decode("utf-8", errors="replace")))
+    tokens = [token for token, count in counts.most_common() if count > 1]
+    selected, size = [], 0
+    for token in tokens:
+        encoded = token.encode("utf-8")
+        if size + len(encoded) > ZLIB_DICTIONARY_SIZE:
+            break
+        selected.append(encoded)
+        size += len(encoded)
+    return b"".join(reversed(selected))
+
+
+def compress_payload(text: str, codec: int = CODEC_ZLIB, dictionary: bytes = None) -> bytes:
+    """Encode a JSON payload with the given codec and (optional) dictionary."""
+    data = text.encode("utf-8")
+    dict_id = dictionary_id(dictionary) if dictionary else NO_DICTIONARY
+    if codec == CODEC_ZLIB:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=dictionary) if dictionary \
+            else zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+        body = compressor.compress(data) + compressor.flush()
+    elif codec == CODEC_ZSTD:
+        params = {"dict_data": zstandard.ZstdCompressionDict(dictionary)} if dictionary else {}
+        body = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, **params).compress(data)
+    else:
+        dict_id, body = NO_DICTIONARY, data
+    return bytes([codec]) + dict_id + body
+
+
+def payload_dictionary_id(value):
+    """Id of the dictionary an encoded payload needs (None for plain text or no dictionary)."""
+    if isinstance(value, str):
+        return None
+    dict_id = bytes(value[1:9])
+    return None if dict_id == NO_DICTIONARY else dict_id
+
+
+def decode_payload(value, dictionary: bytes = None) -> str:
+    """
+    Decode a stored payload back to JSON text.
+
+    Args:
+        value: Plain text (uncompressed payload) or bytes written by compress_payload.
+        dictionary (bytes): The dictionary named by payload_dictionary_id(value), if any.
+    """
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    codec, body = value[0], value[9:]
+    if codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=dictionary) if dictionary else zlib.decompressobj(-15)
+        data = decompressor.decompress(body) + decompressor.flush()
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This payload is zstd-compressed; install the zstandard package to read it")
+        params = {"dict_data": zstandard.ZstdCompressionDict(dictionary)} if dictionary else {}
+        data = zstandard.ZstdDecompressor(**params).decompress(body)
+    else:
+        data = body
+    return data.decode("utf-8")
@@ -1,40 +1,259 @@
-### backend/db.py (Fixed imports)
 """
-Database module for storing configuration snapshots and changes.
+The Flask layer's access to the database.
+
+Each request gets one connection to its tenant's database (get_db, closed on teardown),
+and create_schema creates or migrates the schema of a database once at startup (the API's
+init_db and worker.py). The query helpers below serve the API routes and delegate to
+storage.py, snapshot_diff.py, history.py and search.py.
 """
 
-import sqlite3
+import hashlib
 import json
-from datetime import datetime
 from flask import g # g is used to store the database connection for the current request - initialized every web request
-from config import DATABASE_PATH
+from storage_backend import connect
+from storage import (
+    backfill_checkpoints, load_state, load_change_records, migrate_blob_snapshots, query_snapshots
+)
+from snapshot_diff import snapshot_diff
+from history import object_history, state_at
+from search import create_search_schema, search
+from lease import lease_holder
+from tenants import get_tenants, is_multi_tenant
+
+def _tenant():
+    """The tenant the current request is about (set from ?tenant= by app.py), or None."""
+    return g.get('tenant')
 
 def get_db():
     """Get database connection for current request."""
     if 'db' not in g: # Check if db is already in g
-        g.db = sqlite3.connect(DATABASE_PATH) # Connect to the database - save it in g
-        g.db.row_factory = sqlite3.Row
+        tenant = _tenant()
+        g.db = connect(tenant.database if tenant else None) # Connect to the tenant's database (DATABASE_URL by default) - save it in g
     return g.db # This returns the database connection stored in g - if we already have it, we return the existing connection
 
+def get_control_db():
+    """Connection to DATABASE_URL, which holds the leases whatever the request's tenant."""
+    tenant = _tenant()
+    if tenant is None or not tenant.database:
+        return get_db()
+    if 'control_db' not in g:
+        g.control_db = connect()
+    return g.control_db
+
 def close_db(e=None):
     """Close database connection."""
-    db = g.pop('db', None)
-    if db is not None:
-        db.close() # Close the database connection if it exists - g.pop removes the db from g and returns it, or None if it doesn't exist - not throwing an error if db is None
+    for name in ('db', 'control_db'):
+        db = g.pop(name, None)
+        if db is not None:
+            db.close() # Close (or return to the pool) the database connection if it exists - g.pop removes the db from g and returns it, or None if it doesn't exist - not throwing an error if db is None
 
-def init_db():
-    """Initialize database schema."""
-    db = get_db()
-    db.execute("""
+def _add_column(conn, table, column, definition):
+    """Add a column to an existing table if an older schema lacks it."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+def create_schema(conn):
+    """Create all tables on the given connection. Safe to call repeatedly."""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS snapshots (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp TEXT NOT NULL,
-            config TEXT NOT NULL,
             changes TEXT,
             explanation TEXT
         )
     """)
-    db.commit()
+    # One row per object version, valid from valid_from_snapshot until valid_to_snapshot (exclusive, NULL = current)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS object_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            object_type TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            valid_from_snapshot INTEGER NOT NULL,
+            valid_to_snapshot INTEGER,
+            payload_hash TEXT NOT NULL,
+            payload BLOB NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_object_versions_object
+        ON object_versions (object_type, object_id, valid_from_snapshot)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_object_versions_range
+        ON object_versions (valid_from_snapshot, valid_to_snapshot)
+    """)
+    # Versions closed by a snapshot, for server-side diffs between snapshots
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_object_versions_closed ON object_versions (valid_to_snapshot)")
+    # At most one open (current) version per object
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_object_versions_current
+        ON object_versions (object_type, object_id) WHERE valid_to_snapshot IS NULL
+    """)
+    # One Graph @odata.deltaLink per monitored object type, used by the incremental sync mode
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS delta_links (
+            object_type TEXT PRIMARY KEY,
+            delta_link TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    # Staging area for streaming sync cycles (see storage.stage_page)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_staging (
+            object_type TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            op TEXT NOT NULL,
+            payload_hash TEXT,
+            payload TEXT,
+            PRIMARY KEY (object_type, object_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_seen (
+            object_type TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            PRIMARY KEY (object_type, object_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_progress (
+            object_type TEXT PRIMARY KEY,
+            origin_url TEXT NOT NULL,
+            next_url TEXT,
+            delta_link TEXT,
+            fingerprint TEXT,
+            object_count INTEGER
+        )
+    """)
+    _add_column(conn, "sync_progress", "fingerprint", "TEXT")
+    _add_column(conn, "sync_progress", "object_count", "INTEGER")
+    # Order-independent aggregate hash of each object type, recorded whenever the type changes
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS type_fingerprints (
+            object_type TEXT NOT NULL,
+            snapshot_id INTEGER NOT NULL,
+            fingerprint TEXT NOT NULL,
+            object_count INTEGER NOT NULL,
+            PRIMARY KEY (object_type, snapshot_id)
+        ) WITHOUT ROWID
+    """)
+    # Structured change records (one row per changed field) produced by the diff engine
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            snapshot_id INTEGER NOT NULL,
+            object_type TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            name TEXT,
+            path TEXT NOT NULL,
+            op TEXT NOT NULL,
+            old_value TEXT,
+            new_value TEXT,
+            kind TEXT
+        )
+    """)
+    if _add_column(conn, "change_events", "kind", "TEXT"):
+        conn.execute("""
+            UPDATE change_events SET kind = CASE
+                WHEN path = '' AND op = 'add' THEN 'added'
+                WHEN path = '' AND op = 'remove' THEN 'removed'
+                ELSE 'modified' END
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_events_snapshot ON change_events (snapshot_id)")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_change_events_object
+        ON change_events (object_type, object_id, snapshot_id)
+    """)
+    # Snapshot listing filters: newest matching snapshots first, straight from an index
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_events_type ON change_events (object_type, snapshot_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_events_object_id ON change_events (object_id, snapshot_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_events_kind ON change_events (kind, snapshot_id)")
+    # Generated explanations keyed by change-set fingerprint + model + prompt version
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS explanation_cache (
+            fingerprint TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            explanation TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_explanation_cache_used ON explanation_cache (last_used_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_explanation_cache_created ON explanation_cache (created_at)")
+    # Shared compression dictionaries for object payloads (see compression.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS compression_dicts (
+            id TEXT PRIMARY KEY,
+            codec INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    # Object versions valid at a checkpoint snapshot, so historical states are rebuilt from the
+    # nearest checkpoint plus the versions changed since (see storage.load_state)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS state_checkpoints (
+            snapshot_id INTEGER NOT NULL,
+            object_type TEXT NOT NULL,
+            version_id INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, object_type, version_id)
+        ) WITHOUT ROWID
+    """)
+    # Events pushed to /api/events subscribers (see events.py); the id is the SSE event id
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    # Leader election between monitor workers (see lease.py); expires_at is a Unix time
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            acquired_at TEXT NOT NULL
+        )
+    """)
+    create_search_schema(conn)
+    conn.commit()
+    # Databases created before normalized storage still hold whole-tenant blobs
+    migrate_blob_snapshots(conn)
+    # Number of change lines per snapshot, so listings never parse the changes JSON
+    if _add_column(conn, "snapshots", "change_count", "INTEGER NOT NULL DEFAULT 0"):
+        conn.execute("UPDATE snapshots SET change_count = json_array_length(changes) WHERE changes IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_timestamp ON snapshots (timestamp)")
+    # Explanations are generated in the background: none / pending / ready / failed
+    if _add_column(conn, "snapshots", "explanation_status", "TEXT NOT NULL DEFAULT 'none'"):
+        conn.execute("UPDATE snapshots SET explanation_status = 'ready' WHERE explanation IS NOT NULL AND explanation != ''")
+    _add_column(conn, "snapshots", "explanation_attempts", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "snapshots", "explanation_tokens", "INTEGER NOT NULL DEFAULT 0")
+    # Histories written before checkpoints existed
+    if conn.execute("SELECT 1 FROM state_checkpoints LIMIT 1").fetchone() is None:
+        backfill_checkpoints(conn)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_snapshots_pending
+        ON snapshots (id) WHERE explanation_status = 'pending'
+    """)
+    conn.commit()
+
+def init_db():
+    """Initialize database schema (in every tenant's database too)."""
+    create_schema(get_db())
+    if is_multi_tenant():
+        for tenant in get_tenants():
+            conn = connect(tenant.database)
+            try:
+                create_schema(conn)
+            finally:
+                conn.close()
 
 def init_app(app): 
     """Register database functions with Flask app."""
@@ -42,35 +261,150 @@ def init_app(app):
     with app.app_context(): # This ensures the app context is available when initializing the database - run init_db() only once when the app starts
         init_db()
 
-def get_all_snapshots():
-    """Retrieve all snapshots (id and timestamp only)."""
-    db = get_db()
-    rows = db.execute("SELECT id, timestamp FROM snapshots ORDER BY timestamp DESC").fetchall() # Fetch all snapshots ordered by timestamp in descending order
-    return [{"id": row["id"], "timestamp": row["timestamp"]} for row in rows]
+def get_lease(name):
+    """The current holder of a lease (see lease.lease_holder), or None."""
+    return lease_holder(get_control_db(), name)
 
-def get_snapshot_details(snap_id):
-    """Retrieve full details of a specific snapshot."""
+def get_first_sync_status():
+    """
+    Whether the monitor has stored the tenant's baseline yet.
+
+    Returns:
+        dict: {"complete": bool, "latest_snapshot": {"id", "timestamp"} or None}
+    """
+    row = get_db().execute("SELECT id, timestamp FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+    return {"complete": row is not None,
+            "latest_snapshot": {"id": row[0], "timestamp": row[1]} if row else None}
+
+def get_snapshot_page(**filters):
+    """
+    Retrieve one page of snapshots (id, timestamp and change count), newest first.
+
+    Args:
+        **filters: cursor, limit, since, until, object_type, object_id, kind - see storage.query_snapshots.
+
+    Returns:
+        dict: {"items": [...], "next_cursor": cursor of the next page or None}
+    """
+    return query_snapshots(get_db(), **filters)
+
+def _previous_snapshot_id(db, snap_id):
+    prev = db.execute(
+        "SELECT id FROM snapshots WHERE id < ? ORDER BY id DESC LIMIT 1",
+        (snap_id,)
+    ).fetchone()
+    return prev["id"] if prev else None
+
+def _configs(db, snap_id, prev_id):
+    """Both full configurations of a snapshot (current and previous), rebuilt from object versions."""
+    return {
+        "current_config": load_state(db, snap_id),
+        "previous_config": load_state(db, prev_id) if prev_id else None,
+    }
+
+def get_snapshot_details(snap_id, include_config=False):
+    """
+    Retrieve the details of a specific snapshot.
+
+    Args:
+        snap_id (int): Snapshot id.
+        include_config (bool): Also return the full current and previous configurations.
+            Off by default - use get_snapshot_diff to see what changed.
+    """
     db = get_db()
     current = db.execute("SELECT * FROM snapshots WHERE id=?", (snap_id,)).fetchone() # Fetch the snapshot by ID - and convert text into python objects - and get the previous snapshot for comparison either by ID or by timestamp for comparison
     if not current:
         return None
     
-    # Load JSON fields
-    current_config = json.loads(current["config"])
     changes = json.loads(current["changes"]) if current["changes"] else []
     explanation = current["explanation"]
+    prev_id = _previous_snapshot_id(db, snap_id)
     
-    # Get previous snapshot for comparison
-    prev = db.execute(
-        "SELECT config FROM snapshots WHERE id < ? ORDER BY id DESC LIMIT 1", 
-        (snap_id,)
-    ).fetchone()
-    previous_config = json.loads(prev["config"]) if prev else None
-    
-    return {
+    details = {
         "timestamp": current["timestamp"],
-        "current_config": current_config,
-        "previous_config": previous_config,
+        "previous_snapshot_id": prev_id,
         "changes": changes,
-        "explanation": explanation
+        "change_records": load_change_records(db, snap_id),
+        "explanation": explanation,
+        "explanation_status": current["explanation_status"],
+        "explanation_tokens": current["explanation_tokens"]
     }
+    if include_config:
+        details.update(_configs(db, snap_id, prev_id))
+    return details
+
+# Part of every snapshot ETag: bump it when the shape of the snapshot details changes
+SNAPSHOT_DETAILS_VERSION = 1
+
+def get_snapshot_version(snap_id, include_config=False):
+    """
+    Identify the current content of a snapshot's details without building them.
+
+    The details only change when the explanation is written, or when compaction removes the
+    snapshots before this one (the previous snapshot and the changes then change with it),
+    so a hash of the snapshot row and its previous snapshot id identifies them.
+
+    Args:
+        snap_id (int): Snapshot id.
+        include_config (bool): Whether the details include the full configurations.
+
+    Returns:
+        tuple: (etag, explanation_status), or None if the snapshot does not exist.
+    """
+    db = get_db()
+    row = db.execute(
+        "SELECT timestamp, changes, explanation, explanation_status, explanation_tokens FROM snapshots WHERE id = ?",
+        (snap_id,)
+    ).fetchone()
+    if not row:
+        return None
+    key = json.dumps([SNAPSHOT_DETAILS_VERSION, snap_id, _previous_snapshot_id(db, snap_id), bool(include_config),
+                      row["timestamp"], row["changes"], row["explanation"], row["explanation_status"],
+                      row["explanation_tokens"]])
+    return hashlib.sha256(key.encode()).hexdigest()[:32], row["explanation_status"]
+
+def get_snapshot_diff(snap_id, include_config=False, **paging):
+    """
+    Retrieve one page of the objects that changed in a snapshot (see snapshot_diff.snapshot_diff).
+
+    Args:
+        snap_id (int): Snapshot id.
+        include_config (bool): Also return the full current and previous configurations.
+        **paging: object_type, cursor, limit.
+    """
+    db = get_db()
+    tenant = _tenant()
+    diff = snapshot_diff(db, snap_id, scope=tenant.key if tenant else None, **paging)
+    if diff and include_config:
+        diff.update(_configs(db, snap_id, diff["base_snapshot_id"]))
+    return diff
+
+def get_state_at(at, object_type=None, object_id=None):
+    """
+    Retrieve the configuration as it was at a point in time (see history.state_at).
+
+    Args:
+        at (str): ISO date or timestamp.
+        object_type / object_id (str): Only this object type / object.
+    """
+    return state_at(get_db(), at, object_type, object_id)
+
+def get_object_history(object_type, object_id, **paging):
+    """
+    Retrieve one page of the versions of an object, newest first (see history.object_history).
+
+    Args:
+        object_type / object_id (str): The object.
+        **paging: cursor, limit.
+    """
+    return object_history(get_db(), object_type, object_id, **paging)
+
+def search_history(q, **options):
+    """
+    Search objects and change events (see search.search).
+
+    Args:
+        q (str): Search query.
+        **options: scope, object_type, cursor, limit.
+    """
+    return search(get_db(), q, **options)
@@ -0,0 +1,242 @@
+"""
+Schema-driven deep diff engine for directory objects.
+
+Walks arbitrary nested JSON (dicts, lists of objects keyed by id, lists of scalars, scalars)
+and emits structured ChangeRecord entries instead of formatted strings. Which fields are
+compared is configured per object type with include/exclude rules, and objects whose
+content hash did not change are never walked, so the cost follows the size of what changed.
+"""
+
+import json
+from dataclasses import dataclass, asdict
+from typing import Any, List
+
+
+# Change operations
+OP_ADD = "add"
+OP_REMOVE = "remove"
+OP_REPLACE = "replace"
+
+# Object-level change kinds (an object added, removed, or changed in place)
+CHANGE_KINDS = ("added", "removed", "modified")
+
+
+@dataclass(frozen=True)
+class ChangeRecord:
+    """One change to one object. An empty path means the whole object was added or removed."""
+    object_type: str
+    object_id: str
+    name: str
+    path: str
+    op: str
+    old: Any = None
+    new: Any = None
+
+    @property
+    def kind(self):
+        """Object-level change kind, one of CHANGE_KINDS."""
+        if not self.path:
+            return "added" if self.op == OP_ADD else "removed"
+        return "modified"
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class DiffRules:
+    """
+    Field include/exclude rules for one object type.
+
+    Rules are dotted field paths without list positions ("displayName", "assignedLicenses.skuId").
+    A rule matches the field itself and everything nested below it. When `include` is given,
+    only matching fields are compared; `exclude` always wins.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = tuple(include) if include else None
+        self.exclude = tuple(exclude or ())
+
+    @staticmethod
+    def _matches(field_path: str, rules):
+        return any(field_path == rule or field_path.startswith(rule + ".") for rule in rules)
+
+    def allows(self, field_path: str):
+        if self._matches(field_path, self.exclude):
+            return False
+        if self.include is None:
+            return True
+        # Parents of an included field must be walked to reach it
+        return self._matches(field_path, self.include) or any(
+            rule.startswith(field_path + ".") for rule in self.include
+        )
+
+    @classmethod
+    def for_type(cls, object_type: str, config: dict):
+        """
+        Build the rules of an object type from a configuration mapping such as
+        {"*": {"exclude": ["@odata.etag"]}, "user": {"include": ["displayName", "accountEnabled"]}}.
+        """
+        common = (config or {}).get("*", {})
+        specific = (config or {}).get(object_type, {})
+        return cls(
+            include=specific.get("include") or common.get("include"),
+            exclude=list(common.get("exclude", [])) + list(specific.get("exclude", [])),
+        )
+
+
+ALL_FIELDS = DiffRules()
+
+
+def object_key(obj: dict, key="id"):
+    """
+    Identity of an object under a resource's identity key: a single field name, or a tuple of
+    fields for objects identified by what they link (e.g. principal + role + scope).
+    """
+    if isinstance(key, str):
+        return obj.get(key)
+    return "|".join(str(obj.get(field, "")) for field in key)
+
+def object_name(obj: dict, object_id=None):
+    """Human-readable name of a directory object."""
+    return obj.get('displayName') or obj.get('userPrincipalName') or object_id or obj.get('id')
+
+
+def _scalar_key(value):
+    return json.dumps(value, sort_keys=True)
+
+def _walk(old, new, path: str, field_path: str, rules: DiffRules, emit):
+    """Recursively compare two values, calling emit(path, op, old, new) for each difference."""
+    if old == new:
+        return
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in list(old.keys()) + [key for key in new.keys() if key not in old]:
+            child_field = f"{field_path}.{key}" if field_path else key
+            if not rules.allows(child_field):
+                continue
+            child_path = f"{path}.{key}" if path else key
+            if key not in new:
+                emit(child_path, OP_REMOVE, old[key], None)
+            elif key not in old:
+                emit(child_path, OP_ADD, None, new[key])
+            else:
+                _walk(old[key], new[key], child_path, child_field, rules, emit)
+        return
+
+    if isinstance(old, list) and isinstance(new, list):
+        if all(isinstance(value, dict) and 'id' in value for value in old + new):
+            # List of objects (members, app roles, ...): match items by id
+            old_items = {item['id']: item for item in old}
+            new_items = {item['id']: item for item in new}
+            for item_id, item in old_items.items():
+                if item_id not in new_items:
+                    emit(f"{path}[id={item_id}]", OP_REMOVE, item, None)
+            for item_id, item in new_items.items():
+                item_path = f"{path}[id={item_id}]"
+                if item_id not in old_items:
+                    emit(item_path, OP_ADD, None, item)
+                else:
+                    _walk(old_items[item_id], item, item_path, field_path, rules, emit)
+            return
+        if all(not isinstance(value, (dict, list)) for value in old + new):
+            # Multi-valued scalar attribute (proxyAddresses, businessPhones, ...): compare as a set
+            old_keys = {_scalar_key(value): value for value in old}
+            new_keys = {_scalar_key(value): value for value in new}
+            for key, value in old_keys.items():
+                if key not in new_keys:
+                    emit(f"{path}[]", OP_REMOVE, value, None)
+            for key, value in new_keys.items():
+                if key not in old_keys:
+                    emit(f"{path}[]", OP_ADD, None, value)
+            return
+        # Positional comparison for anything else
+        for index in range(max(len(old), len(new))):
+            item_path = f"{path}[{index}]"
+            if index >= len(new):
+                emit(item_path, OP_REMOVE, old[index], None)
+            elif index >= len(old):
+                emit(item_path, OP_ADD, None, new[index])
+            else:
+                _walk(old[index], new[index], item_path, field_path, rules, emit)
+        return
+
+    emit(path, OP_REPLACE, old, new)
+
+
+def diff_objects(old: dict, new: dict, object_type: str, rules: DiffRules = ALL_FIELDS,
+                 object_id=None) -> List[ChangeRecord]:
+    """Field-level changes between two versions of the same object."""
+    if object_id is None:
+        object_id = new.get('id', old.get('id'))
+    name = object_name(new, object_id)
+    records = []
+
+    def emit(path, op, old_value, new_value):
+        records.append(ChangeRecord(object_type, object_id, name, path, op, old_value, new_value))
+
+    _walk(old, new, "", "", rules, emit)
+    return records
+
+
+def diff_states(old_state: list, new_state: list, object_type: str, rules: DiffRules = ALL_FIELDS,
+                old_hashes=None, new_hashes=None, key="id") -> List[ChangeRecord]:
+    """
+    Changes between two states (lists of objects) of one object type, matched by `key`
+    (see object_key).
+
+    old_hashes / new_hashes are optional storage.HashIndex maps (object id -> content hash, as
+    stored with each snapshot). When both are given, identical aggregate fingerprints skip the
+    whole type in O(1), and only objects whose hash changed are walked.
+    """
+    if old_hashes is not None and new_hashes is not None:
+        if len(old_hashes) == len(new_hashes) and old_hashes.fingerprint == new_hashes.fingerprint:
+            return []
+        # Only objects whose hash differs (or that exist on one side only) need a closer look
+        wanted = {obj_id for obj_id, digest in new_hashes.items() if old_hashes.get(obj_id) != digest}
+        wanted.update(old_hashes.keys() - new_hashes.keys())
+        old_state = [obj for obj in (old_state or []) if object_key(obj, key) in wanted]
+        new_state = [obj for obj in (new_state or []) if object_key(obj, key) in wanted]
+
+    old_index = {object_key(obj, key): obj for obj in (old_state or [])}
+    new_index = {object_key(obj, key): obj for obj in (new_state or [])}
+    records = []
+
+    for obj_id, obj in new_index.items():
+        if obj_id not in old_index:
+            records.append(ChangeRecord(object_type, obj_id, object_name(obj, obj_id), "", OP_ADD, None, obj))
+
+    for obj_id, obj in old_index.items():
+        if obj_id not in new_index:
+            records.append(ChangeRecord(object_type, obj_id, object_name(obj, obj_id), "", OP_REMOVE, obj, None))
+
+    for obj_id, new_obj in new_index.items():
+        old_obj = old_index.get(obj_id)
+        if old_obj is not None:
+            records.extend(diff_objects(old_obj, new_obj, object_type, rules, obj_id))
+
+    return records
+
+
+def _format_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return f"{value}"
+
+def render_change(record: ChangeRecord) -> str:
+    """Render a change record as the one-line text used in snapshots and explanations."""
+    label = record.object_type.replace('_', ' ').capitalize()
+    action = "added" if record.op == OP_ADD else "removed"
+    if not record.path:
+        return f"{label} {action}: {record.name}"
+    if record.path.endswith("]") and record.op != OP_REPLACE:
+        # An element added to / removed from a list: a scalar set value or an object matched by id
+        value = record.new if record.op == OP_ADD else record.old
+        if isinstance(value, dict):
+            value = object_name(value)
+        field = record.path[:record.path.rindex("[")]
+        return f"{label} modified: {record.name} - {field} {action} '{_format_value(value)}'"
+    return (f"{label} modified: {record.name} - {record.path} changed from "
+            f"'{_format_value(record.old)}' to '{_format_value(record.new)}'")
+
+def render_changes(records: List[ChangeRecord]) -> List[str]:
+    return [render_change(record) for record in records]
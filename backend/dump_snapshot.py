@@ -1,5 +1,6 @@
 import sqlite3
 import json
+from storage import load_state
 
 # שם קובץ ה-DB שלך
 DB_FILE = "monitor_data.db"
@@ -17,10 +18,9 @@ row = cursor.fetchone()
 print("Raw row:")
 print(row)
 
-# אם העמודה הרלוונטית שלך היא JSON
-# שנה את האינדקס לפי המבנה האמיתי
+# התצורה המלאה נבנית מחדש מטבלת object_versions
 try:
-    data_json = json.loads(row[1])  # או row[0] תלוי במבנה שלך
+    data_json = load_state(conn, row[0])
     print("\nParsed JSON:")
     print(json.dumps(data_json, indent=2))
 except Exception as e:
@@ -0,0 +1,194 @@
+"""
+Server-Sent Events for the UI: /api/events pushes "snapshot-created" and
+"explanation-ready" events as soon as the monitor and the explanation worker commit them.
+
+Events are rows of the events table, written in the same transaction as the change they
+announce, so a subscriber never hears about a snapshot it cannot read yet. The row id is
+the SSE event id: a client that reconnects with Last-Event-ID is sent what it missed from
+the table (the last EVENTS_RETENTION events are kept).
+
+Each process has one broker per database (one per tenant, see tenants.py). It tails the
+events table - woken at once by events published in the same process, and every
+EVENTS_POLL_SECONDS for events written by other processes - and keeps the newest events in
+memory. Subscribers wait on the broker's condition and read from that buffer, so fanning an
+event out costs no queries per client.
+Under the production server (gunicorn.conf.py) a waiting subscriber holds one of its
+worker's WEB_THREADS threads, idle on the condition until an event or a heartbeat is due.
+"""
+
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from storage_backend import connect
+from config import DATABASE_URL, EVENTS_POLL_SECONDS, EVENTS_HEARTBEAT_SECONDS, EVENTS_RETENTION
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CREATED = "snapshot-created"
+EXPLANATION_READY = "explanation-ready"
+
+# Sent before the first event: how long the browser waits before reconnecting (ms)
+RECONNECT_MS = 5000
+REPLAY_BATCH = 500
+
+
+def record_event(conn, event_type: str, data: dict):
+    """
+    Add an event to the events table. The caller commits (with the change it announces)
+    and then calls notify() so subscribers of this process hear about it immediately.
+
+    Returns:
+        int: The event id.
+    """
+    event_id = conn.execute(
+        "INSERT INTO events (type, data, created_at) VALUES (?, ?, ?)",
+        (event_type, json.dumps(data), datetime.now(timezone.utc).isoformat())
+    ).lastrowid
+    conn.execute("DELETE FROM events WHERE id <= ?", (event_id - EVENTS_RETENTION,))
+    return event_id
+
+
+def format_event(event_id: int, event_type: str, data: str):
+    """One event in the text/event-stream format (data is already JSON)."""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+class EventBroker:
+    """Fans the events table out to the subscribers of this process."""
+
+    def __init__(self, database: str = None, poll_seconds: float = EVENTS_POLL_SECONDS,
+                 heartbeat_seconds: float = EVENTS_HEARTBEAT_SECONDS, buffer_size: int = 1000):
+        self.database = database
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.subscribers = 0
+        self._recent = deque(maxlen=buffer_size)   # (id, type, data), oldest first
+        self._evicted_through = 0                  # highest id no longer in the buffer
+        self._last_id = None
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _fetch(self, after_id: int, limit: int = REPLAY_BATCH):
+        conn = connect(self.database)
+        try:
+            return conn.execute(
+                "SELECT id, type, data FROM events WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def start(self):
+        """Start tailing the events table (once); subscribing starts it on demand."""
+        with self._start_lock:
+            if self._started:
+                return
+            conn = connect(self.database)
+            try:
+                self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+            finally:
+                conn.close()
+            self._evicted_through = self._last_id
+            threading.Thread(target=self._run, name="event-broker", daemon=True).start()
+            self._started = True
+
+    def notify(self):
+        """Check for new events now (called after committing one in this process)."""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Could not read new events: {e}")
+
+    def poll(self):
+        """Move newly committed events into the buffer and wake the subscribers."""
+        rows = self._fetch(self._last_id)
+        while rows:
+            with self._condition:
+                for row in rows:
+                    if len(self._recent) == self._recent.maxlen:
+                        self._evicted_through = self._recent[0][0]
+                    self._recent.append((row[0], row[1], row[2]))
+                self._last_id = rows[-1][0]
+                self._condition.notify_all()
+            rows = self._fetch(self._last_id) if len(rows) == REPLAY_BATCH else None
+
+    def _pending(self, position: int):
+        """Buffered events after position, or None if some of them already left the buffer."""
+        if position < self._evicted_through:
+            return None
+        return [event for event in self._recent if event[0] > position]
+
+    def stream(self, last_event_id=None):
+        """
+        Generate the text/event-stream of one subscriber.
+
+        Args:
+            last_event_id: The Last-Event-ID of a reconnecting client: the events after it
+                are sent first. New subscribers only get events published from now on.
+
+        Yields:
+            str: Stream chunks - events, and a keep-alive comment when idle (which is also
+            how a disconnected client is noticed).
+        """
+        self.start()
+        with self._condition:
+            self.subscribers += 1
+            position = self._last_id
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n"
+            if last_event_id is not None:
+                position = last_event_id
+            while True:
+                with self._condition:
+                    pending = self._pending(position)
+                    if pending == []:
+                        self._condition.wait(self.heartbeat_seconds)
+                        pending = self._pending(position)
+                if pending is None:
+                    # Too far behind for the buffer (a reconnect after a long time): read the table
+                    pending = self._fetch(position)
+                if not pending:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "".join(format_event(*event) for event in pending)
+                position = pending[-1][0]
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+
+broker = EventBroker()
+
+# One broker per tenant database (see tenants.py); the default database has `broker`
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+def broker_for(database: str = None):
+    """The broker of the events table in `database` (DATABASE_URL by default)."""
+    if database is None or database == DATABASE_URL:
+        return broker
+    with _brokers_lock:
+        return _brokers.setdefault(database, EventBroker(database))
+
+def subscriber_count():
+    """Open subscriptions across the brokers of every database."""
+    with _brokers_lock:
+        return broker.subscribers + sum(tenant_broker.subscribers for tenant_broker in _brokers.values())
+
+
+def parse_last_event_id(value):
+    """Last-Event-ID header (or ?last_event_id=) as an int; None when absent or invalid."""
+    try:
+        return int(value) if value not in (None, "") else None
+    except ValueError:
+        return None
@@ -0,0 +1,108 @@
+"""
+Persistent cache of generated explanations.
+
+Change sets recur (the same account toggled on and off, the same nightly HR sync edits), so
+explanations are stored under a fingerprint of the change set that ignores ordering and
+whitespace, combined with the model and prompt version that produced them. A hit skips the
+OpenAI call entirely. Entries expire after a TTL and the least recently used ones are evicted
+beyond a size limit.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from config import EXPLANATION_CACHE_TTL_HOURS, EXPLANATION_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**counters):
+    with _stats_lock:
+        for name, value in counters.items():
+            _stats[name] += value
+
+def cache_stats():
+    """Hit / miss / store / eviction counters of this process, plus the hit ratio."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 3) if lookups else None
+    return stats
+
+def reset_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _normalize(change: str):
+    return " ".join(str(change).split())
+
+def change_set_fingerprint(changes: list, model: str, prompt_version: str):
+    """
+    Order-independent fingerprint of a change set for a given model and prompt version.
+    The same lines in any order (and with any spacing) give the same fingerprint.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{model}\n{prompt_version}\n".encode())
+    for line in sorted(_normalize(change) for change in changes):
+        digest.update(line.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+def get_cached_explanation(conn, fingerprint: str, ttl_hours: float = None):
+    """
+    Cached explanation for a fingerprint, or None (also None once the entry is older than the TTL).
+    Records the hit or miss. The caller commits.
+    """
+    ttl_seconds = (EXPLANATION_CACHE_TTL_HOURS if ttl_hours is None else ttl_hours) * 3600
+    now = time.time()
+    row = conn.execute(
+        "SELECT explanation FROM explanation_cache WHERE fingerprint = ? AND created_at >= ?",
+        (fingerprint, now - ttl_seconds)
+    ).fetchone()
+    if row is None:
+        _count(misses=1)
+        return None
+    conn.execute(
+        "UPDATE explanation_cache SET last_used_at = ?, hits = hits + 1 WHERE fingerprint = ?",
+        (now, fingerprint)
+    )
+    _count(hits=1)
+    return row[0]
+
+def store_explanation(conn, fingerprint: str, model: str, prompt_version: str, explanation: str,
+                      ttl_hours: float = None, max_entries: int = None):
+    """Cache an explanation, then evict expired and least recently used entries. The caller commits."""
+    now = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO explanation_cache "
+        "(fingerprint, model, prompt_version, explanation, created_at, last_used_at, hits) "
+        "VALUES (?, ?, ?, ?, ?, ?, 0)",
+        (fingerprint, model, prompt_version, explanation, now, now)
+    )
+    _count(stores=1)
+    evict(conn, ttl_hours, max_entries, now)
+
+def evict(conn, ttl_hours: float = None, max_entries: int = None, now: float = None):
+    """Drop entries past the TTL, then the least recently used beyond max_entries. Returns the count."""
+    ttl_seconds = (EXPLANATION_CACHE_TTL_HOURS if ttl_hours is None else ttl_hours) * 3600
+    max_entries = EXPLANATION_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    now = time.time() if now is None else now
+
+    evicted = conn.execute("DELETE FROM explanation_cache WHERE created_at < ?", (now - ttl_seconds,)).rowcount
+    evicted += conn.execute(
+        "DELETE FROM explanation_cache WHERE fingerprint IN ("
+        "  SELECT fingerprint FROM explanation_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?"
+        ")",
+        (max_entries,)
+    ).rowcount
+    if evicted:
+        _count(evictions=evicted)
+        logger.debug(f"Evicted {evicted} cached explanations")
+    return evicted
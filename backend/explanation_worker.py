@@ -0,0 +1,219 @@
+"""
+Background generation of snapshot explanations.
+
+Snapshots are committed with explanation_status 'pending' and queued here; a small pool of
+worker threads asks OpenAI for the explanation and fills it in later, so a slow or throttled
+completion never delays the snapshot write or the next check cycle. Throttling, timeouts and
+5xx responses are retried with backoff; snapshots left pending by a restart are picked up
+again by recover(). Change sets explained before are served from the explanation cache, and
+identical change sets queued at the same time share one API call.
+"""
+
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+import openai_client
+from storage_backend import connect
+from explanation_cache import change_set_fingerprint, get_cached_explanation, store_explanation
+from metrics import CHECK_STAGE_SECONDS
+from events import EXPLANATION_READY, broker_for, record_event
+from config import (
+    DATABASE_URL, EXPLANATION_MAX_CONCURRENCY, EXPLANATION_MAX_RETRIES, EXPLANATION_BACKOFF_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# snapshots.explanation_status values
+STATUS_NONE = "none"          # nothing to explain (e.g. the initial snapshot)
+STATUS_PENDING = "pending"    # queued or being generated
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"      # gave up; explanation holds an error message
+
+_MAX_BACKOFF_SECONDS = 60
+
+
+def _retry_delay(error, attempt: int, base: float):
+    """Retry-After from the API response if present, otherwise full-jitter exponential backoff."""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), _MAX_BACKOFF_SECONDS)
+    except ValueError:
+        pass
+    return random.uniform(0, min(_MAX_BACKOFF_SECONDS, base * 2 ** attempt))
+
+
+class ExplanationWorker:
+    """Queue of snapshots waiting for an explanation, served by a bounded pool of threads."""
+
+    def __init__(self, max_concurrency: int = None, max_retries: int = None, backoff_seconds: float = None):
+        self.max_concurrency = max_concurrency or EXPLANATION_MAX_CONCURRENCY
+        self.max_retries = EXPLANATION_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = EXPLANATION_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self._queue = queue.Queue()
+        self._queued = set()
+        self._in_flight = {}    # change-set fingerprint -> Event set once it is explained
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads (once)."""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.max_concurrency):
+                thread = threading.Thread(target=self._run, name=f"explanation-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, snapshot_id: int, database: str = None):
+        """
+        Queue a pending snapshot for explanation (ignored if it is already queued).
+
+        Args:
+            snapshot_id (int): Snapshot whose explanation_status is 'pending'.
+            database (str): Database URL or SQLite path (see storage_backend); DATABASE_URL by default.
+        """
+        item = (database or DATABASE_URL, snapshot_id)
+        with self._lock:
+            if item in self._queued:
+                return
+            self._queued.add(item)
+        self.start()
+        self._queue.put(item)
+
+    def recover(self, database: str = None):
+        """Queue every snapshot still pending, e.g. after a restart. Returns how many were queued."""
+        conn = connect(database or DATABASE_URL)
+        try:
+            rows = conn.execute(
+                "SELECT id FROM snapshots WHERE explanation_status = ? ORDER BY id", (STATUS_PENDING,)
+            ).fetchall()
+        finally:
+            conn.close()
+        for (snapshot_id,) in rows:
+            self.enqueue(snapshot_id, database)
+        if rows:
+            logger.info(f"Queued {len(rows)} pending explanations")
+        return len(rows)
+
+    def join(self, timeout: float = None):
+        """Wait until the queue is drained. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._explain(*item)
+            except Exception as e:
+                logger.error(f"Explanation of snapshot {item[1]} failed: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._queued.discard(item)
+                self._queue.task_done()
+
+    def _explain(self, database: str, snapshot_id: int):
+        """Generate and store the explanation of one snapshot, retrying transient API errors."""
+        conn = connect(database)
+        try:
+            row = conn.execute(
+                "SELECT changes, explanation_status FROM snapshots WHERE id = ?", (snapshot_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if not row or row[1] != STATUS_PENDING:
+            return
+        changes = json.loads(row[0]) if row[0] else []
+        fingerprint = change_set_fingerprint(changes, openai_client.OPENAI_MODEL, openai_client.PROMPT_VERSION)
+
+        # An identical change set being explained right now: wait for it and reuse its result
+        with self._lock:
+            leader = fingerprint not in self._in_flight
+            done = self._in_flight.setdefault(fingerprint, threading.Event())
+        if not leader:
+            done.wait()
+        try:
+            self._explain_change_set(database, snapshot_id, changes, fingerprint)
+        finally:
+            if leader:
+                with self._lock:
+                    self._in_flight.pop(fingerprint, None)
+                done.set()
+
+    def _explain_change_set(self, database: str, snapshot_id: int, changes: list, fingerprint: str):
+        """Store the cached explanation of the change set, or generate (and cache) a new one."""
+        conn = connect(database)
+        try:
+            cached = get_cached_explanation(conn, fingerprint)
+            if cached is not None:
+                conn.execute(
+                    "UPDATE snapshots SET explanation = ?, explanation_status = ?, explanation_attempts = 0 WHERE id = ?",
+                    (cached, STATUS_READY, snapshot_id)
+                )
+                record_event(conn, EXPLANATION_READY, {"snapshot_id": snapshot_id, "status": STATUS_READY})
+                conn.commit()
+                broker_for(database).notify()
+                logger.info(f"Explanation of snapshot {snapshot_id} served from cache")
+                return
+            conn.commit()
+        finally:
+            conn.close()
+
+        # No database connection is held while waiting for the API
+        attempt = 0
+        usage = openai_client.TokenUsage()
+        partials = {}   # chunk summaries of large change sets survive a retry
+        started = time.perf_counter()
+        while True:
+            try:
+                explanation, status = openai_client.generate_explanation(changes, usage, partials), STATUS_READY
+                break
+            except openai_client.RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    explanation, status = openai_client.error_explanation(e), STATUS_FAILED
+                    break
+                delay = _retry_delay(e, attempt, self.backoff_seconds)
+                attempt += 1
+                logger.warning(f"Explanation of snapshot {snapshot_id} failed ({e}), retry {attempt} in {delay:.1f}s")
+                time.sleep(delay)
+            except Exception as e:
+                explanation, status = openai_client.error_explanation(e), STATUS_FAILED
+                break
+        CHECK_STAGE_SECONDS.observe(time.perf_counter() - started, stage="explain")
+
+        conn = connect(database)
+        try:
+            conn.execute(
+                "UPDATE snapshots SET explanation = ?, explanation_status = ?, explanation_attempts = ?, "
+                "explanation_tokens = ? WHERE id = ?",
+                (explanation, status, attempt + 1, usage.total_tokens, snapshot_id)
+            )
+            if status == STATUS_READY and explanation and openai_client.get_client():
+                store_explanation(conn, fingerprint, openai_client.OPENAI_MODEL, openai_client.PROMPT_VERSION, explanation)
+            record_event(conn, EXPLANATION_READY, {"snapshot_id": snapshot_id, "status": status})
+            conn.commit()
+        finally:
+            conn.close()
+        broker_for(database).notify()
+        logger.info(f"Explanation of snapshot {snapshot_id}: {status} after {attempt + 1} attempt(s), "
+                    f"{usage.requests} request(s), {usage.total_tokens} tokens")
+
+
+# Process-wide worker used by the monitor and the app
+explanations = ExplanationWorker()
+
+def enqueue_explanation(snapshot_id: int, database: str = None):
+    explanations.enqueue(snapshot_id, database)
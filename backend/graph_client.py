@@ -1,26 +1,92 @@
 """
 Microsoft Graph API client for retrieving Entra ID configuration.
-Includes pagination support.
+Includes pagination support, incremental delta queries, concurrent fetching and
+throttling-aware retries with an adaptive concurrency limit.
+
+Requests are made for the tenant of the graph_* secrets, or inside use_tenant(tenant) for a
+registered tenant (see tenants.py): each tenant then has its own MSAL app and token cache,
+its own adaptive concurrency limit (Graph throttles per tenant, so one throttled tenant does
+not slow the others down) and its own request counters.
 """
 
+import contextvars
+import random
+import threading
+import time
 import requests
 import msal
 import logging
-from config import GRAPH_CLIENT_ID, GRAPH_TENANT_ID, GRAPH_CLIENT_SECRET, GRAPH_SCOPE, GRAPH_CONFIG_ENDPOINT
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from config import (
+    GRAPH_CLIENT_ID, GRAPH_TENANT_ID, GRAPH_CLIENT_SECRET, GRAPH_SCOPE, GRAPH_CONFIG_ENDPOINT,
+    GRAPH_MAX_CONCURRENCY, GRAPH_MAX_RETRIES, GRAPH_BACKOFF_BASE_SECONDS, GRAPH_BACKOFF_MAX_SECONDS,
+    GRAPH_REQUEST_TIMEOUT
+)
+from metrics import register_collector, GRAPH_BYTES, GRAPH_REQUESTS, GRAPH_REQUEST_SECONDS, GRAPH_RETRIES, GRAPH_THROTTLED
 
 logger = logging.getLogger(__name__)
 
-# Initialize MSAL client - This is efficient as it's created only once.
-_auth_app = msal.ConfidentialClientApplication(
-    GRAPH_CLIENT_ID,
-    authority=f"https://login.microsoftonline.com/{GRAPH_TENANT_ID}",
-    client_credential=GRAPH_CLIENT_SECRET
-)
+# One pooled keep-alive session shared by every request (and every fetch thread)
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=GRAPH_MAX_CONCURRENCY, pool_maxsize=GRAPH_MAX_CONCURRENCY)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+# The registered tenant (tenants.Tenant) requests are made for; None for the tenant of the
+# graph_* secrets. A context variable, so fetch_concurrently carries it into its threads.
+_current_tenant = contextvars.ContextVar("graph_tenant", default=None)
+
+@contextmanager
+def use_tenant(tenant):
+    """Make the Graph requests of the block for a registered tenant (None: the configured one)."""
+    token = _current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+def current_tenant():
+    return _current_tenant.get()
+
+# MSAL client, created on the first token request: building it fetches the tenant's OpenID
+# configuration from login.microsoftonline.com, which must not hold up (or, when the network
+# is down, fail) importing this module. Created only once, and it caches the token.
+_auth_app = None
+_auth_app_lock = threading.Lock()
+# Registered tenant key -> its MSAL app, each with its own token cache
+_tenant_auth_apps = {}
+
+def _create_auth_app(tenant_id: str, client_id: str, client_secret: str):
+    return msal.ConfidentialClientApplication(
+        client_id,
+        authority=f"https://login.microsoftonline.com/{tenant_id}",
+        client_credential=client_secret,
+        token_cache=msal.TokenCache()
+    )
+
+def _get_auth_app():
+    global _auth_app
+    tenant = _current_tenant.get()
+    if tenant is not None:
+        with _auth_app_lock:
+            app = _tenant_auth_apps.get(tenant.key)
+            if app is None:
+                app = _tenant_auth_apps[tenant.key] = _create_auth_app(
+                    tenant.tenant_id, tenant.client_id, tenant.client_secret
+                )
+            return app
+    if _auth_app is None:
+        with _auth_app_lock:
+            if _auth_app is None:
+                _auth_app = _create_auth_app(GRAPH_TENANT_ID, GRAPH_CLIENT_ID, GRAPH_CLIENT_SECRET)
+    return _auth_app
 
 def _get_access_token():
     """Get access token for Microsoft Graph API. Handles caching automatically."""
-    # This function was missing from your file. It's essential for authentication.
-    result = _auth_app.acquire_token_for_client(scopes=[GRAPH_SCOPE])
+    result = _get_auth_app().acquire_token_for_client(scopes=[GRAPH_SCOPE])
     if "access_token" in result:
         return result["access_token"]
     
@@ -28,45 +94,299 @@ def _get_access_token():
     logger.error(error_msg)
     raise RuntimeError(error_msg)
 
+class FetchStats:
+    """Per-cycle request counters, shared by every fetch thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.resumed = 0
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "resumed": self.resumed,
+            }
+
+
+class RateController:
+    """
+    Adaptive limit on in-flight Graph requests (additive increase, multiplicative decrease).
+
+    Every throttling response halves the limit; every `limit` consecutive successes raise it
+    by one again, up to the configured maximum.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def on_throttle(self):
+        with self._condition:
+            self._successes = 0
+            if self.limit > 1:
+                self.limit = max(1, self.limit // 2)
+                logger.warning(f"Graph throttling detected - concurrency limit lowered to {self.limit}")
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self.limit < self.max_limit and self._successes >= self.limit:
+                self._successes = 0
+                self.limit += 1
+                self._condition.notify()
+
+
+# Statuses worth retrying: throttled, or the service is temporarily unavailable
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+_controller = RateController(GRAPH_MAX_CONCURRENCY)
+_stats = FetchStats()
+# Registered tenant key -> its limit and counters (the two above are the configured tenant's)
+_tenant_controllers = {}
+_tenant_stats = {}
+_tenant_state_lock = threading.Lock()
+
+def _rate_controller():
+    tenant = _current_tenant.get()
+    if tenant is None:
+        return _controller
+    with _tenant_state_lock:
+        return _tenant_controllers.setdefault(tenant.key, RateController(GRAPH_MAX_CONCURRENCY))
+
+def _fetch_stats():
+    tenant = _current_tenant.get()
+    if tenant is None:
+        return _stats
+    with _tenant_state_lock:
+        return _tenant_stats.setdefault(tenant.key, FetchStats())
+
+def count_resumed_walk():
+    """Count a walk continued from the page that failed in the previous cycle."""
+    _fetch_stats().add(resumed=1)
+
+def reset_fetch_stats():
+    """Start a new set of per-cycle counters (of the current tenant) and return the previous ones."""
+    global _stats
+    tenant = _current_tenant.get()
+    if tenant is None:
+        previous, _stats = _stats, FetchStats()
+        return previous
+    with _tenant_state_lock:
+        previous = _tenant_stats.get(tenant.key) or FetchStats()
+        _tenant_stats[tenant.key] = FetchStats()
+    return previous
+
+def get_fetch_stats():
+    """Counters of the current cycle, plus the current adaptive concurrency limit."""
+    stats = _fetch_stats().as_dict()
+    stats["concurrency_limit"] = _rate_controller().limit
+    return stats
+
+def _collect_metrics():
+    with _tenant_state_lock:
+        limits = [({"tenant": key}, controller.limit) for key, controller in _tenant_controllers.items()]
+    return [("graph_concurrency_limit", "gauge", "Current adaptive limit on concurrent Graph requests",
+             limits or [({}, _controller.limit)])]
+
+register_collector(_collect_metrics)
+
+def _retry_delay(response, attempt: int):
+    """
+    Seconds to wait before retrying. Graph's Retry-After header wins when present;
+    otherwise use exponential backoff with full jitter.
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), GRAPH_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                return min(max(0.0, retry_at.timestamp() - time.time()), GRAPH_BACKOFF_MAX_SECONDS)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(GRAPH_BACKOFF_MAX_SECONDS, GRAPH_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+def _get_with_retry(url: str, headers: dict):
+    """
+    GET one page, retrying throttling/unavailable responses and connection errors.
+
+    Returns the final response; non-retryable errors (and retryable ones once
+    GRAPH_MAX_RETRIES is exhausted) are returned to the caller unchanged.
+    """
+    controller, stats = _rate_controller(), _fetch_stats()
+    attempt = 0
+    while True:
+        response = None
+        try:
+            with controller.slot():
+                started = time.perf_counter()
+                response = _session.get(url, headers=headers, timeout=GRAPH_REQUEST_TIMEOUT)
+                GRAPH_REQUEST_SECONDS.observe(time.perf_counter() - started)
+            stats.add(requests=1)
+            GRAPH_REQUESTS.inc(status=response.status_code)
+            GRAPH_BYTES.inc(len(response.content))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            stats.add(requests=1)
+            GRAPH_REQUESTS.inc(status="error")
+            if attempt >= GRAPH_MAX_RETRIES:
+                raise
+            logger.warning(f"Graph request failed ({e}), retrying")
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                controller.on_success()
+                return response
+            if response.status_code == 429 or response.status_code == 503:
+                stats.add(throttled=1)
+                GRAPH_THROTTLED.inc()
+                controller.on_throttle()
+            if attempt >= GRAPH_MAX_RETRIES:
+                logger.error(f"Giving up on {url} after {attempt} retries (HTTP {response.status_code})")
+                return response
+
+        delay = _retry_delay(response, attempt)
+        stats.add(retries=1, wait_seconds=delay)
+        GRAPH_RETRIES.inc()
+        logger.info(f"Retrying in {delay:.1f}s (attempt {attempt + 1}/{GRAPH_MAX_RETRIES})")
+        time.sleep(delay)
+        attempt += 1
+
+def iter_pages(url: str, delta: bool = False, label: str = None):
+    """
+    Stream a Graph collection page by page, following @odata.nextLink.
+
+    Only one page is held in memory at a time, so callers can process tenants of any size.
+    A fresh token is requested for every page (MSAL serves it from its cache), so walks that
+    outlive a token's lifetime keep working.
+
+    Args:
+        url (str): Absolute URL of the first page (an endpoint URL, nextLink or deltaLink).
+        delta (bool): Raise DeltaTokenExpiredError when Graph rejects the delta token.
+        label (str): Name used in log messages.
+
+    Yields:
+        tuple: (items on the page, full page body incl. @odata.nextLink / @odata.deltaLink)
+    """
+    next_url = url
+    while next_url:
+        headers = {"Authorization": f"Bearer {_get_access_token()}"}
+        response = _get_with_retry(next_url, headers)
+        if delta and _is_delta_expired(response):
+            logger.warning(f"Delta token for {label or url} has expired - a full resync is required")
+            raise DeltaTokenExpiredError(label or url)
+        response.raise_for_status()
+
+        data = response.json()
+        next_url = data.get("@odata.nextLink")
+        yield data.get("value", []), data
+
+def is_rejected_link_error(error):
+    """True when a saved page link was refused for good (4xx other than throttling)."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return (isinstance(error, requests.HTTPError) and status is not None
+            and 400 <= status < 500 and status not in RETRYABLE_STATUS_CODES)
+
+def graph_url(endpoint: str):
+    """Absolute Graph URL for an endpoint path (e.g., "/users" -> "https://graph.microsoft.com/v1.0/users")."""
+    return f"{GRAPH_CONFIG_ENDPOINT}{endpoint}"
+
 def fetch_all_graph_data(endpoint: str):
     """
     Retrieve all data from a specified Microsoft Graph API endpoint, handling pagination.
-    
+
+    Holds the whole collection in memory; the monitor streams collections page by page
+    instead (see monitor._stream_walk). Throttled pages are retried in place.
+
     Args:
         endpoint (str): The API endpoint to query (e.g., "/users", "/groups").
         
     Returns:
         list: A list containing all items retrieved from the endpoint.
     """
-    all_results = []
-    try:
-        # This call will now succeed because _get_access_token is defined above.
-        token = _get_access_token()
-        headers = {"Authorization": f"Bearer {token}"}
-        
-        next_url = f"{GRAPH_CONFIG_ENDPOINT}{endpoint}"
-        
-        logger.info(f"Fetching all data from endpoint: {endpoint}")
-        
-        # Pagination loop
-        while next_url:
-            response = requests.get(next_url, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            page_results = data.get("value", [])
-            all_results.extend(page_results)
-            
-            next_url = data.get("@odata.nextLink")
-            
-            if next_url:
-                logger.info(f"Fetching next page... (retrieved {len(all_results)} items so far)")
-
-        logger.info(f"Successfully retrieved a total of {len(all_results)} items from {endpoint}")
-        return all_results
-        
-    except Exception as e:
-        logger.error(f"Error retrieving all data from Graph API endpoint {endpoint}: {e}", exc_info=True)
-        # Re-raise the exception to allow the calling code to handle it
-        raise
+    logger.info(f"Fetching all data from endpoint: {endpoint}")
+    all_results = [item for items, _ in iter_pages(graph_url(endpoint), label=endpoint) for item in items]
+    logger.info(f"Successfully retrieved a total of {len(all_results)} items from {endpoint}")
+    return all_results
+
+
+def fetch_executor(max_workers: int = None):
+    """
+    A thread pool for repeated fetch_concurrently calls (e.g. one per page of a walk), so
+    they do not each start new threads. The caller shuts it down.
+    """
+    return ThreadPoolExecutor(max_workers=max_workers or GRAPH_MAX_CONCURRENCY, thread_name_prefix="graph-fetch")
+
+def fetch_concurrently(fetchers: dict, max_workers: int = None, executor=None):
+    """
+    Run several fetch callables in parallel on a bounded thread pool.
+
+    Pages of a single endpoint must still be walked in order (each page carries the next
+    link), so the parallelism is across endpoints.
+
+    Args:
+        fetchers (dict): Key -> zero-argument callable.
+        max_workers (int): Concurrency limit, defaults to GRAPH_MAX_CONCURRENCY.
+        executor: Pool to run on (see fetch_executor); a new one for this call if None.
+
+    Returns:
+        dict: Key -> result of the callable, in the same key order as `fetchers`.
+    """
+    if not fetchers:
+        return {}
+    if executor is None:
+        workers = min(max_workers or GRAPH_MAX_CONCURRENCY, len(fetchers))
+        with fetch_executor(workers) as executor:
+            return fetch_concurrently(fetchers, executor=executor)
+    # Each fetch runs in a copy of the caller's context, so it requests for the same tenant
+    futures = {key: executor.submit(contextvars.copy_context().run, fetcher) for key, fetcher in fetchers.items()}
+    # .result() re-raises the first failure, like the serial path would
+    return {key: future.result() for key, future in futures.items()}
+
+
+class DeltaTokenExpiredError(Exception):
+    """Raised when Graph no longer accepts a stored deltaLink and a full resync is required."""
+
+
+# Error codes Graph uses when a delta token can no longer be used
+_DELTA_EXPIRED_CODES = {"syncStateNotFound", "syncStateInvalid", "resyncRequired"}
+
+def _is_delta_expired(response):
+    """Check whether a delta response signals an expired or invalid sync state."""
+    if response.status_code == 410:
+        return True
+    if response.status_code >= 400:
+        try:
+            code = response.json().get("error", {}).get("code")
+        except ValueError:
+            return False
+        return code in _DELTA_EXPIRED_CODES
+    return False
@@ -0,0 +1,38 @@
+"""
+Gunicorn settings for the production server: gunicorn -c gunicorn.conf.py wsgi:app
+
+Threaded (gthread) workers, one process per CPU by default, each serving WEB_THREADS requests
+at a time. Each request keeps a real thread, so the per-thread SQLite connection pool is
+reused and a blocking PostgreSQL query only holds up its own request. The cost is that every
+open /api/events stream also holds a thread for as long as the dashboard stays open: a worker
+serves WEB_THREADS streams and requests together. The workers share their metrics through
+METRICS_MULTIPROC_DIR, so /metrics reports all of them whichever one answers.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Set before config is imported: the workers are forked from this process and inherit it
+if not os.environ.get("METRICS_MULTIPROC_DIR"):
+    os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="entra-monitor-metrics-")
+
+from config import WEB_BIND, WEB_WORKERS, WEB_THREADS, METRICS_MULTIPROC_DIR
+
+bind = WEB_BIND
+workers = WEB_WORKERS or multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = WEB_THREADS
+# The app is imported by each worker after it forks, not by the master: database connections
+# and the event broker's thread must not be shared across a fork
+preload_app = False
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+def on_starting(server):
+    """Start from zero: the files of a previous run would be added to this one's totals."""
+    shutil.rmtree(METRICS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
@@ -0,0 +1,175 @@
+"""
+Point-in-time queries, for the /api/state and /api/objects/<type>/<id>/history endpoints.
+
+Both are answered from indexes: a point in time is resolved to the last snapshot taken at
+or before it through the snapshot timestamp index, the state at that snapshot is rebuilt
+from the nearest checkpoint (see storage.load_state), and an object's history is a range
+scan over its own versions. No snapshot's change list is ever parsed.
+"""
+
+import json
+from datetime import datetime, time, timezone
+
+from storage import decode, load_object, load_state
+
+MAX_PAGE_SIZE = 500
+
+
+def parse_point_in_time(value: str) -> str:
+    """
+    Normalize an ?at= value to the UTC ISO format snapshot timestamps are stored in.
+
+    A date without a time means the end of that day (UTC): "2024-03-03" is the state as it
+    was when March 3rd ended. Times without a timezone are taken as UTC.
+
+    Raises:
+        ValueError: If the value is not an ISO 8601 date or timestamp.
+    """
+    try:
+        if len(value) == 10:
+            parsed = datetime.combine(datetime.strptime(value, "%Y-%m-%d").date(), time.max)
+        else:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        raise ValueError("at must be an ISO 8601 date or timestamp, e.g. 2024-03-03 or 2024-03-03T12:00:00Z")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
+def snapshot_at(conn, at: str):
+    """The last snapshot taken at or before a point in time, as (id, timestamp), or None."""
+    row = conn.execute(
+        "SELECT id, timestamp FROM snapshots WHERE timestamp <= ? ORDER BY timestamp DESC, id DESC LIMIT 1",
+        (parse_point_in_time(at),)
+    ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def state_at(conn, at: str, object_type: str = None, object_id: str = None):
+    """
+    The configuration as it was at a point in time.
+
+    Args:
+        conn: Open database connection.
+        at (str): ISO date or timestamp (see parse_point_in_time).
+        object_type (str): Only this object type.
+        object_id (str): Only this object (requires object_type).
+
+    Returns:
+        dict: {"at", "snapshot_id", "timestamp", "state": {type: [objects]}, "object_counts"},
+        or {"object": ...} instead of the state when object_id is given. None if no snapshot
+        existed yet at that time.
+
+    Raises:
+        ValueError: On an invalid timestamp, or object_id without object_type.
+    """
+    if object_id is not None and object_type is None:
+        raise ValueError("object_id requires object_type")
+    snapshot = snapshot_at(conn, at)
+    if snapshot is None:
+        return None
+    snapshot_id, timestamp = snapshot
+    result = {"at": at, "snapshot_id": snapshot_id, "timestamp": timestamp}
+    if object_id is not None:
+        result.update({"object_type": object_type, "object_id": object_id,
+                       "object": load_object(conn, object_type, object_id, snapshot_id)})
+        return result
+    state = load_state(conn, snapshot_id, object_type)
+    result.update({"state": state, "object_counts": {obj_type: len(objects) for obj_type, objects in state.items()}})
+    return result
+
+
+def _changes_by_snapshot(conn, object_type: str, object_id: str, snapshot_ids):
+    """Change records of one object in the given snapshots, grouped by snapshot id."""
+    if not snapshot_ids:
+        return {}
+    placeholders = ",".join("?" * len(snapshot_ids))
+    rows = conn.execute(
+        "SELECT snapshot_id, path, op, old_value, new_value, kind FROM change_events "
+        f"WHERE object_type = ? AND object_id = ? AND snapshot_id IN ({placeholders}) ORDER BY id",
+        (object_type, object_id, *snapshot_ids)
+    ).fetchall()
+    grouped = {}
+    for snapshot_id, path, op, old, new, kind in rows:
+        grouped.setdefault(snapshot_id, []).append({
+            "path": path, "op": op, "kind": kind,
+            "old": json.loads(old) if old is not None else None,
+            "new": json.loads(new) if new is not None else None,
+        })
+    return grouped
+
+
+def object_history(conn, object_type: str, object_id: str, cursor=None, limit: int = 50):
+    """
+    Every version of one object, newest first, with the change records that produced it.
+
+    Each version is one entry with event "added" (first version, or re-created after a
+    removal) or "modified". When a version was closed without a successor the object was
+    removed, which adds a "removed" entry at the snapshot that closed it.
+
+    Args:
+        conn: Open database connection.
+        object_type / object_id (str): The object.
+        cursor: next_cursor of the previous page (None for the first page).
+        limit (int): Versions per page, at most MAX_PAGE_SIZE.
+
+    Returns:
+        dict: {"object_type", "object_id", "items": [{"event", "snapshot_id", "timestamp",
+        "valid_to_snapshot_id", "object", "changes"}, ...], "next_cursor"}, or None if the
+        object was never seen.
+
+    Raises:
+        ValueError: On an invalid cursor or limit.
+    """
+    limit = int(limit)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    try:
+        upper = int(cursor) - 1 if cursor is not None else 2 ** 62
+    except ValueError:
+        raise ValueError("invalid cursor")
+
+    # One extra (older) version tells whether the last one on the page followed another
+    rows = conn.execute(
+        "SELECT v.valid_from_snapshot, v.valid_to_snapshot, v.payload, f.timestamp, t.timestamp "
+        "FROM object_versions v "
+        "LEFT JOIN snapshots f ON f.id = v.valid_from_snapshot "
+        "LEFT JOIN snapshots t ON t.id = v.valid_to_snapshot "
+        "WHERE v.object_type = ? AND v.object_id = ? AND v.valid_from_snapshot <= ? "
+        "ORDER BY v.valid_from_snapshot DESC LIMIT ?",
+        (object_type, object_id, upper, limit + 1)
+    ).fetchall()
+    if not rows and cursor is None:
+        return None
+    page = rows[:limit]
+    # The snapshot that opened the version after each one on the page (None for the newest)
+    newer_from = [None] + [row[0] for row in page[:-1]]
+    if cursor is not None and page:
+        newer = conn.execute(
+            "SELECT MIN(valid_from_snapshot) FROM object_versions "
+            "WHERE object_type = ? AND object_id = ? AND valid_from_snapshot > ?",
+            (object_type, object_id, page[0][0])
+        ).fetchone()
+        newer_from[0] = newer[0] if newer else None
+
+    changes = _changes_by_snapshot(
+        conn, object_type, object_id,
+        sorted({row[0] for row in page} | {row[1] for row in page if row[1] is not None})
+    )
+    items = []
+    for index, (valid_from, valid_to, payload, timestamp, closed_at) in enumerate(page):
+        if valid_to is not None and newer_from[index] != valid_to:
+            items.append({"event": "removed", "snapshot_id": valid_to, "timestamp": closed_at,
+                          "valid_to_snapshot_id": None, "object": None, "changes": changes.get(valid_to, [])})
+        older = rows[index + 1] if index + 1 < len(rows) else None
+        items.append({
+            "event": "modified" if older is not None and older[1] == valid_from else "added",
+            "snapshot_id": valid_from,
+            "timestamp": timestamp,
+            "valid_to_snapshot_id": valid_to,
+            "object": json.loads(decode(conn, payload)),
+            "changes": changes.get(valid_from, []),
+        })
+    next_cursor = str(page[-1][0]) if len(rows) > limit else None
+    return {"object_type": object_type, "object_id": object_id, "items": items, "next_cursor": next_cursor}
@@ -0,0 +1,133 @@
+"""
+Compression and HTTP caching of API responses.
+
+compress_response (an after_request hook) encodes JSON and text responses of at least
+RESPONSE_COMPRESSION_MIN_BYTES with brotli when the client accepts it and the optional
+`brotli` package is installed, otherwise with gzip. Streamed responses (the Server-Sent
+Events of /api/events) are sent as they are.
+
+cacheable() gives a response a strong ETag (a hash of its body, or a cheaper version key
+from the caller) and a Cache-Control header, and turns it into a 304 Not Modified when the
+request's If-None-Match already has that content; with client_has() a route can answer a
+304 before building the body at all.
+
+A compressed body is a different representation with its own strong ETag - the encoding is
+appended ("<hash>-br") - and If-None-Match is compared without that suffix, so a client that
+cached either representation gets a 304.
+"""
+
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+from werkzeug.http import remove_entity_headers
+
+from config import RESPONSE_COMPRESSION_MIN_BYTES, RESPONSE_GZIP_LEVEL, RESPONSE_BROTLI_QUALITY
+
+COMPRESSIBLE_TYPES = ("application/json", "text/plain")
+
+
+def _encodings():
+    """Supported Content-Encodings, preferred first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encodings):
+    """
+    The encoding to send, from a request's Accept-Encoding.
+
+    Args:
+        accept_encodings: request.accept_encodings.
+
+    Returns:
+        str: "br" or "gzip", or None when the client accepts neither.
+    """
+    best, best_quality = None, 0
+    for encoding in _encodings():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def encode(data: bytes, encoding: str):
+    if encoding == "br":
+        return brotli.compress(data, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def compress_response(request, response):
+    """Compress a response in place if it is worth it and the client accepts it."""
+    if (response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None or len(data) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+    response.set_data(encode(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def _strip_encoding(etag: str):
+    for encoding in ("br", "gzip"):
+        if etag.endswith(f"-{encoding}"):
+            return etag[:-len(encoding) - 1]
+    return etag
+
+
+def _matching_tag(request, etag: str):
+    """The tag of If-None-Match that has this ETag (in any encoding), or None."""
+    if request.if_none_match.star_tag:
+        return etag
+    return next((tag for tag in request.if_none_match.as_set(include_weak=True)
+                 if _strip_encoding(tag) == etag), None)
+
+
+def client_has(request, etag: str):
+    """True when If-None-Match shows the client already has this ETag's content."""
+    return _matching_tag(request, etag) is not None
+
+
+def cacheable(request, response, etag: str = None, max_age: int = 0, immutable: bool = False):
+    """
+    Add a strong ETag and Cache-Control to a response, and answer If-None-Match.
+
+    Args:
+        request: The current request.
+        response: The (uncompressed) response.
+        etag (str): The response's ETag when the caller can identify its content more
+            cheaply; a hash of the body by default.
+        max_age (int): Seconds the browser may reuse the response without asking again;
+            0 means it must revalidate every time (it still gets a 304 if nothing changed).
+        immutable (bool): Add Cache-Control: immutable (no revalidation on reload).
+
+    Returns:
+        The response, changed to 304 Not Modified when the client already has it.
+    """
+    etag = etag or hashlib.sha256(response.get_data()).hexdigest()[:32]
+    response.set_etag(etag)
+    response.cache_control.private = True   # Behind the session cookie: never in shared caches
+    if max_age:
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = immutable or None
+    else:
+        response.cache_control.no_cache = True
+
+    matched = _matching_tag(request, etag)
+    if matched is not None:
+        response.status_code = 304
+        response.set_data(b"")
+        remove_entity_headers(response.headers)
+        response.set_etag(matched)
+    return response
@@ -0,0 +1,126 @@
+"""
+Database-backed leases: at most one holder at a time among any number of processes or
+hosts sharing the database.
+
+A lease is a row of the leases table with its holder and an expiry time. The holder renews
+it every few seconds; another instance can only take it once it has expired, i.e. the
+holder stopped renewing it (crashed, hung, lost the database) for a whole TTL. A holder
+that shuts down cleanly releases it, and a standby takes over at its next attempt.
+
+The lease also fences the holder's writes: renew_in() renews it inside the caller's
+transaction and fails if it was lost, so an instance that was paused past its expiry (and
+replaced) cannot commit anything afterwards. Acquiring and renewing are single conditional
+statements, which SQLite and PostgreSQL both execute atomically.
+
+Expiry times come from the instances' clocks, so these must agree (NTP) to well within
+the TTL.
+"""
+
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+
+from storage_backend import connect
+from config import MONITOR_LEASE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLost(Exception):
+    """Raised when a write is fenced off because this instance no longer holds the lease."""
+
+
+class Lease:
+    """One named lease, as seen by one instance."""
+
+    def __init__(self, name: str, holder: str = None, ttl: float = MONITOR_LEASE_TTL_SECONDS, database: str = None):
+        self.name = name
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ttl = ttl
+        self.database = database
+        self.held = False
+
+    def acquire(self):
+        """
+        Take the lease if it is free or expired, or renew it if this instance holds it.
+
+        Returns:
+            bool: True if this instance holds the lease for the next TTL.
+        """
+        now = time.time()
+        conn = connect(self.database)
+        try:
+            held = conn.execute(
+                "UPDATE leases SET holder = ?, expires_at = ?, "
+                "acquired_at = CASE WHEN holder = ? THEN acquired_at ELSE ? END "
+                "WHERE name = ? AND (holder = ? OR expires_at < ?)",
+                (self.holder, now + self.ttl, self.holder, datetime.now(timezone.utc).isoformat(),
+                 self.name, self.holder, now)
+            ).rowcount == 1
+            if not held:
+                held = conn.execute(
+                    "INSERT OR IGNORE INTO leases (name, holder, expires_at, acquired_at) VALUES (?, ?, ?, ?)",
+                    (self.name, self.holder, now + self.ttl, datetime.now(timezone.utc).isoformat())
+                ).rowcount == 1
+            conn.commit()
+        finally:
+            conn.close()
+        if held != self.held:
+            if held:
+                logger.info(f"Acquired the {self.name} lease as {self.holder}")
+            else:
+                logger.warning(f"Lost the {self.name} lease")
+        self.held = held
+        return held
+
+    def renew_in(self, conn):
+        """
+        Renew the lease inside the caller's transaction, before it commits.
+
+        Raises:
+            LeaseLost: This instance no longer holds the lease; the caller must roll back.
+        """
+        now = time.time()
+        renewed = conn.execute(
+            "UPDATE leases SET expires_at = ? WHERE name = ? AND holder = ? AND expires_at >= ?",
+            (now + self.ttl, self.name, self.holder, now)
+        ).rowcount == 1
+        if not renewed:
+            self.held = False
+            raise LeaseLost(f"The {self.name} lease is no longer held by {self.holder}")
+
+    def scoped(self, database: str):
+        """
+        The same lease (name, holder, TTL) in another database, to fence the writes made there:
+        the leader holds it in each tenant's database while it leads (see monitor._tenant_fence).
+        """
+        return Lease(self.name, holder=self.holder, ttl=self.ttl, database=database)
+
+    def release(self):
+        """Give the lease up (on shutdown) so a standby can take over at once."""
+        conn = connect(self.database)
+        try:
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+            conn.commit()
+        finally:
+            conn.close()
+        if self.held:
+            logger.info(f"Released the {self.name} lease")
+        self.held = False
+
+
+def lease_holder(conn, name: str):
+    """
+    The current holder of a lease.
+
+    Returns:
+        dict: {"holder", "acquired_at", "expires_at"} (ISO timestamps), or None if nobody holds it.
+    """
+    row = conn.execute("SELECT holder, acquired_at, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+    if not row or row[2] < time.time():
+        return None
+    return {"holder": row[0], "acquired_at": row[1],
+            "expires_at": datetime.fromtimestamp(row[2], timezone.utc).isoformat()}
@@ -0,0 +1,283 @@
+"""
+Prometheus metrics, served in the text exposition format on /metrics.
+
+A small in-process registry rather than the prometheus_client package: counters, gauges
+and histograms with labels, each updated with a dict lookup and a few additions under its
+own lock, so the timing hooks stay on in production. Histograms keep per-bucket counts and
+only build the cumulative series when scraped.
+
+The counters this project already keeps (explanation cache, OpenAI usage, diff cache,
+compaction) are exported through collectors that read them at scrape time.
+
+The registry lives in one process. Under gunicorn a scrape reaches whichever worker accepts
+it, so the workers share their values through METRICS_MULTIPROC_DIR (set by gunicorn.conf.py):
+each writes its samples to its own file there every METRICS_FLUSH_SECONDS, and /metrics adds
+up the files of all workers - counters and histograms summed, including those of workers
+that have exited, so totals never go backwards; gauges per live worker, with a pid label.
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_MULTIPROC_DIR, METRICS_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "entra_monitor_"
+
+# Seconds: from fast API requests up to long full-tenant check cycles
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+_registry = []
+_collectors = []
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labelnames) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key)) + (extra or [])
+        return dict(pairs)
+
+    def samples(self):
+        """(sample name, labels, value) tuples of the current values."""
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+
+class Counter(_Metric):
+    """A monotonically increasing count. Name it with a _total suffix."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down."""
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (durations in seconds by default)."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        samples = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", self._labels(key, [("le", _format_value(bound))]), cumulative))
+            samples.append((f"{self.name}_sum", self._labels(key), series[-1]))
+            samples.append((f"{self.name}_count", self._labels(key), cumulative))
+        return samples
+
+
+def register_collector(collect):
+    """
+    Export values kept elsewhere, read at scrape time.
+
+    Args:
+        collect: Callable returning (name, type, documentation, [(labels dict, value), ...])
+            tuples; names get the common prefix.
+    """
+    _collectors.append(collect)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample_line(name: str, labels: dict, value):
+    if labels:
+        rendered = ",".join(f'{label}="{_escape(str(label_value))}"' for label, label_value in labels.items())
+        return f"{name}{{{rendered}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+def _families():
+    """This process's metrics: (name, type, documentation, [(sample name, labels, value)]) tuples."""
+    families = [(metric.name, metric.type, metric.documentation, metric.samples()) for metric in list(_registry)]
+    for collect in list(_collectors):
+        for name, metric_type, documentation, values in collect():
+            families.append((PREFIX + name, metric_type, documentation,
+                             [(PREFIX + name, labels, value) for labels, value in values if value is not None]))
+    return families
+
+
+def _process_file(directory: str, pid: int):
+    return os.path.join(directory, f"metrics_{pid}.json")
+
+
+def flush(directory: str = None):
+    """Write this process's samples to its file in the shared metrics directory."""
+    directory = directory or METRICS_MULTIPROC_DIR
+    if not directory:
+        return
+    path = _process_file(directory, os.getpid())
+    with open(path + ".tmp", "w") as f:
+        json.dump([[name, metric_type, documentation, [[sample, list(labels.items()), value]
+                                                       for sample, labels, value in samples]]
+                   for name, metric_type, documentation, samples in _families()], f)
+    os.replace(path + ".tmp", path)   # Readers never see a half-written file
+
+
+def _is_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _shared_families(directory: str):
+    """The samples of every process writing to the directory, added up (see the module docstring)."""
+    flush(directory)
+    merged = {}
+    for filename in sorted(os.listdir(directory)):
+        if not (filename.startswith("metrics_") and filename.endswith(".json")):
+            continue
+        pid = int(filename[len("metrics_"):-len(".json")])
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                families = json.load(f)
+        except (OSError, ValueError):
+            continue   # Removed or replaced while listing
+        alive = _is_alive(pid)
+        for name, metric_type, documentation, samples in families:
+            values = merged.setdefault(name, (metric_type, documentation, {}))[2]
+            if metric_type == "gauge":
+                if not alive:
+                    continue
+                samples = [(sample, labels + [["pid", str(pid)]], value) for sample, labels, value in samples]
+            for sample, labels, value in samples:
+                key = (sample, tuple(tuple(pair) for pair in labels))
+                values[key] = values.get(key, 0) + value
+    return [(name, metric_type, documentation, [(sample, dict(labels), value) for (sample, labels), value in values.items()])
+            for name, (metric_type, documentation, values) in merged.items()]
+
+
+def render():
+    """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+    families = _shared_families(METRICS_MULTIPROC_DIR) if METRICS_MULTIPROC_DIR else _families()
+    lines = []
+    for name, metric_type, documentation, samples in families:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(_sample_line(*sample) for sample in samples)
+    return "\n".join(lines) + "\n"
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            logger.warning(f"Could not write the shared metrics: {e}")
+
+
+if METRICS_MULTIPROC_DIR:
+    threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True).start()
+    atexit.register(flush)
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Check cycle ---
+
+CHECK_STAGE_SECONDS = Histogram(
+    "check_stage_duration_seconds",
+    "Duration of each stage of a check cycle (fetch, diff, store, total) and of explanation generation (explain)",
+    ["stage"]
+)
+CHECK_CYCLES = Counter("check_cycles_total", "Check cycles by outcome (changes, no_changes, error, lease_lost)",
+                       ["outcome"])
+MONITOR_LEADER = Gauge("monitor_leader", "1 while this instance holds the monitor lease and polls Graph")
+CHANGES_DETECTED = Counter("changes_detected_total", "Detected changes by object type and kind", ["object_type", "kind"])
+SNAPSHOT_CHANGES = Gauge("last_snapshot_changes", "Change lines in the most recently saved snapshot")
+OBJECTS = Gauge("objects", "Objects of each type in the latest stored state", ["object_type"])
+
+# --- Microsoft Graph ---
+
+GRAPH_PAGES = Counter("graph_pages_total", "Graph pages fetched by object type", ["object_type"])
+GRAPH_OBJECTS = Counter("graph_objects_total", "Directory objects fetched by object type", ["object_type"])
+GRAPH_REQUESTS = Counter("graph_requests_total", "Graph HTTP requests by status code (error = no response)", ["status"])
+GRAPH_REQUEST_SECONDS = Histogram("graph_request_duration_seconds", "Duration of single Graph HTTP requests")
+GRAPH_BYTES = Counter("graph_response_bytes_total", "Bytes downloaded from Graph (response bodies)")
+GRAPH_RETRIES = Counter("graph_retries_total", "Graph requests retried")
+GRAPH_THROTTLED = Counter("graph_throttled_total", "Graph responses that signalled throttling (429 / 503)")
+
+# --- HTTP API ---
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latency of API requests by route", ["method", "route", "status"]
+)
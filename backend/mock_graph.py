@@ -0,0 +1,245 @@
+"""
+Local stand-in for the Microsoft Graph API, used by the tests and benchmarks.
+
+Serves paged collections ("/v1.0/users", "/v1.0/groups/g1/members",
+"/v1.0/identity/conditionalAccess/policies", ...) and their delta endpoints
+("/v1.0/users/delta") from an in-memory tenant. Collections are named by their
+path below /v1.0 ("users", "groups/g1/members"), so the real
+graph_client code can be exercised over HTTP without a live tenant.
+
+For benchmarks the server can also behave like the real service under load: a base
+latency plus random jitter on every response, and a request rate limit above which
+requests are answered with 429 and a Retry-After header.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+
+class MockGraphServer:
+    """In-memory Graph tenant served over HTTP on a local port."""
+
+    def __init__(self, page_size=100, latency=0.0, host="127.0.0.1", port=0, latency_jitter=0.0,
+                 rate_limit=None, seed=None):
+        self.page_size = page_size
+        self.latency = latency     # artificial seconds of delay added to every response
+        self.latency_jitter = latency_jitter   # up to this many extra seconds, uniformly random
+        self.rate_limit = rate_limit           # requests per second (token bucket), None = unlimited
+        self.throttled = 0                     # requests answered 429 by the rate limit
+        self._tokens = rate_limit or 0.0
+        self._refilled_at = time.monotonic()
+        self._random = random.Random(seed)
+        self.collections = {}      # collection name -> {id: object}
+        self.change_log = {}       # collection name -> list of (sequence, id)
+        self.sequence = 0
+        self.expired_delta_tokens = set()
+        self.failures = []         # queued (status, retry_after, match) responses to inject
+        self.requests = []         # request paths, for assertions
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    # --- Lifecycle ---
+
+    @property
+    def base_url(self):
+        """Value to use for GRAPH_CONFIG_ENDPOINT."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1.0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Tenant mutation ---
+
+    def set_objects(self, collection, objects):
+        """Replace a collection wholesale (does not record delta changes)."""
+        with self._lock:
+            self.collections[collection] = {obj["id"]: dict(obj) for obj in objects}
+            self.change_log.setdefault(collection, [])
+
+    def upsert(self, collection, obj):
+        """Create or update an object and record it in the delta change log."""
+        with self._lock:
+            self.collections.setdefault(collection, {})[obj["id"]] = dict(obj)
+            self._record_change(collection, obj["id"])
+
+    def delete(self, collection, obj_id):
+        """Delete an object and record it in the delta change log."""
+        with self._lock:
+            self.collections.get(collection, {}).pop(obj_id, None)
+            self._record_change(collection, obj_id)
+
+    def expire_delta_tokens(self):
+        """Make every delta token issued so far answer 410 Gone / syncStateNotFound."""
+        with self._lock:
+            self.expired_delta_tokens.update(str(seq) for seq in range(self.sequence + 1))
+
+    def inject_failures(self, count, status=429, retry_after="0", match=None):
+        """
+        Answer the next `count` requests (whose path contains `match`, if given) with an
+        error status, e.g. 429 Too Many Requests with a Retry-After header.
+        """
+        with self._lock:
+            self.failures.extend([(status, retry_after, match)] * count)
+
+    def _take_failure(self, path):
+        for index, (status, retry_after, match) in enumerate(self.failures):
+            if match is None or match in path:
+                del self.failures[index]
+                return status, retry_after
+        return None
+
+    def _take_token(self):
+        """Seconds until the rate limit admits a request (0 when it is admitted now)."""
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        self.throttled += 1
+        return (1 - self._tokens) / self.rate_limit
+
+    def _delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0
+        return self.latency + jitter
+
+    def _record_change(self, collection, obj_id):
+        self.sequence += 1
+        self.change_log.setdefault(collection, []).append((self.sequence, obj_id))
+
+    # --- Request handling ---
+
+    def _page(self, url_path, params, items):
+        """Slice one page out of items and attach @odata.nextLink if more remain."""
+        skip = int(params.get("$skiptoken", ["0"])[0])
+        page = items[skip:skip + self.page_size]
+        body = {"value": page}
+        if skip + self.page_size < len(items):
+            next_params = {key: values[0] for key, values in params.items()}
+            next_params["$skiptoken"] = str(skip + self.page_size)
+            body["@odata.nextLink"] = f"{self.base_url}{url_path}?{urlencode(next_params, safe='$,')}"
+        return body, skip + self.page_size >= len(items)
+
+    @staticmethod
+    def _select(obj, params):
+        select = params.get("$select")
+        if not select:
+            return dict(obj)
+        fields = select[0].split(",")
+        return {key: obj[key] for key in fields if key in obj}
+
+    def handle_get(self, path):
+        """Route a GET request. Returns (status, body dict, extra headers)."""
+        with self._lock:
+            failure = self._take_failure(path)
+            if failure is None and self.rate_limit:
+                wait = self._take_token()
+                if wait:
+                    failure = 429, f"{wait:.3f}"
+            if failure:
+                self.requests.append(path)
+        if failure:
+            status, retry_after = failure
+            headers = {"Retry-After": retry_after} if retry_after is not None else {}
+            return status, {"error": {"code": "TooManyRequests" if status == 429 else "ServiceUnavailable",
+                                      "message": "Injected failure"}}, headers
+        status, body = self._route(path)
+        return status, body, {}
+
+    def _route(self, path):
+        parts = urlsplit(path)
+        params = parse_qs(parts.query)
+        segments = [segment for segment in parts.path.split("/") if segment]
+        if not segments or segments[0] != "v1.0" or len(segments) < 2:
+            return 404, {"error": {"code": "Request_ResourceNotFound", "message": path}}
+
+        is_delta = segments[-1] == "delta" and len(segments) > 2
+        collection = "/".join(segments[1:-1] if is_delta else segments[1:])
+        url_path = "/" + "/".join(segments[1:])
+        with self._lock:
+            self.requests.append(path)
+            objects = self.collections.get(collection)
+            if objects is None:
+                return 404, {"error": {"code": "Request_ResourceNotFound", "message": path}}
+
+            if is_delta:
+                return self._handle_delta(collection, url_path, params, objects)
+
+            items = [self._select(obj, params) for obj in objects.values()]
+            body, _ = self._page(url_path, params, items)
+            return 200, body
+
+    def _handle_delta(self, collection, url_path, params, objects):
+        delta_token = params.get("$deltatoken", [None])[0]
+        if delta_token is not None and delta_token in self.expired_delta_tokens:
+            return 410, {"error": {"code": "syncStateNotFound",
+                                   "message": "The delta token has expired."}}
+
+        if delta_token is None:
+            # Initial round: every object currently in the tenant
+            items = [self._select(obj, params) for obj in objects.values()]
+        else:
+            since = int(delta_token)
+            changed_ids = []
+            for seq, obj_id in self.change_log.get(collection, []):
+                if seq > since and obj_id not in changed_ids:
+                    changed_ids.append(obj_id)
+            items = []
+            for obj_id in changed_ids:
+                if obj_id in objects:
+                    items.append(self._select(objects[obj_id], params))
+                else:
+                    items.append({"id": obj_id, "@removed": {"reason": "deleted"}})
+
+        body, is_last = self._page(url_path, params, items)
+        if is_last:
+            delta_params = {"$deltatoken": str(self.sequence)}
+            if "$select" in params:
+                delta_params["$select"] = params["$select"][0]
+            body["@odata.deltaLink"] = f"{self.base_url}{url_path}?{urlencode(delta_params, safe='$,')}"
+        return 200, body
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real Graph endpoint
+
+            def do_GET(self):
+                delay = server._delay()
+                if delay:
+                    time.sleep(delay)
+                status, body, headers = server.handle_get(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,118 @@
+"""
+Local stand-in for the OpenAI chat completions API, used by the tests and benchmarks.
+
+Answers POST /v1/chat/completions with a canned (or computed) completion, so the real
+openai client can be exercised over HTTP. Failures (429, 500, ...) can be injected and the
+peak number of requests in flight is recorded.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOpenAIServer:
+    """Chat completions endpoint served over HTTP on a local port."""
+
+    def __init__(self, latency=0.0, responder=None, host="127.0.0.1", port=0):
+        self.latency = latency          # artificial seconds of delay added to every response
+        self.responder = responder or (lambda messages: "<p>Mock explanation</p>")
+        self.failures = []              # queued (status, retry_after) responses to inject
+        self.requests = []              # request bodies, for assertions
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    # --- Lifecycle ---
+
+    @property
+    def base_url(self):
+        """Value to use for OPENAI_BASE_URL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def inject_failures(self, count, status=429, retry_after="0"):
+        """Answer the next `count` requests with an error status."""
+        with self._lock:
+            self.failures.extend([(status, retry_after)] * count)
+
+    # --- Request handling ---
+
+    def handle_post(self, path, body):
+        """Route a POST request. Returns (status, body dict, extra headers)."""
+        with self._lock:
+            self.requests.append(body)
+            failure = self.failures.pop(0) if self.failures else None
+        if failure:
+            status, retry_after = failure
+            headers = {"Retry-After": retry_after} if retry_after is not None else {}
+            error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+            return status, {"error": {"message": "Injected failure", "type": error_type, "code": error_type}}, headers
+        if not path.rstrip("/").endswith("/chat/completions"):
+            return 404, {"error": {"message": f"Unknown path {path}", "type": "invalid_request_error"}}, {}
+
+        messages = body.get("messages", [])
+        content = self.responder(messages)
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        return 200, {
+            "id": f"chatcmpl-mock-{len(self.requests)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, {}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    if server.latency:
+                        time.sleep(server.latency)
+                    status, payload, headers = server.handle_post(self.path, body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -1,149 +1,575 @@
-import json
-import sqlite3
 import logging
+import threading
 import time
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from functools import partial
 
-from graph_client import fetch_all_graph_data
-from openai_client import get_explanation
-from config import DATABASE_PATH, CHECK_INTERVAL_MINUTES
+from graph_client import (
+    iter_pages, graph_url, fetch_concurrently, fetch_executor, is_rejected_link_error, reset_fetch_stats,
+    get_fetch_stats, count_resumed_walk, use_tenant, DeltaTokenExpiredError
+)
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+
+from explanation_worker import enqueue_explanation, explanations, STATUS_PENDING, STATUS_NONE
+from compaction import compaction_stats, run_compaction
+from explanation_cache import cache_stats
+from openai_client import usage_stats
+from lease import LeaseLost
+from events import SNAPSHOT_CREATED, broker_for, record_event
+from diff_engine import DiffRules, diff_states, render_changes
+from resources import RESOURCES, get_resource, enabled_resources, poll_interval
+from tenants import get_tenants, is_multi_tenant
+from storage import (
+    insert_snapshot, save_change_records, stage_page, stage_removals, iter_staged_changes, apply_staged,
+    clear_staging, get_sync_progress, save_sync_progress, walk_matches_fingerprint, get_type_fingerprint,
+    maybe_checkpoint, refresh_staged
+)
+from storage_backend import connect
+from metrics import (
+    CHANGES_DETECTED, CHECK_CYCLES, CHECK_STAGE_SECONDS, GRAPH_OBJECTS, GRAPH_PAGES, MONITOR_LEADER, OBJECTS,
+    SNAPSHOT_CHANGES
+)
+from config import (
+    DATABASE_URL, SYNC_MODE, DIFF_FIELD_RULES, COMPACTION_INTERVAL_HOURS, MONITOR_LEASE_RENEW_SECONDS,
+    MONITOR_MAX_CONCURRENT_CHECKS
+)
 
 logger = logging.getLogger(__name__)
 
-def _compute_diff(old_config: list, new_config: list, object_type: str):
+# Name of the lease that elects the one monitor instance polling Graph (see lease.py)
+MONITOR_LEASE = "monitor"
+
+# One lock per (tenant, resource), so two runs never sync the same resource at the same time
+_resource_locks = {}
+_resource_locks_guard = threading.Lock()
+
+def _resource_lock(name: str, tenant=None):
+    with _resource_locks_guard:
+        return _resource_locks.setdefault((tenant.key if tenant else None, name), threading.Lock())
+
+# Tenant database -> the monitor lease taken in it (see _tenant_fence)
+_tenant_fences = {}
+_tenant_fences_guard = threading.Lock()
+
+def _tenant_fence(lease, database: str):
+    """
+    The monitor lease in a tenant's own database, which fences the writes made there. There is
+    one per tenant database, shared by all the checks of that tenant and held for as long as
+    this instance leads: start_monitoring renews it with the main lease and releases it when
+    leadership ends, so no check gives it up under another one still running, and a long wait
+    between commits (Retry-After, the diff stage) does not let it expire.
+
+    Returns:
+        lease.Lease: The tenant's lease, acquired (or renewed) now; check .held.
+    """
+    with _tenant_fences_guard:
+        fence = _tenant_fences.get(database)
+        if fence is None or fence.holder != lease.holder:
+            fence = _tenant_fences[database] = lease.scoped(database)
+    fence.acquire()
+    return fence
+
+def _renew_tenant_fences():
+    with _tenant_fences_guard:
+        fences = list(_tenant_fences.values())
+    for fence in fences:
+        try:
+            fence.acquire()
+        except Exception as e:
+            logger.error(f"Could not renew the monitor lease in {fence.database}: {e}")
+
+def _release_tenant_fences():
+    with _tenant_fences_guard:
+        fences = list(_tenant_fences.values())
+        _tenant_fences.clear()
+    for fence in fences:
+        try:
+            fence.release()
+        except Exception as e:
+            logger.error(f"Could not release the monitor lease in {fence.database}: {e}")
+
+def _connect(database: str = None):
+    """Open a connection to the snapshot database (a tenant's, or DATABASE_URL; one per thread)."""
+    return connect(database or DATABASE_URL)
+
+def _commit(conn, lease):
+    """Commit, unless this instance has lost the monitor lease it runs under (see lease.py)."""
+    if lease is not None:
+        lease.renew_in(conn)
+    conn.commit()
+
+def _delta_endpoint(endpoint: str):
+    """Turn a list endpoint ("/users?$select=...") into its delta form ("/users/delta?$select=...")."""
+    path, _, query = endpoint.partition('?')
+    return f"{path}/delta?{query}" if query else f"{path}/delta"
+
+def _load_delta_links(conn):
+    """Load the persisted @odata.deltaLink for every object type."""
+    rows = conn.execute("SELECT object_type, delta_link FROM delta_links").fetchall()
+    return {row["object_type"]: row["delta_link"] for row in rows}
+
+def _save_delta_links(conn, delta_links: dict):
+    """Persist the deltaLinks returned by this cycle (committed by the caller)."""
+    timestamp = datetime.now(timezone.utc).isoformat()
+    for obj_type, delta_link in delta_links.items():
+        conn.execute(
+            "INSERT OR REPLACE INTO delta_links (object_type, delta_link, updated_at) VALUES (?, ?, ?)",
+            (obj_type, delta_link, timestamp)
+        )
+
+def _expand_page(resource, items: list, executor=None):
+    """
+    Attach each object's child collection (e.g. a group's members) to it, fetching the
+    children of the page's objects in parallel on `executor` (the walk's pool, see
+    fetch_executor). Children are sorted by id so an unchanged collection always hashes the same.
+    """
+    collection = resource.endpoint.partition('?')[0]
+
+    def fetch_children(object_id):
+        url = graph_url(f"{collection}/{object_id}/{resource.expand}")
+        children = [child for page_items, _ in iter_pages(url) for child in page_items]
+        return sorted(children, key=lambda child: child.get('id') or "")
+
+    children = fetch_concurrently({item['id']: partial(fetch_children, item['id']) for item in items},
+                                  executor=executor)
+    return [{**item, resource.expand_field: children[item['id']]} for item in items]
+
+def _stream_walk(conn, resource, origin_url: str, incremental: bool, lease=None):
+    """
+    Stream one walk of an object type (a full enumeration or a delta round) into the
+    staging tables, committing page by page.
+
+    The walk's progress is stored with every page, so if the previous cycle failed part-way
+    through the same walk it continues from the failed page instead of page 1. Under a lease
+    every page commit is fenced by it (LeaseLost once another instance took over).
+
+    Returns:
+        str: The @odata.deltaLink issued by the last page (None for plain list endpoints).
+    """
+    obj_type = resource.name
+    progress = get_sync_progress(conn, obj_type)
+    start_url = origin_url
+    hash_sum, object_count = 0, 0
+    if progress and progress["origin_url"] == origin_url:
+        if progress["next_url"] is None:
+            logger.info(f"Reusing the {obj_type} walk completed by the previous cycle")
+            return progress["delta_link"]
+        start_url = progress["next_url"]
+        hash_sum, object_count = progress["hash_sum"], progress["object_count"]
+        count_resumed_walk()
+        logger.info(f"Resuming the {obj_type} walk from the page that failed in the previous cycle")
+    else:
+        clear_staging(conn, obj_type)
+        _commit(conn, lease)
+
+    delta_link = None
+    staged = 0
+    # One pool for the children of every page, not one per page
+    executor = fetch_executor() if resource.expand else None
+    try:
+        for items, page in iter_pages(start_url, delta=incremental, label=f"{obj_type}s"):
+            if resource.expand and items:
+                items = _expand_page(resource, items, executor)
+            page_staged, page_hash_sum = stage_page(conn, obj_type, items, incremental, resource.key)
+            staged += page_staged
+            hash_sum += page_hash_sum
+            object_count += len(items)
+            GRAPH_PAGES.inc(object_type=obj_type)
+            GRAPH_OBJECTS.inc(len(items), object_type=obj_type)
+            next_url, delta_link = page.get("@odata.nextLink"), page.get("@odata.deltaLink")
+            if not next_url and not incremental:
+                # Same aggregate hash as the stored state: nothing can have been removed
+                if walk_matches_fingerprint(conn, obj_type, hash_sum, object_count):
+                    logger.info(f"{obj_type.capitalize()} fingerprint unchanged - skipping removal scan")
+                else:
+                    staged += stage_removals(conn, obj_type)
+            save_sync_progress(conn, obj_type, origin_url, next_url, delta_link, hash_sum, object_count)
+            _commit(conn, lease)
+    except Exception as e:
+        conn.rollback()
+        if start_url != origin_url and is_rejected_link_error(e):
+            logger.warning(f"Saved page link for {obj_type}s was rejected, starting the walk over")
+            clear_staging(conn, obj_type)
+            _commit(conn, lease)
+            return _stream_walk(conn, resource, origin_url, incremental, lease)
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    logger.info(f"Staged {staged} changed {obj_type}s")
+    return delta_link
+
+def _sync_resource(resource, delta_link, is_initial_run: bool, lease=None, database: str = None):
+    """
+    Stage the changes of one resource since the last snapshot.
+
+    In delta mode the stored deltaLink is used to fetch only what changed since the last cycle.
+    Without a usable deltaLink (first run, expired token) a full delta round is performed,
+    which also yields a fresh deltaLink. Resources without a delta query are always walked
+    in full. Runs on its own connection so resources can be fetched in parallel.
+
+    Returns:
+        str: New deltaLink, or None in full mode.
+    """
+    conn = _connect(database)
+    try:
+        if SYNC_MODE != "delta" or not resource.delta:
+            return _stream_walk(conn, resource, graph_url(resource.endpoint), incremental=False, lease=lease)
+
+        if delta_link and not is_initial_run:
+            try:
+                return _stream_walk(conn, resource, delta_link, incremental=True, lease=lease)
+            except DeltaTokenExpiredError:
+                logger.warning(f"Delta token for {resource.name}s expired. Falling back to a full resync.")
+
+        return _stream_walk(conn, resource, graph_url(_delta_endpoint(resource.endpoint)), incremental=False,
+                            lease=lease)
+    finally:
+        conn.close()
+
+def _compute_diff(old_config: list, new_config: list, object_type: str, old_hashes=None, new_hashes=None):
     """
     Compute differences between two configurations for a specific object type.
+
+    Thin wrapper over diff_engine.diff_states that returns the rendered change lines.
+    """
+    rules = DiffRules.for_type(object_type, DIFF_FIELD_RULES)
+    key = get_resource(object_type).key if object_type in RESOURCES else "id"
+    records = diff_states(old_config, new_config, object_type, rules, old_hashes, new_hashes, key)
+    return render_changes(records)
+
+def _observe_stage(stage: str, started: float):
+    """Record the duration of a check stage; returns the start time of the next one."""
+    now = time.perf_counter()
+    CHECK_STAGE_SECONDS.observe(now - started, stage=stage)
+    return now
+
+def collect_monitor_metrics():
+    """
+    The monitor's in-process counters (explanations, OpenAI usage, compaction) as Prometheus
+    metrics, for the process that runs it: worker.py, or the development server.
+    """
+    cache, usage = cache_stats(), usage_stats()
+    last_compaction = compaction_stats()["last_run"] or {}
+    return [
+        ("explanation_cache_lookups_total", "counter", "Explanation cache lookups by result",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("explanation_cache_evictions_total", "counter", "Explanation cache entries evicted",
+         [({}, cache["evictions"])]),
+        ("openai_requests_total", "counter", "OpenAI chat completion requests", [({}, usage["requests"])]),
+        ("openai_tokens_total", "counter", "OpenAI tokens used by kind",
+         [({"kind": "prompt"}, usage["prompt_tokens"]), ({"kind": "completion"}, usage["completion_tokens"])]),
+        ("compaction_last_bytes_saved", "gauge", "Bytes saved by the last compaction run",
+         [({}, last_compaction.get("bytes_saved"))]),
+    ]
+
+def _record_cycle_metrics(conn, resources, saved_changes, change_records):
+    """Change counts and stored object counts after a completed check."""
+    for record in change_records:
+        CHANGES_DETECTED.inc(object_type=record.object_type, kind=record.kind)
+    if saved_changes is not None:
+        SNAPSHOT_CHANGES.set(len(saved_changes))
+    for resource in resources:
+        fingerprint = get_type_fingerprint(conn, resource.name)
+        if fingerprint is not None:
+            OBJECTS.set(fingerprint[1], object_type=resource.name)
+
+def check_for_changes(resource_names=None, lease=None, tenant=None):
     """
-    changes = []
-    old_index = {obj.get('id'): obj for obj in (old_config or [])}
-    new_index = {obj.get('id'): obj for obj in (new_config or [])}
-
-    # Find added items
-    for obj_id, obj in new_index.items():
-        if obj_id not in old_index:
-            name = obj.get('displayName') or obj.get('userPrincipalName') or obj_id
-            changes.append(f"{object_type.capitalize()} added: {name}")
-
-    # Find removed items
-    for obj_id, obj in old_index.items():
-        if obj_id not in new_index:
-            name = obj.get('displayName') or obj.get('userPrincipalName') or obj_id
-            changes.append(f"{object_type.capitalize()} removed: {name}")
-
-    # Find modified items
-    for obj_id in set(old_index) & set(new_index):
-        old_obj = old_index[obj_id]
-        new_obj = new_index[obj_id]
-
-        for key in ['displayName', 'userPrincipalName', 'accountEnabled', 'jobTitle', 'description']:
-            if key in old_obj or key in new_obj:
-                old_val = old_obj.get(key)
-                new_val = new_obj.get(key)
-                if old_val != new_val:
-                    name = new_obj.get('displayName') or new_obj.get('userPrincipalName') or obj_id
-                    changes.append(f"{object_type.capitalize()} modified: {name} - {key} changed from '{old_val}' to '{new_val}'")
-
-    return changes
-
-def check_for_changes():
-    """Check for configuration changes and save snapshot if changes detected."""
-    logger.info("="*20 + " Starting Configuration Check " + "="*20)
-
-    endpoints_to_monitor = {
-        "user": "/users?$select=id,displayName,userPrincipalName,jobTitle,accountEnabled",
-        "group": "/groups?$select=id,displayName,description"
-    }
-
-    full_current_config = {}
+    Check for configuration changes and save snapshot if changes detected.
+
+    Args:
+        resource_names (list): Registry names of the resources to check; defaults to every
+            enabled resource. Resources already being checked by another run are skipped.
+        lease (lease.Lease): The monitor lease this instance runs under, if any. Every write
+            of the check is committed only while it is still held, so an instance that lost
+            it part-way (paused past its expiry, cut off from the database) stores nothing.
+        tenant (tenants.Tenant): The registered tenant to check, with its own credentials and
+            database; None checks the tenant of the graph_* secrets into DATABASE_URL.
+    """
+    with use_tenant(tenant):
+        _check_for_changes(resource_names, lease, tenant)
+
+def _check_for_changes(resource_names, lease, tenant):
+    database = tenant.database if tenant else None
+    label = f" [{tenant.key}]" if tenant else ""
+    names = resource_names or [resource.name for resource in enabled_resources()]
+    resources, locks = [], []
+    for name in names:
+        lock = _resource_lock(name, tenant)
+        if lock.acquire(blocking=False):
+            resources.append(get_resource(name))
+            locks.append(lock)
+        else:
+            logger.info(f"Previous {name} check{label} is still running - skipping")
+    if not resources:
+        return
+
+    # A tenant with its own database is fenced there: the leader holds the same lease in it,
+    # so a replaced leader's writes fail there exactly as in DATABASE_URL
+    fence = lease
+    if lease is not None and database and database != DATABASE_URL:
+        try:
+            fenced = lease.held
+            if fenced:
+                fence = _tenant_fence(lease, database)
+                fenced = fence.held
+        except Exception as e:
+            logger.error(f"Could not reach the monitor lease in the{label} database: {e}")
+            fenced = False
+        if not fenced:
+            logger.warning(f"Not holding the monitor lease{label} - skipping this check")
+            for lock in locks:
+                lock.release()
+            return
+
+    logger.info("="*20 + f" Starting Configuration Check{label} " + "="*20)
+
     all_changes = []
+    change_records = []
 
     conn = None
+    reset_fetch_stats()
+    cycle_started = time.perf_counter()
+    outcome = "error"
     try:
-        # Fetch current configuration for all endpoints
-        for obj_type, endpoint in endpoints_to_monitor.items():
-            logger.info(f"Fetching current state for: {obj_type}s")
-            full_current_config[obj_type] = fetch_all_graph_data(endpoint)
-
         # Connect to database
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
-
-        # Get previous configuration
-        cur = conn.execute("SELECT config FROM snapshots ORDER BY id DESC LIMIT 1")
-        row = cur.fetchone()
-        previous_config_data = json.loads(row["config"]) if row else None
-
-        # --- IMPROVEMENT: Handle old data format gracefully ---
-        is_initial_run = True
-        full_previous_config = {}
-        
-        if previous_config_data:
-            if isinstance(previous_config_data, dict):
-                # This is the expected new format, proceed normally
-                is_initial_run = False
-                full_previous_config = previous_config_data
-                logger.info("Previous configuration found in the correct format.")
-            elif isinstance(previous_config_data, list):
-                # This is the old format. Assume it's a list of users and migrate it.
-                logger.warning("Old data format (list) detected. Migrating to new format for comparison.")
-                is_initial_run = False
-                # We build the new dictionary format from the old list data.
-                # We assume the old format only contained users.
-                full_previous_config = {
-                    "user": previous_config_data,
-                    "group": [] # Assume no groups were tracked in the old format
-                }
-        else:
+        conn = _connect(database)
+
+        is_initial_run = conn.execute("SELECT 1 FROM snapshots LIMIT 1").fetchone() is None
+        if is_initial_run:
             # This is the first run ever.
             logger.info("No previous configuration found. This is the first run.")
+        # Resources never stored before (e.g. newly enabled) start from a baseline, not a diff
+        new_resources = {resource.name for resource in resources
+                         if get_type_fingerprint(conn, resource.name) is None}
 
+        # Stream every resource into the staging tables, in parallel
+        delta_links = _load_delta_links(conn)
+        logger.info(f"Fetching current state for: {', '.join(resource.name for resource in resources)}")
+        stage_started = time.perf_counter()
+        results = fetch_concurrently({
+            resource.name: partial(_sync_resource, resource, delta_links.get(resource.name),
+                                   resource.name in new_resources, fence, database)
+            for resource in resources
+        })
+        new_delta_links = {obj_type: link for obj_type, link in results.items() if link}
+        stage_started = _observe_stage("fetch", stage_started)
 
-        # Determine changes for each object type
+        # Determine changes for each resource, one bounded chunk of staged objects at a time
         if is_initial_run:
             all_changes = ["Initial configuration snapshot"]
             logger.info("Creating initial configuration snapshot")
         else:
-            for obj_type in endpoints_to_monitor.keys():
-                # Use .get() to safely access keys that might not exist in migrated data
-                previous_state = full_previous_config.get(obj_type)
-                current_state = full_current_config.get(obj_type)
-                changes = _compute_diff(previous_state, current_state, obj_type)
-                if changes:
-                    all_changes.extend(changes)
+            for resource in resources:
+                if resource.name in new_resources:
+                    if conn.execute("SELECT 1 FROM sync_staging WHERE object_type = ? LIMIT 1",
+                                    (resource.name,)).fetchone():
+                        all_changes.append(f"Initial {resource.name.replace('_', ' ')} snapshot")
+                    continue
+                rules = DiffRules.for_type(resource.name, DIFF_FIELD_RULES)
+                for previous_objects, current_objects in iter_staged_changes(conn, resource.name):
+                    change_records.extend(
+                        diff_states(previous_objects, current_objects, resource.name, rules, key=resource.key)
+                    )
+            all_changes.extend(render_changes(change_records))
             logger.info(f"Found a total of {len(all_changes)} changes across all types.")
+        stage_started = _observe_stage("diff", stage_started)
 
-        # Save snapshot if there are changes
+        # Save snapshot if there are changes; the explanation is generated in the background
+        snapshot_id = None
+        explain = any(not change.startswith("Initial") for change in all_changes)
         if all_changes:
-            explanation = ""
-            if len(all_changes) > 1 or (len(all_changes) == 1 and not all_changes[0].startswith("Initial")):
-                explanation = get_explanation(all_changes)
-
             timestamp = datetime.now(timezone.utc).isoformat()
-            conn.execute(
-                "INSERT INTO snapshots (timestamp, config, changes, explanation) VALUES (?, ?, ?, ?)",
-                (timestamp, json.dumps(full_current_config), json.dumps(all_changes), explanation)
-            )
-            conn.commit()
+            snapshot_id = insert_snapshot(conn, timestamp, all_changes, None,
+                                          STATUS_PENDING if explain else STATUS_NONE)
+            save_change_records(conn, snapshot_id, change_records)
+            for resource in resources:
+                apply_staged(conn, snapshot_id, resource.name)
+            maybe_checkpoint(conn, snapshot_id)
+            record_event(conn, SNAPSHOT_CREATED, {
+                "id": snapshot_id, "timestamp": timestamp, "change_count": len(all_changes),
+                "explanation_status": STATUS_PENDING if explain else STATUS_NONE,
+            })
             logger.info(f"Saved snapshot at {timestamp} with {len(all_changes)} changes.")
         else:
             logger.info("No changes detected - snapshot not saved.")
+            # Staged versions can still differ in what the diff ignores; keep them, or the
+            # objects would be staged again on every cycle (and a delta walk would lose them)
+            for resource in resources:
+                refreshed = refresh_staged(conn, resource.name)
+                if refreshed:
+                    logger.info(f"Updated {refreshed} {resource.name} versions in place (no reported changes)")
+
+        # Only advance the delta tokens once the state they describe is safely stored
+        for resource in resources:
+            clear_staging(conn, resource.name)
+        _save_delta_links(conn, new_delta_links)
+        _commit(conn, fence)
+        if snapshot_id is not None:
+            broker_for(database).notify()
+        _observe_stage("store", stage_started)
+        _record_cycle_metrics(conn, resources, all_changes if snapshot_id is not None else None, change_records)
+        outcome = "changes" if snapshot_id is not None else "no_changes"
+
+        if snapshot_id is not None and explain:
+            enqueue_explanation(snapshot_id, database or DATABASE_URL)
 
+    except LeaseLost as e:
+        if conn:
+            conn.rollback()
+        logger.warning(f"{e} - another instance took over, discarding this check")
+        outcome = "lease_lost"
     except Exception as e:
         logger.error(f"Error during configuration check: {e}", exc_info=True)
     finally:
         if conn:
             conn.close()
-        logger.info("="*22 + " Configuration Check End " + "="*22 + "\n")
+        for lock in locks:
+            lock.release()
+        _observe_stage("total", cycle_started)
+        CHECK_CYCLES.inc(outcome=outcome)
+        stats = get_fetch_stats()
+        logger.info(
+            f"Graph requests: {stats['requests']}, retries: {stats['retries']} "
+            f"({stats['throttled']} throttled), waited {stats['wait_seconds']}s, "
+            f"resumed walks: {stats['resumed']}, concurrency limit: {stats['concurrency_limit']}"
+        )
+        logger.info("="*22 + f" Configuration Check End{label} " + "="*22 + "\n")
+
 
+def poll_intervals():
+    """Poll interval in minutes of every enabled resource."""
+    return {resource.name: poll_interval(resource) for resource in enabled_resources()}
 
-def start_monitoring():
-    """Starts the monitoring loop."""
-    logger.info("Monitoring service started.")
-    while True:
-        check_for_changes()
-        sleep_seconds = CHECK_INTERVAL_MINUTES * 60
-        logger.info(f"Check complete. Sleeping for {CHECK_INTERVAL_MINUTES} minutes...")
-        time.sleep(sleep_seconds)
+
+def _monitored_tenants():
+    """The tenants to check: the registered ones, or None for the single tenant of the graph_* secrets."""
+    return get_tenants() if is_multi_tenant() else [None]
+
+
+def schedule_resources(scheduler, lease=None, tenants=None):
+    """
+    Add one interval job per enabled resource (and tenant) to an APScheduler scheduler, each on
+    its own poll interval. A resource never runs twice at once: max_instances=1 keeps the
+    scheduler from starting a second run, and missed runs are coalesced into one.
+
+    With several tenants, the first runs of a resource's jobs are spread evenly over its
+    interval, so 100 tenants on a 15 minute interval start one every 9 seconds instead of all
+    at once; the scheduler's thread pool (MONITOR_MAX_CONCURRENT_CHECKS) caps how many checks
+    run at the same time.
+
+    Args:
+        scheduler: The APScheduler scheduler.
+        lease (lease.Lease): Passed on to check_for_changes.
+        tenants (list): The tenants.Tenant to check; None checks the single tenant of the
+            graph_* secrets.
+
+    Returns:
+        dict: Resource name -> poll interval in minutes.
+    """
+    intervals = poll_intervals()
+    tenants = tenants or [None]
+    now = datetime.now(timezone.utc)
+    for name, minutes in intervals.items():
+        for i, tenant in enumerate(tenants):
+            if tenant is None:
+                job_id, kwargs, start_date = f"check_{name}", {'lease': lease}, None
+            else:
+                job_id, kwargs = f"check_{tenant.key}_{name}", {'lease': lease, 'tenant': tenant}
+                start_date = now + timedelta(minutes=minutes * (i + 1) / len(tenants))
+            scheduler.add_job(
+                func=check_for_changes,
+                args=[[name]],
+                kwargs=kwargs,
+                trigger='interval',
+                minutes=minutes,
+                start_date=start_date,
+                id=job_id,
+                name=f"Check Entra ID {name.replace('_', ' ')}s" + (f" of {tenant.key}" if tenant else ""),
+                max_instances=1,
+                coalesce=True,
+                replace_existing=True
+            )
+    return intervals
+
+
+def _on_job_error(event):
+    logger.error(f"Scheduled job {event.job_id} failed: {event.exception}")
+
+def _on_job_executed(event):
+    logger.info(f"Scheduled job {event.job_id} completed successfully")
+
+
+def start_monitoring(lease=None, stop=None):
+    """
+    Run the monitor until stop is set: every enabled resource on its own poll interval, the
+    explanation worker and the compaction job.
+
+    With a lease, several instances can run against the same database and only the one
+    holding it polls Graph. Every instance tries to acquire (or, as leader, renew) it every
+    MONITOR_LEASE_RENEW_SECONDS. The leader starts with a full check and the explanations
+    left pending; one that loses the lease pauses its jobs until it gets it back. On stop
+    the lease is released, so a standby takes over at its next attempt.
+
+    Args:
+        lease (lease.Lease): The monitor lease; None runs unconditionally (a single instance).
+        stop (threading.Event): Set to stop; runs until the process exits by default.
+    """
+    stop = stop or threading.Event()
+    tenants = _monitored_tenants()
+    scheduler = BackgroundScheduler(
+        daemon=True, executors={'default': ThreadPoolExecutor(MONITOR_MAX_CONCURRENT_CHECKS)}
+    )
+    scheduler.add_listener(_on_job_error, EVENT_JOB_ERROR)
+    scheduler.add_listener(_on_job_executed, EVENT_JOB_EXECUTED)
+    intervals = schedule_resources(scheduler, lease, tenants)
+    # Retention and payload compression (COMPACTION_INTERVAL_HOURS=0 disables it)
+    if COMPACTION_INTERVAL_HOURS > 0:
+        for tenant in tenants:
+            scheduler.add_job(run_compaction, 'interval', hours=COMPACTION_INTERVAL_HOURS,
+                              args=[tenant.database if tenant else None],
+                              id=f"compact_history_{tenant.key}" if tenant else 'compact_history',
+                              max_instances=1, coalesce=True)
+    scheduler.start(paused=True)
+    logger.info(f"Monitoring service started ({', '.join(f'{name}: {minutes}m' for name, minutes in intervals.items())}"
+                + (f", {len(tenants)} tenants)" if tenants != [None] else ")"))
+
+    leading = False
+    try:
+        while not stop.is_set():
+            try:
+                held = lease is None or lease.acquire()
+            except Exception as e:
+                logger.error(f"Could not reach the monitor lease: {e}")
+                held = False
+            MONITOR_LEADER.set(1 if held else 0)
+            if held and not leading:
+                logger.info("Leading: starting the checks")
+                for tenant in tenants:
+                    explanations.recover(tenant.database if tenant else DATABASE_URL)
+                    scheduler.add_job(check_for_changes, kwargs={'lease': lease, 'tenant': tenant},
+                                      id=f"initial_check_{tenant.key}" if tenant else 'initial_check',
+                                      replace_existing=True)
+                scheduler.resume()
+                leading = True
+            elif held:
+                _renew_tenant_fences()
+            elif leading:
+                logger.warning("No longer leading: pausing the checks")
+                scheduler.pause()
+                _release_tenant_fences()
+                leading = False
+            stop.wait(MONITOR_LEASE_RENEW_SECONDS)
+    finally:
+        scheduler.shutdown(wait=False)
+        _release_tenant_fences()
+        if lease is not None and lease.held:
+            lease.release()
+        logger.info("Monitoring service stopped.")
 
 if __name__ == '__main__':
     start_monitoring()
@@ -4,59 +4,68 @@ This module is updated for openai library version >= 1.0.0.
 """
 
 import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
 from typing import List
 # --- FIX: Changed 'InvalidRequestError' to 'BadRequestError' ---
-from openai import OpenAI, RateLimitError, AuthenticationError, BadRequestError
-from config import OPENAI_API_KEY, OPENAI_MODEL
+from openai import (
+    OpenAI, RateLimitError, AuthenticationError, BadRequestError, APIConnectionError, APITimeoutError,
+    InternalServerError
+)
+from config import (
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_BASE_URL, OPENAI_TIMEOUT, OPENAI_MAX_CONCURRENT_REQUESTS,
+    EXPLANATION_CHUNK_TOKENS
+)
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Initialize the client
+# The client is created by the first explanation (get_client), not at import: the API
+# process never needs it
 client = None
-if OPENAI_API_KEY:
-    try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-    except Exception as e:
-        logger.error(f"Failed to initialize OpenAI client: {e}")
-else:
-    logger.warning("OPENAI_API_KEY is not set. AI explanations will be disabled.")
+_client_initialized = False
+_client_lock = threading.Lock()
 
 
-def get_explanation(changes: List[str]) -> str:
-    """
-    Generate an AI-powered explanation for configuration changes using the modern OpenAI client.
-    """
-    if not client:
-        return """
+def get_client():
+    """The OpenAI client, created on first use; None when OpenAI is not configured."""
+    global client, _client_initialized
+    if client is None and not _client_initialized:
+        with _client_lock:
+            if client is None and not _client_initialized:
+                if OPENAI_API_KEY:
+                    try:
+                        # Retries are handled by the explanation worker, which knows about the whole queue
+                        client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, timeout=OPENAI_TIMEOUT,
+                                        max_retries=0)
+                    except Exception as e:
+                        logger.error(f"Failed to initialize OpenAI client: {e}")
+                else:
+                    logger.warning("OPENAI_API_KEY is not set. AI explanations will be disabled.")
+                _client_initialized = True
+    return client
+
+
+# Bump whenever the prompt changes, so cached explanations from the old prompt are not reused
+PROMPT_VERSION = "2"
+
+# Errors worth retrying later: throttling, timeouts, connection problems and 5xx responses
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+NOT_CONFIGURED_HTML = """
         <div class="alert alert-secondary">
             <h4>AI Service Not Configured</h4>
             <p>The OpenAI API key is not configured. AI-powered explanations are currently disabled.</p>
         </div>
         """
 
-    if not changes:
-        logger.debug("No changes to explain")
-        return ""
-    
-    # Limit the number of changes to prevent token overflow
-    if len(changes) > 50:
-        logger.warning(f"Too many changes ({len(changes)}), truncating to 50")
-        original_count = len(changes)
-        changes = changes[:50]
-        changes.append(f"... and {original_count - 50} more changes")
-    
-    changes_text = "\n".join(f"- {change}" for change in changes)
-    
-    system_prompt = """You are a Microsoft Entra ID (Azure AD) security expert. 
+SYSTEM_PROMPT = """You are a Microsoft Entra ID (Azure AD) security expert. 
     Format all responses in clean, semantic HTML without any markdown.
     Be concise but thorough in your analysis."""
-    
-    user_prompt = f"""Analyze these Microsoft Entra ID configuration changes:
-
-{changes_text}
 
-Provide your analysis in HTML format with these exact sections:
+REPORT_FORMAT = """Provide your analysis in HTML format with these exact sections:
 
 <h3>Summary</h3>
 <p>Brief overview of what changed (1-2 sentences)</p>
@@ -85,53 +94,297 @@ Provide your analysis in HTML format with these exact sections:
 
 Keep the total response under 500 words. Focus on actionable insights."""
 
-    try:
-        logger.info(f"Requesting GPT explanation for {len(changes)} changes")
-        
-        response = client.chat.completions.create(
+SUMMARY_MAX_TOKENS = 400
+REPORT_MAX_TOKENS = 1000
+
+# Rendered change lines start with "<Object type> added|removed|modified: "
+_CHANGE_LINE = re.compile(r"^(?P<label>[A-Z][\w ]*?) (?P<kind>added|removed|modified): ")
+
+# Caps the OpenAI requests in flight across every explanation being generated
+_request_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENT_REQUESTS)
+
+
+@dataclass
+class TokenUsage:
+    """Requests made and tokens spent generating one explanation (or in total)."""
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other):
+        self.requests += other.requests
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+
+    def to_dict(self):
+        return {**asdict(self), "total_tokens": self.total_tokens}
+
+
+_usage_totals = TokenUsage()
+_usage_lock = threading.Lock()
+
+def usage_stats():
+    """Requests and tokens used by this process so far."""
+    with _usage_lock:
+        return _usage_totals.to_dict()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of English text (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _complete(messages, max_tokens: int, usage: TokenUsage) -> str:
+    """One chat completion, counted against the concurrency cap and the token accounting."""
+    with _request_slots:
+        response = get_client().chat.completions.create(
             model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=1000,
+            messages=messages,
+            max_tokens=max_tokens,
             temperature=0.3,
             presence_penalty=0.1,
             frequency_penalty=0.1
         )
-        
-        explanation = response.choices[0].message.content.strip()
-        
-        if not explanation.startswith('<'):
-            explanation = f"<p>{explanation}</p>"
-        
-        usage = response.usage
-        if usage:
-            logger.info(f"GPT response received. Tokens used: {usage.total_tokens}")
-        
-        return explanation
-        
-    except RateLimitError as e:
+    used = TokenUsage(requests=1)
+    if response.usage:
+        used.prompt_tokens = response.usage.prompt_tokens
+        used.completion_tokens = response.usage.completion_tokens
+    with _usage_lock:
+        usage.add(used)
+        _usage_totals.add(used)
+    return response.choices[0].message.content.strip()
+
+
+def _build_messages(changes: List[str]):
+    """Chat messages asking for an HTML analysis of the given changes."""
+    changes_text = "\n".join(f"- {change}" for change in changes)
+    user_prompt = f"""Analyze these Microsoft Entra ID configuration changes:
+
+{changes_text}
+
+{REPORT_FORMAT}"""
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def group_changes(changes: List[str]):
+    """
+    Group change lines by object type and change kind, in order of first appearance.
+
+    Returns:
+        dict: "<Object type> <kind>" (e.g. "User removed") -> change lines. Lines that do not
+        follow the usual format are grouped under "Other".
+    """
+    groups = {}
+    for change in changes:
+        match = _CHANGE_LINE.match(change)
+        group = f"{match['label']} {match['kind']}" if match else "Other"
+        groups.setdefault(group, []).append(change)
+    return groups
+
+
+def chunk_changes(changes: List[str], token_budget: int):
+    """
+    Split the change set into chunks of one group (see group_changes) each, every chunk
+    within `token_budget` prompt tokens. A single line larger than the budget gets its own chunk.
+
+    Returns:
+        list: (group, change lines) tuples.
+    """
+    chunks = []
+    for group, lines in group_changes(changes).items():
+        current, current_tokens = [], 0
+        for line in lines:
+            tokens = estimate_tokens(line) + 1
+            if current and current_tokens + tokens > token_budget:
+                chunks.append((group, current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += tokens
+        chunks.append((group, current))
+    return chunks
+
+
+def _pack(texts: List[str], token_budget: int):
+    """Pack texts into consecutive batches of at most `token_budget` tokens (at least one text each)."""
+    batches, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and current_tokens + tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _summarize_chunk(group: str, lines: List[str], part: int, parts: int, usage: TokenUsage) -> str:
+    """Map step: a plain-text summary of one chunk of same-type, same-kind changes."""
+    changes_text = "\n".join(f"- {line}" for line in lines)
+    user_prompt = f"""These are {len(lines)} Microsoft Entra ID changes of type "{group}" (part {part} of {parts} of this type):
+
+{changes_text}
+
+Summarize them in at most 8 plain-text bullet points for a security report. Name the most
+sensitive objects explicitly (administrators, privileged groups, policies, applications),
+describe patterns instead of listing every object, and keep exact counts."""
+    summary = _complete(
+        [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user_prompt}],
+        SUMMARY_MAX_TOKENS, usage
+    )
+    return f"{group} ({len(lines)} changes):\n{summary}"
+
+
+def _merge_summaries(summaries: List[str], usage: TokenUsage) -> str:
+    """Intermediate reduce step: condense several partial summaries into one."""
+    user_prompt = "Merge these partial summaries of Microsoft Entra ID changes into one plain-text summary " \
+                  "of at most 12 bullet points. Keep exact counts and the most sensitive objects.\n\n" + \
+                  "\n\n".join(summaries)
+    return _complete(
+        [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user_prompt}],
+        SUMMARY_MAX_TOKENS, usage
+    )
+
+
+def _map_reduce_explanation(changes: List[str], usage: TokenUsage, partials: dict) -> str:
+    """
+    Explain a change set too large for one prompt: summarize every chunk in parallel (map),
+    condense the summaries until they fit one prompt, then write the report from them (reduce).
+    """
+    chunks = chunk_changes(changes, EXPLANATION_CHUNK_TOKENS)
+    groups = group_changes(changes)
+    logger.info(f"Explaining {len(changes)} changes in {len(chunks)} chunks ({len(groups)} groups)")
+
+    parts = {group: sum(1 for chunk_group, _ in chunks if chunk_group == group) for group in groups}
+    with ThreadPoolExecutor(max_workers=OPENAI_MAX_CONCURRENT_REQUESTS) as pool:
+        futures, part = {}, {group: 0 for group in groups}
+        for index, (group, lines) in enumerate(chunks):
+            part[group] += 1
+            if index not in partials:
+                futures[index] = pool.submit(_summarize_chunk, group, lines, part[group], parts[group], usage)
+        error = None
+        for index, future in futures.items():
+            try:
+                # Kept by the caller across retries, so a failed chunk does not redo the others
+                partials[index] = future.result()
+            except Exception as e:
+                error = error or e
+    if error:
+        raise error
+
+    summaries = [partials[index] for index in range(len(chunks))]
+    while len(summaries) > 1 and sum(estimate_tokens(text) for text in summaries) > EXPLANATION_CHUNK_TOKENS:
+        batches = _pack(summaries, EXPLANATION_CHUNK_TOKENS)
+        if len(batches) == len(summaries):
+            break
+        with ThreadPoolExecutor(max_workers=OPENAI_MAX_CONCURRENT_REQUESTS) as pool:
+            summaries = list(pool.map(
+                lambda batch: batch[0] if len(batch) == 1 else _merge_summaries(batch, usage), batches
+            ))
+
+    overview = "\n".join(f"- {group}: {len(lines)}" for group, lines in groups.items())
+    summaries_text = "\n\n".join(summaries)
+    user_prompt = f"""Analyze this bulk Microsoft Entra ID change event ({len(changes)} changes).
+
+Number of changes by object type and kind:
+{overview}
+
+Summaries of all the changes:
+
+{summaries_text}
+
+{REPORT_FORMAT}"""
+    return _complete(
+        [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user_prompt}],
+        REPORT_MAX_TOKENS, usage
+    )
+
+
+def generate_explanation(changes: List[str], usage: TokenUsage = None, partials: dict = None) -> str:
+    """
+    Request an explanation for configuration changes from the OpenAI API.
+
+    Change sets that fit EXPLANATION_CHUNK_TOKENS are explained in one request. Larger ones
+    are split by object type and change kind, summarized chunk by chunk and merged into one
+    report, so every change is taken into account.
+
+    Unlike get_explanation, API errors are raised (see RETRYABLE_ERRORS) so the caller can
+    decide whether to retry.
+
+    Args:
+        changes (list): Rendered change lines.
+        usage (TokenUsage): Optional accumulator for the requests and tokens spent.
+        partials (dict): Optional chunk summaries from a previous failed attempt of the same
+            change set; filled in as chunks are summarized.
+
+    Returns:
+        str: HTML explanation ("" when there is nothing to explain).
+    """
+    if not get_client():
+        return NOT_CONFIGURED_HTML
+
+    if not changes:
+        logger.debug("No changes to explain")
+        return ""
+
+    usage = usage if usage is not None else TokenUsage()
+    partials = partials if partials is not None else {}
+    changes = list(changes)
+    if sum(estimate_tokens(change) + 1 for change in changes) <= EXPLANATION_CHUNK_TOKENS:
+        logger.info(f"Requesting GPT explanation for {len(changes)} changes")
+        explanation = _complete(_build_messages(changes), REPORT_MAX_TOKENS, usage)
+    else:
+        explanation = _map_reduce_explanation(changes, usage, partials)
+
+    if not explanation.startswith('<'):
+        explanation = f"<p>{explanation}</p>"
+
+    logger.info(f"GPT explanation received. Requests: {usage.requests}, tokens used: {usage.total_tokens}")
+    return explanation
+
+
+def error_explanation(e: Exception) -> str:
+    """HTML shown in place of an explanation that could not be generated."""
+    if isinstance(e, RateLimitError):
         logger.error(f"OpenAI rate limit exceeded: {e}")
         return """
         <div class="alert alert-warning"><h4>Rate Limit Exceeded</h4><p>The AI service is temporarily unavailable due to rate limits.</p></div>
         """
         
-    except AuthenticationError as e:
+    if isinstance(e, AuthenticationError):
         logger.error(f"OpenAI authentication failed: {e}")
         return """
         <div class="alert alert-danger"><h4>Authentication Error</h4><p>Unable to authenticate with the AI service. Please check your API key.</p></div>
         """
         
     # --- FIX: Changed 'InvalidRequestError' to 'BadRequestError' ---
-    except BadRequestError as e:
+    if isinstance(e, BadRequestError):
         logger.error(f"Invalid OpenAI request: {e}")
         return f"""
         <div class="alert alert-danger"><h4>Configuration Error</h4><p>The AI model '{OPENAI_MODEL}' may not be available. Error: {str(e)}</p></div>
         """
         
-    except Exception as e:
-        logger.error(f"Unexpected error in GPT explanation: {e}", exc_info=True)
-        return f"""
+    logger.error(f"Unexpected error in GPT explanation: {e}", exc_info=True)
+    return f"""
         <div class="alert alert-danger"><h4>Error Generating Explanation</h4><p>An unexpected error occurred.</p><details><summary>Details</summary><pre>{str(e)}</pre></details></div>
         """
+
+
+def get_explanation(changes: List[str]) -> str:
+    """
+    Generate an AI-powered explanation for configuration changes using the modern OpenAI client.
+    Errors are returned as an HTML alert instead of being raised.
+    """
+    try:
+        return generate_explanation(changes)
+    except Exception as e:
+        return error_explanation(e)
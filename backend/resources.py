@@ -0,0 +1,117 @@
+"""
+Registry of the Entra ID resources the monitor tracks.
+
+Each resource describes where its objects come from (endpoint and $select), how an object
+is identified across polls (identity key), whether Graph offers a delta query for it, and
+how often it is polled. The monitor and the scheduler are driven entirely by this registry,
+so covering a new resource only needs a new entry here.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
+
+from config import CHECK_INTERVAL_MINUTES, MONITORED_RESOURCES, RESOURCE_POLL_INTERVALS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Resource:
+    """A monitored resource type."""
+    name: str                                  # object type stored with every version ("user")
+    endpoint: str                              # collection endpoint including $select
+    key: Union[str, Tuple[str, ...]] = "id"    # identity key, see diff_engine.object_key
+    delta: bool = False                        # Graph supports /delta for this collection
+    expand: Optional[str] = None               # per-object child collection merged into the object
+    interval_minutes: Optional[int] = None     # default poll interval, at most CHECK_INTERVAL_MINUTES
+
+    @property
+    def expand_field(self):
+        """Field the expanded child collection is stored under ("members")."""
+        return self.expand.partition('?')[0] if self.expand else None
+
+
+# Conditional access policies and directory role assignments grant or guard privileged access
+# and are small collections, so they are polled more often by default
+HIGH_VALUE_INTERVAL_MINUTES = 2
+
+RESOURCES = {resource.name: resource for resource in (
+    Resource(
+        name="user",
+        endpoint="/users?$select=id,displayName,userPrincipalName,jobTitle,accountEnabled",
+        delta=True,
+    ),
+    Resource(
+        name="group",
+        endpoint="/groups?$select=id,displayName,description",
+        delta=True,
+    ),
+    Resource(
+        name="conditional_access_policy",
+        endpoint="/identity/conditionalAccess/policies"
+                 "?$select=id,displayName,state,conditions,grantControls,sessionControls",
+        interval_minutes=HIGH_VALUE_INTERVAL_MINUTES,
+    ),
+    Resource(
+        name="application",
+        endpoint="/applications?$select=id,appId,displayName,signInAudience,requiredResourceAccess,"
+                 "passwordCredentials,keyCredentials",
+        delta=True,
+    ),
+    Resource(
+        name="service_principal",
+        endpoint="/servicePrincipals?$select=id,appId,displayName,accountEnabled,servicePrincipalType,"
+                 "appRoleAssignmentRequired",
+        delta=True,
+    ),
+    Resource(
+        # The same principal holding the same role at the same scope is the same assignment,
+        # even if it was removed and re-created under a new id
+        name="directory_role_assignment",
+        endpoint="/roleManagement/directory/roleAssignments?$select=id,principalId,roleDefinitionId,directoryScopeId",
+        key=("principalId", "roleDefinitionId", "directoryScopeId"),
+        interval_minutes=HIGH_VALUE_INTERVAL_MINUTES,
+    ),
+    Resource(
+        # One object per group holding its member list, so membership changes diff as
+        # "members[id=...]" additions and removals
+        name="group_membership",
+        endpoint="/groups?$select=id,displayName",
+        expand="members?$select=id,displayName",
+    ),
+)}
+
+# Monitored when MONITORED_RESOURCES is empty: the resources tracked before the registry existed,
+# readable with the permissions existing deployments already granted. The others are opt-in.
+DEFAULT_RESOURCES = ("user", "group")
+
+
+def get_resource(name: str):
+    """Look up a registered resource by name (KeyError if unknown)."""
+    return RESOURCES[name]
+
+def enabled_resources():
+    """
+    The resources to monitor: those listed in MONITORED_RESOURCES, every registered resource
+    for "all", or DEFAULT_RESOURCES when the setting is empty. Unknown names are logged and
+    ignored.
+    """
+    if not MONITORED_RESOURCES:
+        return [RESOURCES[name] for name in DEFAULT_RESOURCES]
+    if MONITORED_RESOURCES == ["all"]:
+        return list(RESOURCES.values())
+    unknown = [name for name in MONITORED_RESOURCES if name not in RESOURCES]
+    if unknown:
+        logger.warning(f"Ignoring unknown resources in MONITORED_RESOURCES: {', '.join(unknown)}")
+    return [RESOURCES[name] for name in MONITORED_RESOURCES if name in RESOURCES]
+
+def poll_interval(resource: Resource):
+    """
+    Poll interval of a resource in minutes: RESOURCE_POLL_INTERVALS, then its default when
+    shorter than CHECK_INTERVAL_MINUTES, then CHECK_INTERVAL_MINUTES.
+    """
+    configured = RESOURCE_POLL_INTERVALS.get(resource.name)
+    if configured:
+        return int(configured)
+    return min(resource.interval_minutes or CHECK_INTERVAL_MINUTES, CHECK_INTERVAL_MINUTES)
@@ -0,0 +1,240 @@
+"""
+Full-text search over directory objects and change events, for the /api/search endpoint.
+
+Two things are searchable:
+- Objects: every name and UPN an object ever had. object_names holds one row per distinct
+  (object, display name, UPN), written by storage.write_state / apply_staged together with
+  the object versions, so renamed and deleted objects are found under their old names too.
+- Change events: object id and name, the changed attribute path, and the old and new values.
+
+On SQLite both are FTS5 indexes with external content (the text is not stored twice), kept
+up to date by triggers on the indexed tables: every saved snapshot is indexed in the same
+transaction, and rows deleted by compaction leave the index with them. On PostgreSQL the
+same columns are covered by GIN indexes over a tsvector expression.
+
+Results are returned newest first with keyset pagination on the row id, which both index
+types can serve without ranking every match.
+"""
+
+import json
+import logging
+import re
+
+from storage import decode, object_search_names, record_object_names
+from storage_backend import dialect
+
+logger = logging.getLogger(__name__)
+
+MAX_PAGE_SIZE = 200
+MAX_TERMS = 10
+SCOPES = ("objects", "changes")
+
+# Words as both index types tokenize them: runs of letters and digits
+_WORD = re.compile(r"[^\W_]+")
+
+# PostgreSQL: the indexed text, split into words the same way as FTS5's unicode61 tokenizer
+_PG_CHANGE_TEXT = (
+    "to_tsvector('simple', regexp_replace(object_id || ' ' || coalesce(name, '') || ' ' || path || ' ' "
+    "|| coalesce(old_value, '') || ' ' || coalesce(new_value, ''), '[^[:alnum:]]+', ' ', 'g'))"
+)
+_PG_OBJECT_TEXT = (
+    "to_tsvector('simple', regexp_replace(object_id || ' ' || name || ' ' || upn, '[^[:alnum:]]+', ' ', 'g'))"
+)
+
+_FTS_TABLES = {
+    # FTS table: (content table, indexed columns)
+    "search_changes": ("change_events", ("object_type", "object_id", "name", "path", "old_value", "new_value")),
+    "search_objects": ("object_names", ("object_type", "object_id", "name", "upn")),
+}
+
+
+def _create_fts_index(conn, table: str):
+    """An FTS5 index over a content table, with the triggers that keep it in sync."""
+    content, columns = _FTS_TABLES[table]
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    # object_type is only filtered on, never searched; prefix indexes keep short prefixes fast
+    conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+        f"object_type UNINDEXED, {', '.join(columns[1:])}, "
+        f"content='{content}', content_rowid='id', prefix='2 3')"
+    )
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {table} ({table}, rowid, {names}) VALUES ('delete', old.id, {old_values});"
+    insert = f"INSERT INTO {table} (rowid, {names}) VALUES (new.id, {new_values});"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON {content} BEGIN {insert} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON {content} BEGIN {delete} END")
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF {names} ON {content} "
+        f"BEGIN {delete} {insert} END"
+    )
+    if not exists:
+        # Index the rows written before the index existed
+        conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+
+
+def _backfill_object_names(conn):
+    """Names of the object versions stored before object_names existed."""
+    last_id, total = 0, 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, object_type, object_id, valid_from_snapshot, payload FROM object_versions "
+            "WHERE id > ? ORDER BY id LIMIT 1000", (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for _, object_type, object_id, valid_from, payload in rows:
+            record_object_names(conn, valid_from, object_type, [(object_id, json.loads(decode(conn, payload)))])
+        total += len(rows)
+    if total:
+        logger.info(f"Indexed the names of {total} stored object versions for search")
+
+
+def create_search_schema(conn):
+    """Create the search tables and indexes. Safe to call repeatedly; the caller commits."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS object_names (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            object_type TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            upn TEXT NOT NULL,
+            first_snapshot INTEGER NOT NULL,
+            UNIQUE (object_type, object_id, name, upn)
+        )
+    """)
+    empty = conn.execute("SELECT 1 FROM object_names LIMIT 1").fetchone() is None
+    if dialect(conn) == "postgres":
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_change_events_search ON change_events USING GIN ({_PG_CHANGE_TEXT})")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_object_names_search ON object_names USING GIN ({_PG_OBJECT_TEXT})")
+    else:
+        for table in _FTS_TABLES:
+            _create_fts_index(conn, table)
+    if empty:
+        _backfill_object_names(conn)
+
+
+def _terms(query: str):
+    terms = _WORD.findall((query or "").lower())
+    if not terms:
+        raise ValueError("q must contain at least one letter or digit")
+    return terms[:MAX_TERMS]
+
+
+def _match(conn, terms):
+    """Match expression for the search terms: every term, as a word prefix."""
+    if dialect(conn) == "postgres":
+        return " & ".join(f"{term}:*" for term in terms)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _search_changes(conn, terms, object_type: str, upper: int, limit: int):
+    order = "e.id"
+    if dialect(conn) == "postgres":
+        sql = (
+            "SELECT e.id, e.snapshot_id, s.timestamp, e.object_type, e.object_id, e.name, e.path, e.op, e.kind, "
+            "e.old_value, e.new_value FROM change_events e LEFT JOIN snapshots s ON s.id = e.snapshot_id "
+            f"WHERE {_PG_CHANGE_TEXT} @@ to_tsquery('simple', ?) AND e.id <= ?"
+        )
+    else:
+        sql = (
+            "SELECT e.id, e.snapshot_id, s.timestamp, e.object_type, e.object_id, e.name, e.path, e.op, e.kind, "
+            "e.old_value, e.new_value FROM search_changes f JOIN change_events e ON e.id = f.rowid "
+            "LEFT JOIN snapshots s ON s.id = e.snapshot_id "
+            "WHERE search_changes MATCH ? AND f.rowid <= ?"
+        )
+        # Rowid order comes straight from the FTS index, without sorting the matches
+        order = "f.rowid"
+    params = [_match(conn, terms), upper]
+    if object_type is not None:
+        sql += " AND e.object_type = ?"
+        params.append(object_type)
+    rows = conn.execute(sql + f" ORDER BY {order} DESC LIMIT ?", (*params, limit + 1)).fetchall()
+    items = [
+        {
+            "id": row[0], "snapshot_id": row[1], "timestamp": row[2], "object_type": row[3], "object_id": row[4],
+            "name": row[5], "path": row[6], "op": row[7], "kind": row[8],
+            "old": json.loads(row[9]) if row[9] is not None else None,
+            "new": json.loads(row[10]) if row[10] is not None else None,
+        }
+        for row in rows[:limit]
+    ]
+    return items, (str(items[-1]["id"]) if len(rows) > limit else None)
+
+
+def _search_objects(conn, terms, object_type: str, upper: int, limit: int):
+    order = "n.id"
+    if dialect(conn) == "postgres":
+        sql = (
+            "SELECT n.id, n.object_type, n.object_id, n.name, n.upn, n.first_snapshot FROM object_names n "
+            f"WHERE {_PG_OBJECT_TEXT} @@ to_tsquery('simple', ?) AND n.id <= ?"
+        )
+    else:
+        sql = (
+            "SELECT n.id, n.object_type, n.object_id, n.name, n.upn, n.first_snapshot "
+            "FROM search_objects f JOIN object_names n ON n.id = f.rowid "
+            "WHERE search_objects MATCH ? AND f.rowid <= ?"
+        )
+        order = "f.rowid"
+    params = [_match(conn, terms), upper]
+    if object_type is not None:
+        sql += " AND n.object_type = ?"
+        params.append(object_type)
+    rows = conn.execute(sql + f" ORDER BY {order} DESC LIMIT ?", (*params, limit + 1)).fetchall()
+    items = []
+    for row in rows[:limit]:
+        current = conn.execute(
+            "SELECT payload FROM object_versions WHERE object_type = ? AND object_id = ? AND valid_to_snapshot IS NULL",
+            (row[1], row[2])
+        ).fetchone()
+        current_name = object_search_names(json.loads(decode(conn, current[0])))[0] if current else None
+        items.append({
+            "id": row[0], "object_type": row[1], "object_id": row[2], "name": row[3], "upn": row[4] or None,
+            "first_snapshot_id": row[5], "exists": current is not None, "current_name": current_name,
+        })
+    return items, (str(items[-1]["id"]) if len(rows) > limit else None)
+
+
+def search(conn, q: str, scope: str = None, object_type: str = None, cursor=None, limit: int = 20):
+    """
+    Search objects (by any name or UPN they ever had) and change events, newest first.
+
+    Every word of the query must match, as a word prefix ("ali cont" finds
+    alice@contoso.com); punctuation is ignored.
+
+    Args:
+        conn: Open database connection.
+        q (str): Search query.
+        scope (str): "objects" or "changes" for one of the two lists; both by default.
+        object_type (str): Only this object type.
+        cursor: next_cursor of the previous page (requires scope).
+        limit (int): Results per list, at most MAX_PAGE_SIZE.
+
+    Returns:
+        dict: {"objects": {"items", "next_cursor"}, "changes": {"items", "next_cursor"}} (only
+        the requested scope when one is given).
+
+    Raises:
+        ValueError: On an empty query or an invalid scope, cursor or limit.
+    """
+    terms = _terms(q)
+    limit = int(limit)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if scope is not None and scope not in SCOPES:
+        raise ValueError(f"scope must be one of: {', '.join(SCOPES)}")
+    if cursor is not None and scope is None:
+        raise ValueError("cursor requires scope")
+    try:
+        upper = int(cursor) - 1 if cursor is not None else 2 ** 62
+    except ValueError:
+        raise ValueError("invalid cursor")
+
+    result = {}
+    for name, run in (("objects", _search_objects), ("changes", _search_changes)):
+        if scope in (None, name):
+            items, next_cursor = run(conn, terms, object_type, upper, limit)
+            result[name] = {"items": items, "next_cursor": next_cursor}
+    return result
@@ -0,0 +1,126 @@
+"""
+Server-side diffs between snapshots, for the /api/snapshots/<id>/diff endpoint.
+
+Only the objects whose version changed between the two snapshots are loaded and diffed
+(see storage.load_changed_versions), never the full tenant configurations. Snapshots never
+change once written, so a computed diff is cached per snapshot pair.
+"""
+
+import threading
+from collections import OrderedDict
+
+from config import DIFF_CACHE_SIZE, DIFF_FIELD_RULES
+from diff_engine import DiffRules, diff_states, object_key
+from resources import RESOURCES
+from storage import load_changed_versions
+
+MAX_PAGE_SIZE = 500
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _object_diffs(conn, base_id: int, snapshot_id: int, object_type: str = None):
+    """Every changed object between two snapshots, with its field-level changes."""
+    objects = []
+    changed = load_changed_versions(conn, base_id, snapshot_id, object_type)
+    for obj_type in sorted(changed):
+        old_objects, new_objects = changed[obj_type]
+        key = RESOURCES[obj_type].key if obj_type in RESOURCES else "id"
+        records = diff_states(old_objects, new_objects, obj_type, DiffRules.for_type(obj_type, DIFF_FIELD_RULES), key=key)
+        before = {object_key(obj, key): obj for obj in old_objects}
+        after = {object_key(obj, key): obj for obj in new_objects}
+
+        by_object = OrderedDict()
+        for record in records:
+            entry = by_object.get(record.object_id)
+            if entry is None:
+                entry = by_object[record.object_id] = {
+                    "object_type": obj_type,
+                    "object_id": record.object_id,
+                    "name": record.name,
+                    "kind": record.kind,
+                    "changes": [],
+                    "before": before.get(record.object_id),
+                    "after": after.get(record.object_id),
+                }
+            entry["changes"].append({"path": record.path, "op": record.op, "old": record.old, "new": record.new})
+        objects.extend(by_object.values())
+    return objects
+
+def get_cached_diff(conn, base_id: int, snapshot_id: int, object_type: str = None, scope: str = None):
+    """
+    Changed objects between two snapshots, computed once per (pair, object type) and cached.
+    scope names the database (the tenant) the snapshot ids belong to.
+    """
+    cache_key = (scope, base_id, snapshot_id, object_type)
+    with _cache_lock:
+        if cache_key in _cache:
+            _cache.move_to_end(cache_key)
+            _cache_stats["hits"] += 1
+            return _cache[cache_key]
+        _cache_stats["misses"] += 1
+
+    objects = _object_diffs(conn, base_id, snapshot_id, object_type)
+    with _cache_lock:
+        _cache[cache_key] = objects
+        while len(_cache) > DIFF_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return objects
+
+def clear_diff_cache():
+    """Drop every cached diff (e.g. after snapshots were rewritten by compaction)."""
+    with _cache_lock:
+        _cache.clear()
+
+def diff_cache_stats():
+    with _cache_lock:
+        return {**_cache_stats, "entries": len(_cache)}
+
+def snapshot_diff(conn, snapshot_id: int, object_type: str = None, cursor=None, limit: int = 100,
+                  scope: str = None):
+    """
+    One page of the changed objects of a snapshot, compared with the previous snapshot.
+
+    Args:
+        conn: Open sqlite3 connection.
+        snapshot_id (int): Snapshot to diff.
+        object_type (str): Only objects of this type.
+        cursor: next_cursor of the previous page (None for the first page).
+        limit (int): Objects per page, at most MAX_PAGE_SIZE.
+        scope (str): The tenant the snapshot belongs to (keeps the cache entries of tenants
+            with the same snapshot ids apart).
+
+    Returns:
+        dict: snapshot_id, base_snapshot_id (None for the first snapshot), total, objects
+        (each with object_type, object_id, name, kind, changes, before, after) and
+        next_cursor - or None if the snapshot does not exist.
+
+    Raises:
+        ValueError: On an invalid cursor or limit.
+    """
+    limit = int(limit)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    try:
+        offset = int(cursor) if cursor is not None else 0
+    except ValueError:
+        raise ValueError("invalid cursor")
+
+    if conn.execute("SELECT 1 FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone() is None:
+        return None
+    previous = conn.execute(
+        "SELECT id FROM snapshots WHERE id < ? ORDER BY id DESC LIMIT 1", (snapshot_id,)
+    ).fetchone()
+    base_id = previous[0] if previous else None
+
+    objects = get_cached_diff(conn, base_id or 0, snapshot_id, object_type, scope)
+    page = objects[offset:offset + limit]
+    return {
+        "snapshot_id": snapshot_id,
+        "base_snapshot_id": base_id,
+        "total": len(objects),
+        "objects": page,
+        "next_cursor": str(offset + limit) if offset + limit < len(objects) else None,
+    }
@@ -0,0 +1,906 @@
+"""
+Normalized snapshot storage.
+
+Instead of one JSON blob holding the whole tenant per snapshot, every object version is
+stored once in `object_versions` together with the range of snapshots in which it was
+valid (valid_from_snapshot inclusive, valid_to_snapshot exclusive, NULL while current).
+A snapshot therefore only writes the objects that changed, and the state at any snapshot
+can be rebuilt with a single indexed query.
+"""
+
+import json
+import hashlib
+import logging
+
+from compression import (
+    CODEC_NONE, compress_payload, configured_codec, decode_payload, dictionary_id, payload_dictionary_id,
+    train_dictionary
+)
+from config import STATE_CHECKPOINT_MIN_CHANGES
+from diff_engine import object_key, object_name, CHANGE_KINDS
+from storage_backend import stream
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_json(obj):
+    """Serialize an object deterministically (sorted keys, no whitespace)."""
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def payload_hash(obj):
+    """Stable content hash of a directory object."""
+    return hashlib.sha256(canonical_json(obj).encode('utf-8')).hexdigest()
+
+
+# --- Payload compression ---
+#
+# Object versions are stored compressed (see compression.py) against the newest dictionary
+# trained for the configured codec. Dictionaries are trained by the compaction job and kept
+# in compression_dicts; they are content-addressed, so the in-process cache below is valid
+# for any database.
+
+_dictionaries = {}
+
+def _dictionary(conn, dict_id: bytes):
+    """A compression dictionary by id (cached)."""
+    data = _dictionaries.get(dict_id)
+    if data is None:
+        row = conn.execute("SELECT data FROM compression_dicts WHERE id = ?", (dict_id.hex(),)).fetchone()
+        if row is None:
+            raise LookupError(f"Compression dictionary {dict_id.hex()} is missing")
+        data = _dictionaries[dict_id] = bytes(row[0])
+    return data
+
+def decode(conn, value):
+    """Stored payload (compressed or legacy plain text) -> JSON text."""
+    dict_id = payload_dictionary_id(value)
+    return decode_payload(value, _dictionary(conn, dict_id) if dict_id else None)
+
+def current_dictionary(conn):
+    """
+    The dictionary new payloads are compressed with.
+
+    Returns:
+        tuple: (codec, dictionary bytes or None when none was trained yet)
+    """
+    codec = configured_codec()
+    if codec == CODEC_NONE:
+        return codec, None
+    row = conn.execute(
+        "SELECT id, data FROM compression_dicts WHERE codec = ? ORDER BY created_at DESC, id LIMIT 1", (codec,)
+    ).fetchone()
+    if row is None:
+        return codec, None
+    data = _dictionaries.setdefault(bytes.fromhex(row[0]), bytes(row[1]))
+    return codec, data
+
+def payload_encoder(conn):
+    """A function that encodes JSON text for storage with the current codec and dictionary."""
+    codec, dictionary = current_dictionary(conn)
+    return lambda text: compress_payload(text, codec, dictionary)
+
+def save_dictionary(conn, samples, created_at: str):
+    """
+    Train a dictionary for the configured codec from sample payloads and make it current.
+    The caller commits.
+
+    Returns:
+        bytes: The dictionary, or None if it could not be trained or compression is off.
+    """
+    codec = configured_codec()
+    if codec == CODEC_NONE:
+        return None
+    data = train_dictionary(samples, codec)
+    if not data:
+        return None
+    dict_id = dictionary_id(data)
+    conn.execute("DELETE FROM compression_dicts WHERE id = ?", (dict_id.hex(),))
+    conn.execute(
+        "INSERT INTO compression_dicts (id, codec, data, created_at) VALUES (?, ?, ?, ?)",
+        (dict_id.hex(), codec, data, created_at)
+    )
+    _dictionaries[dict_id] = data
+    return data
+
+
+# --- Content fingerprints ---
+#
+# Every object version carries its payload hash. The hashes of one object type are also
+# combined into an aggregate fingerprint (their sum modulo 2^256). The sum does not depend on
+# order and can be updated in O(1) per added, changed or removed object, so it is kept up to
+# date in type_fingerprints from the staged changes alone. Two states of a type with equal
+# fingerprints and counts are identical, and diffing them can be skipped outright.
+
+_FINGERPRINT_MODULUS = 2 ** 256
+
+def _fingerprint_hex(total: int):
+    return format(total % _FINGERPRINT_MODULUS, '064x')
+
+def aggregate_hash(hashes):
+    """Order-independent aggregate of content hashes."""
+    return _fingerprint_hex(sum(int(digest, 16) for digest in hashes))
+
+class HashIndex(dict):
+    """Object id -> content hash for one object type, plus the aggregate fingerprint of all entries."""
+
+    def __init__(self, entries=(), fingerprint: str = None):
+        super().__init__(entries)
+        self.fingerprint = fingerprint or aggregate_hash(self.values())
+
+def get_type_fingerprint(conn, object_type: str, snapshot_id: int = None):
+    """
+    Aggregate fingerprint of an object type as of a snapshot (latest if None).
+
+    Returns:
+        tuple: (fingerprint, object_count), or None if none was recorded.
+    """
+    row = conn.execute(
+        "SELECT fingerprint, object_count FROM type_fingerprints "
+        "WHERE object_type = ? AND snapshot_id <= ? ORDER BY snapshot_id DESC LIMIT 1",
+        (object_type, snapshot_id if snapshot_id is not None else 2 ** 62)
+    ).fetchone()
+    return (row[0], row[1]) if row else None
+
+def _record_type_fingerprint(conn, snapshot_id: int, object_type: str, fingerprint: str, object_count: int):
+    conn.execute(
+        "INSERT OR REPLACE INTO type_fingerprints (object_type, snapshot_id, fingerprint, object_count) "
+        "VALUES (?, ?, ?, ?)",
+        (object_type, snapshot_id, fingerprint, object_count)
+    )
+
+def _recompute_type_fingerprint(conn, snapshot_id: int, object_type: str):
+    """Full recomputation from the open versions (first snapshot of a type, or older databases)."""
+    total, count = 0, 0
+    for (digest,) in conn.execute(
+        "SELECT payload_hash FROM object_versions WHERE object_type = ? AND valid_to_snapshot IS NULL",
+        (object_type,)
+    ):
+        total += int(digest, 16)
+        count += 1
+    _record_type_fingerprint(conn, snapshot_id, object_type, _fingerprint_hex(total), count)
+
+def load_hashes(conn, object_type: str, snapshot_id: int = None):
+    """
+    Content hashes of every object of a type at a snapshot (latest if None).
+
+    Returns:
+        HashIndex: object id -> payload hash, carrying the stored aggregate fingerprint.
+    """
+    if snapshot_id is None:
+        rows = conn.execute(
+            "SELECT object_id, payload_hash FROM object_versions "
+            "WHERE object_type = ? AND valid_to_snapshot IS NULL",
+            (object_type,)
+        )
+    else:
+        rows = conn.execute(
+            "SELECT object_id, payload_hash FROM object_versions "
+            "WHERE object_type = ? AND valid_from_snapshot <= ? "
+            "AND (valid_to_snapshot IS NULL OR valid_to_snapshot > ?)",
+            (object_type, snapshot_id, snapshot_id)
+        )
+    stored = get_type_fingerprint(conn, object_type, snapshot_id)
+    return HashIndex(((row[0], row[1]) for row in rows), stored[0] if stored else None)
+
+
+def object_search_names(obj: dict):
+    """(display name, UPN) an object is found by in search; the UPN falls back to mail or appId."""
+    return (object_name(obj, "") or "",
+            obj.get("userPrincipalName") or obj.get("mail") or obj.get("appId") or "")
+
+def record_object_names(conn, snapshot_id: int, object_type: str, objects):
+    """
+    Remember the names of newly written object versions for search (see search.py). Each
+    distinct (object, name, UPN) is stored once, with the snapshot it first appeared in.
+
+    Args:
+        objects: (object id, object) pairs.
+    """
+    conn.executemany(
+        "INSERT OR IGNORE INTO object_names (object_type, object_id, name, upn, first_snapshot) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(object_type, object_id, *object_search_names(obj), snapshot_id) for object_id, obj in objects]
+    )
+
+def write_state(conn, snapshot_id: int, state: dict):
+    """
+    Record the given state as valid from snapshot_id onwards.
+
+    Only object types present in `state` are touched: objects whose payload hash changed get
+    their open version closed and a new version inserted, objects that disappeared are closed,
+    and unchanged objects are left alone. The caller commits.
+
+    Args:
+        conn: Open sqlite3 connection.
+        snapshot_id (int): The snapshot the new versions belong to.
+        state (dict): Object type -> list of objects (each with an "id").
+
+    Returns:
+        int: Number of object versions written or closed.
+    """
+    written = 0
+    encode = payload_encoder(conn)
+    for object_type, objects in state.items():
+        open_versions = {
+            row[0]: (row[1], row[2]) for row in conn.execute(
+                "SELECT object_id, id, payload_hash FROM object_versions "
+                "WHERE object_type = ? AND valid_to_snapshot IS NULL",
+                (object_type,)
+            )
+        }
+
+        seen, written_objects = set(), []
+        for obj in objects or []:
+            object_id = obj.get('id')
+            seen.add(object_id)
+            digest = payload_hash(obj)
+            current = open_versions.get(object_id)
+            if current and current[1] == digest:
+                continue
+            if current:
+                conn.execute(
+                    "UPDATE object_versions SET valid_to_snapshot = ? WHERE id = ?",
+                    (snapshot_id, current[0])
+                )
+            conn.execute(
+                "INSERT INTO object_versions "
+                "(object_type, object_id, valid_from_snapshot, valid_to_snapshot, payload_hash, payload) "
+                "VALUES (?, ?, ?, NULL, ?, ?)",
+                (object_type, object_id, snapshot_id, digest, encode(canonical_json(obj)))
+            )
+            written_objects.append((object_id, obj))
+            written += 1
+
+        for object_id, (version_id, _) in open_versions.items():
+            if object_id not in seen:
+                conn.execute(
+                    "UPDATE object_versions SET valid_to_snapshot = ? WHERE id = ?",
+                    (snapshot_id, version_id)
+                )
+                written += 1
+        record_object_names(conn, snapshot_id, object_type, written_objects)
+        _recompute_type_fingerprint(conn, snapshot_id, object_type)
+    return written
+
+def insert_snapshot(conn, timestamp: str, changes: list, explanation: str, explanation_status: str = None):
+    """
+    Insert a snapshot row without any object versions. Returns the new snapshot id.
+
+    explanation_status defaults to 'ready' when an explanation is given and 'none' otherwise;
+    pass 'pending' to have the explanation generated later (see explanation_worker).
+    """
+    if explanation_status is None:
+        explanation_status = "ready" if explanation else "none"
+    cur = conn.execute(
+        "INSERT INTO snapshots (timestamp, changes, explanation, change_count, explanation_status) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (timestamp, json.dumps(changes), explanation, len(changes), explanation_status)
+    )
+    return cur.lastrowid
+
+def save_change_records(conn, snapshot_id: int, records):
+    """Store the diff engine's ChangeRecords of a snapshot. The caller commits."""
+    conn.executemany(
+        "INSERT INTO change_events "
+        "(snapshot_id, object_type, object_id, name, path, op, old_value, new_value, kind) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (snapshot_id, record.object_type, record.object_id, record.name, record.path, record.op,
+             json.dumps(record.old), json.dumps(record.new), record.kind)
+            for record in records
+        ]
+    )
+
+def load_change_records(conn, snapshot_id: int):
+    """Change records of a snapshot as dicts, in the order they were detected."""
+    rows = conn.execute(
+        "SELECT object_type, object_id, name, path, op, old_value, new_value FROM change_events "
+        "WHERE snapshot_id = ? ORDER BY id",
+        (snapshot_id,)
+    ).fetchall()
+    return [
+        {
+            "object_type": row[0], "object_id": row[1], "name": row[2], "path": row[3], "op": row[4],
+            "old": json.loads(row[5]) if row[5] is not None else None,
+            "new": json.loads(row[6]) if row[6] is not None else None,
+        }
+        for row in rows
+    ]
+
+def load_changed_versions(conn, base_id: int, snapshot_id: int, object_type: str = None):
+    """
+    The objects whose version differs between two snapshots, without rebuilding either state.
+
+    A version that changed in (base_id, snapshot_id] either starts or ends inside that range,
+    so both sides come from two index range scans. Intermediate versions (valid only between
+    the two snapshots) are skipped.
+
+    Returns:
+        dict: Object type -> (versions valid at base_id, versions valid at snapshot_id).
+    """
+    sql = (
+        "SELECT object_type, valid_from_snapshot, valid_to_snapshot, payload FROM object_versions "
+        "WHERE ((valid_from_snapshot > ? AND valid_from_snapshot <= ?) "
+        "OR (valid_to_snapshot > ? AND valid_to_snapshot <= ?))"
+    )
+    params = [base_id, snapshot_id, base_id, snapshot_id]
+    if object_type is not None:
+        sql += " AND object_type = ?"
+        params.append(object_type)
+
+    changed = {}
+    for obj_type, valid_from, valid_to, payload in conn.execute(sql + " ORDER BY id", params):
+        old_objects, new_objects = changed.setdefault(obj_type, ([], []))
+        if valid_from <= base_id:
+            old_objects.append(json.loads(decode(conn, payload)))
+        elif valid_to is None or valid_to > snapshot_id:
+            new_objects.append(json.loads(decode(conn, payload)))
+    return changed
+
+
+# --- Snapshot listing ---
+
+MAX_PAGE_SIZE = 500
+
+def _snapshot_id_bound(conn, timestamp: str, lower: bool):
+    """
+    Translate a time bound into a snapshot id bound. Ids grow with timestamps, so a time
+    range is an id range, found with one lookup in the timestamp index.
+    """
+    if lower:
+        row = conn.execute(
+            "SELECT id FROM snapshots WHERE timestamp >= ? ORDER BY timestamp, id LIMIT 1", (timestamp,)
+        ).fetchone()
+    else:
+        row = conn.execute(
+            "SELECT id FROM snapshots WHERE timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 1", (timestamp,)
+        ).fetchone()
+    return row[0] if row else None
+
+def query_snapshots(conn, cursor=None, limit: int = 50, since: str = None, until: str = None,
+                    object_type: str = None, object_id: str = None, kind: str = None):
+    """
+    One page of the snapshot timeline, newest first, using keyset pagination.
+
+    Every page is an index range scan that starts right below the cursor, so fetching page
+    1000 costs the same as page 1. The changes JSON is never read.
+
+    Args:
+        conn: Open sqlite3 connection.
+        cursor: next_cursor of the previous page (None for the first page).
+        limit (int): Page size, at most MAX_PAGE_SIZE.
+        since / until (str): ISO timestamps, inclusive lower / exclusive upper bound.
+        object_type / object_id (str): Only snapshots that changed this type / object.
+        kind (str): Only snapshots with a change of this kind (one of CHANGE_KINDS).
+
+    Returns:
+        dict: {"items": [{"id", "timestamp", "change_count", "explanation_status"}, ...],
+        "next_cursor": str or None}
+
+    Raises:
+        ValueError: On an invalid cursor, limit or kind.
+    """
+    limit = int(limit)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if kind is not None and kind not in CHANGE_KINDS:
+        raise ValueError(f"kind must be one of: {', '.join(CHANGE_KINDS)}")
+    try:
+        upper = int(cursor) - 1 if cursor is not None else 2 ** 62
+    except ValueError:
+        raise ValueError("invalid cursor")
+    lower = 0
+
+    if since:
+        since_id = _snapshot_id_bound(conn, since, lower=True)
+        if since_id is None:
+            return {"items": [], "next_cursor": None}
+        lower = since_id
+    if until:
+        until_id = _snapshot_id_bound(conn, until, lower=False)
+        if until_id is None:
+            return {"items": [], "next_cursor": None}
+        upper = min(upper, until_id)
+
+    conditions, params = [], []
+    for column, value in (("object_type", object_type), ("object_id", object_id), ("kind", kind)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+
+    if conditions:
+        rows = conn.execute(
+            "SELECT id, timestamp, change_count, explanation_status FROM snapshots WHERE id IN ("
+            "  SELECT DISTINCT snapshot_id FROM change_events "
+            f"  WHERE {' AND '.join(conditions)} AND snapshot_id BETWEEN ? AND ? "
+            "  ORDER BY snapshot_id DESC LIMIT ?"
+            ") ORDER BY id DESC",
+            (*params, lower, upper, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, timestamp, change_count, explanation_status FROM snapshots WHERE id BETWEEN ? AND ? "
+            "ORDER BY id DESC LIMIT ?",
+            (lower, upper, limit + 1)
+        ).fetchall()
+
+    items = [
+        {"id": row[0], "timestamp": row[1], "change_count": row[2], "explanation_status": row[3]}
+        for row in rows[:limit]
+    ]
+    next_cursor = str(items[-1]["id"]) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+def save_snapshot(conn, timestamp: str, state: dict, changes: list, explanation: str):
+    """
+    Insert a snapshot row and the object versions that changed in it. The caller commits.
+
+    Returns:
+        int: The new snapshot id.
+    """
+    snapshot_id = insert_snapshot(conn, timestamp, changes, explanation)
+    written = write_state(conn, snapshot_id, state)
+    maybe_checkpoint(conn, snapshot_id)
+    logger.debug(f"Snapshot {snapshot_id}: wrote {written} object versions")
+    return snapshot_id
+
+def load_state(conn, snapshot_id: int = None, object_type: str = None):
+    """
+    Rebuild the full configuration as it was at a snapshot.
+
+    Args:
+        conn: Open sqlite3 connection.
+        snapshot_id (int): Snapshot to rebuild; None means the latest state.
+        object_type (str): Only rebuild this object type.
+
+    Returns:
+        dict: Object type -> list of objects, or None if no snapshot exists.
+    """
+    if snapshot_id is None:
+        row = conn.execute("SELECT MAX(id) FROM snapshots").fetchone()
+        if row[0] is None:
+            return None
+    sql, params = _state_query(conn, snapshot_id, "v.object_type, v.id, v.payload", object_type)
+
+    state = {}
+    for obj_type, _, payload in conn.execute(sql + " ORDER BY 1, 2", params):
+        state.setdefault(obj_type, []).append(json.loads(decode(conn, payload)))
+    return state
+
+def load_object(conn, object_type: str, object_id: str, snapshot_id: int = None):
+    """One object as it was at a snapshot (None if it did not exist), via the per-object index."""
+    sql = ("SELECT valid_to_snapshot, payload FROM object_versions "
+           "WHERE object_type = ? AND object_id = ?")
+    params = [object_type, object_id]
+    if snapshot_id is None:
+        row = conn.execute(sql + " AND valid_to_snapshot IS NULL", params).fetchone()
+    else:
+        row = conn.execute(sql + " AND valid_from_snapshot <= ? ORDER BY valid_from_snapshot DESC LIMIT 1",
+                           (*params, snapshot_id)).fetchone()
+        if row and row[0] is not None and row[0] <= snapshot_id:
+            row = None
+    return json.loads(decode(conn, row[1])) if row else None
+
+
+# --- State checkpoints ---
+#
+# Rebuilding a past state from the version ranges alone scans every version written before
+# that snapshot, which grows with the length of the history. A checkpoint records the ids of
+# the versions valid at one snapshot; a state is then the nearest earlier checkpoint minus
+# the versions closed since, plus the versions opened since. A new checkpoint is written once
+# the versions changed since the previous one reach the number of live objects, so rebuilding
+# any state reads at most about twice the state size, and checkpoints take at most one row
+# per changed version.
+
+def _state_query(conn, snapshot_id: int, columns: str, object_type: str = None):
+    """SQL and parameters selecting `columns` of the versions (aliased v) valid at a snapshot."""
+    type_filter, type_params = (" AND v.object_type = ?", [object_type]) if object_type else ("", [])
+    if snapshot_id is None:
+        return (f"SELECT {columns} FROM object_versions v WHERE v.valid_to_snapshot IS NULL{type_filter}",
+                type_params)
+
+    alive = "(v.valid_to_snapshot IS NULL OR v.valid_to_snapshot > ?)"
+    checkpoint = conn.execute(
+        "SELECT MAX(snapshot_id) FROM state_checkpoints WHERE snapshot_id <= ?", (snapshot_id,)
+    ).fetchone()[0]
+    if checkpoint is None:
+        return (f"SELECT {columns} FROM object_versions v WHERE v.valid_from_snapshot <= ? AND {alive}{type_filter}",
+                [snapshot_id, snapshot_id, *type_params])
+    return (
+        f"SELECT {columns} FROM state_checkpoints c JOIN object_versions v ON v.id = c.version_id "
+        f"WHERE c.snapshot_id = ?{type_filter.replace('v.', 'c.')} AND {alive} "
+        f"UNION ALL SELECT {columns} FROM object_versions v "
+        f"WHERE v.valid_from_snapshot > ? AND v.valid_from_snapshot <= ? AND {alive}{type_filter}",
+        [checkpoint, *type_params, snapshot_id, checkpoint, snapshot_id, snapshot_id, *type_params]
+    )
+
+def write_checkpoint(conn, snapshot_id: int):
+    """Record the versions valid at a snapshot as a checkpoint. The caller commits."""
+    latest = conn.execute("SELECT MAX(id) FROM snapshots").fetchone()[0]
+    sql, params = _state_query(conn, None if snapshot_id == latest else snapshot_id, "v.object_type, v.id")
+    conn.execute(
+        "INSERT OR IGNORE INTO state_checkpoints (snapshot_id, object_type, version_id) "
+        f"SELECT ?, object_type, id FROM ({sql}) AS state",
+        (snapshot_id, *params)
+    )
+
+def _checkpoint_due(changed: int, live: int):
+    return changed >= max(STATE_CHECKPOINT_MIN_CHANGES, live)
+
+def maybe_checkpoint(conn, snapshot_id: int):
+    """
+    Write a checkpoint at the latest snapshot if enough changed since the previous one.
+    The caller commits.
+
+    Returns:
+        bool: True if a checkpoint was written.
+    """
+    last = conn.execute("SELECT MAX(snapshot_id) FROM state_checkpoints").fetchone()[0] or 0
+    changed = (
+        conn.execute("SELECT COUNT(*) FROM object_versions WHERE valid_from_snapshot > ?", (last,)).fetchone()[0]
+        + conn.execute("SELECT COUNT(*) FROM object_versions WHERE valid_to_snapshot > ?", (last,)).fetchone()[0]
+    )
+    if changed < STATE_CHECKPOINT_MIN_CHANGES:
+        return False
+    live = conn.execute("SELECT COUNT(*) FROM object_versions WHERE valid_to_snapshot IS NULL").fetchone()[0]
+    if not _checkpoint_due(changed, live):
+        return False
+    write_checkpoint(conn, snapshot_id)
+    logger.info(f"Wrote a state checkpoint at snapshot {snapshot_id} ({live} objects, {changed} changes since the last)")
+    return True
+
+def backfill_checkpoints(conn):
+    """
+    Add the checkpoints a history written without them (or rewritten by compaction) is
+    missing, oldest first, so each one is built from the previous one. The caller commits.
+
+    Returns:
+        int: Number of checkpoints written.
+    """
+    opened = dict(conn.execute(
+        "SELECT valid_from_snapshot, COUNT(*) FROM object_versions GROUP BY valid_from_snapshot"
+    ).fetchall())
+    closed = dict(conn.execute(
+        "SELECT valid_to_snapshot, COUNT(*) FROM object_versions WHERE valid_to_snapshot IS NOT NULL "
+        "GROUP BY valid_to_snapshot"
+    ).fetchall())
+    existing = {row[0] for row in conn.execute("SELECT DISTINCT snapshot_id FROM state_checkpoints")}
+
+    written, live, changed = 0, 0, 0
+    for (snapshot_id,) in conn.execute("SELECT id FROM snapshots ORDER BY id").fetchall():
+        live += opened.get(snapshot_id, 0) - closed.get(snapshot_id, 0)
+        changed += opened.get(snapshot_id, 0) + closed.get(snapshot_id, 0)
+        if snapshot_id in existing:
+            changed = 0
+        elif _checkpoint_due(changed, live):
+            write_checkpoint(conn, snapshot_id)
+            written += 1
+            changed = 0
+    return written
+
+
+# --- Streaming ingestion ---
+#
+# A sync cycle streams Graph pages into sync_staging (objects that are new or changed
+# compared to the open versions) and sync_seen (ids observed during a full walk). Both live
+# on disk, so memory stays bounded by the page size. Once every object type is staged the
+# cycle diffs the staged rows chunk by chunk and applies them to object_versions in one
+# short transaction.
+
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+_CHUNK_SIZE = 500
+
+def _clean(item: dict):
+    """Drop OData annotations (@odata.type, @removed, ...) from a Graph object."""
+    return {key: value for key, value in item.items() if not key.startswith('@')}
+
+def _open_versions(conn, object_type: str, object_ids: list):
+    """Current (hash, stored payload) of the given objects, from the open-version index (see decode)."""
+    found = {}
+    for start in range(0, len(object_ids), _CHUNK_SIZE):
+        chunk = object_ids[start:start + _CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        for object_id, digest, payload in conn.execute(
+            f"SELECT object_id, payload_hash, payload FROM object_versions "
+            f"WHERE object_type = ? AND valid_to_snapshot IS NULL AND object_id IN ({placeholders})",
+            (object_type, *chunk)
+        ):
+            found[object_id] = (digest, payload)
+    return found
+
+def stage_page(conn, object_type: str, items: list, incremental: bool = False, key="id"):
+    """
+    Stage one Graph page.
+
+    In a full walk every item is the complete object and its id is recorded as seen, so
+    removals can be found once the walk is over. In an incremental (delta) walk items carry
+    only changed properties and are merged over the staged or current version; items with an
+    "@removed" annotation are staged as removals. Objects are identified by `key` (see
+    diff_engine.object_key).
+
+    Returns:
+        tuple: (number of objects on the page that differ from their current version,
+        sum of the page's content hashes - full walks only, see aggregate_hash)
+    """
+    object_ids = [object_key(item, key) for item in items]
+    current = _open_versions(conn, object_type, object_ids)
+
+    staged = {}
+    if incremental:
+        for start in range(0, len(object_ids), _CHUNK_SIZE):
+            chunk = object_ids[start:start + _CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            for object_id, payload in conn.execute(
+                f"SELECT object_id, payload FROM sync_staging "
+                f"WHERE object_type = ? AND op = 'upsert' AND object_id IN ({placeholders})",
+                (object_type, *chunk)
+            ):
+                staged[object_id] = payload
+    else:
+        conn.executemany(
+            "INSERT OR IGNORE INTO sync_seen (object_type, object_id) VALUES (?, ?)",
+            [(object_type, object_id) for object_id in object_ids]
+        )
+
+    upserts, removals, unchanged = [], [], []
+    hash_sum = 0
+    for object_id, item in zip(object_ids, items):
+        if incremental and '@removed' in item:
+            if object_id in current:
+                removals.append((object_type, object_id))
+            else:
+                # Created and deleted within the same window: nothing to record
+                unchanged.append((object_type, object_id))
+            continue
+
+        if incremental:
+            base = staged.get(object_id) or (decode(conn, current[object_id][1]) if object_id in current else None)
+            obj = json.loads(base) if base else {}
+            obj.update(_clean(item))
+        else:
+            obj = _clean(item)
+
+        digest = payload_hash(obj)
+        if not incremental:
+            hash_sum += int(digest, 16)
+        if object_id in current and current[object_id][0] == digest:
+            # Back to (or still at) the current version
+            if incremental:
+                unchanged.append((object_type, object_id))
+            continue
+        upserts.append((object_type, object_id, digest, canonical_json(obj)))
+
+    if unchanged:
+        conn.executemany("DELETE FROM sync_staging WHERE object_type = ? AND object_id = ?", unchanged)
+    conn.executemany(
+        "INSERT OR REPLACE INTO sync_staging (object_type, object_id, op, payload_hash, payload) "
+        "VALUES (?, ?, 'remove', NULL, NULL)",
+        removals
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO sync_staging (object_type, object_id, op, payload_hash, payload) "
+        "VALUES (?, ?, 'upsert', ?, ?)",
+        upserts
+    )
+    return len(upserts) + len(removals), hash_sum
+
+def stage_removals(conn, object_type: str):
+    """After a complete full walk: stage every current object that was not seen as removed."""
+    cur = conn.execute(
+        "INSERT OR REPLACE INTO sync_staging (object_type, object_id, op, payload_hash, payload) "
+        "SELECT v.object_type, v.object_id, 'remove', NULL, NULL FROM object_versions v "
+        "WHERE v.object_type = ? AND v.valid_to_snapshot IS NULL AND NOT EXISTS ("
+        "  SELECT 1 FROM sync_seen s WHERE s.object_type = v.object_type AND s.object_id = v.object_id"
+        ")",
+        (object_type,)
+    )
+    return cur.rowcount
+
+def iter_staged_changes(conn, object_type: str):
+    """
+    Yield the staged changes of an object type in bounded chunks.
+
+    Yields:
+        tuple: (current versions of the chunk's objects, new versions of the chunk's objects),
+        both lists of objects, ready for a diff.
+    """
+    cur = stream(
+        conn,
+        "SELECT object_id, op, payload FROM sync_staging WHERE object_type = ? ORDER BY object_id",
+        (object_type,)
+    )
+    while True:
+        rows = cur.fetchmany(_CHUNK_SIZE)
+        if not rows:
+            break
+        current = _open_versions(conn, object_type, [row[0] for row in rows])
+        old_objects = [json.loads(decode(conn, payload)) for _, payload in current.values()]
+        new_objects = [json.loads(payload) for _, op, payload in rows if op == 'upsert']
+        yield old_objects, new_objects
+
+def _update_type_fingerprint(conn, snapshot_id: int, object_type: str):
+    """
+    Move the type's fingerprint forward by the staged changes only: subtract the hashes of
+    the versions being replaced or removed, add the hashes of the staged versions.
+    Must run before the staged rows are applied.
+    """
+    previous = get_type_fingerprint(conn, object_type)
+    if previous is None:
+        return False
+    total, count = int(previous[0], 16), previous[1]
+    cur = stream(
+        conn,
+        "SELECT object_id, op, payload_hash FROM sync_staging WHERE object_type = ?",
+        (object_type,)
+    )
+    while True:
+        rows = cur.fetchmany(_CHUNK_SIZE)
+        if not rows:
+            break
+        current = _open_versions(conn, object_type, [row[0] for row in rows])
+        for object_id, op, digest in rows:
+            if object_id in current:
+                total -= int(current[object_id][0], 16)
+                count -= 1
+            if op == 'upsert':
+                total += int(digest, 16)
+                count += 1
+    _record_type_fingerprint(conn, snapshot_id, object_type, _fingerprint_hex(total), count)
+    return True
+
+def apply_staged(conn, snapshot_id: int, object_type: str):
+    """
+    Close the replaced versions and insert the staged ones (compressed) as of snapshot_id.
+    The caller commits.
+    """
+    if conn.execute("SELECT 1 FROM sync_staging WHERE object_type = ? LIMIT 1", (object_type,)).fetchone() is None:
+        return
+    fingerprint_updated = _update_type_fingerprint(conn, snapshot_id, object_type)
+    conn.execute(
+        "UPDATE object_versions SET valid_to_snapshot = ? "
+        "WHERE object_type = ? AND valid_to_snapshot IS NULL "
+        "AND object_id IN (SELECT object_id FROM sync_staging WHERE object_type = ?)",
+        (snapshot_id, object_type, object_type)
+    )
+    encode = payload_encoder(conn)
+    cur = stream(
+        conn,
+        "SELECT object_id, payload_hash, payload FROM sync_staging WHERE object_type = ? AND op = 'upsert'",
+        (object_type,)
+    )
+    while True:
+        rows = cur.fetchmany(_CHUNK_SIZE)
+        if not rows:
+            break
+        conn.executemany(
+            "INSERT INTO object_versions "
+            "(object_type, object_id, valid_from_snapshot, valid_to_snapshot, payload_hash, payload) "
+            "VALUES (?, ?, ?, NULL, ?, ?)",
+            [(object_type, object_id, snapshot_id, digest, encode(payload)) for object_id, digest, payload in rows]
+        )
+        record_object_names(conn, snapshot_id, object_type,
+                            [(object_id, json.loads(payload)) for object_id, _, payload in rows])
+    if not fingerprint_updated:
+        _recompute_type_fingerprint(conn, snapshot_id, object_type)
+
+def refresh_staged(conn, object_type: str):
+    """
+    Overwrite the current versions with the staged ones without a new snapshot, for staged
+    changes the diff does not report (e.g. only fields excluded by DIFF_FIELD_RULES changed).
+    The type's latest fingerprint moves with them, so later walks of the same objects are
+    recognised as unchanged. The caller commits.
+
+    Returns:
+        int: Number of versions overwritten.
+    """
+    latest = conn.execute("SELECT MAX(id) FROM snapshots").fetchone()[0]
+    if latest is None or conn.execute(
+        "SELECT 1 FROM sync_staging WHERE object_type = ? AND op = 'upsert' LIMIT 1", (object_type,)
+    ).fetchone() is None:
+        return 0
+    fingerprint_updated = _update_type_fingerprint(conn, latest, object_type)
+    encode = payload_encoder(conn)
+    cur = stream(
+        conn,
+        "SELECT object_id, payload_hash, payload FROM sync_staging WHERE object_type = ? AND op = 'upsert'",
+        (object_type,)
+    )
+    overwritten = 0
+    while True:
+        rows = cur.fetchmany(_CHUNK_SIZE)
+        if not rows:
+            break
+        conn.executemany(
+            "UPDATE object_versions SET payload_hash = ?, payload = ? "
+            "WHERE object_type = ? AND object_id = ? AND valid_to_snapshot IS NULL",
+            [(digest, encode(payload), object_type, object_id) for object_id, digest, payload in rows]
+        )
+        record_object_names(conn, latest, object_type,
+                            [(object_id, json.loads(payload)) for object_id, _, payload in rows])
+        overwritten += len(rows)
+    if not fingerprint_updated:
+        _recompute_type_fingerprint(conn, latest, object_type)
+    return overwritten
+
+def clear_staging(conn, object_type: str):
+    """Forget everything staged for an object type, including its walk progress."""
+    conn.execute("DELETE FROM sync_staging WHERE object_type = ?", (object_type,))
+    conn.execute("DELETE FROM sync_seen WHERE object_type = ?", (object_type,))
+    conn.execute("DELETE FROM sync_progress WHERE object_type = ?", (object_type,))
+
+def get_sync_progress(conn, object_type: str):
+    """
+    Progress of the last walk of an object type, or None.
+
+    Returns:
+        dict: origin_url (where the walk started), next_url (page still to fetch, None once
+        complete), delta_link (issued by the last page of a delta walk), and hash_sum /
+        object_count of the objects seen so far by a full walk.
+    """
+    row = conn.execute(
+        "SELECT origin_url, next_url, delta_link, fingerprint, object_count FROM sync_progress "
+        "WHERE object_type = ?",
+        (object_type,)
+    ).fetchone()
+    if not row:
+        return None
+    return {
+        "origin_url": row[0], "next_url": row[1], "delta_link": row[2],
+        "hash_sum": int(row[3], 16) if row[3] else 0, "object_count": row[4] or 0
+    }
+
+def save_sync_progress(conn, object_type: str, origin_url: str, next_url: str, delta_link: str,
+                       hash_sum: int = 0, object_count: int = 0):
+    """Record walk progress (committed together with the staged page by the caller)."""
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_progress "
+        "(object_type, origin_url, next_url, delta_link, fingerprint, object_count) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (object_type, origin_url, next_url, delta_link, _fingerprint_hex(hash_sum), object_count)
+    )
+
+def walk_matches_fingerprint(conn, object_type: str, hash_sum: int, object_count: int):
+    """True when a completed full walk saw exactly the current objects of the type (O(1) check)."""
+    stored = get_type_fingerprint(conn, object_type)
+    return stored is not None and stored == (_fingerprint_hex(hash_sum), object_count)
+
+
+def migrate_blob_snapshots(conn):
+    """
+    Convert the legacy schema (whole tenant JSON blob in snapshots.config) to object versions.
+
+    Each blob is replayed in id order through write_state, so only the differences between
+    consecutive blobs end up stored. The snapshots table is then rebuilt without the config
+    column. Runs inside a single transaction.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(snapshots)")]
+    if 'config' not in columns:
+        return
+
+    count = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+    logger.warning(f"Legacy snapshot blobs detected. Migrating {count} snapshots to object versions...")
+
+    rows = conn.execute("SELECT id, config FROM snapshots ORDER BY id").fetchall()
+    for snapshot_id, config in rows:
+        state = json.loads(config) if config else {}
+        if isinstance(state, list):
+            # Oldest format: a plain list of users, no groups were tracked
+            state = {"user": state, "group": []}
+        write_state(conn, snapshot_id, state)
+
+    conn.execute("""
+        CREATE TABLE snapshots_migrated (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            changes TEXT,
+            explanation TEXT
+        )
+    """)
+    conn.execute(
+        "INSERT INTO snapshots_migrated (id, timestamp, changes, explanation) "
+        "SELECT id, timestamp, changes, explanation FROM snapshots"
+    )
+    conn.execute("DROP TABLE snapshots")
+    conn.execute("ALTER TABLE snapshots_migrated RENAME TO snapshots")
+    conn.commit()
+    logger.info(f"✓ Migrated {count} snapshots to normalized storage")
@@ -0,0 +1,134 @@
+"""
+Registry of the Entra ID tenants the monitor covers.
+
+Without TENANTS_FILE there is one tenant, "default": the tenant of the graph_* secrets, with
+its history in DATABASE_URL - a single-tenant deployment works exactly as before. With it,
+the file lists the tenants as JSON:
+
+    [
+      {"key": "contoso", "name": "Contoso Ltd", "tenant_id": "<directory id>",
+       "client_id": "<app id>", "client_secret_file": "/run/secrets/contoso_secret"},
+      {"key": "fabrikam", "tenant_id": "...", "client_id": "...", "client_secret": "...",
+       "database_url": "postgresql://monitor:pass@db/fabrikam"}
+    ]
+
+Each tenant gets its own app registration credentials (and with them its own MSAL app and
+token cache, see graph_client.use_tenant) and its own database, so snapshots, delta tokens
+and history of different tenants never share a table. The key names the tenant in the API
+(?tenant=), the scheduler's jobs and the logs.
+"""
+
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+from config import TENANTS_FILE, TENANT_DATABASE_URL, GRAPH_TENANT_ID, GRAPH_CLIENT_ID, GRAPH_CLIENT_SECRET
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+
+_KEY_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """A monitored tenant."""
+    key: str                                   # short unique name (URLs, job ids, database names)
+    tenant_id: str                             # Entra directory (tenant) id
+    client_id: str                             # app registration used to read the tenant
+    client_secret: str = field(repr=False)
+    database: Optional[str] = None             # database URL or SQLite path of its history (None: DATABASE_URL)
+    name: Optional[str] = None                 # display name
+
+    def as_dict(self):
+        """The public fields (no credentials, no database URL)."""
+        return {"key": self.key, "name": self.name or self.key, "tenant_id": self.tenant_id}
+
+
+def _read_client_secret(entry: dict):
+    if entry.get("client_secret"):
+        return entry["client_secret"]
+    if entry.get("client_secret_file"):
+        with open(entry["client_secret_file"]) as f:
+            return f.read().strip()
+    raise ValueError(f"Tenant {entry.get('key')!r} has no client_secret or client_secret_file")
+
+
+def parse_tenants(entries: list):
+    """
+    Build the registry from the TENANTS_FILE entries.
+
+    Raises:
+        ValueError: An entry is incomplete, or a key is invalid or used twice.
+    """
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("The tenants file must hold a non-empty JSON list of tenants")
+    tenants = []
+    for entry in entries:
+        key = entry.get("key", "")
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid tenant key {key!r} (lowercase letters, digits, '-' and '_')")
+        if any(tenant.key == key for tenant in tenants):
+            raise ValueError(f"Tenant {key!r} is registered twice")
+        missing = [name for name in ("tenant_id", "client_id") if not entry.get(name)]
+        if missing:
+            raise ValueError(f"Tenant {key!r} is missing {', '.join(missing)}")
+        tenants.append(Tenant(
+            key=key,
+            tenant_id=entry["tenant_id"],
+            client_id=entry["client_id"],
+            client_secret=_read_client_secret(entry),
+            database=entry.get("database_url") or TENANT_DATABASE_URL.replace("{tenant}", key),
+            name=entry.get("name"),
+        ))
+    return tenants
+
+
+def load_tenants(path: str = None):
+    """
+    The registered tenants, in file order: those of the tenants file (TENANTS_FILE by default),
+    or the single default tenant when there is none.
+    """
+    path = path if path is not None else TENANTS_FILE
+    if not path:
+        return [Tenant(DEFAULT_TENANT, GRAPH_TENANT_ID, GRAPH_CLIENT_ID, GRAPH_CLIENT_SECRET)]
+    with open(path) as f:
+        tenants = parse_tenants(json.load(f))
+    logger.info(f"Loaded {len(tenants)} tenants from {path}")
+    return tenants
+
+
+_tenants = None
+_tenants_lock = threading.Lock()
+
+def get_tenants():
+    """The registered tenants (loaded once per process)."""
+    global _tenants
+    if _tenants is None:
+        with _tenants_lock:
+            if _tenants is None:
+                _tenants = load_tenants()
+    return _tenants
+
+def get_tenant(key: str = None):
+    """
+    Look up a registered tenant by key; without one, the first registered tenant.
+
+    Raises:
+        KeyError: No tenant is registered under that key.
+    """
+    tenants = get_tenants()
+    if not key:
+        return tenants[0]
+    for tenant in tenants:
+        if tenant.key == key:
+            return tenant
+    raise KeyError(key)
+
+def is_multi_tenant():
+    """True when the tenants come from a tenants file."""
+    return bool(TENANTS_FILE)
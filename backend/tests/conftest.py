@@ -0,0 +1,62 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# config.py exits when required secrets are missing; give the test run harmless placeholders.
+for _name in ("GRAPH_CLIENT_ID", "GRAPH_TENANT_ID", "GRAPH_CLIENT_SECRET", "OPENAI_API_KEY", "FLASK_SECRET_KEY"):
+    os.environ.setdefault(_name, f"test-{_name.lower()}")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The backend's modules import config, so only once the placeholders are set
+import graph_client
+import monitor
+import resources
+from db import create_schema
+from mock_graph import MockGraphServer
+from storage import load_state
+
+
+@pytest.fixture
+def graph_page_size():
+    """Objects per page served by the mock Graph server (override in a test module to change it)."""
+    return 2
+
+
+@pytest.fixture
+def graph(monkeypatch, graph_page_size):
+    """A mock Graph server that graph_client talks to, with a dummy token."""
+    with MockGraphServer(page_size=graph_page_size) as server:
+        monkeypatch.setattr(graph_client, "GRAPH_CONFIG_ENDPOINT", server.base_url)
+        monkeypatch.setattr(graph_client, "_get_access_token", lambda: "test-token")
+        yield server
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """The monitor's database, created as at startup, monitoring users and groups in delta mode."""
+    path = str(tmp_path / "monitor.db")
+    conn = sqlite3.connect(path)
+    create_schema(conn)   # done once at startup by worker.py / the API
+    conn.close()
+    monkeypatch.setattr(monitor, "DATABASE_URL", path)
+    monkeypatch.setattr(monitor, "SYNC_MODE", "delta")
+    monkeypatch.setattr(monitor, "enqueue_explanation", lambda snapshot_id, database_path=None: None)
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["user", "group"])
+    return path
+
+
+@pytest.fixture
+def snapshots(database):
+    """Loads the saved snapshots of `database`, oldest first, as (state, changes) pairs."""
+    def load():
+        conn = sqlite3.connect(database)
+        try:
+            rows = conn.execute("SELECT id, changes FROM snapshots ORDER BY id").fetchall()
+            return [(load_state(conn, snap_id), json.loads(changes)) for snap_id, changes in rows]
+        finally:
+            conn.close()
+    return load
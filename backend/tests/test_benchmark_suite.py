@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import graph_client
+import monitor
+import resources
+from benchmarks import suite
+from benchmarks.tenant import SyntheticTenant
+from mock_graph import MockGraphServer
+
+
+def test_tenant_churn_is_served_as_delta_changes():
+    tenant = SyntheticTenant(users=500, seed=3)
+    assert len(tenant.collections["groups"]) == 20
+    assert SyntheticTenant(users=500, seed=3).collections == tenant.collections
+
+    with MockGraphServer() as server:
+        tenant.load(server)
+        sequence = server.sequence
+        changes = tenant.churn(server, rate=0.05)
+        served = {collection: dict(objects) for collection, objects in server.collections.items()}
+
+    assert changes >= 25
+    assert server.sequence > sequence
+    for collection, objects in tenant.collections.items():
+        assert served[collection] == objects
+    for group_id, members in tenant.members.items():
+        assert served[f"groups/{group_id}/members"] == members
+
+
+@pytest.fixture
+def isolated(monkeypatch):
+    """Undo the module settings the suite changes to run the monitor against the mock."""
+    for module, name in ((monitor, "DATABASE_URL"), (monitor, "SYNC_MODE"), (monitor, "enqueue_explanation"),
+                         (resources, "MONITORED_RESOURCES"), (graph_client, "GRAPH_CONFIG_ENDPOINT"),
+                         (graph_client, "_get_access_token")):
+        monkeypatch.setattr(module, name, getattr(module, name))
+
+
+def test_suite_writes_results_and_flags_regressions(tmp_path, isolated, capsys):
+    output = tmp_path / "now.json"
+    arguments = ["--users", "200", "--cycles", "1", "--repeat", "1", "--latency", "0", "--jitter", "0",
+                 "--only", "fetch,diff,persistence,cycle", "--output", str(output)]
+
+    assert suite.main(arguments) == 0
+
+    document = json.loads(output.read_text())
+    assert document["parameters"]["users"] == 200
+    assert {"fetch.concurrent.all", "diff.user", "persistence.save_snapshot", "cycle.initial",
+            "cycle.incremental.store"} <= set(document["results"])
+    assert all(result["seconds"] >= 0 for result in document["results"].values())
+
+    baseline = json.loads(output.read_text())
+    for result in baseline["results"].values():
+        result["seconds"] /= 10
+    baseline_path = tmp_path / "baseline.json"
+    baseline_path.write_text(json.dumps(baseline))
+    assert suite.main(["--only", "diff", "--users", "200", "--repeat", "1", "--output", str(output),
+                       "--compare", str(baseline_path)]) == 1
+    assert "<< slower" in capsys.readouterr().out
+
+
+def test_suite_times_startup(tmp_path, isolated):
+    output = tmp_path / "startup.json"
+    assert suite.main(["--users", "200", "--repeat", "1", "--latency", "0", "--jitter", "0", "--only", "startup",
+                       "--output", str(output)]) == 0
+
+    results = json.loads(output.read_text())["results"]
+    assert results["startup.first_request"]["seconds"] > 0
+    assert results["startup.first_request"]["cold_seconds"] > 0
+    assert results["startup.first_sync"]["objects"] == SyntheticTenant(users=200).object_count
@@ -0,0 +1,131 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import snapshot_diff
+from compaction import compact, snapshots_to_keep
+from compression import CODEC_ZLIB, compress_payload, decode_payload, train_dictionary
+from db import create_schema
+from storage import aggregate_hash, get_type_fingerprint, load_hashes, load_state, save_snapshot
+
+NOW = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _user(index, version=0):
+    return {"id": f"00000000-0000-0000-0000-{index:012d}", "displayName": f"User {index}",
+            "userPrincipalName": f"user{index}@contoso.onmicrosoft.com", "accountEnabled": True,
+            "jobTitle": f"Engineer {version}", "department": "Engineering", "usageLocation": "US"}
+
+
+@pytest.fixture
+def conn():
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+    yield connection
+    connection.close()
+
+
+def _history(conn, days=800, users=60):
+    """One snapshot every 12 hours, each changing one user."""
+    state = [_user(index) for index in range(users)]
+    for step in range(days * 2):
+        timestamp = (NOW - timedelta(hours=12 * (days * 2 - step))).isoformat()
+        if step:
+            state[step % users] = _user(step % users, step)
+        save_snapshot(conn, timestamp, {"user": list(state)}, [f"step {step}"], None)
+    conn.commit()
+
+
+def test_payload_round_trip():
+    text = json.dumps(_user(1))
+    samples = [json.dumps(_user(index)) for index in range(200)]
+    dictionary = train_dictionary(samples)
+
+    plain = compress_payload(text, CODEC_ZLIB)
+    shared = compress_payload(text, CODEC_ZLIB, dictionary)
+
+    assert decode_payload(plain) == text
+    assert decode_payload(shared, dictionary) == text
+    assert decode_payload(text) == text  # payloads written before compression
+    assert len(shared) < len(plain) < len(text)
+
+
+def test_retention_tiers():
+    ages = [24 * 500, 24 * 410, 24 * 400, 24 * 41, 24 * 40, 24 * 40 - 3, 24 * 10, 1]  # hours, oldest first
+    snapshots = [(snap_id, (NOW - timedelta(hours=age)).isoformat())
+                 for snap_id, age in enumerate(ages, start=1)]
+
+    keep = snapshots_to_keep(snapshots, NOW, keep_all_days=30, daily_days=365)
+
+    # 500 days: the baseline; 410 and 400 days: same month, the later one wins; 41 days: its
+    # own day; 40 days and 40 days - 3h: same day, the later one wins; last 30 days: everything
+    assert keep == {1, 3, 4, 6, 7, 8}
+
+
+def test_compaction_preserves_kept_states(conn):
+    _history(conn)
+    conn.execute("UPDATE snapshots SET explanation = 'explained', explanation_status = 'ready'")
+    snapshot_ids = [row[0] for row in conn.execute("SELECT id, timestamp FROM snapshots ORDER BY id")]
+    keep = snapshots_to_keep(list(conn.execute("SELECT id, timestamp FROM snapshots")), NOW)
+    expected = {snap_id: load_state(conn, snap_id) for snap_id in keep}
+    snapshot_diff._cache[("stale",)] = []
+
+    stats = compact(conn, now=NOW)
+
+    remaining = [row[0] for row in conn.execute("SELECT id FROM snapshots ORDER BY id")]
+    assert set(remaining) == keep
+    assert stats["snapshots_removed"] == len(snapshot_ids) - len(keep) > 0
+    assert stats["versions_removed"] > 0
+    assert snapshot_diff._cache == {}
+    for snap_id in remaining:
+        assert load_state(conn, snap_id) == expected[snap_id]
+        hashes = load_hashes(conn, "user", snap_id)
+        assert get_type_fingerprint(conn, "user", snap_id) == (aggregate_hash(hashes.values()), len(hashes))
+
+    # A kept snapshot after removed ones now lists its changes since the previous kept snapshot
+    first_month = remaining[1]
+    changes = json.loads(conn.execute("SELECT changes FROM snapshots WHERE id = ?", (first_month,)).fetchone()[0])
+    assert changes and all(change.startswith("User modified:") for change in changes)
+    events = conn.execute("SELECT COUNT(*) FROM change_events WHERE snapshot_id = ?", (first_month,)).fetchone()[0]
+    assert events == len(changes)
+    # It keeps its explanation rather than costing another OpenAI call
+    assert stats["requeued_explanations"] == []
+    assert conn.execute("SELECT explanation, explanation_status FROM snapshots WHERE id = ?",
+                        (first_month,)).fetchone() == ("explained", "ready")
+    # Every version range starts and ends at an existing snapshot
+    assert conn.execute(
+        "SELECT COUNT(*) FROM object_versions WHERE valid_from_snapshot NOT IN (SELECT id FROM snapshots) "
+        "OR valid_to_snapshot NOT IN (SELECT id FROM snapshots)"
+    ).fetchone()[0] == 0
+
+
+def test_compaction_explains_the_newest_rewritten_snapshots_again_if_asked(conn):
+    _history(conn)
+    conn.execute("UPDATE snapshots SET explanation = 'explained', explanation_status = 'ready'")
+
+    stats = compact(conn, now=NOW, reexplain_max=2)
+
+    requeued = stats["requeued_explanations"]
+    assert len(requeued) == 2 and requeued == sorted(requeued)
+    pending = [row[0] for row in conn.execute(
+        "SELECT id FROM snapshots WHERE explanation_status = 'pending' AND explanation IS NULL ORDER BY id")]
+    assert pending == requeued
+    # Every other rewritten snapshot kept its explanation
+    assert conn.execute("SELECT COUNT(*) FROM snapshots WHERE explanation = 'explained'").fetchone()[0] == \
+        conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0] - 2
+
+
+def test_compaction_trains_a_dictionary_and_recompresses(conn):
+    _history(conn, days=120)
+    before = load_state(conn)
+
+    stats = compact(conn, now=NOW)
+
+    assert conn.execute("SELECT COUNT(*) FROM compression_dicts").fetchone()[0] == 1
+    assert stats["versions_recompressed"] > 0
+    assert stats["bytes_saved"] > 0 and stats["bytes_after"] < stats["bytes_before"]
+    assert load_state(conn) == before
+    # Nothing left to recompress on the next run
+    assert compact(conn, now=NOW)["versions_recompressed"] == 0
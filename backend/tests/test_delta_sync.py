@@ -0,0 +1,126 @@
+import json
+import sqlite3
+
+import pytest
+
+import graph_client
+import monitor
+from storage import aggregate_hash, get_type_fingerprint, load_hashes, load_object
+
+
+def _seed(graph):
+    graph.set_objects("users", [
+        {"id": "u1", "displayName": "Alice", "userPrincipalName": "alice@contoso.com", "accountEnabled": True},
+        {"id": "u2", "displayName": "Bob", "userPrincipalName": "bob@contoso.com", "accountEnabled": True},
+        {"id": "u3", "displayName": "Carol", "userPrincipalName": "carol@contoso.com", "accountEnabled": True},
+    ])
+    graph.set_objects("groups", [{"id": "g1", "displayName": "Admins", "description": "Tenant admins"}])
+
+
+def test_incremental_cycle_only_fetches_changes(graph, database, snapshots):
+    _seed(graph)
+    monitor.check_for_changes()
+
+    graph.upsert("users", {"id": "u1", "displayName": "Alice", "userPrincipalName": "alice@contoso.com", "accountEnabled": False})
+    graph.delete("users", "u2")
+    graph.upsert("groups", {"id": "g2", "displayName": "Helpdesk", "description": "Tier 1"})
+    graph.requests.clear()
+
+    monitor.check_for_changes()
+
+    assert all("$deltatoken" in path for path in graph.requests)
+    saved = snapshots()
+    assert len(saved) == 2
+    config, changes = saved[-1]
+    assert {user["id"] for user in config["user"]} == {"u1", "u3"}
+    assert {group["id"] for group in config["group"]} == {"g1", "g2"}
+    assert "User removed: Bob" in changes
+    assert "Group added: Helpdesk" in changes
+    assert "User modified: Alice - accountEnabled changed from 'True' to 'False'" in changes
+
+
+def test_no_changes_does_not_save_snapshot(graph, database, snapshots):
+    _seed(graph)
+    monitor.check_for_changes()
+    monitor.check_for_changes()
+
+    assert len(snapshots()) == 1
+
+
+@pytest.mark.parametrize("mode", ["delta", "full"])
+def test_changes_to_excluded_fields_are_stored_without_a_snapshot(graph, database, snapshots, monkeypatch, mode):
+    monkeypatch.setattr(monitor, "SYNC_MODE", mode)
+    monkeypatch.setattr(monitor, "DIFF_FIELD_RULES", {"user": {"exclude": ["accountEnabled"]}})
+    _seed(graph)
+    monitor.check_for_changes()
+
+    graph.upsert("users", {"id": "u1", "displayName": "Alice", "userPrincipalName": "alice@contoso.com", "accountEnabled": False})
+    monitor.check_for_changes()
+
+    assert len(snapshots()) == 1
+    conn = sqlite3.connect(database)
+    assert load_object(conn, "user", "u1")["accountEnabled"] is False
+    # The fingerprint follows, so the next full walk is recognised as unchanged
+    hashes = load_hashes(conn, "user")
+    assert get_type_fingerprint(conn, "user") == (aggregate_hash(hashes.values()), 3)
+    conn.close()
+
+
+def test_expired_delta_token_falls_back_to_full_resync(graph, database, snapshots):
+    _seed(graph)
+    monitor.check_for_changes()
+
+    graph.upsert("users", {"id": "u4", "displayName": "Dave", "userPrincipalName": "dave@contoso.com", "accountEnabled": True})
+    graph.expire_delta_tokens()
+    graph.requests.clear()
+
+    monitor.check_for_changes()
+
+    assert any("$deltatoken" not in path for path in graph.requests)
+    config, changes = snapshots()[-1]
+    assert {user["id"] for user in config["user"]} == {"u1", "u2", "u3", "u4"}
+    assert changes == ["User added: Dave"]
+
+    conn = sqlite3.connect(database)
+    links = dict(conn.execute("SELECT object_type, delta_link FROM delta_links").fetchall())
+    conn.close()
+    assert set(links) == {"user", "group"}
+    assert all("$deltatoken" in link for link in links.values())
+
+
+def test_failed_walk_resumes_from_failed_page_next_cycle(graph, database, snapshots, monkeypatch):
+    monkeypatch.setattr(graph_client, "GRAPH_MAX_RETRIES", 0)
+    _seed(graph)
+    monitor.check_for_changes()
+
+    for i in range(5, 10):
+        graph.upsert("users", {"id": f"u{i}", "displayName": f"User {i}"})
+    graph.inject_failures(1, status=503, retry_after=None, match="skiptoken=2")
+
+    monitor.check_for_changes()
+    assert len(snapshots()) == 1
+
+    graph.requests.clear()
+    monitor.check_for_changes()
+
+    user_requests = [path for path in graph.requests if path.startswith("/v1.0/users")]
+    # Continued at the failed page, then fetched the last one
+    assert ["skiptoken=2" in path for path in user_requests] == [True, False]
+    config, changes = snapshots()[-1]
+    assert len(config["user"]) == 8
+    assert sorted(changes) == sorted(f"User added: User {i}" for i in range(5, 10))
+
+
+def test_saved_snapshots_are_announced(graph, database):
+    _seed(graph)
+    monitor.check_for_changes()
+    graph.delete("users", "u2")
+    monitor.check_for_changes()
+    monitor.check_for_changes()
+
+    conn = sqlite3.connect(database)
+    rows = conn.execute("SELECT type, data FROM events ORDER BY id").fetchall()
+    conn.close()
+    assert [(event_type, json.loads(data)["id"], json.loads(data)["change_count"]) for event_type, data in rows] == [
+        ("snapshot-created", 1, 1), ("snapshot-created", 2, 1)
+    ]
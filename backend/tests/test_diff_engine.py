@@ -0,0 +1,117 @@
+import sqlite3
+
+from db import create_schema
+from diff_engine import (
+    ChangeRecord, DiffRules, diff_objects, diff_states, render_change, render_changes,
+    OP_ADD, OP_REMOVE, OP_REPLACE
+)
+from storage import insert_snapshot, save_change_records, load_change_records, payload_hash, HashIndex, aggregate_hash
+
+
+def _paths(records):
+    return [(record.path, record.op, record.old, record.new) for record in records]
+
+
+def test_nested_dict_changes_have_dotted_paths():
+    old = {"id": "u1", "displayName": "Alice", "passwordPolicies": {"expires": True, "strength": "high"}}
+    new = {"id": "u1", "displayName": "Alice", "passwordPolicies": {"expires": False}, "jobTitle": "Dev"}
+
+    records = diff_objects(old, new, "user")
+
+    assert _paths(records) == [
+        ("passwordPolicies.expires", OP_REPLACE, True, False),
+        ("passwordPolicies.strength", OP_REMOVE, "high", None),
+        ("jobTitle", OP_ADD, None, "Dev"),
+    ]
+    assert all(record.object_id == "u1" and record.name == "Alice" for record in records)
+
+
+def test_lists_of_objects_are_matched_by_id():
+    old = {"id": "g1", "members": [{"id": "u1", "role": "member"}, {"id": "u2", "role": "member"}]}
+    new = {"id": "g1", "members": [{"id": "u2", "role": "owner"}, {"id": "u3", "role": "member"}]}
+
+    records = diff_objects(old, new, "group")
+
+    assert _paths(records) == [
+        ("members[id=u1]", OP_REMOVE, {"id": "u1", "role": "member"}, None),
+        ("members[id=u2].role", OP_REPLACE, "member", "owner"),
+        ("members[id=u3]", OP_ADD, None, {"id": "u3", "role": "member"}),
+    ]
+
+
+def test_scalar_lists_are_compared_as_sets():
+    old = {"id": "u1", "proxyAddresses": ["a@x", "b@x"]}
+    reordered = {"id": "u1", "proxyAddresses": ["b@x", "a@x"]}
+    changed = {"id": "u1", "proxyAddresses": ["b@x", "c@x"]}
+
+    assert diff_objects(old, reordered, "user") == []
+    assert _paths(diff_objects(old, changed, "user")) == [
+        ("proxyAddresses[]", OP_REMOVE, "a@x", None),
+        ("proxyAddresses[]", OP_ADD, None, "c@x"),
+    ]
+
+
+def test_include_and_exclude_rules():
+    old = {"id": "u1", "displayName": "A", "jobTitle": "Dev", "signIn": {"last": "1", "count": 1}}
+    new = {"id": "u1", "displayName": "B", "jobTitle": "Ops", "signIn": {"last": "2", "count": 2}}
+    config = {
+        "*": {"exclude": ["signIn.last"]},
+        "user": {"include": ["displayName", "signIn.last", "signIn.count"]},
+    }
+
+    rules = DiffRules.for_type("user", config)
+
+    assert [record.path for record in diff_objects(old, new, "user", rules)] == ["displayName", "signIn.count"]
+    # Types without their own rules only get the common ones
+    group_rules = DiffRules.for_type("group", config)
+    assert [record.path for record in diff_objects(old, new, "group", group_rules)] == [
+        "displayName", "jobTitle", "signIn.count"
+    ]
+
+
+def test_diff_states_only_walks_objects_whose_hash_changed():
+    old_state = [{"id": f"u{i}", "displayName": f"User {i}"} for i in range(5)]
+    new_state = [dict(obj) for obj in old_state]
+    new_state[2]["displayName"] = "Renamed"
+    old_hashes = HashIndex((obj["id"], payload_hash(obj)) for obj in old_state)
+    old_hashes.fingerprint = aggregate_hash(old_hashes.values())
+    new_hashes = HashIndex((obj["id"], payload_hash(obj)) for obj in new_state)
+    new_hashes.fingerprint = aggregate_hash(new_hashes.values())
+    # Content outside the changed object is ignored once hashes say it is unchanged
+    old_state[0]["displayName"] = "stale copy"
+
+    records = diff_states(old_state, new_state, "user", old_hashes=old_hashes, new_hashes=new_hashes)
+
+    assert _paths(records) == [("displayName", OP_REPLACE, "User 2", "Renamed")]
+    assert diff_states(old_state, new_state, "user", old_hashes=old_hashes, new_hashes=old_hashes) == []
+
+
+def test_render_keeps_the_snapshot_text_format():
+    old_state = [{"id": "u1", "displayName": "Alice", "accountEnabled": True},
+                 {"id": "u2", "displayName": "Bob"}]
+    new_state = [{"id": "u1", "displayName": "Alice", "accountEnabled": False, "businessPhones": ["1"]},
+                 {"id": "u3", "userPrincipalName": "carol@x"}]
+    old_state[0]["businessPhones"] = []
+
+    assert render_changes(diff_states(old_state, new_state, "user")) == [
+        "User added: carol@x",
+        "User removed: Bob",
+        "User modified: Alice - accountEnabled changed from 'True' to 'False'",
+        "User modified: Alice - businessPhones added '1'",
+    ]
+    record = ChangeRecord("group_membership", "g1", "Admins", "members[id=u1]", OP_REMOVE,
+                          {"id": "u1", "displayName": "Alice"}, None)
+    assert render_change(record) == "Group membership modified: Admins - members removed 'Alice'"
+
+
+def test_change_records_round_trip_through_storage():
+    conn = sqlite3.connect(":memory:")
+    create_schema(conn)
+    records = diff_objects({"id": "u1", "displayName": "A", "tags": ["x"]},
+                           {"id": "u1", "displayName": "B", "tags": ["x", "y"]}, "user")
+
+    snapshot_id = insert_snapshot(conn, "2024-01-01T00:00:00", render_changes(records), "")
+    save_change_records(conn, snapshot_id, records)
+
+    assert load_change_records(conn, snapshot_id) == [record.to_dict() for record in records]
+    conn.close()
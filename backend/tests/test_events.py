@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+import events
+from db import create_schema
+from events import EventBroker, SNAPSHOT_CREATED, EXPLANATION_READY, format_event, record_event
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "events.db")
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.close()
+    return path
+
+
+def _publish(database, broker, event_type, data):
+    conn = sqlite3.connect(database)
+    event_id = record_event(conn, event_type, data)
+    conn.commit()
+    conn.close()
+    broker.notify()
+    return event_id
+
+
+def _events(chunk):
+    """(id, type, data) of the events in a stream chunk."""
+    parsed = []
+    for block in chunk.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        if "id" in fields:
+            parsed.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+def _next_events(stream):
+    """Events of the next chunk that carries any (keep-alive comments are skipped)."""
+    for _ in range(20):
+        found = _events(next(stream))
+        if found:
+            return found
+    raise AssertionError("no event received")
+
+
+def test_subscribers_receive_new_events(database):
+    broker = EventBroker(database, poll_seconds=0.05, heartbeat_seconds=0.1)
+    _publish(database, broker, SNAPSHOT_CREATED, {"id": 1})   # before anyone subscribed: not sent
+    first, second = broker.stream(), broker.stream()
+    assert next(first).startswith("retry: ") and next(second).startswith("retry: ")
+    assert broker.subscribers == 2
+
+    event_id = _publish(database, broker, SNAPSHOT_CREATED, {"id": 2, "change_count": 3})
+
+    assert _next_events(first) == [(event_id, SNAPSHOT_CREATED, {"id": 2, "change_count": 3})]
+    assert _next_events(second) == [(event_id, SNAPSHOT_CREATED, {"id": 2, "change_count": 3})]
+    first.close()
+    assert broker.subscribers == 1
+
+
+def test_idle_streams_get_keep_alives(database):
+    broker = EventBroker(database, poll_seconds=0.05, heartbeat_seconds=0.05)
+    stream = broker.stream()
+    next(stream)
+    assert next(stream) == ": keep-alive\n\n"
+
+
+def test_reconnect_replays_from_last_event_id(database):
+    broker = EventBroker(database, poll_seconds=0.05, heartbeat_seconds=0.1)
+    ids = [_publish(database, broker, EXPLANATION_READY, {"snapshot_id": n, "status": "ready"}) for n in range(5)]
+
+    stream = broker.stream(last_event_id=ids[1])
+    next(stream)
+    assert [event[0] for event in _next_events(stream)] == ids[2:]
+
+    later = _publish(database, broker, SNAPSHOT_CREATED, {"id": 9})
+    assert [event[0] for event in _next_events(stream)] == [later]
+
+
+def test_subscribers_behind_the_buffer_are_served_from_the_table(database):
+    broker = EventBroker(database, poll_seconds=0.05, heartbeat_seconds=0.1, buffer_size=3)
+    stream = broker.stream()
+    next(stream)
+    broker.start()
+    ids = [_publish(database, broker, SNAPSHOT_CREATED, {"id": n}) for n in range(10)]
+    broker.poll()
+
+    received = []
+    while len(received) < len(ids):
+        received.extend(event[0] for event in _next_events(stream))
+    assert received == ids
+
+
+def test_old_events_are_pruned(database, monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_RETENTION", 3)
+    conn = sqlite3.connect(database)
+    for n in range(6):
+        record_event(conn, SNAPSHOT_CREATED, {"id": n})
+    conn.commit()
+    assert [row[0] for row in conn.execute("SELECT id FROM events ORDER BY id")] == [4, 5, 6]
+    conn.close()
+
+
+def test_many_subscribers_share_one_poller(database):
+    broker = EventBroker(database, poll_seconds=0.05, heartbeat_seconds=1)
+    streams = [broker.stream() for _ in range(50)]
+    for stream in streams:
+        next(stream)
+    received = []
+
+    def consume(stream):
+        received.append(_next_events(stream))
+    threads = [threading.Thread(target=consume, args=(stream,)) for stream in streams]
+    for thread in threads:
+        thread.start()
+    event_id = _publish(database, broker, SNAPSHOT_CREATED, {"id": 1})
+    for thread in threads:
+        thread.join(5)
+
+    assert len(received) == 50 and all(found[0][0] == event_id for found in received)
+
+
+def test_format():
+    assert format_event(7, SNAPSHOT_CREATED, '{"id": 1}') == 'id: 7\nevent: snapshot-created\ndata: {"id": 1}\n\n'
@@ -0,0 +1,94 @@
+import sqlite3
+import time
+
+import pytest
+from openai import OpenAI
+
+import explanation_cache
+import openai_client
+from db import create_schema
+from explanation_cache import change_set_fingerprint, get_cached_explanation, store_explanation, evict, cache_stats
+from explanation_worker import ExplanationWorker, STATUS_PENDING, STATUS_READY
+from mock_openai import MockOpenAIServer
+from storage import insert_snapshot
+
+
+@pytest.fixture
+def conn():
+    explanation_cache.reset_cache_stats()
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+    yield connection
+    connection.close()
+
+
+def test_fingerprint_ignores_order_and_spacing():
+    changes = ["User modified: Alice - accountEnabled changed from 'True' to 'False'", "Group added: Helpdesk"]
+    reordered = ["Group added:  Helpdesk ", changes[0]]
+
+    assert change_set_fingerprint(changes, "gpt", "1") == change_set_fingerprint(reordered, "gpt", "1")
+    assert change_set_fingerprint(changes, "gpt", "1") != change_set_fingerprint(changes[:1], "gpt", "1")
+    assert change_set_fingerprint(changes, "gpt", "1") != change_set_fingerprint(changes, "gpt", "2")
+    assert change_set_fingerprint(changes, "gpt", "1") != change_set_fingerprint(changes, "other", "1")
+
+
+def test_hits_misses_and_ttl(conn):
+    fingerprint = change_set_fingerprint(["User added: Dave"], "gpt", "1")
+    assert get_cached_explanation(conn, fingerprint) is None
+
+    store_explanation(conn, fingerprint, "gpt", "1", "<p>Dave joined</p>")
+    assert get_cached_explanation(conn, fingerprint) == "<p>Dave joined</p>"
+    # Older than the TTL: treated as a miss
+    conn.execute("UPDATE explanation_cache SET created_at = ?", (time.time() - 7200,))
+    assert get_cached_explanation(conn, fingerprint, ttl_hours=1) is None
+
+    stats = cache_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 2, 1)
+    assert stats["hit_ratio"] == pytest.approx(0.333, abs=0.001)
+
+
+def test_least_recently_used_entries_are_evicted(conn):
+    for i in range(4):
+        store_explanation(conn, f"fp{i}", "gpt", "1", f"<p>{i}</p>", max_entries=10)
+        conn.execute("UPDATE explanation_cache SET last_used_at = ? WHERE fingerprint = ?", (1000 + i, f"fp{i}"))
+    conn.execute("UPDATE explanation_cache SET last_used_at = 2000 WHERE fingerprint = 'fp0'")
+
+    assert evict(conn, max_entries=2, now=1500) == 2
+
+    remaining = {row[0] for row in conn.execute("SELECT fingerprint FROM explanation_cache")}
+    assert remaining == {"fp0", "fp3"}
+    assert cache_stats()["evictions"] == 2
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    with MockOpenAIServer(latency=0.1) as server:
+        client = OpenAI(api_key="test-key", base_url=server.base_url, max_retries=0, timeout=10)
+        monkeypatch.setattr(openai_client, "client", client)
+        yield server
+
+
+def test_recurring_change_sets_skip_the_api(completions, tmp_path):
+    path = str(tmp_path / "monitor.db")
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    toggles = ["User modified: Alice - accountEnabled changed from 'True' to 'False'", "Group added: Helpdesk"]
+    # Two identical change sets queued together, then the same set again in a different order
+    first = [insert_snapshot(conn, "2024-01-01T00:00:00", toggles, None, STATUS_PENDING) for _ in range(2)]
+    conn.commit()
+
+    worker = ExplanationWorker(max_concurrency=2)
+    for snapshot_id in first:
+        worker.enqueue(snapshot_id, path)
+    assert worker.join(timeout=10)
+
+    later = insert_snapshot(conn, "2024-01-02T00:00:00", list(reversed(toggles)), None, STATUS_PENDING)
+    conn.commit()
+    worker.enqueue(later, path)
+    assert worker.join(timeout=10)
+
+    rows = conn.execute("SELECT explanation_status, explanation FROM snapshots ORDER BY id").fetchall()
+    conn.close()
+    assert len(completions.requests) == 1
+    assert {row[0] for row in rows} == {STATUS_READY}
+    assert len({row[1] for row in rows}) == 1
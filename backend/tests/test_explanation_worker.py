@@ -0,0 +1,113 @@
+import sqlite3
+
+import pytest
+from openai import OpenAI
+
+import openai_client
+from db import create_schema
+from explanation_worker import ExplanationWorker, STATUS_PENDING, STATUS_READY, STATUS_FAILED
+from mock_openai import MockOpenAIServer
+from storage import insert_snapshot
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    with MockOpenAIServer() as server:
+        client = OpenAI(api_key="test-key", base_url=server.base_url, max_retries=0, timeout=10)
+        monkeypatch.setattr(openai_client, "client", client)
+        yield server
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "monitor.db")
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.close()
+    return path
+
+
+def _pending_snapshot(path, changes):
+    conn = sqlite3.connect(path)
+    snapshot_id = insert_snapshot(conn, "2024-01-01T00:00:00", changes, None, STATUS_PENDING)
+    conn.commit()
+    conn.close()
+    return snapshot_id
+
+
+def _explanation(path, snapshot_id):
+    conn = sqlite3.connect(path)
+    row = conn.execute(
+        "SELECT explanation, explanation_status, explanation_attempts FROM snapshots WHERE id = ?", (snapshot_id,)
+    ).fetchone()
+    conn.close()
+    return row
+
+
+def test_pending_snapshot_is_explained_in_the_background(completions, database):
+    completions.responder = lambda messages: "<h3>Summary</h3><p>Alice was disabled</p>"
+    snapshot_id = _pending_snapshot(database, ["User modified: Alice - accountEnabled changed from 'True' to 'False'"])
+    assert _explanation(database, snapshot_id)[1] == STATUS_PENDING
+
+    worker = ExplanationWorker(max_concurrency=1)
+    worker.enqueue(snapshot_id, database)
+    assert worker.join(timeout=10)
+
+    assert _explanation(database, snapshot_id) == ("<h3>Summary</h3><p>Alice was disabled</p>", STATUS_READY, 1)
+    assert "accountEnabled" in completions.requests[0]["messages"][1]["content"]
+
+
+def test_throttled_requests_are_retried(completions, database):
+    completions.inject_failures(2, status=429, retry_after="0")
+    snapshot_id = _pending_snapshot(database, ["User added: Dave"])
+
+    worker = ExplanationWorker(max_concurrency=1, max_retries=3, backoff_seconds=0)
+    worker.enqueue(snapshot_id, database)
+    assert worker.join(timeout=10)
+
+    explanation, status, attempts = _explanation(database, snapshot_id)
+    assert (status, attempts) == (STATUS_READY, 3)
+    assert len(completions.requests) == 3
+
+
+def test_gives_up_after_max_retries(completions, database):
+    completions.inject_failures(5, status=500, retry_after=None)
+    snapshot_id = _pending_snapshot(database, ["User added: Dave"])
+
+    worker = ExplanationWorker(max_concurrency=1, max_retries=1, backoff_seconds=0)
+    worker.enqueue(snapshot_id, database)
+    assert worker.join(timeout=10)
+
+    explanation, status, attempts = _explanation(database, snapshot_id)
+    assert (status, attempts) == (STATUS_FAILED, 2)
+    assert "alert" in explanation
+
+
+def test_concurrency_is_bounded(completions, database):
+    completions.latency = 0.1
+    snapshot_ids = [_pending_snapshot(database, [f"User added: User {i}"]) for i in range(8)]
+
+    worker = ExplanationWorker(max_concurrency=3)
+    for snapshot_id in snapshot_ids:
+        worker.enqueue(snapshot_id, database)
+    assert worker.join(timeout=20)
+
+    assert all(_explanation(database, snapshot_id)[1] == STATUS_READY for snapshot_id in snapshot_ids)
+    assert completions.max_in_flight <= 3
+    assert len(completions.requests) == 8
+
+
+def test_recover_queues_snapshots_left_pending(completions, database):
+    snapshot_ids = [_pending_snapshot(database, ["User added: Erin"]) for _ in range(2)]
+    conn = sqlite3.connect(database)
+    conn.execute("UPDATE snapshots SET explanation_status = 'ready', explanation = 'done' WHERE id = ?", (snapshot_ids[0],))
+    conn.commit()
+    conn.close()
+
+    worker = ExplanationWorker(max_concurrency=2)
+    assert worker.recover(database) == 1
+    assert worker.join(timeout=10)
+
+    assert _explanation(database, snapshot_ids[0])[0] == "done"
+    assert _explanation(database, snapshot_ids[1])[1] == STATUS_READY
+    assert len(completions.requests) == 1
@@ -0,0 +1,134 @@
+from functools import partial
+
+import pytest
+
+import graph_client
+import monitor
+import resources
+from db import create_schema
+from mock_graph import MockGraphServer
+from storage_backend import connect
+
+
+@pytest.fixture
+def graph_page_size():
+    return 3
+
+
+def test_concurrent_fetch_matches_serial(graph):
+    for collection in ("users", "groups", "applications"):
+        graph.set_objects(collection, [{"id": f"{collection}-{i}", "displayName": str(i)} for i in range(10)])
+    endpoints = {"user": "/users", "group": "/groups?$select=id", "application": "/applications"}
+
+    serial = {key: graph_client.fetch_all_graph_data(endpoint) for key, endpoint in endpoints.items()}
+    concurrent = graph_client.fetch_concurrently(
+        {key: partial(graph_client.fetch_all_graph_data, endpoint) for key, endpoint in endpoints.items()},
+        max_workers=2
+    )
+
+    assert concurrent == serial
+    assert list(concurrent) == list(endpoints)
+    assert len(concurrent["user"]) == 10
+    assert concurrent["group"][0] == {"id": "groups-0"}
+
+
+def test_concurrent_fetch_propagates_errors(graph):
+    graph.set_objects("users", [{"id": "u1"}])
+
+    with pytest.raises(Exception):
+        graph_client.fetch_concurrently({key: partial(graph_client.fetch_all_graph_data, endpoint)
+                                         for key, endpoint in {"user": "/users", "missing": "/doesNotExist"}.items()})
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(graph_client, "GRAPH_MAX_RETRIES", 3)
+    monkeypatch.setattr(graph_client, "GRAPH_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(graph_client, "_controller", graph_client.RateController(4))
+    graph_client.reset_fetch_stats()
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = connect(str(tmp_path / "walk.db"))
+    create_schema(conn)
+    yield conn
+    conn.close()
+
+
+def _walk_users(conn):
+    """One full walk of the users, as the monitor streams it."""
+    resource = resources.get_resource("user")
+    return monitor._stream_walk(conn, resource, graph_client.graph_url("/users"), incremental=False)
+
+
+def _staged_ids(conn):
+    return sorted(row[0] for row in conn.execute("SELECT object_id FROM sync_staging WHERE object_type = 'user'"))
+
+
+def test_throttled_page_is_retried_honouring_retry_after(graph, fast_retries, conn):
+    graph.set_objects("users", [{"id": f"u{i}"} for i in range(9)])
+    graph.inject_failures(2, status=429, retry_after="0.05", match="skiptoken=6")
+
+    _walk_users(conn)
+
+    assert _staged_ids(conn) == [f"u{i}" for i in range(9)]
+    stats = graph_client.get_fetch_stats()
+    assert stats["retries"] == 2
+    assert stats["throttled"] == 2
+    assert stats["wait_seconds"] == pytest.approx(0.1)
+    # Only the throttled page was requested again
+    assert sum("skiptoken=6" in path for path in graph.requests) == 3
+    assert sum("skiptoken" not in path for path in graph.requests) == 1
+
+
+def test_exhausted_retries_resume_from_failed_page(graph, fast_retries, conn):
+    graph.set_objects("users", [{"id": f"u{i}"} for i in range(9)])
+    graph.inject_failures(4, status=503, retry_after=None, match="skiptoken=6")
+
+    with pytest.raises(Exception):
+        _walk_users(conn)
+    # The pages committed before the failure stay staged
+    assert _staged_ids(conn) == [f"u{i}" for i in range(6)]
+
+    graph.requests.clear()
+    _walk_users(conn)
+
+    assert _staged_ids(conn) == [f"u{i}" for i in range(9)]
+    assert graph.requests == [path for path in graph.requests if "skiptoken=6" in path]
+    assert graph_client.get_fetch_stats()["resumed"] == 1
+
+
+def test_retry_delay_uses_jittered_exponential_backoff(monkeypatch):
+    monkeypatch.setattr(graph_client, "GRAPH_BACKOFF_BASE_SECONDS", 1.0)
+    monkeypatch.setattr(graph_client, "GRAPH_BACKOFF_MAX_SECONDS", 10.0)
+
+    delays = [graph_client._retry_delay(None, attempt=3) for _ in range(200)]
+
+    assert all(0 <= delay <= 8.0 for delay in delays)
+    assert len(set(delays)) > 1
+    assert max(graph_client._retry_delay(None, attempt=10) for _ in range(200)) <= 10.0
+
+
+def test_rate_controller_backs_off_and_recovers():
+    controller = graph_client.RateController(8)
+
+    controller.on_throttle()
+    controller.on_throttle()
+    assert controller.limit == 2
+
+    for _ in range(2 + 3 + 4):
+        controller.on_success()
+    assert controller.limit == 5
+
+
+def test_mock_rate_limit_throttles_with_retry_after():
+    with MockGraphServer(rate_limit=5) as server:
+        server.set_objects("users", [{"id": "u1"}])
+        responses = [server.handle_get("/v1.0/users") for _ in range(10)]
+
+    statuses = [status for status, _, _ in responses]
+    assert statuses[:5] == [200] * 5
+    assert statuses.count(429) >= 4 and server.throttled == statuses.count(429)
+    retry_after = [float(headers["Retry-After"]) for status, _, headers in responses if status == 429]
+    assert all(0 < wait <= 0.2 for wait in retry_after)
@@ -0,0 +1,149 @@
+import json
+import random
+import sqlite3
+
+import pytest
+
+import storage
+from db import create_schema
+from diff_engine import DiffRules, diff_states
+from history import object_history, parse_point_in_time, state_at
+from storage import backfill_checkpoints, decode, load_state, save_change_records, save_snapshot
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(storage, "STATE_CHECKPOINT_MIN_CHANGES", 5)
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+    yield connection
+    connection.close()
+
+
+def _scan_state(conn, snapshot_id):
+    """The state at a snapshot straight from the version ranges, without checkpoints."""
+    state = {}
+    for object_type, payload in conn.execute(
+        "SELECT object_type, payload FROM object_versions WHERE valid_from_snapshot <= ? "
+        "AND (valid_to_snapshot IS NULL OR valid_to_snapshot > ?) ORDER BY object_type, id",
+        (snapshot_id, snapshot_id)
+    ):
+        state.setdefault(object_type, []).append(json.loads(decode(conn, payload)))
+    return state
+
+
+def _random_history(conn, snapshots=60, seed=3):
+    rng = random.Random(seed)
+    users = {f"u{index}": {"id": f"u{index}", "displayName": f"User {index}"} for index in range(10)}
+    groups = {f"g{index}": {"id": f"g{index}", "displayName": f"Group {index}"} for index in range(3)}
+    for day in range(snapshots):
+        for _ in range(rng.randint(0, 4)):
+            object_id = f"u{rng.randint(0, 14)}"
+            if object_id in users and rng.random() < 0.3:
+                del users[object_id]
+            else:
+                users[object_id] = {"id": object_id, "displayName": f"User {object_id} v{day}"}
+        if day % 7 == 0:
+            groups[f"g{day % 5}"] = {"id": f"g{day % 5}", "displayName": f"Group v{day}"}
+        save_snapshot(conn, f"2024-01-01T{day // 60:02d}:{day % 60:02d}:00+00:00",
+                      {"user": list(users.values()), "group": list(groups.values())}, [f"day {day}"], None)
+    conn.commit()
+
+
+def test_checkpoints_rebuild_the_same_states(conn):
+    _random_history(conn)
+    checkpoints = [row[0] for row in conn.execute("SELECT DISTINCT snapshot_id FROM state_checkpoints")]
+
+    assert len(checkpoints) > 2
+    for (snapshot_id,) in conn.execute("SELECT id FROM snapshots").fetchall():
+        expected = _scan_state(conn, snapshot_id)
+        assert load_state(conn, snapshot_id) == expected
+        assert load_state(conn, snapshot_id, "group") == {key: value for key, value in expected.items() if key == "group"}
+
+
+def test_backfill_adds_checkpoints_to_an_existing_history(conn, monkeypatch):
+    monkeypatch.setattr(storage, "STATE_CHECKPOINT_MIN_CHANGES", 10 ** 9)
+    _random_history(conn)
+    assert conn.execute("SELECT COUNT(*) FROM state_checkpoints").fetchone()[0] == 0
+
+    monkeypatch.setattr(storage, "STATE_CHECKPOINT_MIN_CHANGES", 5)
+    assert backfill_checkpoints(conn) > 2
+    assert backfill_checkpoints(conn) == 0
+    for (snapshot_id,) in conn.execute("SELECT id FROM snapshots").fetchall():
+        assert load_state(conn, snapshot_id) == _scan_state(conn, snapshot_id)
+
+
+def _snapshot(conn, timestamp, before, after):
+    records = diff_states(before, after, "user", DiffRules())
+    snapshot_id = save_snapshot(conn, timestamp, {"user": after}, [record.path for record in records], None)
+    save_change_records(conn, snapshot_id, records)
+    return snapshot_id
+
+
+@pytest.fixture
+def lifecycle(conn):
+    """Alice is created, renamed, removed and created again; Bob never changes."""
+    bob = {"id": "u2", "displayName": "Bob"}
+    states = [
+        [{"id": "u1", "displayName": "Alice"}, bob],
+        [{"id": "u1", "displayName": "Alice Smith"}, bob],
+        [bob],
+        [{"id": "u1", "displayName": "Alice Jones"}, bob],
+    ]
+    ids, before = [], []
+    for day, state in enumerate(states, start=1):
+        ids.append(_snapshot(conn, f"2024-03-0{day}T12:00:00+00:00", before, state))
+        before = state
+    conn.commit()
+    return ids
+
+
+def test_object_history(conn, lifecycle):
+    history = object_history(conn, "user", "u1")
+
+    assert [(item["event"], item["snapshot_id"]) for item in history["items"]] == [
+        ("added", lifecycle[3]), ("removed", lifecycle[2]), ("modified", lifecycle[1]), ("added", lifecycle[0])
+    ]
+    renamed = history["items"][2]
+    assert renamed["object"] == {"id": "u1", "displayName": "Alice Smith"}
+    assert renamed["timestamp"] == "2024-03-02T12:00:00+00:00"
+    assert renamed["valid_to_snapshot_id"] == lifecycle[2]
+    assert renamed["changes"] == [
+        {"path": "displayName", "op": "replace", "kind": "modified", "old": "Alice", "new": "Alice Smith"}
+    ]
+    assert history["next_cursor"] is None
+    assert object_history(conn, "user", "missing") is None
+
+
+def test_object_history_pages(conn, lifecycle):
+    first = object_history(conn, "user", "u1", limit=1)
+    second = object_history(conn, "user", "u1", cursor=first["next_cursor"], limit=1)
+    third = object_history(conn, "user", "u1", cursor=second["next_cursor"], limit=1)
+
+    assert [item["event"] for item in first["items"]] == ["added"]
+    assert [item["event"] for item in second["items"]] == ["removed", "modified"]
+    assert [item["event"] for item in third["items"]] == ["added"]
+    assert third["next_cursor"] is None
+    with pytest.raises(ValueError):
+        object_history(conn, "user", "u1", limit=0)
+
+
+def test_state_at(conn, lifecycle):
+    # A date means the end of that day
+    on_march_2 = state_at(conn, "2024-03-02")
+    assert on_march_2["snapshot_id"] == lifecycle[1]
+    assert on_march_2["object_counts"] == {"user": 2}
+
+    assert state_at(conn, "2024-03-03T11:59:59Z")["snapshot_id"] == lifecycle[1]
+    assert state_at(conn, "2024-03-03T12:00:00Z", "user", "u1")["object"] is None
+    assert state_at(conn, "2024-03-04T12:00:00", "user", "u1")["object"] == {"id": "u1", "displayName": "Alice Jones"}
+    assert state_at(conn, "2024-02-01") is None
+    with pytest.raises(ValueError):
+        state_at(conn, "yesterday")
+    with pytest.raises(ValueError):
+        state_at(conn, "2024-03-02", object_id="u1")
+
+
+def test_parse_point_in_time():
+    assert parse_point_in_time("2024-03-03") == "2024-03-03T23:59:59.999999+00:00"
+    assert parse_point_in_time("2024-03-03T14:00:00+02:00") == "2024-03-03T12:00:00+00:00"
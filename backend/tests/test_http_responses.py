@@ -0,0 +1,127 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+from flask import Flask, Response, jsonify, request
+
+import http_responses
+import storage_backend
+from db import close_db, create_schema, get_snapshot_version
+from http_responses import cacheable, client_has, compress_response
+from storage import insert_snapshot
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    body = {"changes": [f"User modified: user{n}@contoso.com" for n in range(200)]}
+
+    @app.route("/snapshot")
+    def snapshot():
+        return cacheable(request, jsonify(body), max_age=60, immutable=True)
+
+    @app.route("/pending")
+    def pending():
+        return cacheable(request, jsonify(body))
+
+    @app.route("/versioned")
+    def versioned():
+        if client_has(request, "v1"):
+            return cacheable(request, Response(), etag="v1")
+        raise AssertionError("the body should not be built for a client that has it")
+
+    @app.route("/small")
+    def small():
+        return jsonify({"status": "ok"})
+
+    @app.route("/stream")
+    def stream():
+        return app.response_class((chunk for chunk in ["a" * 2000]), mimetype="text/event-stream")
+
+    app.after_request(lambda response: compress_response(request, response))
+    return app.test_client()
+
+
+def test_json_is_gzipped_when_accepted(client, monkeypatch):
+    monkeypatch.setattr(http_responses, "brotli", None)
+    plain = client.get("/snapshot")
+    compressed = client.get("/snapshot", headers={"Accept-Encoding": "gzip, deflate, br"})
+
+    assert "Content-Encoding" not in plain.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert len(compressed.data) < len(plain.data) / 4
+    assert json.loads(gzip.decompress(compressed.data)) == plain.json
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert compressed.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+
+
+@pytest.mark.skipif(http_responses.brotli is None, reason="brotli is not installed")
+def test_brotli_is_preferred(client):
+    response = client.get("/snapshot", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert json.loads(http_responses.brotli.decompress(response.data))["changes"][0].startswith("User modified")
+    # Unless the client prefers gzip
+    assert client.get("/snapshot", headers={"Accept-Encoding": "gzip, br;q=0.5"}).headers["Content-Encoding"] == "gzip"
+
+
+def test_small_and_streamed_responses_are_not_compressed(client):
+    for path in ("/small", "/stream"):
+        assert "Content-Encoding" not in client.get(path, headers={"Accept-Encoding": "gzip"}).headers
+
+
+def test_repeat_views_get_304(client):
+    first = client.get("/snapshot", headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, max-age=60, immutable"
+
+    again = client.get("/snapshot", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+    assert again.headers["ETag"] == first.headers["ETag"]
+
+    # The identity ETag matches too, and a different one does not
+    identity = client.get("/snapshot").headers["ETag"]
+    assert client.get("/snapshot", headers={"If-None-Match": identity}).status_code == 304
+    assert client.get("/snapshot", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_uncacheable_responses_are_revalidated(client):
+    response = client.get("/pending")
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert client.get("/pending", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_known_versions_are_answered_before_building_the_body(client):
+    response = client.get("/versioned", headers={"If-None-Match": '"v1-gzip"'})
+    assert response.status_code == 304 and response.headers["ETag"] == '"v1-gzip"'
+
+
+def test_snapshot_version_changes_with_the_explanation(tmp_path, monkeypatch):
+    path = str(tmp_path / "snapshots.db")
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    insert_snapshot(conn, "2024-01-01T00:00:00+00:00", ["Initial configuration snapshot"], "")
+    snapshot_id = insert_snapshot(conn, "2024-01-02T00:00:00+00:00", ["User added: u1"], None, "pending")
+    conn.commit()
+    monkeypatch.setattr(storage_backend, "DATABASE_URL", path)
+    app = Flask(__name__)
+    app.teardown_appcontext(close_db)
+
+    def version(**options):
+        with app.app_context():
+            return get_snapshot_version(snapshot_id, **options)
+
+    pending_etag, status = version()
+    assert status == "pending"
+    assert version() == (pending_etag, "pending")
+    assert version(include_config=True)[0] != pending_etag
+
+    conn.execute("UPDATE snapshots SET explanation = 'A user was added', explanation_status = 'ready' WHERE id = ?",
+                 (snapshot_id,))
+    conn.commit()
+    conn.close()
+    ready_etag, status = version()
+    assert status == "ready" and ready_etag != pending_etag
+    with app.app_context():
+        assert get_snapshot_version(999) is None
+
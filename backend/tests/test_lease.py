@@ -0,0 +1,145 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import graph_client
+import monitor
+import resources
+from db import create_schema
+from lease import Lease, LeaseLost, lease_holder
+from mock_graph import MockGraphServer
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "lease.db")
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.close()
+    return path
+
+
+def _holder(path, name="monitor"):
+    conn = sqlite3.connect(path)
+    try:
+        return lease_holder(conn, name)
+    finally:
+        conn.close()
+
+
+def test_only_one_instance_holds_the_lease(database):
+    first = Lease("monitor", holder="a", ttl=30, database=database)
+    second = Lease("monitor", holder="b", ttl=30, database=database)
+
+    assert first.acquire() and first.held
+    assert not second.acquire() and not second.held
+    assert first.acquire()   # Renewal
+    assert _holder(database)["holder"] == "a"
+
+    first.release()
+    assert _holder(database) is None and not first.held
+    assert second.acquire()
+    assert _holder(database)["holder"] == "b"
+
+
+def test_an_expired_lease_is_taken_over(database):
+    crashed = Lease("monitor", holder="a", ttl=0.2, database=database)
+    standby = Lease("monitor", holder="b", ttl=30, database=database)
+    assert crashed.acquire()
+    acquired_at = _holder(database)["acquired_at"]
+    assert not standby.acquire()
+
+    time.sleep(0.3)
+    assert _holder(database) is None
+    assert standby.acquire()
+    holder = _holder(database)
+    assert holder["holder"] == "b" and holder["acquired_at"] != acquired_at
+    # Leases are independent by name
+    assert Lease("other", holder="a", database=database).acquire()
+
+
+def test_writes_are_fenced_once_the_lease_is_lost(database):
+    stale = Lease("monitor", holder="a", ttl=0.2, database=database)
+    assert stale.acquire()
+    conn = sqlite3.connect(database)
+    stale.renew_in(conn)
+    conn.commit()
+
+    time.sleep(0.3)
+    assert Lease("monitor", holder="b", ttl=30, database=database).acquire()
+    with pytest.raises(LeaseLost):
+        stale.renew_in(conn)
+    assert not stale.held
+    conn.close()
+
+
+@pytest.fixture
+def graph(monkeypatch, database):
+    monkeypatch.setattr(monitor, "DATABASE_URL", database)
+    monkeypatch.setattr(monitor, "enqueue_explanation", lambda snapshot_id, database_path=None: None)
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["user"])
+    with MockGraphServer(page_size=2) as server:
+        monkeypatch.setattr(graph_client, "GRAPH_CONFIG_ENDPOINT", server.base_url)
+        monkeypatch.setattr(graph_client, "_get_access_token", lambda: "test-token")
+        server.set_objects("users", [
+            {"id": f"u{n}", "displayName": f"User {n}", "userPrincipalName": f"user{n}@contoso.com"} for n in range(5)
+        ])
+        yield server
+
+
+def _snapshot_count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_a_replaced_leader_stores_nothing(graph, database):
+    stale = Lease("monitor", holder="a", ttl=0.2, database=database)
+    assert stale.acquire()
+    time.sleep(0.3)
+    assert Lease("monitor", holder="b", ttl=30, database=database).acquire()
+
+    monitor.check_for_changes(lease=stale)
+    assert _snapshot_count(database) == 0
+
+    leader = Lease("monitor", holder="b", ttl=30, database=database)
+    monitor.check_for_changes(lease=leader)
+    assert _snapshot_count(database) == 1
+
+
+def test_standby_takes_over_when_the_leader_stops(graph, database, monkeypatch):
+    monkeypatch.setattr(monitor, "MONITOR_LEASE_RENEW_SECONDS", 0.05)
+    monkeypatch.setattr(monitor.explanations, "recover", lambda database=None: None)
+    leader = Lease("monitor", holder="a", ttl=30, database=database)
+    standby = Lease("monitor", holder="b", ttl=30, database=database)
+    leader_stop, standby_stop = threading.Event(), threading.Event()
+    threads = [threading.Thread(target=monitor.start_monitoring, args=(leader, leader_stop)),
+               threading.Thread(target=monitor.start_monitoring, args=(standby, standby_stop))]
+    threads[0].start()
+    try:
+        _wait_for(lambda: _snapshot_count(database) == 1)
+        threads[1].start()
+        time.sleep(0.2)
+        assert leader.held and not standby.held
+
+        leader_stop.set()
+        threads[0].join(5)
+        _wait_for(lambda: standby.held)
+        assert _holder(database)["holder"] == "b"
+    finally:
+        leader_stop.set()
+        standby_stop.set()
+        for thread in threads:
+            if thread.ident:
+                thread.join(5)
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
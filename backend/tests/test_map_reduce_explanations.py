@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+from openai import OpenAI
+
+import openai_client
+from mock_openai import MockOpenAIServer
+from openai_client import TokenUsage, chunk_changes, generate_explanation, group_changes
+
+
+def _offboarding(count):
+    return [f"User removed: Leaver {index:05d}" for index in range(count)]
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    def responder(messages):
+        prompt = messages[-1]["content"]
+        if "Provide your analysis in HTML" in prompt:
+            return "<h3>Summary</h3><p>Bulk offboarding</p>"
+        return "- several accounts removed"
+
+    with MockOpenAIServer(latency=0.05, responder=responder) as server:
+        client = OpenAI(api_key="test-key", base_url=server.base_url, max_retries=0, timeout=10)
+        monkeypatch.setattr(openai_client, "client", client)
+        monkeypatch.setattr(openai_client, "EXPLANATION_CHUNK_TOKENS", 500)
+        yield server
+
+
+def test_changes_are_grouped_by_type_and_kind():
+    changes = ["User added: Dave", "Group removed: Old team", "User added: Erin",
+               "User modified: Alice - jobTitle changed from 'a' to 'b'", "Initial group membership snapshot"]
+
+    groups = group_changes(changes)
+
+    assert groups == {
+        "User added": ["User added: Dave", "User added: Erin"],
+        "Group removed": ["Group removed: Old team"],
+        "User modified": ["User modified: Alice - jobTitle changed from 'a' to 'b'"],
+        "Other": ["Initial group membership snapshot"],
+    }
+    assert group_changes(["Conditional access policy modified: MFA - state changed"]) == {
+        "Conditional access policy modified": ["Conditional access policy modified: MFA - state changed"]
+    }
+
+
+def test_chunks_respect_the_token_budget():
+    changes = _offboarding(1000) + ["Group added: New team"]
+
+    chunks = chunk_changes(changes, 500)
+
+    assert sum(len(lines) for _, lines in chunks) == len(changes)
+    assert {group for group, _ in chunks} == {"User removed", "Group added"}
+    for _, lines in chunks:
+        assert sum(openai_client.estimate_tokens(line) + 1 for line in lines) <= 500
+
+
+def test_small_change_sets_use_a_single_request(completions):
+    usage = TokenUsage()
+
+    explanation = generate_explanation(_offboarding(60), usage)
+
+    assert explanation.startswith("<h3>Summary</h3>")
+    assert usage.requests == 1
+    # No more truncation at 50 changes
+    assert "Leaver 00059" in completions.requests[0]["messages"][1]["content"]
+
+
+def test_large_change_sets_are_summarized_in_chunks(completions, monkeypatch):
+    monkeypatch.setattr(openai_client, "_request_slots", threading.BoundedSemaphore(3))
+    changes = _offboarding(2000)
+    usage = TokenUsage()
+
+    explanation = generate_explanation(changes, usage)
+
+    assert explanation == "<h3>Summary</h3><p>Bulk offboarding</p>"
+    prompts = [request["messages"][1]["content"] for request in completions.requests]
+    # Every change reached a summarization prompt
+    summarized = "".join(prompt for prompt in prompts if "plain-text bullet points" in prompt)
+    assert all(change in summarized for change in changes)
+    assert "- User removed: 2000" in prompts[-1]
+    assert usage.requests == len(completions.requests)
+    assert usage.total_tokens > 0
+    assert completions.max_in_flight <= 3
+
+
+def test_retry_reuses_chunk_summaries(completions):
+    changes = _offboarding(400)
+    chunks = len(chunk_changes(changes, 500))
+    partials = {}
+    completions.inject_failures(1, status=500)
+
+    with pytest.raises(openai_client.InternalServerError):
+        generate_explanation(changes, partials=partials)
+    assert len(partials) == chunks - 1
+
+    generate_explanation(changes, partials=partials)
+    # Only the failed chunk and the final report were requested again
+    assert len(completions.requests) == chunks + 2
@@ -0,0 +1,135 @@
+import json
+import os
+import re
+
+import pytest
+
+import metrics
+import monitor
+from metrics import Counter, Gauge, Histogram, register_collector, render
+
+
+@pytest.fixture
+def graph(graph):
+    graph.set_objects("users", [
+        {"id": f"u{index}", "displayName": name, "userPrincipalName": f"{name.lower()}@contoso.com",
+         "accountEnabled": True}
+        for index, name in enumerate(("Alice", "Bob", "Carol"), start=1)
+    ])
+    graph.set_objects("groups", [{"id": "g1", "displayName": "Admins"}])
+    return graph
+
+
+def _value(name: str, **labels):
+    """Current value of one sample in the /metrics output (0 when absent)."""
+    rendered = ",".join(f'{label}="{value}"' for label, value in labels.items())
+    sample = metrics.PREFIX + name + (f"{{{rendered}}}" if labels else "")
+    for line in render().splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_counters_and_gauges():
+    requests = Counter("test_requests_total", "Test requests", ["status"])
+    requests.inc(status=200)
+    requests.inc(2, status=200)
+    requests.inc(status='say "hi"\n')
+    level = Gauge("test_level", "Test level")
+    level.set(7.5)
+
+    text = render()
+    assert "# TYPE entra_monitor_test_requests_total counter" in text
+    assert 'entra_monitor_test_requests_total{status="200"} 3' in text
+    assert 'entra_monitor_test_requests_total{status="say \\"hi\\"\\n"} 1' in text
+    assert "entra_monitor_test_level 7.5" in text
+    with pytest.raises((ValueError, KeyError)):
+        requests.inc(code=200)
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram("test_latency_seconds", "Test latency", ["route"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, route="/a")
+
+    assert _value("test_latency_seconds_bucket", route="/a", le="0.1") == 2
+    assert _value("test_latency_seconds_bucket", route="/a", le="1") == 3
+    assert _value("test_latency_seconds_bucket", route="/a", le="+Inf") == 4
+    assert _value("test_latency_seconds_count", route="/a") == 4
+    assert _value("test_latency_seconds_sum", route="/a") == pytest.approx(3.65)
+
+    with latency.time(route="/b"):
+        pass
+    assert _value("test_latency_seconds_count", route="/b") == 1
+
+
+def test_collectors_are_read_at_scrape_time():
+    state = {"depth": 1}
+    register_collector(lambda: [("test_queue_depth", "gauge", "Test queue", [({"queue": "q"}, state["depth"])])])
+    assert _value("test_queue_depth", queue="q") == 1
+    state["depth"] = 5
+    assert _value("test_queue_depth", queue="q") == 5
+
+
+def test_output_is_valid_exposition_format():
+    sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? \S+$')
+    for line in render().splitlines():
+        assert line.startswith("# HELP ") or line.startswith("# TYPE ") or sample.match(line), line
+
+
+def test_check_cycle_is_instrumented(graph, database):
+    before = {
+        "total": _value("check_stage_duration_seconds_count", stage="total"),
+        "fetch": _value("check_stage_duration_seconds_count", stage="fetch"),
+        "store": _value("check_stage_duration_seconds_count", stage="store"),
+        "pages": _value("graph_pages_total", object_type="user"),
+        "objects": _value("graph_objects_total", object_type="user"),
+        "requests": _value("graph_requests_total", status="200"),
+        "bytes": _value("graph_response_bytes_total"),
+        "modified": _value("changes_detected_total", object_type="user", kind="modified"),
+        "changes": _value("check_cycles_total", outcome="changes"),
+        "no_changes": _value("check_cycles_total", outcome="no_changes"),
+    }
+    monitor.check_for_changes()
+    graph.upsert("users", {"id": "u1", "displayName": "Alice", "userPrincipalName": "alice@contoso.com",
+                           "accountEnabled": False})
+    monitor.check_for_changes()
+    monitor.check_for_changes()
+
+    assert _value("check_stage_duration_seconds_count", stage="total") - before["total"] == 3
+    assert _value("check_stage_duration_seconds_count", stage="fetch") - before["fetch"] == 3
+    assert _value("check_stage_duration_seconds_count", stage="store") - before["store"] == 3
+    # Three users in pages of two on the first walk, then one changed user per delta round
+    assert _value("graph_pages_total", object_type="user") - before["pages"] == 4
+    assert _value("graph_objects_total", object_type="user") - before["objects"] == 4
+    assert _value("graph_requests_total", status="200") - before["requests"] >= 7
+    assert _value("graph_response_bytes_total") > before["bytes"]
+    assert _value("changes_detected_total", object_type="user", kind="modified") - before["modified"] == 1
+    assert _value("check_cycles_total", outcome="changes") - before["changes"] == 2
+    assert _value("check_cycles_total", outcome="no_changes") - before["no_changes"] == 1
+    assert _value("objects", object_type="user") == 3
+    assert _value("last_snapshot_changes") == 1
+
+
+def test_worker_processes_are_added_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    served = Counter("test_served_total", "Test requests served", ["route"])
+    served.inc(3, route="/a")
+    workers = Gauge("test_workers_busy", "Test busy flag")
+    workers.set(1)
+    # Another worker (alive: our parent's pid) and one that has exited
+    for pid, count in ((os.getppid(), 4), (2 ** 22 + 1, 2)):
+        with open(tmp_path / f"metrics_{pid}.json", "w") as f:
+            json.dump([["entra_monitor_test_served_total", "counter", "Test requests served",
+                        [["entra_monitor_test_served_total", [["route", "/a"]], count]]],
+                       ["entra_monitor_test_workers_busy", "gauge", "Test busy flag",
+                        [["entra_monitor_test_workers_busy", [], 0]]]], f)
+
+    text = render()
+    assert 'entra_monitor_test_served_total{route="/a"} 9' in text
+    assert text.count("# TYPE entra_monitor_test_served_total counter") == 1
+    # Gauges are per live worker
+    assert f'entra_monitor_test_workers_busy{{pid="{os.getpid()}"}} 1' in text
+    assert f'entra_monitor_test_workers_busy{{pid="{os.getppid()}"}} 0' in text
+    assert f'pid="{2 ** 22 + 1}"' not in text
+    assert (tmp_path / f"metrics_{os.getpid()}.json").exists()
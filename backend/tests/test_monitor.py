@@ -1,6 +1,16 @@
-import pytest
-from monitor import diff_policies
+from monitor import _compute_diff
+
 
 def test_policy_created():
-    changes = diff_policies([], [{'id':'1','displayName':'p'}])
-    assert any('Policy Created' in c or 'נוצרה' in c for c in changes)
+    changes = _compute_diff([], [{'id': '1', 'displayName': 'p'}], 'conditional_access_policy')
+    assert changes == ["Conditional access policy added: p"]
+
+
+def test_policy_modified_and_removed():
+    before = [{'id': '1', 'displayName': 'p', 'state': 'enabled'}, {'id': '2', 'displayName': 'q'}]
+    after = [{'id': '1', 'displayName': 'p', 'state': 'disabled'}]
+
+    changes = _compute_diff(before, after, 'conditional_access_policy')
+
+    assert "Conditional access policy modified: p - state changed from 'enabled' to 'disabled'" in changes
+    assert "Conditional access policy removed: q" in changes
@@ -0,0 +1,135 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import monitor
+import resources
+
+
+def _seed_memberships(graph):
+    graph.set_objects("groups", [{"id": "g1", "displayName": "Admins"}, {"id": "g2", "displayName": "Helpdesk"},
+                                 {"id": "g3", "displayName": "Empty"}])
+    graph.set_objects("groups/g1/members", [{"id": "u1", "displayName": "Alice"}, {"id": "u2", "displayName": "Bob"}])
+    graph.set_objects("groups/g2/members", [{"id": "u3", "displayName": "Carol"}])
+    graph.set_objects("groups/g3/members", [])
+
+
+def test_group_memberships_diff_as_member_additions_and_removals(graph, database, snapshots):
+    _seed_memberships(graph)
+    monitor.check_for_changes(["group_membership"])
+
+    graph.set_objects("groups/g1/members", [{"id": "u2", "displayName": "Bob"}, {"id": "u4", "displayName": "Dave"}])
+    monitor.check_for_changes(["group_membership"])
+
+    config, changes = snapshots()[-1]
+    assert sorted(changes) == [
+        "Group membership modified: Admins - members added 'Dave'",
+        "Group membership modified: Admins - members removed 'Alice'",
+    ]
+    admins = next(group for group in config["group_membership"] if group["id"] == "g1")
+    assert [member["id"] for member in admins["members"]] == ["u2", "u4"]
+
+
+def test_members_of_every_page_are_fetched_on_one_pool(graph, database, monkeypatch):
+    _seed_memberships(graph)   # two pages of groups
+    pools = []
+    expand = monitor._expand_page
+    monkeypatch.setattr(monitor, "_expand_page",
+                        lambda resource, items, executor=None: pools.append(executor) or expand(resource, items, executor))
+
+    monitor.check_for_changes(["group_membership"])
+
+    assert len(pools) == 2 and pools[0] is not None and pools[1] is pools[0]
+    assert pools[0]._shutdown
+
+
+def test_role_assignments_are_identified_by_principal_role_and_scope(graph, database, snapshots):
+    assignment = {"principalId": "u1", "roleDefinitionId": "global-admin", "directoryScopeId": "/"}
+    graph.set_objects("roleManagement/directory/roleAssignments", [{"id": "a1", **assignment}])
+    monitor.check_for_changes(["directory_role_assignment"])
+
+    # Removed and re-created under a new id: the same assignment, only its id changed
+    graph.set_objects("roleManagement/directory/roleAssignments", [
+        {"id": "a2", **assignment},
+        {"id": "a3", "principalId": "u2", "roleDefinitionId": "global-admin", "directoryScopeId": "/"},
+    ])
+    monitor.check_for_changes(["directory_role_assignment"])
+
+    _, changes = snapshots()[-1]
+    assert sorted(changes) == [
+        "Directory role assignment added: u2|global-admin|/",
+        "Directory role assignment modified: u1|global-admin|/ - id changed from 'a1' to 'a2'",
+    ]
+
+
+def test_each_resource_is_checked_independently(graph, database, snapshots):
+    graph.set_objects("users", [{"id": "u1", "displayName": "Alice"}])
+    graph.set_objects("identity/conditionalAccess/policies", [
+        {"id": "p1", "displayName": "Require MFA", "state": "enabled", "grantControls": {"builtInControls": ["mfa"]}}
+    ])
+    monitor.check_for_changes(["user"])
+    monitor.check_for_changes(["conditional_access_policy"])
+
+    graph.upsert("users", {"id": "u1", "displayName": "Alice Smith"})
+    graph.set_objects("identity/conditionalAccess/policies", [
+        {"id": "p1", "displayName": "Require MFA", "state": "disabled", "grantControls": {"builtInControls": ["mfa"]}}
+    ])
+    graph.requests.clear()
+    monitor.check_for_changes(["conditional_access_policy"])
+
+    assert all("/identity/conditionalAccess/policies" in path for path in graph.requests)
+    saved = snapshots()
+    # A resource enabled after the first snapshot starts from a baseline instead of "added" lines
+    assert saved[1][1] == ["Initial conditional access policy snapshot"]
+    assert saved[-1][1] == ["Conditional access policy modified: Require MFA - state changed from 'enabled' to 'disabled'"]
+    # The pending user change is left for the user job
+    assert saved[-1][0]["user"] == [{"id": "u1", "displayName": "Alice"}]
+
+
+def test_concurrent_run_of_the_same_resource_is_skipped(graph, database, snapshots, monkeypatch):
+    graph.set_objects("users", [{"id": "u1", "displayName": "Alice"}])
+    lock = monitor._resource_lock("user")
+    lock.acquire()
+    try:
+        monitor.check_for_changes(["user"])
+    finally:
+        lock.release()
+    assert graph.requests == []
+
+    monitor.check_for_changes(["user"])
+    assert len(snapshots()) == 1
+
+
+def test_scheduler_gets_one_non_overlapping_job_per_resource(monkeypatch):
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["user", "conditional_access_policy"])
+    monkeypatch.setattr(resources, "RESOURCE_POLL_INTERVALS", {"conditional_access_policy": 1, "user": 60})
+    scheduler = BackgroundScheduler()
+
+    intervals = monitor.schedule_resources(scheduler)
+
+    assert intervals == {"user": 60, "conditional_access_policy": 1}
+    jobs = {job.id: job for job in scheduler.get_jobs()}
+    assert set(jobs) == {"check_user", "check_conditional_access_policy"}
+    assert jobs["check_conditional_access_policy"].trigger.interval.total_seconds() == 60
+    assert jobs["check_user"].args == (["user"],)
+    assert all(job.max_instances == 1 and job.coalesce for job in jobs.values())
+
+
+def test_privileged_resources_are_polled_more_often(monkeypatch):
+    monkeypatch.setattr(resources, "RESOURCE_POLL_INTERVALS", {})
+    monkeypatch.setattr(resources, "CHECK_INTERVAL_MINUTES", 10)
+    assert resources.poll_interval(resources.get_resource("user")) == 10
+    assert resources.poll_interval(resources.get_resource("conditional_access_policy")) == 2
+    assert resources.poll_interval(resources.get_resource("directory_role_assignment")) == 2
+    # Never slower than the configured interval, and an explicit setting wins
+    monkeypatch.setattr(resources, "CHECK_INTERVAL_MINUTES", 1)
+    assert resources.poll_interval(resources.get_resource("conditional_access_policy")) == 1
+    monkeypatch.setattr(resources, "RESOURCE_POLL_INTERVALS", {"directory_role_assignment": 30})
+    assert resources.poll_interval(resources.get_resource("directory_role_assignment")) == 30
+
+
+def test_new_resources_are_opt_in(monkeypatch):
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", [])
+    assert [resource.name for resource in resources.enabled_resources()] == ["user", "group"]
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["all"])
+    assert [resource.name for resource in resources.enabled_resources()] == list(resources.RESOURCES)
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["group_membership", "nope"])
+    assert [resource.name for resource in resources.enabled_resources()] == ["group_membership"]
@@ -0,0 +1,111 @@
+import sqlite3
+
+import pytest
+
+from db import create_schema
+from diff_engine import DiffRules, diff_states
+from search import search
+from storage import save_change_records, save_snapshot
+
+
+@pytest.fixture
+def conn():
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+    yield connection
+    connection.close()
+
+
+def _snapshot(conn, timestamp, before, after):
+    records = diff_states(before, after, "user", DiffRules())
+    snapshot_id = save_snapshot(conn, timestamp, {"user": after}, [record.path for record in records], None)
+    save_change_records(conn, snapshot_id, records)
+    conn.commit()
+    return snapshot_id
+
+
+def _user(object_id, name, upn, title="Engineer"):
+    return {"id": object_id, "displayName": name, "userPrincipalName": upn, "jobTitle": title}
+
+
+@pytest.fixture
+def history(conn):
+    first = [_user("u1", "Alice Smith", "alice@contoso.com"), _user("u2", "Bob Stone", "bob@contoso.com")]
+    second = [_user("u1", "Alice Jones", "alice.jones@contoso.com", "Security Administrator"),
+              _user("u2", "Bob Stone", "bob@contoso.com")]
+    third = [_user("u1", "Alice Jones", "alice.jones@contoso.com", "Security Administrator")]
+    return [_snapshot(conn, "2024-01-01T00:00:00", [], first),
+            _snapshot(conn, "2024-01-02T00:00:00", first, second),
+            _snapshot(conn, "2024-01-03T00:00:00", second, third)]
+
+
+def test_objects_are_found_by_current_and_past_names(conn, history):
+    objects = search(conn, "smith", scope="objects")["objects"]["items"]
+    assert [(item["object_id"], item["name"], item["current_name"], item["exists"]) for item in objects] == [
+        ("u1", "Alice Smith", "Alice Jones", True)
+    ]
+    assert objects[0]["first_snapshot_id"] == history[0]
+
+    by_upn = search(conn, "alice.jones@contoso.com", scope="objects")["objects"]["items"]
+    assert [item["upn"] for item in by_upn] == ["alice.jones@contoso.com"]
+
+    removed = search(conn, "bob", scope="objects")["objects"]["items"]
+    assert [(item["object_id"], item["exists"]) for item in removed] == [("u2", False)]
+
+
+def test_change_events_match_names_paths_and_values(conn, history):
+    changes = search(conn, "security admin", scope="changes")["changes"]["items"]
+    assert [(item["snapshot_id"], item["path"], item["new"]) for item in changes] == [
+        (history[1], "jobTitle", "Security Administrator")
+    ]
+    assert changes[0]["timestamp"] == "2024-01-02T00:00:00"
+
+    # Every word must match; prefixes and punctuation are fine
+    assert search(conn, "alice bob", scope="changes")["changes"]["items"] == []
+    assert {item["path"] for item in search(conn, "ali CONT", scope="changes")["changes"]["items"]} == {
+        "", "userPrincipalName"
+    }
+    bob = search(conn, "bob", object_type="user")["changes"]["items"]
+    assert [(item["snapshot_id"], item["kind"]) for item in bob] == [(history[2], "removed"), (history[0], "added")]
+    assert search(conn, "bob", object_type="group") == {
+        "objects": {"items": [], "next_cursor": None}, "changes": {"items": [], "next_cursor": None}
+    }
+
+
+def test_pagination(conn, history):
+    seen, cursor = [], None
+    while True:
+        page = search(conn, "contoso", scope="changes", cursor=cursor, limit=1)["changes"]
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    everything = search(conn, "contoso", scope="changes", limit=200)["changes"]["items"]
+    assert seen == [item["id"] for item in everything] and len(seen) > 1
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_index_follows_deletes(conn, history):
+    conn.execute("DELETE FROM change_events WHERE snapshot_id = ?", (history[1],))
+    assert search(conn, "security", scope="changes")["changes"]["items"] == []
+
+
+def test_existing_databases_are_indexed(conn, history):
+    for name in ("search_changes", "search_objects"):
+        for trigger in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER {name}_{trigger}")
+        conn.execute(f"DROP TABLE {name}")
+    conn.execute("DROP TABLE object_names")
+    conn.commit()
+
+    create_schema(conn)
+
+    assert len(search(conn, "alice", scope="objects")["objects"]["items"]) == 2
+    assert len(search(conn, "security", scope="changes")["changes"]["items"]) == 1
+
+
+def test_invalid_requests(conn):
+    for kwargs in ({"q": " @ "}, {"q": "x", "scope": "snapshots"}, {"q": "x", "cursor": "5"},
+                   {"q": "x", "scope": "changes", "cursor": "abc"}, {"q": "x", "limit": 0}):
+        with pytest.raises(ValueError):
+            search(conn, **kwargs)
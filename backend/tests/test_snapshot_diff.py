@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+import snapshot_diff
+from db import create_schema
+from storage import save_snapshot, load_changed_versions
+
+
+@pytest.fixture
+def conn():
+    snapshot_diff.clear_diff_cache()
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+    yield connection
+    connection.close()
+
+
+def _users(*names):
+    return [{"id": f"u{i}", "displayName": name} for i, name in enumerate(names)]
+
+
+@pytest.fixture
+def history(conn):
+    first = save_snapshot(conn, "2024-01-01T00:00:00", {"user": _users("Alice", "Bob", "Carol"), "group": [
+        {"id": "g1", "displayName": "Admins", "description": "old"}
+    ]}, ["Initial configuration snapshot"], "")
+    second = save_snapshot(conn, "2024-01-02T00:00:00", {"user": _users("Alice", "Robert") + [{"id": "u3", "displayName": "Dave"}], "group": [
+        {"id": "g1", "displayName": "Admins", "description": "new"}
+    ]}, [], "")
+    third = save_snapshot(conn, "2024-01-03T00:00:00", {"user": _users("Alice", "Robert") + [{"id": "u3", "displayName": "Dave"}], "group": [
+        {"id": "g1", "displayName": "Admins", "description": "new"}, {"id": "g2", "displayName": "Helpdesk"}
+    ]}, [], "")
+    return first, second, third
+
+
+def test_diff_returns_only_changed_objects_and_paths(conn, history):
+    diff = snapshot_diff.snapshot_diff(conn, history[1])
+
+    assert diff["base_snapshot_id"] == history[0]
+    assert diff["total"] == 4
+    by_id = {obj["object_id"]: obj for obj in diff["objects"]}
+    assert set(by_id) == {"g1", "u1", "u2", "u3"}
+    assert by_id["u1"]["kind"] == "modified"
+    assert by_id["u1"]["changes"] == [{"path": "displayName", "op": "replace", "old": "Bob", "new": "Robert"}]
+    assert by_id["u1"]["before"] == {"id": "u1", "displayName": "Bob"}
+    assert by_id["u2"]["kind"] == "removed" and by_id["u2"]["after"] is None
+    assert by_id["u3"]["kind"] == "added" and by_id["u3"]["before"] is None
+    assert by_id["g1"]["changes"][0]["path"] == "description"
+
+
+def test_first_snapshot_diffs_against_nothing(conn, history):
+    diff = snapshot_diff.snapshot_diff(conn, history[0])
+    assert diff["base_snapshot_id"] is None
+    assert diff["total"] == 4
+    assert {obj["kind"] for obj in diff["objects"]} == {"added"}
+
+
+def test_object_type_filter_and_paging(conn, history):
+    diff = snapshot_diff.snapshot_diff(conn, history[1], object_type="user", limit=2)
+    assert [obj["object_type"] for obj in diff["objects"]] == ["user", "user"]
+    assert diff["total"] == 3 and diff["next_cursor"] == "2"
+
+    rest = snapshot_diff.snapshot_diff(conn, history[1], object_type="user", limit=2, cursor=diff["next_cursor"])
+    assert len(rest["objects"]) == 1 and rest["next_cursor"] is None
+    assert snapshot_diff.snapshot_diff(conn, history[2])["objects"][0]["object_id"] == "g2"
+
+
+def test_diff_is_cached_per_snapshot_pair(conn, history):
+    before = snapshot_diff.diff_cache_stats()
+    snapshot_diff.snapshot_diff(conn, history[1], limit=1)
+    snapshot_diff.snapshot_diff(conn, history[1], limit=1, cursor="1")
+    snapshot_diff.snapshot_diff(conn, history[1], object_type="group")
+    after = snapshot_diff.diff_cache_stats()
+
+    assert after["misses"] - before["misses"] == 2
+    assert after["hits"] - before["hits"] == 1
+
+
+def test_changed_versions_skip_intermediate_versions(conn, history):
+    changed = load_changed_versions(conn, history[0], history[2])
+    old_users, new_users = changed["user"]
+    assert sorted(user["displayName"] for user in old_users) == ["Bob", "Carol"]
+    assert sorted(user["displayName"] for user in new_users) == ["Dave", "Robert"]
+    assert changed["group"][1] == [{"id": "g1", "displayName": "Admins", "description": "new"},
+                                   {"id": "g2", "displayName": "Helpdesk"}]
+
+
+def test_missing_snapshot_and_bad_paging(conn, history):
+    assert snapshot_diff.snapshot_diff(conn, 999) is None
+    with pytest.raises(ValueError):
+        snapshot_diff.snapshot_diff(conn, history[1], limit=0)
+    with pytest.raises(ValueError):
+        snapshot_diff.snapshot_diff(conn, history[1], cursor="x")
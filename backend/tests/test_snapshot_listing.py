@@ -0,0 +1,90 @@
+import sqlite3
+
+import pytest
+
+from db import create_schema
+from diff_engine import ChangeRecord, OP_ADD, OP_REMOVE, OP_REPLACE
+from storage import insert_snapshot, save_change_records, query_snapshots
+
+
+@pytest.fixture
+def conn():
+    connection = sqlite3.connect(":memory:")
+    create_schema(connection)
+    yield connection
+    connection.close()
+
+
+def _add(conn, day, records):
+    snapshot_id = insert_snapshot(conn, f"2024-01-{day:02d}T00:00:00+00:00", [f"change {i}" for i in range(len(records) or 1)], "")
+    save_change_records(conn, snapshot_id, records)
+    return snapshot_id
+
+
+def _ids(page):
+    return [item["id"] for item in page["items"]]
+
+
+@pytest.fixture
+def history(conn):
+    ids = [_add(conn, 1, [])]
+    for day in range(2, 11):
+        records = [ChangeRecord("user", f"u{day}", f"User {day}", "", OP_ADD, None, {"id": f"u{day}"})]
+        if day % 2 == 0:
+            records.append(ChangeRecord("group", "g1", "Admins", "description", OP_REPLACE, "a", "b"))
+        if day % 3 == 0:
+            records.append(ChangeRecord("user", "u2", "User 2", "", OP_REMOVE, {"id": "u2"}, None))
+        ids.append(_add(conn, day, records))
+    return ids
+
+
+def test_keyset_pages_cover_every_snapshot_once(conn, history):
+    seen, cursor = [], None
+    while True:
+        page = query_snapshots(conn, cursor=cursor, limit=3)
+        seen.extend(_ids(page))
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == sorted(history, reverse=True)
+
+    first = query_snapshots(conn, limit=1)["items"][0]
+    assert first == {"id": history[-1], "timestamp": "2024-01-10T00:00:00+00:00", "change_count": 2,
+                     "explanation_status": "none"}
+
+
+def test_time_range_filter(conn, history):
+    page = query_snapshots(conn, since="2024-01-03", until="2024-01-06")
+    assert _ids(page) == [history[4], history[3], history[2]]
+    assert query_snapshots(conn, since="2025-01-01")["items"] == []
+
+
+def test_change_filters(conn, history):
+    assert _ids(query_snapshots(conn, object_type="group")) == [history[i] for i in (9, 7, 5, 3, 1)]
+    assert _ids(query_snapshots(conn, object_id="u2")) == [history[i] for i in (8, 5, 2, 1)]
+    assert _ids(query_snapshots(conn, kind="removed")) == [history[i] for i in (8, 5, 2)]
+    assert _ids(query_snapshots(conn, object_type="user", kind="modified")) == []
+
+    page = query_snapshots(conn, object_type="group", limit=2)
+    assert _ids(page) == [history[9], history[7]]
+    assert _ids(query_snapshots(conn, object_type="group", limit=2, cursor=page["next_cursor"])) == [history[5], history[3]]
+
+
+def test_listing_queries_use_indexes(conn, history):
+    plans = []
+    for filters in ({}, {"object_type": "user"}, {"object_id": "u2"}, {"kind": "added"}):
+        statements = []
+        conn.set_trace_callback(statements.append)
+        query_snapshots(conn, since="2024-01-02", **filters)
+        conn.set_trace_callback(None)
+        for statement in statements:
+            plans.extend(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}"))
+    # Only index searches (or rowid range scans) - never a full table scan or a temp sort
+    assert not [plan for plan in plans if plan.startswith("SCAN") and "INDEX" not in plan]
+    assert not [plan for plan in plans if "TEMP B-TREE" in plan and "ORDER BY" in plan]
+
+
+@pytest.mark.parametrize("filters", [{"limit": 0}, {"limit": "ten"}, {"kind": "renamed"}, {"cursor": "abc"}])
+def test_invalid_parameters(conn, filters):
+    with pytest.raises(ValueError):
+        query_snapshots(conn, **filters)
@@ -0,0 +1,88 @@
+import sqlite3
+
+import msal
+import pytest
+
+import graph_client
+import openai_client
+import storage_backend
+from db import create_schema
+from lease import Lease
+from storage import insert_snapshot
+
+
+def test_msal_app_is_created_on_the_first_token_request(monkeypatch):
+    created = []
+
+    class AuthApp:
+        def __init__(self, client_id, authority, client_credential, **kwargs):
+            created.append(authority)
+
+        def acquire_token_for_client(self, scopes):
+            return {"access_token": "token"}
+
+    monkeypatch.setattr(msal, "ConfidentialClientApplication", AuthApp)
+    monkeypatch.setattr(graph_client, "_auth_app", None)
+
+    assert created == []
+    assert graph_client._get_access_token() == "token"
+    assert graph_client._get_access_token() == "token"
+    assert len(created) == 1
+
+
+def test_openai_client_is_created_on_first_use(monkeypatch):
+    monkeypatch.setattr(openai_client, "client", None)
+    monkeypatch.setattr(openai_client, "_client_initialized", False)
+    monkeypatch.setattr(openai_client, "OPENAI_API_KEY", None)
+    assert openai_client.get_client() is None
+    assert openai_client.generate_explanation(["User added: u1"]) == openai_client.NOT_CONFIGURED_HTML
+
+    monkeypatch.setattr(openai_client, "_client_initialized", False)
+    monkeypatch.setattr(openai_client, "OPENAI_API_KEY", "test-key")
+    client = openai_client.get_client()
+    assert client is not None and openai_client.get_client() is client
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    from app import app
+    path = str(tmp_path / "ready.db")
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.close()
+    monkeypatch.setattr(storage_backend, "DATABASE_URL", path)
+    return app.test_client(), path
+
+
+def test_ready_while_the_first_sync_is_in_progress(api):
+    client, path = api
+    response = client.get("/api/ready")
+    assert response.status_code == 200
+    assert response.json["status"] == "serving" and response.json["first_sync"] == "in_progress"
+    assert response.json["monitor_leading"] is False
+
+    assert Lease("monitor", holder="worker-1", database=path).acquire()
+    conn = sqlite3.connect(path)
+    snapshot_id = insert_snapshot(conn, "2024-01-01T00:00:00+00:00", ["Initial configuration snapshot"], "")
+    conn.commit()
+    conn.close()
+
+    ready = client.get("/api/ready").json
+    assert ready["first_sync"] == "complete"
+    assert ready["latest_snapshot"]["id"] == snapshot_id
+    # Who leads (host and process) only for a logged-in user
+    assert ready["monitor_leading"] is True and "monitor_leader" not in ready
+    with client.session_transaction() as session:
+        session["user_id"] = "admin"
+    assert client.get("/api/ready").json["monitor_leader"]["holder"] == "worker-1"
+
+
+def test_not_ready_without_the_database(api, tmp_path, monkeypatch):
+    client, _ = api
+    monkeypatch.setattr(storage_backend, "DATABASE_URL", str(tmp_path / "missing" / "ready.db"))
+    response = client.get("/api/ready")
+    assert response.status_code == 503 and response.json["status"] == "unavailable"
+    # Liveness does not depend on the database
+    health = client.get("/api/health")
+    assert health.status_code == 200 and health.json["status"] == "ok"
+    assert "monitor_leader" not in health.json and "openai_usage" not in health.json
@@ -0,0 +1,145 @@
+import json
+import sqlite3
+
+import pytest
+
+from db import create_schema
+from storage import (
+    load_state, save_snapshot, payload_hash, insert_snapshot, stage_page, stage_removals,
+    iter_staged_changes, apply_staged, clear_staging, get_type_fingerprint, load_hashes,
+    aggregate_hash, HashIndex
+)
+
+
+@pytest.fixture
+def conn():
+    connection = sqlite3.connect(":memory:")
+    connection.row_factory = sqlite3.Row
+    create_schema(connection)
+    yield connection
+    connection.close()
+
+
+def _versions(conn):
+    return conn.execute("SELECT COUNT(*) FROM object_versions").fetchone()[0]
+
+
+def test_snapshot_only_stores_changed_objects(conn):
+    alice = {"id": "u1", "displayName": "Alice"}
+    bob = {"id": "u2", "displayName": "Bob"}
+    first = save_snapshot(conn, "2024-01-01T00:00:00", {"user": [alice, bob], "group": []}, ["Initial configuration snapshot"], "")
+    second = save_snapshot(conn, "2024-01-02T00:00:00", {"user": [alice, {"id": "u2", "displayName": "Robert"}], "group": []}, [], "")
+    third = save_snapshot(conn, "2024-01-03T00:00:00", {"user": [alice], "group": []}, [], "")
+
+    # u1 once, u2 twice (Bob, Robert); the removal only closes a row
+    assert _versions(conn) == 3
+    assert load_state(conn, first)["user"] == [alice, bob]
+    assert load_state(conn, second)["user"] == [alice, {"id": "u2", "displayName": "Robert"}]
+    assert load_state(conn, third)["user"] == [alice]
+    assert load_state(conn) == load_state(conn, third)
+
+
+def test_payload_hash_ignores_key_order():
+    assert payload_hash({"a": 1, "b": [1, 2]}) == payload_hash({"b": [1, 2], "a": 1})
+    assert payload_hash({"a": 1}) != payload_hash({"a": 2})
+
+
+def test_migrates_legacy_blob_table():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL,
+            config TEXT NOT NULL, changes TEXT, explanation TEXT
+        )
+    """)
+    legacy_users = [{"id": "u1", "displayName": "Alice"}]
+    blobs = [
+        legacy_users,  # oldest format: bare list of users
+        {"user": legacy_users, "group": [{"id": "g1", "displayName": "Admins"}]},
+        {"user": [], "group": [{"id": "g1", "displayName": "Admins"}]},
+    ]
+    for day, blob in enumerate(blobs, start=1):
+        conn.execute(
+            "INSERT INTO snapshots (timestamp, config, changes, explanation) VALUES (?, ?, ?, ?)",
+            (f"2024-01-0{day}", json.dumps(blob), json.dumps([f"change {day}"]), f"explanation {day}")
+        )
+    conn.commit()
+
+    create_schema(conn)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(snapshots)")]
+    assert "config" not in columns
+    assert _versions(conn) == 2
+    assert load_state(conn, 1) == {"user": legacy_users}
+    assert load_state(conn, 2) == {"group": [{"id": "g1", "displayName": "Admins"}], "user": legacy_users}
+    assert load_state(conn, 3) == {"group": [{"id": "g1", "displayName": "Admins"}]}
+    row = conn.execute("SELECT changes, explanation FROM snapshots WHERE id = 3").fetchone()
+    assert json.loads(row["changes"]) == ["change 3"]
+    assert row["explanation"] == "explanation 3"
+
+
+def _stage_full_walk(conn, object_type, objects):
+    stage_page(conn, object_type, objects)
+    stage_removals(conn, object_type)
+
+
+def _apply(conn, object_types):
+    snapshot_id = insert_snapshot(conn, "t", [], "")
+    for object_type in object_types:
+        apply_staged(conn, snapshot_id, object_type)
+        clear_staging(conn, object_type)
+    conn.commit()
+    return snapshot_id
+
+
+def test_full_walk_stages_only_differences(conn):
+    save_snapshot(conn, "t0", {"user": [{"id": "u1", "displayName": "A"}, {"id": "u2", "displayName": "B"}]}, [], "")
+
+    _stage_full_walk(conn, "user", [{"id": "u1", "displayName": "A"}, {"id": "u3", "displayName": "C", "@odata.type": "#user"}])
+    staged = conn.execute("SELECT object_id, op FROM sync_staging ORDER BY object_id").fetchall()
+    assert [tuple(row) for row in staged] == [("u2", "remove"), ("u3", "upsert")]
+
+    chunks = list(iter_staged_changes(conn, "user"))
+    assert chunks == [([{"id": "u2", "displayName": "B"}], [{"id": "u3", "displayName": "C"}])]
+
+    snapshot_id = _apply(conn, ["user"])
+    assert load_state(conn, snapshot_id) == {"user": [{"id": "u1", "displayName": "A"}, {"id": "u3", "displayName": "C"}]}
+
+
+def test_incremental_pages_merge_partial_updates(conn):
+    save_snapshot(conn, "t0", {"user": [{"id": "u1", "displayName": "A", "jobTitle": "Dev"}, {"id": "u2", "displayName": "B"}]}, [], "")
+
+    stage_page(conn, "user", [{"id": "u1", "jobTitle": "Lead"}, {"id": "u2", "@removed": {"reason": "deleted"}}], incremental=True)
+    # The same object may appear again on a later page of the same round
+    stage_page(conn, "user", [{"id": "u1", "displayName": "Alice"}, {"id": "u9", "@removed": {"reason": "deleted"}}], incremental=True)
+
+    snapshot_id = _apply(conn, ["user"])
+    assert load_state(conn, snapshot_id) == {"user": [{"id": "u1", "displayName": "Alice", "jobTitle": "Lead"}]}
+
+
+def test_type_fingerprint_tracks_staged_changes(conn):
+    save_snapshot(conn, "t0", {"user": [{"id": "u1", "displayName": "A"}, {"id": "u2", "displayName": "B"}]}, [], "")
+
+    _stage_full_walk(conn, "user", [{"id": "u1", "displayName": "A2"}, {"id": "u3", "displayName": "C"}])
+    snapshot_id = _apply(conn, ["user"])
+
+    expected = [{"id": "u1", "displayName": "A2"}, {"id": "u3", "displayName": "C"}]
+    assert get_type_fingerprint(conn, "user", snapshot_id) == (aggregate_hash(payload_hash(obj) for obj in expected), 2)
+    hashes = load_hashes(conn, "user", snapshot_id)
+    assert hashes == {obj["id"]: payload_hash(obj) for obj in expected}
+    assert hashes.fingerprint == aggregate_hash(hashes.values())
+    assert load_hashes(conn, "user", 1).fingerprint != hashes.fingerprint
+
+
+def test_hash_first_diff_matches_field_diff():
+    from monitor import _compute_diff
+
+    old = [{"id": "1", "displayName": "A"}, {"id": "2", "displayName": "B"}, {"id": "3", "displayName": "C"}]
+    new = [{"id": "1", "displayName": "A"}, {"id": "2", "displayName": "Bee"}, {"id": "4", "displayName": "D"}]
+    old_hashes = HashIndex((obj["id"], payload_hash(obj)) for obj in old)
+    new_hashes = HashIndex((obj["id"], payload_hash(obj)) for obj in new)
+
+    assert sorted(_compute_diff(old, new, "user", old_hashes, new_hashes)) == sorted(_compute_diff(old, new, "user"))
+    # Equal fingerprints skip the type without looking at the objects
+    assert _compute_diff(old, new, "user", old_hashes, HashIndex(old_hashes)) == []
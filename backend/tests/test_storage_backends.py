@@ -0,0 +1,307 @@
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from compaction import compact
+from db import create_schema
+from diff_engine import diff_states
+from explanation_cache import evict, store_explanation
+from search import search
+from storage import (
+    apply_staged, clear_staging, get_sync_progress, insert_snapshot, iter_staged_changes, load_changed_versions,
+    load_state, query_snapshots, save_change_records, save_snapshot, save_sync_progress, stage_page, stage_removals
+)
+from storage_backend import PostgresBackend, SQLiteBackend, create_backend, stream, to_postgres_sql
+
+
+# --- PostgreSQL test server ---
+#
+# Uses TEST_DATABASE_URL when set (a server the tests may create databases on; CI sets it, and
+# the PostgreSQL variants then fail rather than skip); otherwise a throwaway cluster is started
+# with the local PostgreSQL binaries. Without either, the PostgreSQL variants are skipped.
+
+def _pg_bin(name):
+    found = shutil.which(name) or sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+    return found if isinstance(found, str) else (found[-1] if found else None)
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(scope="session")
+def postgres_server(tmp_path_factory):
+    if os.environ.get("TEST_DATABASE_URL"):
+        import psycopg2  # noqa: F401
+        yield os.environ["TEST_DATABASE_URL"]
+        return
+    pytest.importorskip("psycopg2")
+    initdb, pg_ctl = _pg_bin("initdb"), _pg_bin("pg_ctl")
+    if not (initdb and pg_ctl):
+        pytest.skip("PostgreSQL is not installed on this host")
+
+    data_dir = tmp_path_factory.mktemp("pgdata")
+    port = _free_port()
+    try:
+        subprocess.run([initdb, "-D", str(data_dir), "-U", "postgres", "-A", "trust"], check=True, capture_output=True)
+        subprocess.run(
+            [pg_ctl, "-D", str(data_dir), "-w", "-l", str(data_dir / "server.log"),
+             "-o", f"-p {port} -k {data_dir} -h 127.0.0.1", "start"],
+            check=True, capture_output=True
+        )
+    except subprocess.CalledProcessError as e:
+        # e.g. initdb refuses to run as root
+        pytest.skip(f"Could not start a local PostgreSQL server: {e.stderr.decode(errors='replace').strip()}")
+    try:
+        yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+    finally:
+        subprocess.run([pg_ctl, "-D", str(data_dir), "-m", "immediate", "stop"], capture_output=True)
+
+def _postgres_database(server_url):
+    """A fresh, empty database on the test server."""
+    import psycopg2
+    name = f"monitor_test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(server_url)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE {name}")
+    admin.close()
+    return server_url.rsplit("/", 1)[0] + f"/{name}"
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        instance = SQLiteBackend(str(tmp_path / "monitor.db"))
+    else:
+        server_url = request.getfixturevalue("postgres_server")
+        instance = PostgresBackend(_postgres_database(server_url), 1, 4)
+    conn = instance.connect()
+    create_schema(conn)
+    conn.close()
+    yield instance
+    instance.close()
+
+
+# --- Backend-independent behaviour ---
+
+def test_snapshot_lifecycle(backend):
+    conn = backend.connect()
+    first = insert_snapshot(conn, "2024-01-01T00:00:00", ["Initial configuration snapshot"], None)
+    stage_page(conn, "user", [{"id": "u1", "displayName": "Alice"}, {"id": "u2", "displayName": "Bob"}])
+    apply_staged(conn, first, "user")
+    clear_staging(conn, "user")
+    conn.commit()
+
+    second = insert_snapshot(conn, "2024-01-02T00:00:00", ["User removed: Bob"], None, "pending")
+    stage_page(conn, "user", [{"id": "u1", "displayName": "Alice"}])
+    assert stage_removals(conn, "user") == 1
+    apply_staged(conn, second, "user")
+    clear_staging(conn, "user")
+    conn.commit()
+
+    assert second > first
+    assert load_state(conn, first) == {"user": [{"id": "u1", "displayName": "Alice"}, {"id": "u2", "displayName": "Bob"}]}
+    assert load_state(conn) == {"user": [{"id": "u1", "displayName": "Alice"}]}
+    assert load_changed_versions(conn, first, second) == {"user": ([{"id": "u2", "displayName": "Bob"}], [])}
+    page = query_snapshots(conn, limit=1)
+    assert [item["id"] for item in page["items"]] == [second]
+    assert page["items"][0]["explanation_status"] == "pending"
+    assert query_snapshots(conn, cursor=page["next_cursor"])["items"][0]["change_count"] == 1
+    conn.close()
+
+
+
+def test_staged_rows_are_read_in_chunks(backend, monkeypatch):
+    monkeypatch.setattr("storage._CHUNK_SIZE", 2)
+    conn = backend.connect()
+    stage_page(conn, "user", [{"id": f"u{index}", "displayName": f"User {index}"} for index in range(5)])
+
+    cur = stream(conn, "SELECT object_id FROM sync_staging WHERE object_type = ? ORDER BY object_id", ("user",))
+    assert [row[0] for row in cur.fetchmany(2)] == ["u0", "u1"]
+    if backend.name == "postgres":
+        # A server-side cursor: only the first chunk has left the server
+        assert cur._cursor.name and cur._cursor.rowcount == 2
+    assert [row[0] for row in cur.fetchmany(10)] == ["u2", "u3", "u4"]
+    assert cur.fetchmany(2) == []
+    assert [len(new) for _, new in iter_staged_changes(conn, "user")] == [2, 2, 1]
+    conn.close()
+
+
+def test_compaction(backend, monkeypatch):
+    monkeypatch.setattr("compaction.COMPRESSION_DICT_SAMPLES", 10)
+    conn = backend.connect()
+    users = [{"id": f"u{index}", "displayName": f"User {index}", "jobTitle": "Engineer"} for index in range(5)]
+    for day in range(1, 11):
+        users[day % 5] = {**users[day % 5], "jobTitle": f"Engineer {day}"}
+        save_snapshot(conn, f"2024-01-{day:02d}T{day:02d}:00:00+00:00", {"user": list(users)}, [f"day {day}"], None)
+    conn.commit()
+    expected = load_state(conn)
+
+    stats = compact(conn, now=datetime(2025, 6, 1, tzinfo=timezone.utc))
+
+    # Monthly tier: only the baseline and the latest snapshot of January remain
+    assert stats["snapshots_removed"] == 8
+    assert stats["versions_recompressed"] > 0
+    assert load_state(conn) == expected
+    assert conn.execute("SELECT COUNT(*) FROM change_events").fetchone()[0] == 5
+    conn.close()
+
+
+def test_checkpointed_states(backend, monkeypatch):
+    monkeypatch.setattr("storage.STATE_CHECKPOINT_MIN_CHANGES", 2)
+    conn = backend.connect()
+    states = []
+    for day in range(1, 8):
+        users = [{"id": f"u{index}", "displayName": f"User {index} v{day if index < day % 3 + 1 else 0}"}
+                 for index in range(3)]
+        states.append((save_snapshot(conn, f"2024-01-0{day}T00:00:00", {"user": users}, [], None), users))
+    conn.commit()
+
+    assert conn.execute("SELECT COUNT(DISTINCT snapshot_id) FROM state_checkpoints").fetchone()[0] > 1
+    for snapshot_id, users in states:
+        assert sorted(load_state(conn, snapshot_id)["user"], key=lambda user: user["id"]) == users
+    conn.close()
+
+
+def test_search(backend):
+    conn = backend.connect()
+    before = [{"id": "u1", "displayName": "Alice Smith", "userPrincipalName": "alice@contoso.com"}]
+    after = [{"id": "u1", "displayName": "Alice Jones", "userPrincipalName": "alice@contoso.com"}]
+    for timestamp, old, new in (("2024-01-01T00:00:00", [], before), ("2024-01-02T00:00:00", before, after)):
+        snapshot_id = save_snapshot(conn, timestamp, {"user": new}, [], None)
+        save_change_records(conn, snapshot_id, diff_states(old, new, "user"))
+    conn.commit()
+
+    result = search(conn, "smi")
+    assert [(item["name"], item["current_name"]) for item in result["objects"]["items"]] == [("Alice Smith", "Alice Jones")]
+    assert [(item["path"], item["old"]) for item in result["changes"]["items"]] == [("displayName", "Alice Smith"), ("", None)]
+    page = search(conn, "contoso", scope="changes", limit=1)["changes"]
+    assert search(conn, "contoso", scope="changes", cursor=page["next_cursor"])["changes"]["items"][0]["path"] == ""
+    conn.close()
+
+def test_upserts_replace_rows(backend):
+    conn = backend.connect()
+    save_sync_progress(conn, "user", "https://graph/users", "https://graph/users?page=2", None, 5, 1)
+    save_sync_progress(conn, "user", "https://graph/users", None, "https://graph/delta", 12, 2)
+    conn.commit()
+
+    progress = get_sync_progress(conn, "user")
+    assert (progress["next_url"], progress["delta_link"], progress["hash_sum"]) == (None, "https://graph/delta", 12)
+    assert conn.execute("SELECT COUNT(*) FROM sync_progress").fetchone()[0] == 1
+    conn.close()
+
+
+def test_explanation_cache_eviction(backend):
+    conn = backend.connect()
+    for index in range(5):
+        store_explanation(conn, f"fp{index}", "gpt", "1", f"<p>{index}</p>", max_entries=100)
+        conn.execute("UPDATE explanation_cache SET last_used_at = ? WHERE fingerprint = ?",
+                     (1000.5 + index, f"fp{index}"))
+    assert evict(conn, max_entries=2, now=2000) == 3
+    conn.commit()
+
+    rows = conn.execute("SELECT fingerprint, last_used_at FROM explanation_cache ORDER BY fingerprint").fetchall()
+    assert [(row["fingerprint"], row["last_used_at"]) for row in rows] == [("fp3", 1003.5), ("fp4", 1004.5)]
+    conn.close()
+
+
+def test_concurrent_writers(backend):
+    errors = []
+
+    def write(worker):
+        try:
+            for index in range(10):
+                conn = backend.connect()
+                insert_snapshot(conn, f"2024-01-01T00:{worker:02d}:{index:02d}", ["x"], None)
+                conn.commit()
+                conn.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    conn = backend.connect()
+    assert conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0] == 80
+    conn.close()
+
+
+# --- Backend selection and SQL translation ---
+
+def test_backend_is_chosen_by_url(tmp_path):
+    assert isinstance(create_backend(str(tmp_path / "a.db")), SQLiteBackend)
+    assert create_backend("sqlite:////data/monitor.db").path == "/data/monitor.db"
+
+
+def test_postgres_translation():
+    assert to_postgres_sql("SELECT id FROM snapshots WHERE id = ? AND kind = '?'") == \
+        "SELECT id FROM snapshots WHERE id = %s AND kind = '?'"
+    assert to_postgres_sql(
+        "INSERT OR REPLACE INTO sync_progress (object_type, origin_url) VALUES (?, ?)", ("object_type",)
+    ) == ("INSERT INTO sync_progress (object_type, origin_url) VALUES (%s, %s) "
+          "ON CONFLICT (object_type) DO UPDATE SET origin_url = EXCLUDED.origin_url")
+    assert to_postgres_sql("INSERT OR IGNORE INTO sync_seen (object_type, object_id) VALUES (?, ?)") == \
+        "INSERT INTO sync_seen (object_type, object_id) VALUES (%s, %s) ON CONFLICT DO NOTHING"
+    assert to_postgres_sql(
+        "CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT, n INTEGER, at REAL, PRIMARY KEY (n)) WITHOUT ROWID"
+    ) == "CREATE TABLE t (id BIGSERIAL PRIMARY KEY, n BIGINT, at DOUBLE PRECISION, PRIMARY KEY (n))"
+    assert "LIMIT ALL OFFSET %s" in to_postgres_sql("SELECT x FROM t ORDER BY y LIMIT -1 OFFSET ?")
+    assert "information_schema.columns" in to_postgres_sql("PRAGMA table_info(snapshots)")
+
+
+# --- SQLite performance mode ---
+
+def test_sqlite_performance_mode(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "monitor.db"), performance_mode=True)
+    conn = backend.connect()
+    create_schema(conn)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    raw = conn._raw
+    insert_snapshot(conn, "2024-01-01T00:00:00", ["left uncommitted"], None)
+    conn.close()
+
+    # Same thread: the pooled connection comes back, without the uncommitted write
+    conn = backend.connect()
+    assert conn._raw is raw
+    assert conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0] == 0
+    conn.close()
+    backend.close()
+
+
+def test_sqlite_readers_are_not_blocked_by_a_writer(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "monitor.db"), performance_mode=True)
+    writer = backend.connect()
+    create_schema(writer)
+    insert_snapshot(writer, "2024-01-01T00:00:00", ["committed"], None)
+    writer.commit()
+    # A long snapshot write in progress
+    insert_snapshot(writer, "2024-01-02T00:00:00", ["in progress"], None)
+    stage_page(writer, "user", [{"id": f"u{index}", "displayName": f"User {index}"} for index in range(1000)])
+
+    result = {}
+
+    def read():
+        reader = backend.connect()
+        result["items"] = query_snapshots(reader)["items"]
+        reader.close()
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert [item["timestamp"] for item in result["items"]] == ["2024-01-01T00:00:00"]
+    writer.commit()
+    writer.close()
@@ -0,0 +1,221 @@
+import sqlite3
+import threading
+
+import msal
+import pytest
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import graph_client
+import monitor
+import resources
+import storage_backend
+import tenants
+from db import create_schema
+from lease import Lease, lease_holder
+from mock_graph import MockGraphServer
+from storage import insert_snapshot
+from tenants import Tenant, parse_tenants
+
+
+def _tenant(key, database=None):
+    return Tenant(key, f"{key}-directory", f"{key}-app", f"{key}-secret", database=database)
+
+
+def test_tenants_file_is_validated(tmp_path):
+    secret = tmp_path / "secret"
+    secret.write_text("s3cret\n")
+    parsed = parse_tenants([
+        {"key": "contoso", "tenant_id": "t1", "client_id": "c1", "client_secret_file": str(secret)},
+        {"key": "fabrikam", "tenant_id": "t2", "client_id": "c2", "client_secret": "x",
+         "database_url": "postgresql://db/fabrikam", "name": "Fabrikam"},
+    ])
+    assert [tenant.key for tenant in parsed] == ["contoso", "fabrikam"]
+    assert parsed[0].client_secret == "s3cret" and parsed[0].database == "monitor_data_contoso.db"
+    assert parsed[1].database == "postgresql://db/fabrikam"
+    assert parsed[1].as_dict() == {"key": "fabrikam", "name": "Fabrikam", "tenant_id": "t2"}
+    assert "x" not in repr(parsed[1])
+
+    entry = {"tenant_id": "t", "client_id": "c", "client_secret": "s"}
+    for entries in ([], [{**entry, "key": "Bad Key"}], [{**entry, "key": "a"}, {**entry, "key": "a"}],
+                    [{"key": "a", "client_id": "c", "client_secret": "s"}], [{"key": "a", "tenant_id": "t", "client_id": "c"}]):
+        with pytest.raises(ValueError):
+            parse_tenants(entries)
+
+
+def test_each_tenant_has_its_own_msal_app_and_throttling_state(monkeypatch):
+    created = []
+
+    class AuthApp:
+        def __init__(self, client_id, authority, client_credential, token_cache=None):
+            created.append((client_id, authority, token_cache))
+            self.authority = authority
+
+        def acquire_token_for_client(self, scopes):
+            return {"access_token": f"token for {self.authority}"}
+
+    monkeypatch.setattr(msal, "ConfidentialClientApplication", AuthApp)
+    monkeypatch.setattr(graph_client, "_tenant_auth_apps", {})
+    monkeypatch.setattr(graph_client, "_tenant_controllers", {})
+    contoso, fabrikam = _tenant("contoso"), _tenant("fabrikam")
+
+    with graph_client.use_tenant(contoso):
+        assert graph_client._get_access_token().endswith("/contoso-directory")
+        assert graph_client._get_access_token().endswith("/contoso-directory")
+        contoso_controller = graph_client._rate_controller()
+        # The tenant carries over into fetch_concurrently's threads
+        assert graph_client.fetch_concurrently({"a": graph_client.current_tenant,
+                                                "b": graph_client.current_tenant}) == {"a": contoso, "b": contoso}
+    with graph_client.use_tenant(fabrikam):
+        assert graph_client._get_access_token().endswith("/fabrikam-directory")
+        fabrikam_controller = graph_client._rate_controller()
+    assert graph_client.current_tenant() is None
+
+    assert [client_id for client_id, _, _ in created] == ["contoso-app", "fabrikam-app"]
+    assert created[0][2] is not created[1][2]
+    assert contoso_controller is not fabrikam_controller
+    assert graph_client._controller not in (contoso_controller, fabrikam_controller)
+
+
+def _database(path):
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.close()
+    return path
+
+
+def _snapshot_count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def graph(monkeypatch, tmp_path):
+    control = _database(str(tmp_path / "control.db"))
+    monkeypatch.setattr(monitor, "DATABASE_URL", control)
+    monkeypatch.setattr(monitor, "enqueue_explanation", lambda snapshot_id, database_path=None: None)
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["user"])
+    monkeypatch.setattr(monitor, "_tenant_fences", {})
+    with MockGraphServer(page_size=2, latency=0.05) as server:
+        monkeypatch.setattr(graph_client, "GRAPH_CONFIG_ENDPOINT", server.base_url)
+        monkeypatch.setattr(graph_client, "_get_access_token", lambda: "test-token")
+        server.set_objects("users", [
+            {"id": f"u{n}", "displayName": f"User {n}", "userPrincipalName": f"user{n}@contoso.com"} for n in range(5)
+        ])
+        yield server, control
+
+
+def test_each_tenant_is_stored_in_its_own_database(graph, tmp_path):
+    server, control = graph
+    contoso = _tenant("contoso", _database(str(tmp_path / "contoso.db")))
+    fabrikam = _tenant("fabrikam", _database(str(tmp_path / "fabrikam.db")))
+    lease = Lease("monitor", holder="a", database=control)
+    assert lease.acquire()
+
+    monitor.check_for_changes(lease=lease, tenant=contoso)
+    monitor.check_for_changes(lease=lease, tenant=fabrikam)
+    server.delete("users", "u0")
+    monitor.check_for_changes(lease=lease, tenant=contoso)
+
+    assert _snapshot_count(contoso.database) == 2
+    assert _snapshot_count(fabrikam.database) == 1
+    assert _snapshot_count(control) == 0
+    # The tenant's copy of the lease is held while leading, and given up with the leadership
+    assert _fence_holder(contoso.database)["holder"] == "a"
+    monitor._release_tenant_fences()
+    assert _fence_holder(contoso.database) is None
+
+    # An instance that is not leading stores nothing in the tenants' databases either
+    lease.release()
+    server.delete("users", "u1")
+    monitor.check_for_changes(lease=lease, tenant=fabrikam)
+    assert _snapshot_count(fabrikam.database) == 1
+
+
+def _fence_holder(path):
+    conn = sqlite3.connect(path)
+    try:
+        return lease_holder(conn, "monitor")
+    finally:
+        conn.close()
+
+
+def _stored_types(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[0] for row in conn.execute("SELECT DISTINCT object_type FROM object_versions")}
+    finally:
+        conn.close()
+
+
+def test_concurrent_checks_of_one_tenant_share_its_lease(graph, tmp_path, monkeypatch):
+    server, control = graph
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["user", "group"])
+    server.set_objects("groups", [{"id": "g1", "displayName": "Group 1"}])
+    contoso = _tenant("contoso", _database(str(tmp_path / "contoso.db")))
+    lease = Lease("monitor", holder="a", database=control)
+    assert lease.acquire()
+
+    # The group check finishes first; the user check, still walking its pages, must keep
+    # committing under the tenant's lease
+    threads = [threading.Thread(target=monitor.check_for_changes, args=([name],),
+                                kwargs={"lease": lease, "tenant": contoso}) for name in ("user", "group")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert _stored_types(contoso.database) == {"user", "group"}
+    assert _fence_holder(contoso.database)["holder"] == "a"
+
+
+def test_tenant_checks_are_spread_over_the_interval(monkeypatch):
+    monkeypatch.setattr(resources, "MONITORED_RESOURCES", ["user"])
+    monkeypatch.setattr(resources, "RESOURCE_POLL_INTERVALS", {"user": 10})
+    registered = [_tenant(f"t{n}") for n in range(4)]
+    scheduler = BackgroundScheduler()
+
+    monitor.schedule_resources(scheduler, tenants=registered)
+
+    jobs = scheduler.get_jobs()
+    assert [job.id for job in jobs] == ["check_t0_user", "check_t1_user", "check_t2_user", "check_t3_user"]
+    assert [job.kwargs["tenant"] for job in jobs] == registered
+    starts = [job.trigger.start_date for job in jobs]
+    gaps = {round((later - earlier).total_seconds()) for earlier, later in zip(starts, starts[1:])}
+    assert gaps == {150}
+    assert all(job.max_instances == 1 and job.coalesce for job in jobs)
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    from app import app
+    monkeypatch.setattr(storage_backend, "DATABASE_URL", _database(str(tmp_path / "control.db")))
+    registered = [_tenant("contoso", _database(str(tmp_path / "contoso.db"))),
+                  _tenant("fabrikam", _database(str(tmp_path / "fabrikam.db")))]
+    monkeypatch.setattr(tenants, "TENANTS_FILE", "tenants.json")
+    monkeypatch.setattr(tenants, "_tenants", registered)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = "admin"
+    return client, registered
+
+
+def test_requests_pick_the_tenant(api):
+    client, (contoso, fabrikam) = api
+    conn = sqlite3.connect(fabrikam.database)
+    snapshot_id = insert_snapshot(conn, "2024-01-01T00:00:00+00:00", ["Initial configuration snapshot"], "")
+    conn.commit()
+    conn.close()
+
+    listed = client.get("/api/tenants").json
+    assert [tenant["key"] for tenant in listed["tenants"]] == ["contoso", "fabrikam"]
+    assert listed["default"] == "contoso"
+
+    assert client.get("/api/ready").json["first_sync"] == "in_progress"
+    ready = client.get("/api/ready?tenant=fabrikam").json
+    assert ready["tenant"] == "fabrikam" and ready["first_sync"] == "complete"
+    assert client.get("/api/snapshots?tenant=fabrikam").json["items"][0]["id"] == snapshot_id
+    assert client.get("/api/snapshots?tenant=contoso").json["items"] == []
+    assert client.get("/api/snapshots?tenant=unknown").status_code == 404
@@ -0,0 +1,126 @@
+"""
+Monitor worker: polls Graph, explains the changes and compacts history, apart from the API.
+
+    python worker.py
+
+Run any number of instances (e.g. two, on different hosts) against the database the API
+uses: they elect a leader through the monitor lease (lease.py) and only the leader polls
+Graph. If it dies, a standby takes over within MONITOR_LEASE_TTL_SECONDS; if it stops
+cleanly (SIGTERM), at the standby's next attempt. Snapshots and explanations reach the
+API's /api/events subscribers through the database.
+
+Each instance serves /metrics (Prometheus) and /health on MONITOR_METRICS_PORT (0 disables
+it); the monitor_leader gauge tells which one is polling.
+
+With TENANTS_FILE the leader polls every registered tenant (see tenants.py), each into its
+own database; the lease stays in DATABASE_URL.
+"""
+
+import json
+import logging
+import signal
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (
+    GRAPH_CLIENT_ID, GRAPH_TENANT_ID, GRAPH_CLIENT_SECRET, LOG_LEVEL, LOG_FORMAT, MONITOR_METRICS_PORT
+)
+
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger("worker")
+
+from storage_backend import connect
+from db import create_schema
+from lease import Lease
+from monitor import MONITOR_LEASE, collect_monitor_metrics, poll_intervals, start_monitoring
+from tenants import get_tenants, is_multi_tenant
+from explanation_cache import cache_stats
+from openai_client import usage_stats
+from compaction import compaction_stats
+from metrics import CONTENT_TYPE, register_collector, render as render_metrics
+
+
+def _serve_metrics(port: int, lease: Lease):
+    """/metrics and /health on a background thread; returns the server (None if disabled)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                status, content_type, body = 200, CONTENT_TYPE, render_metrics().encode()
+            elif self.path == "/health":
+                status, content_type = 200, "application/json"
+                body = json.dumps({
+                    "status": "healthy",
+                    "holder": lease.holder,
+                    "leader": lease.held,
+                    "poll_intervals_minutes": poll_intervals(),
+                    "tenants": len(get_tenants()) if is_multi_tenant() else 1,
+                    "explanation_cache": cache_stats(),
+                    "openai_usage": usage_stats(),
+                    "compaction": compaction_stats(),
+                }).encode()
+            else:
+                status, content_type, body = 404, "text/plain", b"Not found"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass   # Scrapes every few seconds would drown the log
+
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"✓ Metrics on :{port}/metrics")
+    return server
+
+
+def main():
+    databases = [None]
+    if is_multi_tenant():
+        try:
+            databases += [tenant.database for tenant in get_tenants()]
+        except (OSError, ValueError) as e:
+            logger.error(f"Invalid tenants file: {e}")
+            sys.exit(1)
+    else:
+        missing = [name for name, value in {"GRAPH_CLIENT_ID": GRAPH_CLIENT_ID, "GRAPH_TENANT_ID": GRAPH_TENANT_ID,
+                                            "GRAPH_CLIENT_SECRET": GRAPH_CLIENT_SECRET}.items() if not value]
+        if missing:
+            logger.error(f"Missing required configuration: {missing}")
+            sys.exit(1)
+
+    for database in databases:
+        conn = connect(database)
+        try:
+            create_schema(conn)
+        finally:
+            conn.close()
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Received signal {signum}, stopping")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    lease = Lease(MONITOR_LEASE)
+    register_collector(collect_monitor_metrics)
+    server = _serve_metrics(MONITOR_METRICS_PORT, lease)
+    logger.info(f"Monitor worker {lease.holder} started; waiting for the monitor lease")
+    try:
+        start_monitoring(lease, stop)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
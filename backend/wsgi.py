@@ -0,0 +1,12 @@
+"""
+Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+The worker processes only serve the API, so the API tier can run as many workers and
+replicas as it needs. Graph is polled by the monitor worker (python worker.py), which
+pushes its snapshots and explanations to the API's /api/events subscribers through the
+database.
+"""
+
+from app import app, startup_tasks
+
+startup_tasks(run_monitor=False)
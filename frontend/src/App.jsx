@@ -44,14 +44,20 @@ const SessionExpiredModal = ({ onConfirm }) => (
 function App() {
     const [authStatus, setAuthStatus] = useState('checking');
     const [snapshots, setSnapshots] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
     const [selectedId, setSelectedId] = useState(null);
     const [selectedSnapshot, setSelectedSnapshot] = useState(null);
     const [status, setStatus] = useState('idle');
     const [error, setError] = useState(null);
     const [modalData, setModalData] = useState({ isOpen: false, data: null });
     const [isSessionExpired, setIsSessionExpired] = useState(false);
+    // Monitored tenants, and the key of the one shown (undefined until they are loaded)
+    const [tenants, setTenants] = useState([]);
+    const [tenant, setTenant] = useState(undefined);
 
     const isFetching = useRef(false);
+    const selectedIdRef = useRef(null);
+    selectedIdRef.current = selectedId;
 
     // ✅ הוספת useMemo כדי לייצב את אובייקט האפשרויות של העורך
     const editorOptions = useMemo(() => ({
@@ -75,6 +81,24 @@ function App() {
         });
     }, []);
 
+    // Load the tenants after login; the server's default one is shown first
+    useEffect(() => {
+        if (authStatus !== 'loggedIn') return;
+        Api.getTenants()
+            .then((data) => {
+                setTenants(data.tenants);
+                Api.setTenant(data.default);
+                setTenant(data.default);
+            })
+            .catch((err) => {
+                if (err instanceof ApiError && err.status === 401) {
+                    handleUnauthorized();
+                } else {
+                    setTenant(null);
+                }
+            });
+    }, [authStatus, handleUnauthorized]);
+
     // Fetch timeline snapshots
     const fetchSnapshots = useCallback(async (isRefresh = false) => {
         if (isFetching.current) return;
@@ -85,7 +109,8 @@ function App() {
 
         try {
             const data = await Api.getSnapshots();
-            setSnapshots(data);
+            setSnapshots(data.items);
+            setNextCursor(data.next_cursor);
             setStatus('success');
         } catch (err) {
             if (err instanceof ApiError && err.status === 401) {
@@ -99,12 +124,93 @@ function App() {
         }
     }, [handleUnauthorized]);
 
-    // Run fetch after successful login
+    // Append the next page of older snapshots to the timeline
+    const fetchMoreSnapshots = useCallback(async () => {
+        if (isFetching.current || !nextCursor) return;
+        isFetching.current = true;
+
+        try {
+            const data = await Api.getSnapshots(nextCursor);
+            setSnapshots(previous => [...previous, ...data.items]);
+            setNextCursor(data.next_cursor);
+        } catch (err) {
+            if (err instanceof ApiError && err.status === 401) {
+                handleUnauthorized();
+            } else {
+                setError(err.message || 'Failed to load timeline data.');
+            }
+        } finally {
+            isFetching.current = false;
+        }
+    }, [nextCursor, handleUnauthorized]);
+
+    // Live updates pushed by the server: new snapshots go to the top of the timeline, and a
+    // finished explanation is loaded if its snapshot is open
     useEffect(() => {
-        if (authStatus === 'loggedIn') {
+        if (authStatus !== 'loggedIn' || tenant === undefined) return;
+
+        const source = Api.subscribeToEvents({
+            'snapshot-created': (snapshot) => {
+                setSnapshots(previous => (previous.some(item => item.id === snapshot.id) ? previous : [snapshot, ...previous]));
+            },
+            'explanation-ready': async ({ snapshot_id, status: explanationStatus }) => {
+                setSnapshots(previous => previous.map(item => (
+                    item.id === snapshot_id ? { ...item, explanation_status: explanationStatus } : item
+                )));
+                if (selectedIdRef.current !== snapshot_id) return;
+                try {
+                    const data = await Api.getSnapshot(snapshot_id);
+                    setSelectedSnapshot(current => (current && selectedIdRef.current === snapshot_id && data ? { ...current, ...data } : current));
+                } catch (err) {
+                    if (err instanceof ApiError && err.status === 401) handleUnauthorized();
+                }
+            },
+        });
+        return () => source.close();
+    }, [authStatus, tenant, handleUnauthorized]);
+
+    // Load the data behind the config / diff modal on demand: only the changed objects
+    // for a diff (every page of them), the full configuration only when it is explicitly requested
+    const showConfig = useCallback(async (type) => {
+        if (selectedId === null) return;
+        try {
+            if (type === 'diff') {
+                const objects = [];
+                let cursor = null;
+                do {
+                    const page = await Api.getSnapshotDiff(selectedId, cursor ? { limit: 500, cursor } : { limit: 500 });
+                    objects.push(...page.objects);
+                    cursor = page.next_cursor;
+                } while (cursor);
+                const previous = {};
+                const current = {};
+                objects.forEach(({ object_type, before, after }) => {
+                    if (before) (previous[object_type] = previous[object_type] || []).push(before);
+                    if (after) (current[object_type] = current[object_type] || []).push(after);
+                });
+                setModalData({
+                    isOpen: true,
+                    data: { type, ...selectedSnapshot, previous_config: previous, current_config: current },
+                });
+            } else {
+                const details = await Api.getSnapshot(selectedId, undefined, { includeConfig: true });
+                setModalData({ isOpen: true, data: { type, ...details } });
+            }
+        } catch (err) {
+            if (err instanceof ApiError && err.status === 401) {
+                handleUnauthorized();
+            } else {
+                setError(err.message || 'Failed to load configuration.');
+            }
+        }
+    }, [selectedId, selectedSnapshot, handleUnauthorized]);
+
+    // Run fetch after successful login, and again for another tenant
+    useEffect(() => {
+        if (authStatus === 'loggedIn' && tenant !== undefined) {
             fetchSnapshots();
         }
-    }, [authStatus, fetchSnapshots]);
+    }, [authStatus, tenant, fetchSnapshots]);
 
     // Automatically select first snapshot if none selected
     useEffect(() => {
@@ -152,6 +258,16 @@ function App() {
         setAuthStatus('loggedOut');
         setSnapshots([]);
         setSelectedId(null);
+        setTenant(undefined);
+    };
+
+    const handleTenantChange = (key) => {
+        Api.setTenant(key);
+        setSnapshots([]);
+        setNextCursor(null);
+        setSelectedId(null);
+        setSelectedSnapshot(null);
+        setTenant(key);
     };
 
     const handleSessionExpiredConfirm = () => {
@@ -185,6 +301,9 @@ function App() {
                     onLogout={handleLogout}
                     onRefresh={() => fetchSnapshots(true)}
                     isRefreshing={isRefreshing}
+                    tenants={tenants}
+                    tenant={tenant}
+                    onTenantChange={handleTenantChange}
                 />
                 <main className="flex-grow flex p-4 gap-4 overflow-hidden">
                     <Timeline
@@ -192,13 +311,12 @@ function App() {
                         onSelect={setSelectedId}
                         selectedId={selectedId}
                         isLoading={isLoading && snapshots.length === 0}
+                        onLoadMore={nextCursor ? fetchMoreSnapshots : null}
                     />
                     <SnapshotDetail
                         snapshot={selectedSnapshot}
                         isLoading={isLoading && !!selectedId && !selectedSnapshot}
-                        onShowConfig={(type) =>
-                            setModalData({ isOpen: true, data: { type, ...selectedSnapshot } })
-                        }
+                        onShowConfig={showConfig}
                     />
                 </main>
             </div>
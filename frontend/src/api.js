@@ -7,6 +7,20 @@
 // and is correct for production when frontend and backend are served from the same domain.
 const API_BASE_URL = ''; 
 
+// Key of the tenant every request is about (?tenant=); null for the server's default
+let currentTenant = null;
+
+/**
+ * Add the selected tenant to an API path
+ * @param {string} path - API endpoint path, with or without a query string
+ * @returns {string}
+ */
+function withTenant(path) {
+    if (!currentTenant) return path;
+    const separator = path.includes('?') ? '&' : '?';
+    return `${path}${separator}tenant=${encodeURIComponent(currentTenant)}`;
+}
+
 /**
  * Custom error class for API errors
  */
@@ -30,7 +44,7 @@ class ApiError extends Error {
  * @throws {ApiError} - On any API error
  */
 async function apiRequest(path, options = {}, signal) {
-    const url = `${API_BASE_URL}/api${path}`;
+    const url = `${API_BASE_URL}/api${withTenant(path)}`;
     
     if (process.env.NODE_ENV === 'development') {
         console.debug(`API Request: ${options.method || 'GET'} ${url}`);
@@ -133,10 +147,29 @@ export const Api = {
     },
 
     /**
-     * Get list of all snapshots
+     * Select the tenant the following requests are about
+     * @param {?string} key - Tenant key (from getTenants), or null for the server's default
+     */
+    setTenant(key) {
+        currentTenant = key || null;
+    },
+
+    /**
+     * Get the monitored tenants
+     * @returns {Promise<{multi_tenant: boolean, tenants: Array, default: ?string}>}
+     */
+    async getTenants() {
+        return apiRequest('/tenants');
+    },
+
+    /**
+     * Get one page of snapshots, newest first
+     * @param {string} [cursor] - next_cursor returned with the previous page
+     * @returns {Promise<{items: Array, next_cursor: ?string}>}
      */
-    async getSnapshots() {
-        return apiRequest('/snapshots');
+    async getSnapshots(cursor) {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        return apiRequest(`/snapshots${query}`);
     },
     
     /**
@@ -144,11 +177,40 @@ export const Api = {
      * @param {number} id - Snapshot ID
      * @param {AbortSignal} signal - AbortSignal to cancel the request
      */
-    async getSnapshot(id, signal) {
+    async getSnapshot(id, signal, { includeConfig = false } = {}) {
         if (!id && id !== 0) {
             throw new Error('Snapshot ID is required');
         }
-        return apiRequest(`/snapshots/${id}`, {}, signal);
+        const query = includeConfig ? '?include=config' : '';
+        return apiRequest(`/snapshots/${id}${query}`, {}, signal);
+    },
+
+    /**
+     * Get the objects that changed in a snapshot (computed by the server)
+     * @param {number} id - Snapshot ID
+     * @param {Object} [params] - Optional object_type, cursor and limit
+     * @param {AbortSignal} [signal] - AbortSignal to cancel the request
+     */
+    async getSnapshotDiff(id, params = {}, signal) {
+        if (!id && id !== 0) {
+            throw new Error('Snapshot ID is required');
+        }
+        const query = new URLSearchParams(params).toString();
+        return apiRequest(`/snapshots/${id}/diff${query ? `?${query}` : ''}`, {}, signal);
+    },
+
+    /**
+     * Subscribe to live updates (Server-Sent Events): 'snapshot-created' and 'explanation-ready'.
+     * The browser reconnects by itself and resumes after the last event it received.
+     * @param {Object<string, function(Object)>} handlers - Event type -> handler of the event data
+     * @returns {EventSource} - call close() to unsubscribe
+     */
+    subscribeToEvents(handlers) {
+        const source = new EventSource(`${API_BASE_URL}/api${withTenant('/events')}`, { withCredentials: true });
+        Object.entries(handlers).forEach(([type, handler]) => {
+            source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+        });
+        return source;
     },
 };
 
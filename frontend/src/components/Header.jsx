@@ -23,14 +23,27 @@ export const StatusIndicator = ({ isConnected }) => {
     );
 };
 
+// Tenant picker, shown only when several tenants are monitored
+const TenantSelector = ({ tenants, tenant, onChange }) => (
+    <select
+        value={tenant || ''}
+        onChange={(event) => onChange(event.target.value)}
+        className="bg-slate-700 text-slate-200 text-sm rounded-lg border border-slate-600 px-3 py-1.5 focus:outline-none focus:border-cyan-500"
+        aria-label="Tenant"
+    >
+        {tenants.map(({ key, name }) => <option key={key} value={key}>{name}</option>)}
+    </select>
+);
+
 // --- CHANGE: Added 'onLogout' to the props ---
-export const Header = ({ isConnected, onRefresh, isRefreshing, onLogout }) => (
+export const Header = ({ isConnected, onRefresh, isRefreshing, onLogout, tenants = [], tenant, onTenantChange }) => (
     <header className="bg-slate-800/80 backdrop-blur-sm border-b border-slate-700 p-4 sticky top-0 z-30 shadow-lg">
         <div className="container mx-auto flex items-center justify-between">
             <h1 className="text-2xl font-bold text-white tracking-tight">
                 Entra ID <span className="text-cyan-400">Monitor</span>
             </h1>
             <div className="flex items-center gap-2 sm:gap-4">
+                {tenants.length > 1 && <TenantSelector tenants={tenants} tenant={tenant} onChange={onTenantChange} />}
                 <StatusIndicator isConnected={isConnected} />
                 
                 {/* Refresh Button */}
@@ -50,7 +50,20 @@ const ExplanationContent = ({ content }) => {
 };
 
 // Explanation Section
-const ExplanationSection = ({ explanation }) => {
+const ExplanationSection = ({ explanation, status }) => {
+  if (status === 'pending') {
+    return (
+      <div className="bg-slate-900/50 rounded-lg p-4" aria-busy="true" aria-label="ניתוח GPT בהכנה">
+        <div className="flex items-center text-lg font-semibold text-violet-400 mb-3">
+          <SparklesIcon aria-hidden="true" />
+          <span>ניתוח GPT</span>
+        </div>
+        <p className="text-slate-400 flex items-center gap-2">
+          <RefreshIcon isRefreshing={true} aria-hidden="true" /> הניתוח בהכנה...
+        </p>
+      </div>
+    );
+  }
   if (!explanation) return null;
   return (
     <div className="bg-slate-900/50 rounded-lg p-4" aria-label="חלק ניתוח GPT">
@@ -66,7 +79,7 @@ const ExplanationSection = ({ explanation }) => {
 // === Main Component ===
 const SnapshotDetail = ({ snapshot, isLoading, onShowConfig, error }) => {
   // Always compute derived values safely at the top
-  const hasPreviousConfig = useMemo(() => !!snapshot?.previous_config, [snapshot]);
+  const hasPreviousConfig = useMemo(() => !!snapshot?.previous_snapshot_id, [snapshot]);
   const isInitialSnapshot = useMemo(() => snapshot?.changes?.some(c => c?.includes('Initial configuration')), [snapshot]);
   const formattedDate = useMemo(() => {
     if (!snapshot?.timestamp) return 'N/A';
@@ -145,7 +158,7 @@ const SnapshotDetail = ({ snapshot, isLoading, onShowConfig, error }) => {
 
       <div className="border-t border-slate-700 pt-6">
         {isInitialSnapshot ? (
-          <ExplanationSection explanation={snapshot.explanation} />
+          <ExplanationSection explanation={snapshot.explanation} status={snapshot.explanation_status} />
         ) : snapshot.changes?.length > 0 ? (
           <div className="space-y-6">
             <div className="bg-slate-900/50 rounded-lg p-4" aria-label="רשימת שינויים">
@@ -158,7 +171,7 @@ const SnapshotDetail = ({ snapshot, isLoading, onShowConfig, error }) => {
                 ))}
               </ul>
             </div>
-            <ExplanationSection explanation={snapshot.explanation} />
+            <ExplanationSection explanation={snapshot.explanation} status={snapshot.explanation_status} />
           </div>
         ) : (
           <p className="text-slate-400">לא זוהו שינויים בנקודת זמן זו.</p>
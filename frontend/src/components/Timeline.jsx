@@ -36,7 +36,7 @@ const TimelineItem = ({ snapshot, onSelect, isSelected }) => {
     );
 };
 
-const Timeline = ({ snapshots, onSelect, selectedId, isLoading }) => (
+const Timeline = ({ snapshots, onSelect, selectedId, isLoading, onLoadMore }) => (
     <aside className="w-80 flex-shrink-0 panel p-4 h-full flex flex-col">
         <h2 className="text-lg font-semibold mb-4 text-slate-300 border-b border-slate-600 pb-2 flex-shrink-0">
             ציר זמן - Snapshots
@@ -58,6 +58,16 @@ const Timeline = ({ snapshots, onSelect, selectedId, isLoading }) => (
                             isSelected={s.id === selectedId}
                         />
                     ))}
+                    {onLoadMore && (
+                        <li>
+                            <button
+                                onClick={onLoadMore}
+                                className="w-full text-center text-sm text-slate-400 hover:text-slate-200 p-2"
+                            >
+                                טען עוד...
+                            </button>
+                        </li>
+                    )}
                 </ul>
             ) : (
                 <div className="text-slate-500 text-center p-4">